@@ -220,7 +220,8 @@ class ChurnPredictionTool(BaseTool):
                 'high_risk_cohorts': result.high_risk_cohorts,
                 'churn_reasons': result.churn_reasons,
                 'prevention_strategies': result.prevention_strategies,
-                'prediction_accuracy': result.prediction_accuracy
+                'prediction_accuracy': result.prediction_accuracy,
+                'model_metrics': result.model_metrics
             }
             
         except Exception as e:
@@ -483,7 +484,8 @@ class CohortAnalysisAgent:
                 'high_risk_cohorts': result.high_risk_cohorts,
                 'churn_reasons': result.churn_reasons,
                 'prevention_strategies': result.prevention_strategies,
-                'prediction_accuracy': result.prediction_accuracy
+                'prediction_accuracy': result.prediction_accuracy,
+                'model_metrics': result.model_metrics
             }
             
         except Exception as e:
@@ -0,0 +1,383 @@
+"""
+归因分析引擎模块
+
+提供向量化的多触点转化归因功能。
+所有转化的触点窗口通过对按用户排序的时间戳做二分查找一次性构建，
+支持首次接触、最后接触、线性、时间衰减和位置归因模型，
+以及基于路径转移计数的马尔可夫链（数据驱动）归因。
+"""
+
+import pandas as pd
+import numpy as np
+from typing import Dict, List, Any, Optional, Iterable
+from dataclasses import dataclass
+import logging
+from scipy import sparse
+from scipy.sparse.linalg import splu
+
+from engines.dataset_cache import DatasetCache
+
+logger = logging.getLogger(__name__)
+
+
+@dataclass
+class TouchpointTable:
+    """触点表（列式存储，每行一个转化-触点对）"""
+    conversion_ids: np.ndarray  # 触点所属的转化编号
+    channel_codes: np.ndarray  # 触点渠道编码
+    touch_times: np.ndarray  # 触点时间（int64纳秒）
+    conversion_times: np.ndarray  # 所属转化的时间（int64纳秒）
+    position: np.ndarray  # 触点在转化窗口内的序号（从0开始）
+    touch_counts: np.ndarray  # 所属转化的触点总数
+    channels: pd.Index  # 渠道编码 -> 渠道名称
+    total_conversions: int  # 转化总数（包括无触点的转化）
+
+    @property
+    def attributed_conversions(self) -> int:
+        """有触点的转化数"""
+        return len(np.unique(self.conversion_ids))
+
+
+@dataclass
+class AttributionResult:
+    """归因模型结果"""
+    model: str
+    channel_credits: Dict[str, float]
+    total_conversions: int
+    attributed_conversions: int
+    avg_touchpoints: float
+
+
+@dataclass
+class MarkovAttributionResult:
+    """马尔可夫链归因结果"""
+    conversion_probability: float  # 从起点被吸收到转化状态的概率
+    removal_effects: Dict[str, float]  # 移除渠道后转化概率的相对下降
+    channel_credits: Dict[str, float]  # 按移除效应分配的转化数
+    total_conversions: float
+    n_states: int
+
+
+class AttributionEngine:
+    """归因分析引擎类"""
+
+    SUPPORTED_MODELS = ('first_touch', 'last_touch', 'linear', 'time_decay', 'position_based')
+
+    def __init__(self,
+                 storage_manager=None,
+                 conversion_events: Optional[Iterable[str]] = None,
+                 half_life_days: float = 7.0,
+                 position_weights: tuple = (0.4, 0.4)):
+        """
+        初始化归因分析引擎
+
+        Args:
+            storage_manager: 数据存储管理器实例
+            conversion_events: 转化事件集合
+            half_life_days: 时间衰减模型的半衰期（天）
+            position_weights: 位置归因模型中首次/最后接触的权重
+        """
+        self.storage_manager = storage_manager
+        self.dataset_cache = DatasetCache.for_storage(storage_manager)
+        self.conversion_events = set(conversion_events or {
+            'sign_up', 'login', 'purchase', 'begin_checkout',
+            'add_to_cart', 'add_payment_info', 'subscribe'
+        })
+        self.half_life_days = half_life_days
+        self.position_weights = position_weights
+
+        logger.info("归因分析引擎初始化完成")
+
+    def build_touchpoints(self,
+                          events: pd.DataFrame,
+                          attribution_window_days: float = 7,
+                          channel_column: str = 'event_name') -> TouchpointTable:
+        """
+        构建所有转化的触点表
+
+        触点为转化前归因窗口内（含转化时刻）同一用户的事件，排除与转化同名的事件。
+
+        Args:
+            events: 事件数据
+            attribution_window_days: 归因窗口天数
+            channel_column: 作为渠道的列名
+
+        Returns:
+            触点表
+        """
+        timelines = self.dataset_cache.user_timelines(events)
+        channel_values = events[channel_column].to_numpy()[timelines.source_rows]
+        channel_codes, channels = pd.factorize(channel_values)
+
+        user_codes = timelines.user_codes.astype(np.int64)
+        times = timelines.times
+        names = timelines.event_names
+
+        # 组合键（用户编码, 时间排名）在排序后的时间线上单调，可直接二分查找
+        unique_times, time_ranks = np.unique(times, return_inverse=True)
+        stride = len(unique_times) + 1
+        keys = user_codes * stride + time_ranks
+
+        conversion_positions = np.flatnonzero(
+            pd.Series(names).isin(self.conversion_events).to_numpy()
+        )
+        conv_users = user_codes[conversion_positions]
+        conv_times = times[conversion_positions]
+        window_ns = int(attribution_window_days * 86400 * 1e9)
+
+        window_start = conv_users * stride + np.searchsorted(unique_times, conv_times - window_ns, side='left')
+        window_end = conv_users * stride + np.searchsorted(unique_times, conv_times, side='right')
+        lo = np.searchsorted(keys, window_start, side='left')
+        hi = np.searchsorted(keys, window_end, side='left')
+
+        # 展开每个转化的触点区间
+        lengths = hi - lo
+        conversion_ids = np.repeat(np.arange(len(conversion_positions)), lengths)
+        offsets = np.arange(lengths.sum()) - np.repeat(np.cumsum(lengths) - lengths, lengths)
+        touch_positions = np.repeat(lo, lengths) + offsets
+
+        # 排除转化事件本身和缺失渠道的触点
+        keep = names[touch_positions] != names[conversion_positions[conversion_ids]]
+        keep &= channel_codes[touch_positions] >= 0
+        conversion_ids = conversion_ids[keep]
+        touch_positions = touch_positions[keep]
+
+        touch_counts = np.bincount(conversion_ids, minlength=len(conversion_positions))
+        first_index = np.cumsum(touch_counts) - touch_counts
+        position = np.arange(len(conversion_ids)) - first_index[conversion_ids]
+
+        return TouchpointTable(
+            conversion_ids=conversion_ids,
+            channel_codes=channel_codes[touch_positions],
+            touch_times=times[touch_positions],
+            conversion_times=conv_times[conversion_ids],
+            position=position,
+            touch_counts=touch_counts[conversion_ids],
+            channels=pd.Index(channels),
+            total_conversions=len(conversion_positions)
+        )
+
+    def _touch_weights(self, touchpoints: TouchpointTable, model: str) -> np.ndarray:
+        """
+        计算每个触点在指定模型下的归因权重
+
+        Args:
+            touchpoints: 触点表
+            model: 归因模型名称
+
+        Returns:
+            触点权重数组（每个转化的权重之和为1）
+        """
+        position = touchpoints.position
+        counts = touchpoints.touch_counts
+        is_first = position == 0
+        is_last = position == counts - 1
+
+        if model == 'first_touch':
+            return is_first.astype(float)
+        if model == 'last_touch':
+            return is_last.astype(float)
+        if model == 'linear':
+            return 1.0 / counts
+        if model == 'time_decay':
+            age_days = (touchpoints.conversion_times - touchpoints.touch_times) / (86400 * 1e9)
+            raw = np.power(0.5, age_days / self.half_life_days)
+            totals = np.bincount(touchpoints.conversion_ids, weights=raw)
+            return raw / totals[touchpoints.conversion_ids]
+        if model == 'position_based':
+            first_weight, last_weight = self.position_weights
+            middle_weight = 1.0 - first_weight - last_weight
+            middle_count = np.maximum(counts - 2, 1)
+            weights = np.where(is_first, first_weight,
+                               np.where(is_last, last_weight, middle_weight / middle_count))
+            # 只有一个或两个触点时平分全部权重
+            weights = np.where(counts == 1, 1.0, weights)
+            weights = np.where(counts == 2, 0.5, weights)
+            return weights
+
+        raise ValueError(f"Unsupported attribution model: {model}")
+
+    def attribute(self,
+                  events: Optional[pd.DataFrame] = None,
+                  models: Optional[List[str]] = None,
+                  attribution_window_days: float = 7,
+                  channel_column: str = 'event_name',
+                  touchpoints: Optional[TouchpointTable] = None) -> Dict[str, AttributionResult]:
+        """
+        使用一个或多个归因模型计算渠道贡献
+
+        Args:
+            events: 事件数据DataFrame
+            models: 归因模型列表，默认全部模型
+            attribution_window_days: 归因窗口天数
+            channel_column: 作为渠道的列名
+            touchpoints: 预先构建的触点表（提供时忽略events）
+
+        Returns:
+            模型名称到归因结果的字典
+        """
+        try:
+            models = list(models or self.SUPPORTED_MODELS)
+            for model in models:
+                if model not in self.SUPPORTED_MODELS:
+                    raise ValueError(f"Unsupported attribution model: {model}")
+
+            if touchpoints is None:
+                if events is None:
+                    if self.storage_manager is None:
+                        raise ValueError("Event data not provided and storage manager not initialized")
+                    events = self.dataset_cache.events()
+
+                if events.empty:
+                    logger.warning("Event data is empty, cannot perform attribution analysis")
+                    return {
+                        model: AttributionResult(model, {}, 0, 0, 0.0)
+                        for model in models
+                    }
+
+                touchpoints = self.build_touchpoints(events, attribution_window_days, channel_column)
+
+            attributed = touchpoints.attributed_conversions
+            avg_touchpoints = len(touchpoints.conversion_ids) / attributed if attributed else 0.0
+
+            results = {}
+            for model in models:
+                weights = self._touch_weights(touchpoints, model)
+                credits = np.bincount(
+                    touchpoints.channel_codes,
+                    weights=weights,
+                    minlength=len(touchpoints.channels)
+                )
+                channel_credits = {
+                    touchpoints.channels[code]: float(credits[code])
+                    for code in np.argsort(-credits, kind='stable')
+                    if credits[code] > 0
+                }
+                results[model] = AttributionResult(
+                    model=model,
+                    channel_credits=channel_credits,
+                    total_conversions=touchpoints.total_conversions,
+                    attributed_conversions=attributed,
+                    avg_touchpoints=avg_touchpoints
+                )
+
+            logger.info(f"归因分析完成，{touchpoints.total_conversions}次转化，{len(models)}个模型")
+            return results
+
+        except Exception as e:
+            logger.error(f"归因分析失败: {e}")
+            raise
+
+    def markov_attribution(self,
+                           path_flow_graph: Dict[str, Any],
+                           conversion_events: Optional[Iterable[str]] = None,
+                           chunk_size: int = 256,
+                           dense_fill_ratio: float = 0.1) -> MarkovAttributionResult:
+        """
+        基于路径转移计数的马尔可夫链归因
+
+        转化事件视为吸收态，路径在非转化事件结束视为被“未转化”态吸收。
+        吸收概率通过稀疏LU分解求解；移除渠道c后的转化概率由
+        P(不经过c而转化) = x[起点] - N[起点, c] / N[c, c] * x[c]
+        得到，其中N为基本矩阵，因此所有渠道的移除效应共享同一次分解。
+
+        Args:
+            path_flow_graph: 路径流图（PathAnalysisEngine._build_path_flow_graph的输出）
+            conversion_events: 转化事件集合，默认使用引擎的转化事件
+            chunk_size: 计算基本矩阵对角线时每批求解的列数
+            dense_fill_ratio: LU因子非零元占比超过该值时改用稠密求逆
+
+        Returns:
+            马尔可夫链归因结果
+        """
+        conversion_events = set(conversion_events or self.conversion_events)
+        edges = path_flow_graph.get('edges', [])
+        entry_counts = path_flow_graph.get('entry_counts', {})
+        exit_counts = path_flow_graph.get('exit_counts', {})
+
+        channel_names = sorted(
+            ({edge['from'] for edge in edges} | {edge['to'] for edge in edges}
+             | set(entry_counts) | set(exit_counts)) - conversion_events
+        )
+        channel_index = {name: i for i, name in enumerate(channel_names)}
+        n_channels = len(channel_names)
+        start = n_channels
+        n_states = n_channels + 1
+
+        rows, cols, counts = [], [], []
+        to_conversion = np.zeros(n_states)
+        to_null = np.zeros(n_states)
+
+        # 转化事件为吸收态，其出边不参与计算
+        for edge in edges:
+            if edge['from'] in conversion_events:
+                continue
+            source = channel_index[edge['from']]
+            if edge['to'] in conversion_events:
+                to_conversion[source] += edge['weight']
+            else:
+                rows.append(source)
+                cols.append(channel_index[edge['to']])
+                counts.append(edge['weight'])
+
+        for name, count in entry_counts.items():
+            if name in conversion_events:
+                to_conversion[start] += count
+            else:
+                rows.append(start)
+                cols.append(channel_index[name])
+                counts.append(count)
+
+        for name, count in exit_counts.items():
+            if name not in conversion_events:
+                to_null[channel_index[name]] += count
+
+        transient = sparse.csr_matrix(
+            (np.asarray(counts, dtype=float), (rows, cols)), shape=(n_states, n_states)
+        )
+        row_totals = np.asarray(transient.sum(axis=1)).ravel() + to_conversion + to_null
+        # 没有任何出边的状态视为直接流失
+        row_totals[row_totals == 0] = 1.0
+        inv_totals = sparse.diags(1.0 / row_totals)
+
+        q_matrix = inv_totals @ transient
+        absorb = (sparse.identity(n_states, format='csr') - q_matrix).tocsc()
+        lu = splu(absorb)
+
+        x = lu.solve(to_conversion / row_totals)
+        start_unit = np.zeros(n_states)
+        start_unit[start] = 1.0
+        start_row = lu.solve(start_unit, trans='T')  # 基本矩阵N的起点行
+
+        # 基本矩阵对角线；分解因子接近稠密时稠密求逆更快
+        if lu.L.nnz + lu.U.nnz > dense_fill_ratio * n_states * n_states:
+            diagonal = np.diag(np.linalg.inv(absorb.toarray()))
+        else:
+            diagonal = np.empty(n_states)
+            for begin in range(0, n_states, chunk_size):
+                end = min(begin + chunk_size, n_states)
+                units = np.zeros((n_states, end - begin))
+                units[np.arange(begin, end), np.arange(end - begin)] = 1.0
+                diagonal[begin:end] = lu.solve(units)[np.arange(begin, end), np.arange(end - begin)]
+
+        base_probability = float(x[start])
+        total_conversions = float(to_conversion.sum())
+
+        if base_probability <= 0 or n_channels == 0:
+            return MarkovAttributionResult(base_probability, {}, {}, total_conversions, n_states)
+
+        channels = np.arange(n_channels)
+        removal_probability = base_probability - start_row[channels] / diagonal[channels] * x[channels]
+        effects = np.clip(1.0 - removal_probability / base_probability, 0.0, 1.0)
+
+        effect_total = effects.sum()
+        credits = effects / effect_total * total_conversions if effect_total > 0 else np.zeros(n_channels)
+
+        order = np.argsort(-effects, kind='stable')
+        return MarkovAttributionResult(
+            conversion_probability=base_probability,
+            removal_effects={channel_names[i]: float(effects[i]) for i in order},
+            channel_credits={channel_names[i]: float(credits[i]) for i in order},
+            total_conversions=total_conversions,
+            n_states=n_states
+        )
@@ -0,0 +1,196 @@
+"""
+用户流失预测模型模块
+
+在用户级别训练流失模型（逻辑回归或梯度提升树，仅用CPU）：
+- 快照：截止时间之前的事件计算用户特征（最近活跃、频次、参与度），
+  截止时间之后horizon天内没有任何事件的用户标记为流失；
+- 按时间留出验证：在较早的截止时间训练、在较晚的截止时间验证，得到真实的准确率和AUC，
+  再用两个快照重新拟合最终模型；
+- 特征表由用户特征存储按数据版本缓存，全部用户按块批量打分。
+"""
+
+import pandas as pd
+import numpy as np
+from typing import Any, Dict, List, Optional, Tuple
+from dataclasses import dataclass, field
+import logging
+
+from sklearn.ensemble import HistGradientBoostingClassifier
+from sklearn.linear_model import LogisticRegression
+from sklearn.metrics import accuracy_score, precision_score, recall_score, roc_auc_score
+from sklearn.pipeline import make_pipeline
+from sklearn.preprocessing import StandardScaler
+
+from engines.funnel_matcher import event_times_ns
+from engines.feature_store import UserFeatureStore
+
+logger = logging.getLogger(__name__)
+
+_DAY_NS = 86_400 * 1_000_000_000
+
+# 只由事件计算的最近活跃、频次和参与度特征（会话表没有时间切分，不参与快照）
+CHURN_FEATURES = [
+    'days_since_last_activity', 'recency_score', 'active_days', 'engagement_span_days', 'activity_frequency',
+    'total_events', 'unique_event_types', 'avg_events_per_day', 'behavior_diversity', 'behavior_intensity',
+    'total_conversions', 'conversion_ratio', 'purchase_frequency', 'activity_regularity'
+]
+
+CHURN_MODEL_TYPES = ('logistic', 'gbm')
+
+
+def make_estimator(model_type: str, random_state: int = 42):
+    """
+    创建流失分类器
+
+    Args:
+        model_type: 'logistic'（标准化 + 逻辑回归）或 'gbm'（直方图梯度提升树）
+        random_state: 随机种子
+
+    Returns:
+        未拟合的sklearn分类器
+    """
+    if model_type == 'logistic':
+        return make_pipeline(StandardScaler(), LogisticRegression(max_iter=1000))
+    if model_type == 'gbm':
+        return HistGradientBoostingClassifier(max_iter=200, learning_rate=0.1, random_state=random_state)
+    raise ValueError(f"Unsupported churn model type: {model_type}")
+
+
+def churn_feature_matrix(feature_frame: pd.DataFrame) -> np.ndarray:
+    """特征表中的流失特征矩阵，缺失值记为0"""
+    return np.nan_to_num(feature_frame.reindex(columns=CHURN_FEATURES).to_numpy(dtype=float))
+
+
+def classification_metrics(labels: np.ndarray, probabilities: np.ndarray, threshold: float = 0.5) -> Dict[str, float]:
+    """
+    验证集上的分类指标
+
+    Returns:
+        accuracy、auc（只有一个类别时为NaN）、precision、recall、churn_rate
+    """
+    predictions = probabilities >= threshold
+    return {
+        'accuracy': float(accuracy_score(labels, predictions)),
+        'auc': float(roc_auc_score(labels, probabilities)) if len(np.unique(labels)) == 2 else float('nan'),
+        'precision': float(precision_score(labels, predictions, zero_division=0)),
+        'recall': float(recall_score(labels, predictions, zero_division=0)),
+        'churn_rate': float(np.mean(labels))
+    }
+
+
+def churn_snapshot(events: pd.DataFrame,
+                   times: np.ndarray,
+                   cutoff: int,
+                   horizon: int,
+                   feature_store: UserFeatureStore) -> Tuple[pd.DataFrame, np.ndarray]:
+    """
+    截止时间的训练快照
+
+    Args:
+        events: 事件数据
+        times: 事件时间（int64纳秒）
+        cutoff: 截止时间（int64纳秒）
+        horizon: 流失判定窗口（纳秒）
+        feature_store: 用户特征存储
+
+    Returns:
+        (截止前有事件的用户的特征表, 流失标签：窗口内没有事件为1)
+    """
+    in_history = times < cutoff
+    history = events[in_history]
+    if history.empty:
+        return pd.DataFrame(), np.array([], dtype=int)
+    features = feature_store.get_features(history, reference_time=pd.Timestamp(cutoff), times=times[in_history])
+    window = (times >= cutoff) & (times < cutoff + horizon)
+    active = pd.unique(events['user_pseudo_id'].to_numpy()[window])
+    labels = (~features.index.isin(active)).astype(int)
+    return features, labels
+
+
+@dataclass
+class ChurnModel:
+    """已训练的流失模型及其时间留出验证指标"""
+    model_type: str
+    horizon_days: int
+    estimator: Any
+    data_end: pd.Timestamp  # 训练数据的最后事件时间，打分时作为参考时间
+    metrics: Dict[str, Any] = field(default_factory=dict)
+    feature_names: List[str] = field(default_factory=lambda: list(CHURN_FEATURES))
+
+    def predict_proba(self, feature_frame: pd.DataFrame, chunk_size: int = 100_000) -> pd.Series:
+        """
+        按块批量计算流失概率
+
+        Args:
+            feature_frame: 以user_pseudo_id为索引的特征表
+            chunk_size: 每块行数
+
+        Returns:
+            用户ID -> 流失概率
+        """
+        matrix = churn_feature_matrix(feature_frame)
+        probabilities = np.zeros(len(matrix))
+        for start in range(0, len(matrix), chunk_size):
+            rows = slice(start, start + chunk_size)
+            probabilities[rows] = self.estimator.predict_proba(matrix[rows])[:, 1]
+        return pd.Series(probabilities, index=feature_frame.index, name='churn_probability')
+
+
+def train_churn_model(events: pd.DataFrame,
+                      horizon_days: int = 30,
+                      model_type: str = 'logistic',
+                      feature_store: Optional[UserFeatureStore] = None,
+                      random_state: int = 42,
+                      times: Optional[np.ndarray] = None) -> ChurnModel:
+    """
+    按时间留出验证训练流失模型
+
+    验证快照的截止时间为最后事件时间前horizon_days天，训练快照再提前horizon_days天；
+    在训练快照上拟合、在验证快照上评估，最终模型用两个快照一起拟合。
+
+    Args:
+        events: 事件数据
+        horizon_days: 流失判定窗口（天）
+        model_type: 'logistic' 或 'gbm'
+        feature_store: 用户特征存储，None时使用独立的实例
+        random_state: 随机种子
+        times: 与events的行对应的事件时间（见event_times_ns），None时从events解析
+
+    Returns:
+        流失模型，metrics为验证集上的指标
+    """
+    if model_type not in CHURN_MODEL_TYPES:
+        raise ValueError(f"Unsupported churn model type: {model_type}")
+    feature_store = feature_store or UserFeatureStore()
+
+    times = event_times_ns(events) if times is None else times
+    data_end = int(times.max())
+    horizon = horizon_days * _DAY_NS
+    valid_cutoff = data_end - horizon
+    train_cutoff = valid_cutoff - horizon
+
+    train_features, train_labels = churn_snapshot(events, times, train_cutoff, horizon, feature_store)
+    valid_features, valid_labels = churn_snapshot(events, times, valid_cutoff, horizon, feature_store)
+    for name, labels in (('training', train_labels), ('validation', valid_labels)):
+        if len(np.unique(labels)) < 2:
+            raise ValueError(f"Not enough history for a {horizon_days}-day churn {name} snapshot "
+                             f"(need churned and retained users)")
+
+    train_matrix = churn_feature_matrix(train_features)
+    valid_matrix = churn_feature_matrix(valid_features)
+    estimator = make_estimator(model_type, random_state).fit(train_matrix, train_labels)
+    metrics = classification_metrics(valid_labels, estimator.predict_proba(valid_matrix)[:, 1])
+    metrics.update({
+        'model_type': model_type,
+        'horizon_days': horizon_days,
+        'train_cutoff': pd.Timestamp(train_cutoff).isoformat(),
+        'validation_cutoff': pd.Timestamp(valid_cutoff).isoformat(),
+        'train_users': int(len(train_labels)),
+        'validation_users': int(len(valid_labels))
+    })
+
+    final = make_estimator(model_type, random_state).fit(np.vstack([train_matrix, valid_matrix]),
+                                                        np.concatenate([train_labels, valid_labels]))
+    logger.info(f"流失模型训练完成（{model_type}）：验证准确率{metrics['accuracy']:.3f}，AUC {metrics['auc']:.3f}")
+    return ChurnModel(model_type=model_type, horizon_days=horizon_days, estimator=final,
+                      data_end=pd.Timestamp(data_end), metrics=metrics)
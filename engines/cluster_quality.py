@@ -0,0 +1,224 @@
+"""
+聚类质量指标模块
+
+- 基于簇中心的O(n)指标：簇内平方和（inertia）、Calinski-Harabasz指数、Davies-Bouldin指数，
+  只需按簇累加一次特征和与平方和；
+- 轮廓系数只对按簇分层抽取的评估点计算，每个评估点到各簇的平均距离由参考集
+  （数据量不大时为全部数据，否则为每簇有足够点数的分层抽样）按块计算，
+  按各簇的总体占比加权得到总体估计，并由分层抽样的标准误给出置信区间，
+  避免全量计算O(n²)的距离矩阵。
+"""
+
+import numpy as np
+from typing import Any, Dict
+import logging
+
+from scipy.stats import norm
+from sklearn.metrics import silhouette_score
+
+logger = logging.getLogger(__name__)
+
+
+def centroid_metrics(feature_matrix: np.ndarray, cluster_labels: np.ndarray) -> Dict[str, float]:
+    """
+    由簇中心计算inertia、Calinski-Harabasz和Davies-Bouldin指数
+
+    与sklearn.metrics.calinski_harabasz_score、davies_bouldin_score定义一致，
+    只有一个簇时两个指数记为0。
+
+    Args:
+        feature_matrix: 特征矩阵
+        cluster_labels: 聚类标签
+
+    Returns:
+        inertia, calinski_harabasz, davies_bouldin
+    """
+    labels, codes = np.unique(cluster_labels, return_inverse=True)
+    n_rows, n_clusters = len(feature_matrix), len(labels)
+    sizes = np.bincount(codes, minlength=n_clusters).astype(float)
+
+    centroids = np.zeros((n_clusters, feature_matrix.shape[1]))
+    np.add.at(centroids, codes, feature_matrix)
+    centroids /= sizes[:, None]
+
+    distances = np.linalg.norm(feature_matrix - centroids[codes], axis=1)
+    inertia = float((distances ** 2).sum())
+    metrics = {'inertia': inertia, 'calinski_harabasz': 0.0, 'davies_bouldin': 0.0}
+    if n_clusters < 2 or n_clusters >= n_rows:
+        return metrics
+
+    overall = feature_matrix.mean(axis=0)
+    between = float((sizes * ((centroids - overall) ** 2).sum(axis=1)).sum())
+    metrics['calinski_harabasz'] = (between * (n_rows - n_clusters) / (inertia * (n_clusters - 1))
+                                    if inertia > 0 else 1.0)
+
+    scatter = np.bincount(codes, weights=distances, minlength=n_clusters) / sizes
+    separation = np.linalg.norm(centroids[:, None, :] - centroids[None, :, :], axis=2)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        ratios = (scatter[:, None] + scatter[None, :]) / separation
+    ratios[~np.isfinite(ratios)] = 0.0
+    np.fill_diagonal(ratios, 0.0)
+    metrics['davies_bouldin'] = float(ratios.max(axis=1).mean())
+    return metrics
+
+
+def stratified_sample(cluster_labels: np.ndarray,
+                      sample_size: int,
+                      random_state: int = 42,
+                      min_per_cluster: int = 2) -> np.ndarray:
+    """
+    按簇分层抽样，各簇按规模比例分配样本量，每个簇至少min_per_cluster个（不足时全取）
+
+    Args:
+        cluster_labels: 聚类标签
+        sample_size: 目标样本量
+        random_state: 随机种子
+        min_per_cluster: 每个簇的最少样本数
+
+    Returns:
+        抽样行号（升序）
+    """
+    rng = np.random.default_rng(random_state)
+    labels, codes = np.unique(cluster_labels, return_inverse=True)
+    sizes = np.bincount(codes, minlength=len(labels))
+    quotas = np.round(sizes * sample_size / len(cluster_labels)).astype(int)
+    quotas = np.minimum(np.maximum(quotas, min_per_cluster), sizes)
+
+    order = np.argsort(codes, kind='stable')
+    starts = np.concatenate([[0], np.cumsum(sizes)[:-1]])
+    chosen = [order[start + rng.choice(size, quota, replace=False)]
+              for start, size, quota in zip(starts, sizes, quotas)]
+    return np.sort(np.concatenate(chosen))
+
+
+def _silhouette_values(feature_matrix: np.ndarray,
+                       codes: np.ndarray,
+                       points: np.ndarray,
+                       reference: np.ndarray,
+                       chunk_size: int = 256) -> np.ndarray:
+    """
+    计算评估点的轮廓值，点到各簇的平均距离由参考集估计
+
+    Args:
+        feature_matrix: 特征矩阵
+        codes: 每行的簇编码（0..k-1）
+        points: 评估点行号
+        reference: 参考集行号（升序）
+        chunk_size: 每块评估点数
+
+    Returns:
+        与points一一对应的轮廓值，所在簇只有一个点时为0
+    """
+    n_clusters = int(codes.max()) + 1
+    reference_codes = codes[reference]
+    reference_counts = np.bincount(reference_codes, minlength=n_clusters).astype(float)
+    reference_rows = feature_matrix[reference]
+    reference_norms = (reference_rows ** 2).sum(axis=1)
+    cluster_sizes = np.bincount(codes, minlength=n_clusters)
+
+    # 参考集到簇的求和矩阵
+    membership = np.zeros((len(reference), n_clusters))
+    membership[np.arange(len(reference)), reference_codes] = 1.0
+
+    in_reference = np.isin(points, reference)
+    values = np.zeros(len(points))
+    for start in range(0, len(points), chunk_size):
+        rows = slice(start, start + chunk_size)
+        chunk = feature_matrix[points[rows]]
+        squared = (chunk ** 2).sum(axis=1)[:, None] - 2 * chunk @ reference_rows.T + reference_norms
+        sums = np.sqrt(np.maximum(squared, 0.0)) @ membership
+
+        own = codes[points[rows]]
+        index = np.arange(len(own))
+        # 评估点在参考集中时，自身距离为0，不计入所在簇的平均
+        own_counts = reference_counts[own] - in_reference[rows]
+        with np.errstate(divide='ignore', invalid='ignore'):
+            intra = sums[index, own] / own_counts
+            means = sums / reference_counts
+        means[index, own] = np.inf
+        nearest = means.min(axis=1)
+        with np.errstate(divide='ignore', invalid='ignore'):
+            chunk_values = (nearest - intra) / np.maximum(intra, nearest)
+        values[rows] = np.where((cluster_sizes[own] > 1) & np.isfinite(chunk_values), chunk_values, 0.0)
+    return values
+
+
+def sampled_silhouette(feature_matrix: np.ndarray,
+                       cluster_labels: np.ndarray,
+                       sample_size: int = 10_000,
+                       reference_size: int = 50_000,
+                       min_reference_per_cluster: int = 500,
+                       confidence: float = 0.95,
+                       random_state: int = 42) -> Dict[str, Any]:
+    """
+    分层抽样估计轮廓系数及其置信区间
+
+    评估点的轮廓值按簇的总体占比加权平均；标准误为各簇
+    (占比² × 抽样方差 / 抽样数 × 有限总体校正) 之和的平方根。
+    参考集为全部数据时评估点的轮廓值是精确的，估计无偏。
+
+    Args:
+        feature_matrix: 特征矩阵
+        cluster_labels: 聚类标签（至少2个簇）
+        sample_size: 评估点数
+        reference_size: 参考集大小，不少于总行数时使用全部数据
+        min_reference_per_cluster: 参考集中每个簇的最少点数
+        confidence: 置信水平
+        random_state: 随机种子
+
+    Returns:
+        silhouette_score, silhouette_ci_low, silhouette_ci_high, silhouette_sample_size, silhouette_reference_size
+    """
+    _, codes, population_sizes = np.unique(cluster_labels, return_inverse=True, return_counts=True)
+    n_rows = len(cluster_labels)
+
+    points = stratified_sample(codes, sample_size, random_state)
+    reference = (np.arange(n_rows) if n_rows <= reference_size
+                 else stratified_sample(codes, reference_size, random_state + 1, min_reference_per_cluster))
+    values = _silhouette_values(feature_matrix, codes, points, reference)
+
+    point_codes = codes[points]
+    n_clusters = len(population_sizes)
+    sample_sizes = np.bincount(point_codes, minlength=n_clusters).astype(float)
+    weights = population_sizes / n_rows
+
+    means = np.bincount(point_codes, weights=values, minlength=n_clusters) / sample_sizes
+    squares = np.bincount(point_codes, weights=(values - means[point_codes]) ** 2, minlength=n_clusters)
+    variances = np.divide(squares, sample_sizes - 1, out=np.zeros(n_clusters), where=sample_sizes > 1)
+    finite_correction = 1 - sample_sizes / population_sizes
+
+    estimate = float((weights * means).sum())
+    standard_error = float(np.sqrt((weights ** 2 * variances / sample_sizes * finite_correction).sum()))
+    margin = norm.ppf(0.5 + confidence / 2) * standard_error
+    return {
+        'silhouette_score': estimate,
+        'silhouette_ci_low': max(estimate - margin, -1.0),
+        'silhouette_ci_high': min(estimate + margin, 1.0),
+        'silhouette_sample_size': int(len(points)),
+        'silhouette_reference_size': int(len(reference))
+    }
+
+
+def silhouette_metrics(feature_matrix: np.ndarray,
+                       cluster_labels: np.ndarray,
+                       sample_size: int = 10_000,
+                       reference_size: int = 50_000,
+                       random_state: int = 42) -> Dict[str, Any]:
+    """
+    轮廓系数：行数不超过sample_size时精确计算，否则分层抽样估计（参考集大小reference_size）
+
+    Returns:
+        silhouette_score, silhouette_estimator（exact / stratified_sample），抽样估计时另含置信区间和样本量；
+        簇数小于2或每行一簇时轮廓系数记为0
+    """
+    n_rows = len(feature_matrix)
+    n_clusters = len(np.unique(cluster_labels))
+    if n_clusters < 2 or n_clusters >= n_rows:
+        return {'silhouette_score': 0, 'silhouette_estimator': 'exact'}
+    if n_rows <= sample_size:
+        return {'silhouette_score': float(silhouette_score(feature_matrix, cluster_labels)),
+                'silhouette_estimator': 'exact'}
+    metrics = sampled_silhouette(feature_matrix, cluster_labels, sample_size=sample_size,
+                                 reference_size=reference_size, random_state=random_state)
+    metrics['silhouette_estimator'] = 'stratified_sample'
+    return metrics
@@ -0,0 +1,192 @@
+"""
+聚类数量自动选择模块
+
+对同一个标准化特征矩阵扫描k = k_min..k_max：
+- 先在抽样上依次拟合各k的K-means，k的初始簇中心由k-1的结果加上离最近中心最远的点得到（热启动）；
+- 再以抽样得到的簇中心为初始值，在工作进程中并行地在全部数据上拟合各k（只需一次初始化）；
+- 每个k用轮廓系数（大数据量时分层抽样估计）和基于簇中心的指标打分，返回最优k及得分曲线。
+"""
+
+import os
+import numpy as np
+import pandas as pd
+from typing import Any, Dict, List, Optional
+from dataclasses import dataclass
+from concurrent.futures import ProcessPoolExecutor
+import logging
+
+from sklearn.cluster import KMeans
+
+from engines.cluster_quality import centroid_metrics, silhouette_metrics
+from engines.scalable_clustering import minibatch_kmeans
+
+logger = logging.getLogger(__name__)
+
+# 指标名 -> 是否越大越好
+SELECTION_METRICS = {
+    'silhouette_score': True,
+    'calinski_harabasz': True,
+    'davies_bouldin': False
+}
+
+# 工作进程中的特征矩阵，由进程初始化函数设置，避免每个任务重复传输
+_worker_matrix: Optional[np.ndarray] = None
+
+
+@dataclass
+class KSelectionResult:
+    """聚类数量扫描结果"""
+    best_k: int
+    metric: str
+    scores: pd.DataFrame  # 每个k一行：k、轮廓系数（及置信区间）、inertia、CH、DB
+    labels: np.ndarray  # 最优k的聚类标签
+    centroids: np.ndarray  # 最优k的簇中心
+
+    def score_curve(self) -> List[Dict[str, Any]]:
+        """得分曲线（可序列化）"""
+        return self.scores.replace({np.nan: None}).to_dict('records')
+
+
+def warm_start_centroids(sample: np.ndarray,
+                         k_values: List[int],
+                         random_state: int = 42) -> Dict[int, np.ndarray]:
+    """
+    在抽样上依次拟合各k的K-means，后一个k由前一个k的簇中心热启动
+
+    Args:
+        sample: 抽样特征矩阵
+        k_values: 升序的聚类数量
+        random_state: 随机种子
+
+    Returns:
+        k -> 抽样上的簇中心
+    """
+    centroids = {}
+    previous = None
+    for k in k_values:
+        if previous is None or len(previous) != k - 1:
+            model = KMeans(n_clusters=k, random_state=random_state, n_init=10)
+        else:
+            # 新增的中心取离现有中心最远的点
+            distances = ((sample[:, None, :] - previous[None, :, :]) ** 2).sum(axis=2).min(axis=1)
+            init = np.vstack([previous, sample[np.argmax(distances)]])
+            model = KMeans(n_clusters=k, init=init, n_init=1)
+        model.fit(sample)
+        centroids[k] = model.cluster_centers_
+        previous = model.cluster_centers_
+    return centroids
+
+
+def fit_candidate(feature_matrix: np.ndarray,
+                  k: int,
+                  init: np.ndarray,
+                  scalable: bool = False,
+                  chunk_size: int = 100_000,
+                  silhouette_sample_size: int = 2_000,
+                  silhouette_reference_size: int = 20_000,
+                  random_state: int = 42) -> Dict[str, Any]:
+    """
+    以给定簇中心初始化，在全部数据上拟合一个k并打分
+
+    Returns:
+        k、各质量指标、labels和centroids
+    """
+    if scalable:
+        labels, model = minibatch_kmeans(feature_matrix, k, chunk_size=chunk_size,
+                                         random_state=random_state, init=init)
+    else:
+        model = KMeans(n_clusters=k, init=init, n_init=1)
+        labels = model.fit_predict(feature_matrix)
+
+    scores = {'k': k}
+    scores.update(silhouette_metrics(feature_matrix, labels, sample_size=silhouette_sample_size,
+                                     reference_size=silhouette_reference_size, random_state=random_state))
+    scores.update(centroid_metrics(feature_matrix, labels))
+    scores['labels'] = labels
+    scores['centroids'] = model.cluster_centers_
+    return scores
+
+
+def _init_worker(feature_matrix: np.ndarray) -> None:
+    """工作进程初始化：保存特征矩阵"""
+    global _worker_matrix
+    _worker_matrix = feature_matrix
+
+
+def _fit_candidate_in_worker(k: int, init: np.ndarray, options: Dict[str, Any]) -> Dict[str, Any]:
+    """在工作进程中拟合一个k"""
+    return fit_candidate(_worker_matrix, k, init, **options)
+
+
+def select_n_clusters(feature_matrix: np.ndarray,
+                      k_min: int = 2,
+                      k_max: int = 10,
+                      metric: str = 'silhouette_score',
+                      n_jobs: Optional[int] = None,
+                      pilot_sample_size: int = 20_000,
+                      scalable: bool = False,
+                      chunk_size: int = 100_000,
+                      silhouette_sample_size: int = 2_000,
+                      silhouette_reference_size: int = 20_000,
+                      random_state: int = 42) -> KSelectionResult:
+    """
+    并行扫描聚类数量并选出最优k
+
+    Args:
+        feature_matrix: 标准化后的特征矩阵
+        k_min: 最小聚类数（至少2）
+        k_max: 最大聚类数（不超过行数-1）
+        metric: 选择指标，SELECTION_METRICS之一
+        n_jobs: 工作进程数，None为min(k的个数, CPU数)，1为在当前进程中依次拟合
+        pilot_sample_size: 热启动抽样的行数
+        scalable: 是否用MiniBatchKMeans在全部数据上拟合
+        chunk_size: MiniBatchKMeans每块行数
+        silhouette_sample_size: 轮廓系数精确计算的最大行数，超过时以此为评估点数分层抽样估计
+        silhouette_reference_size: 抽样估计轮廓系数时的参考集大小
+        random_state: 随机种子
+
+    Returns:
+        扫描结果
+    """
+    if metric not in SELECTION_METRICS:
+        raise ValueError(f"Unsupported k selection metric: {metric}")
+
+    n_rows = feature_matrix.shape[0]
+    k_min = max(2, k_min)
+    k_max = min(k_max, n_rows - 1)
+    if k_max < k_min:
+        raise ValueError(f"Not enough rows ({n_rows}) to compare cluster counts")
+    k_values = list(range(k_min, k_max + 1))
+
+    rng = np.random.default_rng(random_state)
+    pilot = (feature_matrix[np.sort(rng.choice(n_rows, pilot_sample_size, replace=False))]
+             if n_rows > pilot_sample_size else feature_matrix)
+    initial = warm_start_centroids(pilot, k_values, random_state)
+
+    options = {'scalable': scalable, 'chunk_size': chunk_size,
+               'silhouette_sample_size': silhouette_sample_size,
+               'silhouette_reference_size': silhouette_reference_size, 'random_state': random_state}
+    n_jobs = min(len(k_values), n_jobs or os.cpu_count() or 1)
+    candidates = None
+    if n_jobs > 1:
+        try:
+            with ProcessPoolExecutor(max_workers=n_jobs, initializer=_init_worker,
+                                     initargs=(feature_matrix,)) as executor:
+                futures = [executor.submit(_fit_candidate_in_worker, k, initial[k], options) for k in k_values]
+                candidates = [future.result() for future in futures]
+        except Exception as e:
+            logger.warning(f"并行扫描聚类数量失败，改为依次拟合: {e}")
+    if candidates is None:
+        candidates = [fit_candidate(feature_matrix, k, initial[k], **options) for k in k_values]
+
+    scores = pd.DataFrame([{key: value for key, value in candidate.items() if key not in ('labels', 'centroids')}
+                           for candidate in candidates])
+    values = scores[metric].astype(float)
+    best = int(values.idxmax() if SELECTION_METRICS[metric] else values.idxmin())
+    return KSelectionResult(
+        best_k=int(scores.loc[best, 'k']),
+        metric=metric,
+        scores=scores,
+        labels=candidates[best]['labels'],
+        centroids=candidates[best]['centroids']
+    )
@@ -10,16 +10,26 @@ import numpy as np
 from typing import Dict, List, Any, Optional, Tuple
 from datetime import datetime, timedelta
 import logging
-from dataclasses import dataclass
-from collections import defaultdict
+from dataclasses import dataclass, field
+from collections import OrderedDict, defaultdict
 from scipy import stats
 import warnings
 
+from engines.feature_store import UserFeatureStore
+from engines.churn_model import train_churn_model
+from engines.dataset_cache import DatasetCache
+
 # 忽略统计计算中的警告
 warnings.filterwarnings('ignore', category=RuntimeWarning)
 
 logger = logging.getLogger(__name__)
 
+_DAY_NS = 86_400 * 1_000_000_000
+# 行为模式分析取队列起始后的天数
+_COHORT_WINDOW_NS = 30 * _DAY_NS
+# 队列度量单位 -> pandas周期
+_COHORT_FREQUENCIES = {'days': 'D', 'weeks': 'W', 'months': 'M'}
+
 
 @dataclass
 class CohortData:
@@ -38,6 +48,7 @@ class CohortResult:
     total_users: int
     cohort_periods: int
     cohorts: List[CohortData]
+    user_cohorts: Optional[pd.Series] = None  # 用户ID -> 所属队列在cohorts中的位置
 
 
 @dataclass
@@ -68,6 +79,8 @@ class ChurnPredictionResult:
     churn_reasons: Dict[str, List[str]]
     prevention_strategies: Dict[str, List[str]]
     prediction_accuracy: float
+    model_metrics: Dict[str, Any] = field(default_factory=dict)  # 时间留出验证指标（accuracy、auc等）
+    user_churn_scores: Optional[pd.Series] = None  # 用户ID -> 流失概率
 
 
 @dataclass
@@ -90,8 +103,13 @@ class CohortAnalysisEngine:
             storage_manager: 数据存储管理器实例
         """
         self.storage_manager = storage_manager
+        self.dataset_cache = DatasetCache.for_storage(storage_manager)
         self.default_cohort_size = 30
         self.default_retention_periods = [1, 7, 14, 30]
+        # 用户特征表与同一存储管理器上的其他引擎共用；流失模型和打分结果按数据版本缓存
+        self.feature_store = UserFeatureStore.for_storage(storage_manager)
+        self.churn_cache_size = 4
+        self._churn_cache: 'OrderedDict[Tuple[str, int, str], Dict[str, Any]]' = OrderedDict()
         
         logger.info("队列分析引擎初始化完成")
     
@@ -110,7 +128,7 @@ class CohortAnalysisEngine:
             events: 事件数据
             
         Returns:
-            队列构建结果
+            队列构建结果，user_cohorts为每个用户所属队列在cohorts中的位置
         """
         try:
             # 获取数据
@@ -126,55 +144,106 @@ class CohortAnalysisEngine:
                 logger.warning("Event data is empty, cannot build cohorts")
                 return self._create_empty_cohort_result(cohort_type)
             
-            # 确保有时间列
-            if 'event_datetime' not in events.columns:
-                if 'event_timestamp' in events.columns:
-                    events['event_datetime'] = pd.to_datetime(events['event_timestamp'], unit='us')
-                else:
-                    raise ValueError("Missing time field in data")
-            
-            # 按用户分组，获取每个用户的首次事件时间
-            user_first_events = events.groupby('user_pseudo_id')['event_datetime'].min().reset_index()
-            user_first_events.columns = ['user_pseudo_id', 'first_event_date']
-            
-            # 按队列周期分组
-            if cohort_metric == "days":
-                period = timedelta(days=cohort_size)
-                user_first_events['cohort_period'] = user_first_events['first_event_date'].dt.floor('D')
-            elif cohort_metric == "weeks":
-                period = timedelta(weeks=cohort_size)
-                user_first_events['cohort_period'] = user_first_events['first_event_date'].dt.to_period('W').dt.start_time
-            elif cohort_metric == "months":
-                period = timedelta(days=30 * cohort_size)
-                user_first_events['cohort_period'] = user_first_events['first_event_date'].dt.to_period('M').dt.start_time
-            
-            # 分组统计
-            cohort_groups = user_first_events.groupby('cohort_period').size().reset_index()
-            cohort_groups.columns = ['cohort_date', 'user_count']
+            if cohort_metric not in _COHORT_FREQUENCIES:
+                raise ValueError(f"Unsupported cohort metric: {cohort_metric}")
+            
+            # 每个用户的首次事件时间，按队列周期取起始时间
+            user_codes, user_ids = pd.factorize(events['user_pseudo_id'])
+            first_times = pd.Series(self.dataset_cache.event_times(events)).groupby(user_codes).min().to_numpy()
+            cohort_periods = self._cohort_period_starts(first_times, cohort_metric)
+            
+            # 队列按起始时间升序，用户 -> 队列位置
+            cohort_dates, cohort_codes = np.unique(cohort_periods, return_inverse=True)
+            user_counts = np.bincount(cohort_codes, minlength=len(cohort_dates))
             
             # 创建队列数据
             cohorts = []
-            for _, row in cohort_groups.iterrows():
-                cohort_name = f"{cohort_type}_{row['cohort_date'].strftime('%Y%m%d')}"
+            for cohort_date, user_count in zip(pd.to_datetime(cohort_dates), user_counts):
+                cohort_name = f"{cohort_type}_{cohort_date.strftime('%Y%m%d')}"
                 cohorts.append(CohortData(
                     cohort_name=cohort_name,
-                    cohort_date=row['cohort_date'],
-                    user_count=row['user_count'],
+                    cohort_date=cohort_date,
+                    user_count=int(user_count),
                     cohort_period=f"{cohort_size}{cohort_metric[0]}"
                 ))
             
             return CohortResult(
                 cohort_type=cohort_type,
                 total_cohorts=len(cohorts),
-                total_users=len(user_first_events),
+                total_users=len(user_ids),
                 cohort_periods=cohort_size,
-                cohorts=cohorts
+                cohorts=cohorts,
+                user_cohorts=pd.Series(cohort_codes, index=pd.Index(user_ids, name='user_pseudo_id'),
+                                       name='cohort')
             )
             
         except Exception as e:
             logger.error(f"队列构建失败: {e}")
             raise
     
+    def _cohort_period_starts(self, times: np.ndarray, cohort_metric: str) -> np.ndarray:
+        """时间（int64纳秒）所在队列周期的起始时间（int64纳秒）"""
+        datetimes = pd.Series(pd.to_datetime(times))
+        if cohort_metric == "days":
+            starts = datetimes.dt.floor('D')
+        else:
+            starts = datetimes.dt.to_period(_COHORT_FREQUENCIES[cohort_metric]).dt.start_time
+        return starts.to_numpy(dtype='datetime64[ns]').view('int64')
+    
+    def _user_cohort_codes(self,
+                           user_ids: pd.Index,
+                           cohorts: CohortResult,
+                           events: pd.DataFrame,
+                           user_codes: np.ndarray,
+                           times: np.ndarray) -> np.ndarray:
+        """
+        用户所属队列在cohorts.cohorts中的位置，不属于任何队列时为-1
+        
+        优先使用build_cohorts记录的映射；没有映射时按用户首次cohort_type事件（没有该事件时为首次事件）
+        落在哪个队列的起始时间之后确定。
+        """
+        if cohorts.user_cohorts is not None:
+            return cohorts.user_cohorts.reindex(user_ids).fillna(-1).to_numpy(dtype=np.int64)
+        
+        cohort_events = (events['event_name'] == cohorts.cohort_type).to_numpy()
+        if not cohort_events.any():
+            cohort_events = np.ones(len(events), dtype=bool)
+        first_times = np.full(len(user_ids), np.iinfo(np.int64).max)
+        np.minimum.at(first_times, user_codes[cohort_events], times[cohort_events])
+        
+        starts = self._cohort_starts(cohorts)
+        codes = np.searchsorted(starts, first_times, side='right') - 1
+        codes[first_times == np.iinfo(np.int64).max] = -1
+        return codes
+    
+    def _cohort_starts(self, cohorts: CohortResult) -> np.ndarray:
+        """各队列起始时间（int64纳秒）"""
+        return pd.to_datetime([cohort.cohort_date for cohort in cohorts.cohorts]).to_numpy(dtype='datetime64[ns]').view('int64')
+    
+    def _period_offsets(self, periods: List[int], period_type: str) -> np.ndarray:
+        """留存周期相对队列起始时间的偏移（int64纳秒）：天、周，其他按30天一个月"""
+        unit = {'days': _DAY_NS, 'weeks': 7 * _DAY_NS}.get(period_type, 30 * _DAY_NS)
+        return np.asarray(periods, dtype=np.int64) * unit
+    
+    def _user_activity(self, events: pd.DataFrame, cohorts: CohortResult) -> Dict[str, np.ndarray]:
+        """
+        按用户一次汇总事件：用户编码、事件时间、用户所属队列、首次/末次事件时间和事件数
+        
+        Returns:
+            user_codes、times（按事件），cohort、first、last、count（按用户）
+        """
+        user_codes, user_ids = pd.factorize(events['user_pseudo_id'])
+        times = self.dataset_cache.event_times(events)
+        grouped = pd.Series(times).groupby(user_codes)
+        return {
+            'user_codes': user_codes,
+            'times': times,
+            'cohort': self._user_cohort_codes(pd.Index(user_ids), cohorts, events, user_codes, times),
+            'first': grouped.min().to_numpy(),
+            'last': grouped.max().to_numpy(),
+            'count': np.bincount(user_codes, minlength=len(user_ids))
+        }
+    
     def calculate_retention_rates(self, 
                                  retention_periods: List[int] = [1, 7, 14, 30],
                                  retention_type: str = "days",
@@ -182,6 +251,9 @@ class CohortAnalysisEngine:
         """
         计算队列留存率
         
+        队列用户在队列起始时间加留存周期之后仍有事件即为留存，
+        所有队列、所有周期由用户末次事件时间与各周期偏移的比较一次汇总得到。
+        
         Args:
             retention_periods: 留存周期列表
             retention_type: 留存类型
@@ -201,72 +273,31 @@ class CohortAnalysisEngine:
             if self.storage_manager is None:
                 raise ValueError("Storage manager not initialized")
             
-            events = self.storage_manager.get_data('events', {})
+            events = self.dataset_cache.events()
             if events.empty:
                 return self._create_empty_retention_result()
             
-            # 确保有时间列
-            if 'event_datetime' not in events.columns:
-                if 'event_timestamp' in events.columns:
-                    events['event_datetime'] = pd.to_datetime(events['event_timestamp'], unit='us')
-                else:
-                    raise ValueError("Missing time field in data")
-            
-            # 构建用户队列映射
-            cohort_user_map = {}
-            for cohort in cohorts.cohorts:
-                cohort_start = cohort.cohort_date
-                cohort_end = cohort_start + timedelta(days=30)  # 假设分析30天数据
-                
-                # 获取该队列的用户
-                user_events = events[
-                    (events['event_datetime'] >= cohort_start) &
-                    (events['event_datetime'] < cohort_end)
-                ]
-                
-                cohort_users = user_events['user_pseudo_id'].unique()
-                cohort_user_map[cohort.cohort_name] = {
-                    'users': set(cohort_users),
-                    'start_date': cohort_start,
-                    'user_count': len(cohort_users)
-                }
+            activity = self._user_activity(events, cohorts)
+            in_cohort = activity['cohort'] >= 0
+            codes = activity['cohort'][in_cohort]
+            n_cohorts = len(cohorts.cohorts)
             
-            # 计算留存率矩阵
-            retention_matrix = pd.DataFrame(index=[c.cohort_name for c in cohorts.cohorts])
+            # 用户 × 周期：末次事件是否不早于 队列起始 + 周期偏移
+            retention_dates = self._cohort_starts(cohorts)[codes][:, None] + self._period_offsets(retention_periods, retention_type)
+            retained = activity['last'][in_cohort][:, None] >= retention_dates
             
-            for period in retention_periods:
-                col_name = f"day_{period}" if retention_type == "days" else f"{retention_type}_{period}"
-                retention_rates = []
-                
-                for cohort_name, cohort_data in cohort_user_map.items():
-                    cohort_start = cohort_data['start_date']
-                    
-                    if retention_type == "days":
-                        retention_date = cohort_start + timedelta(days=period)
-                    elif retention_type == "weeks":
-                        retention_date = cohort_start + timedelta(weeks=period)
-                    else:
-                        retention_date = cohort_start + timedelta(days=30 * period)
-                    
-                    # 获取在留存日期仍有活动的用户
-                    retention_events = events[
-                        events['event_datetime'] >= retention_date
-                    ]
-                    retention_users = set(retention_events['user_pseudo_id'])
-                    
-                    # 计算留存率
-                    original_users = cohort_data['users']
-                    retained_users = original_users.intersection(retention_users)
-                    
-                    retention_rate = len(retained_users) / len(original_users) if len(original_users) > 0 else 0
-                    retention_rates.append(retention_rate)
-                
-                retention_matrix[col_name] = retention_rates
+            cohort_sizes = np.bincount(codes, minlength=n_cohorts)
+            retained_counts = pd.DataFrame(retained).groupby(codes).sum().reindex(range(n_cohorts), fill_value=0).to_numpy()
+            with np.errstate(divide='ignore', invalid='ignore'):
+                rates = np.where(cohort_sizes[:, None] > 0, retained_counts / cohort_sizes[:, None], 0.0)
+            
+            # 计算留存率矩阵
+            columns = [f"day_{period}" if retention_type == "days" else f"{retention_type}_{period}"
+                       for period in retention_periods]
+            retention_matrix = pd.DataFrame(rates, index=[c.cohort_name for c in cohorts.cohorts], columns=columns)
             
             # 计算平均留存率
-            avg_retention_rates = {}
-            for col in retention_matrix.columns:
-                avg_retention_rates[col] = retention_matrix[col].mean()
+            avg_retention_rates = {col: retention_matrix[col].mean() for col in retention_matrix.columns}
             
             # 识别最佳和最差表现的队列
             best_cohort = retention_matrix.mean(axis=1).idxmax()
@@ -310,50 +341,36 @@ class CohortAnalysisEngine:
                 return self._create_empty_lifecycle_result()
             
             # 获取事件和收入数据
-            events = self.storage_manager.get_data('events', {}) if self.storage_manager else None
+            events = self.dataset_cache.events() if self.storage_manager else None
             if events is None or events.empty:
                 return self._create_empty_lifecycle_result()
             
-            ltv_by_cohort = {}
-            lifecycle_distribution = defaultdict(int)
-            cohort_performance = {}
-            
-            # 计算每个队列的LTV
-            for cohort in cohorts.cohorts:
-                # 简化计算：假设每个用户价值基于事件数量
-                cohort_events = events[
-                    events['user_pseudo_id'].isin(
-                        events[events['event_datetime'] >= cohort.cohort_date]['user_pseudo_id'].unique()
-                    )
-                ]
-                
-                # 计算生命周期阶段分布
-                user_activity = cohort_events.groupby('user_pseudo_id').agg({
-                    'event_datetime': ['min', 'max', 'count']
-                }).reset_index()
-                
-                user_activity.columns = ['user_id', 'first_event', 'last_event', 'event_count']
-                
-                # 计算LTV（简化模型）
-                avg_events_per_user = user_activity['event_count'].mean() if len(user_activity) > 0 else 0
-                estimated_ltv = avg_events_per_user * 5  # 假设每个事件价值5元
-                
-                ltv_by_cohort[cohort.cohort_name] = estimated_ltv
-                cohort_performance[cohort.cohort_name] = estimated_ltv
-                
-                # 生命周期阶段分布
-                for _, user in user_activity.iterrows():
-                    days_since_first = (datetime.now() - user['first_event']).days
-                    event_count = user['event_count']
-                    
-                    if days_since_first <= 7 and event_count >= 5:
-                        lifecycle_distribution["new"] += 1
-                    elif days_since_first <= 30 and event_count >= 10:
-                        lifecycle_distribution["active"] += 1
-                    elif days_since_first <= 90 and event_count <= 5:
-                        lifecycle_distribution["dormant"] += 1
-                    else:
-                        lifecycle_distribution["churned"] += 1
+            activity = self._user_activity(events, cohorts)
+            in_cohort = activity['cohort'] >= 0
+            codes = activity['cohort'][in_cohort]
+            event_counts = activity['count'][in_cohort]
+            n_cohorts = len(cohorts.cohorts)
+            
+            # 计算LTV（简化模型：假设每个事件价值5元）
+            cohort_sizes = np.bincount(codes, minlength=n_cohorts)
+            cohort_events = np.bincount(codes, weights=event_counts, minlength=n_cohorts)
+            with np.errstate(divide='ignore', invalid='ignore'):
+                estimated_ltv = np.where(cohort_sizes > 0, cohort_events / cohort_sizes, 0.0) * 5
+            
+            ltv_by_cohort = {cohort.cohort_name: float(ltv) for cohort, ltv in zip(cohorts.cohorts, estimated_ltv)}
+            cohort_performance = dict(ltv_by_cohort)
+            
+            # 生命周期阶段分布
+            days_since_first = (pd.Timestamp.now().value - activity['first'][in_cohort]) // _DAY_NS
+            stages = np.select(
+                [(days_since_first <= 7) & (event_counts >= 5),
+                 (days_since_first <= 30) & (event_counts >= 10),
+                 (days_since_first <= 90) & (event_counts <= 5)],
+                ["new", "active", "dormant"],
+                default="churned"
+            )
+            stage_names, stage_counts = np.unique(stages, return_counts=True)
+            lifecycle_distribution = {str(stage): int(count) for stage, count in zip(stage_names, stage_counts)}
             
             avg_ltv = np.mean(list(ltv_by_cohort.values())) if ltv_by_cohort else 0
             
@@ -362,7 +379,7 @@ class CohortAnalysisEngine:
             
             return LifecycleResult(
                 ltv_by_cohort=ltv_by_cohort,
-                lifecycle_distribution=dict(lifecycle_distribution),
+                lifecycle_distribution=lifecycle_distribution,
                 avg_ltv=avg_ltv,
                 cohort_performance=cohort_performance,
                 lifecycle_insights=insights
@@ -374,40 +391,61 @@ class CohortAnalysisEngine:
     
     def predict_churn_risk(self, 
                           prediction_horizon: int = 30,
-                          risk_threshold: float = 0.7) -> ChurnPredictionResult:
+                          risk_threshold: float = 0.7,
+                          model_type: str = "logistic") -> ChurnPredictionResult:
         """
         预测用户流失风险
         
+        在用户级别训练流失模型（按时间留出验证），对全部用户批量打分，
+        队列的流失风险为其用户流失概率的平均值。模型和打分结果按数据版本缓存，
+        数据未变时重复调用（如调整阈值）不再重新训练。历史数据不足以训练时退回按留存率估计。
+        
         Args:
-            prediction_horizon: 预测时间范围（天）
+            prediction_horizon: 预测时间范围（天），即流失判定窗口
             risk_threshold: 流失风险阈值
+            model_type: 'logistic' 或 'gbm'
             
         Returns:
-            流失预测结果
+            流失预测结果，prediction_accuracy和model_metrics为验证集上的真实指标
         """
         try:
-            # 获取队列和留存数据
+            # 获取队列数据
             cohorts = self.build_cohorts()
-            retention_result = self.calculate_retention_rates()
             
             if not cohorts.cohorts:
                 return self._create_empty_churn_prediction_result()
             
+            try:
+                scores = self._churn_scores(prediction_horizon, model_type)
+            except ValueError as e:
+                logger.warning(f"流失模型训练失败，改为按留存率估计: {e}")
+                return self._retention_churn_risk(cohorts, risk_threshold)
+            
+            model = scores['model']
+            probabilities = scores['probabilities']
+            cohort_codes = cohorts.user_cohorts.reindex(probabilities.index).fillna(-1).to_numpy(dtype=np.int64)
+            in_cohort = cohort_codes >= 0
+            codes = cohort_codes[in_cohort]
+            n_cohorts = len(cohorts.cohorts)
+            
+            # 各队列的平均流失概率、高风险用户占比和平均最近活跃天数
+            cohort_sizes = np.bincount(codes, minlength=n_cohorts)
+            with np.errstate(divide='ignore', invalid='ignore'):
+                mean_risk = np.bincount(codes, weights=probabilities.to_numpy()[in_cohort], minlength=n_cohorts) / cohort_sizes
+                high_risk_share = np.bincount(codes, weights=probabilities.to_numpy()[in_cohort] >= risk_threshold,
+                                              minlength=n_cohorts) / cohort_sizes
+                recency = np.bincount(codes, weights=scores['recency'].to_numpy()[in_cohort], minlength=n_cohorts) / cohort_sizes
+            
             churn_predictions = {}
             high_risk_cohorts = []
             churn_reasons = {}
             prevention_strategies = {}
             
-            # 基于留存率预测流失风险
-            retention_matrix = retention_result.retention_matrix
-            
-            for cohort_name in retention_matrix.index:
-                cohort_retention = retention_matrix.loc[cohort_name]
-                
-                # 计算流失风险（1 - 留存率）
-                latest_retention = cohort_retention.iloc[-1] if len(cohort_retention) > 0 else 0
-                churn_risk = 1 - latest_retention
-                
+            for row, cohort in enumerate(cohorts.cohorts):
+                if cohort_sizes[row] == 0:
+                    continue
+                cohort_name = cohort.cohort_name
+                churn_risk = float(mean_risk[row])
                 churn_predictions[cohort_name] = churn_risk
                 
                 if churn_risk >= risk_threshold:
@@ -415,9 +453,9 @@ class CohortAnalysisEngine:
                     
                     # 分析流失原因
                     churn_reasons[cohort_name] = [
-                        f"留存率仅为 {latest_retention:.1%}",
-                        f"预测时间范围内用户活跃度低",
-                        f"队列用户参与度下降"
+                        f"模型预测平均流失概率为 {churn_risk:.1%}",
+                        f"高风险用户占比 {high_risk_share[row]:.1%}",
+                        f"用户平均 {recency[row]:.0f} 天未活跃"
                     ]
                     
                     # 生成预防策略
@@ -428,27 +466,88 @@ class CohortAnalysisEngine:
                         "建立定期用户沟通机制"
                     ]
             
-            # 计算预测准确率（简化）
-            prediction_accuracy = 0.75  # 基于历史数据
-            
             return ChurnPredictionResult(
                 churn_predictions=churn_predictions,
                 high_risk_cohorts=high_risk_cohorts,
                 churn_reasons=churn_reasons,
                 prevention_strategies=prevention_strategies,
-                prediction_accuracy=prediction_accuracy
+                prediction_accuracy=model.metrics['accuracy'],
+                model_metrics=dict(model.metrics),
+                user_churn_scores=probabilities
             )
             
         except Exception as e:
             logger.error(f"流失预测失败: {e}")
             raise
     
+    def _churn_scores(self, horizon_days: int, model_type: str) -> Dict[str, Any]:
+        """
+        训练（或复用缓存的）流失模型并为全部用户打分
+        
+        Returns:
+            model、probabilities（用户ID -> 流失概率）、recency（用户ID -> 最近活跃距今天数）
+        """
+        if self.storage_manager is None:
+            raise ValueError("Storage manager not initialized")
+        
+        data_version = self.storage_manager.get_data_version() if self.feature_store.is_versioned() else None
+        key = (data_version, horizon_days, model_type)
+        if data_version is not None and key in self._churn_cache:
+            self._churn_cache.move_to_end(key)
+            return self._churn_cache[key]
+        
+        events = self.dataset_cache.events()
+        if events.empty:
+            raise ValueError("No events to train a churn model")
+        model = train_churn_model(events, horizon_days, model_type, feature_store=self.feature_store,
+                                  times=self.dataset_cache.event_times(events))
+        
+        # 以最后事件时间为参考时间计算全部用户的特征并批量打分
+        if data_version is not None:
+            features = self.feature_store.get_features(reference_time=model.data_end)
+        else:
+            features = self.feature_store.get_features(events, reference_time=model.data_end)
+        scores = {
+            'model': model,
+            'probabilities': model.predict_proba(features),
+            'recency': features['days_since_last_activity']
+        }
+        
+        if data_version is not None:
+            self._churn_cache[key] = scores
+            while len(self._churn_cache) > self.churn_cache_size:
+                self._churn_cache.popitem(last=False)
+        return scores
+    
+    def _retention_churn_risk(self, cohorts: CohortResult, risk_threshold: float) -> ChurnPredictionResult:
+        """历史数据不足以训练模型时，按队列最后一个留存周期的留存率估计流失风险"""
+        retention_matrix = self.calculate_retention_rates(cohorts=cohorts).retention_matrix
+        churn_predictions = {}
+        for cohort_name in retention_matrix.index:
+            cohort_retention = retention_matrix.loc[cohort_name]
+            latest_retention = cohort_retention.iloc[-1] if len(cohort_retention) > 0 else 0
+            churn_predictions[cohort_name] = float(1 - latest_retention)
+            
+        high_risk_cohorts = [name for name, risk in churn_predictions.items() if risk >= risk_threshold]
+        return ChurnPredictionResult(
+            churn_predictions=churn_predictions,
+            high_risk_cohorts=high_risk_cohorts,
+            churn_reasons={name: [f"留存率仅为 {1 - churn_predictions[name]:.1%}"] for name in high_risk_cohorts},
+            prevention_strategies={name: [f"针对{name}队列用户实施个性化重新激活策略",
+                                          "提供专属优惠和激励措施"] for name in high_risk_cohorts},
+            prediction_accuracy=0.0,
+            model_metrics={'model_type': 'retention_fallback'}
+        )
+    
     def analyze_behavioral_patterns(self, 
                                    behavior_events: List[str] = None,
                                    comparison_metrics: List[str] = None) -> BehavioralPatternResult:
         """
         分析用户行为模式
         
+        每个队列取其用户在队列起始后30天内的事件，按用户汇总行为事件数和末次事件时间，
+        再按队列汇总RFM指标。
+        
         Args:
             behavior_events: 行为事件列表
             comparison_metrics: 比较指标列表
@@ -469,42 +568,43 @@ class CohortAnalysisEngine:
                 return self._create_empty_behavioral_result()
             
             # 获取事件数据
-            events = self.storage_manager.get_data('events', {}) if self.storage_manager else None
+            events = self.dataset_cache.events() if self.storage_manager else None
             if events is None or events.empty:
                 return self._create_empty_behavioral_result()
             
-            behavioral_patterns = {}
-            cohort_differences = {}
-            
-            # 分析每个队列的行为模式
-            for cohort in cohorts.cohorts:
-                cohort_start = cohort.cohort_date
-                cohort_end = cohort_start + timedelta(days=30)
-                
-                # 获取该队列的用户事件
-                cohort_events = events[
-                    (events['event_datetime'] >= cohort_start) &
-                    (events['event_datetime'] < cohort_end)
-                ]
-                
-                # 计算行为指标
-                user_behavior = cohort_events.groupby('user_pseudo_id').agg({
-                    'event_name': lambda x: x.isin(behavior_events).sum(),
-                    'event_datetime': ['min', 'max']
-                }).reset_index()
-                
-                user_behavior.columns = ['user_id', 'event_count', 'first_event', 'last_event']
-                
-                # 计算RFM指标
-                rfm_data = {
-                    'frequency': user_behavior['event_count'].mean(),
-                    'recency': (datetime.now() - user_behavior['last_event']).dt.days.mean(),
-                    'monetary': user_behavior['event_count'].sum() * 10  # 假设价值
-                }
-                
-                behavioral_patterns[cohort.cohort_name] = rfm_data
+            activity = self._user_activity(events, cohorts)
+            n_cohorts = len(cohorts.cohorts)
+            
+            # 事件所属用户的队列，只保留队列起始后30天内的事件
+            event_cohorts = activity['cohort'][activity['user_codes']]
+            window_starts = self._cohort_starts(cohorts)[np.maximum(event_cohorts, 0)]
+            times = activity['times']
+            in_window = (event_cohorts >= 0) & (times >= window_starts) & (times < window_starts + _COHORT_WINDOW_NS)
+            
+            # 按用户汇总窗口内的行为事件数和末次事件时间
+            window_users = activity['user_codes'][in_window]
+            is_behavior = events['event_name'].isin(behavior_events).to_numpy()[in_window]
+            user_behavior = pd.DataFrame({'event_count': is_behavior, 'last_event': times[in_window]}).groupby(
+                window_users).agg({'event_count': 'sum', 'last_event': 'max'})
+            user_behavior['cohort'] = activity['cohort'][user_behavior.index.to_numpy()]
+            user_behavior['recency'] = (pd.Timestamp.now().value - user_behavior['last_event']) // _DAY_NS
+            
+            # 按队列汇总RFM指标
+            cohort_metrics = user_behavior.groupby('cohort').agg(
+                frequency=('event_count', 'mean'),
+                recency=('recency', 'mean'),
+                monetary=('event_count', 'sum')
+            ).reindex(range(n_cohorts))
+            cohort_metrics['monetary'] = cohort_metrics['monetary'].fillna(0) * 10  # 假设价值
+            cohort_metrics = cohort_metrics.fillna(0.0).astype(float)
+            
+            behavioral_patterns = {
+                cohort.cohort_name: cohort_metrics.iloc[row].to_dict()
+                for row, cohort in enumerate(cohorts.cohorts)
+            }
                 
             # 计算队列间差异
+            cohort_differences = {}
             for metric in comparison_metrics:
                 values = [patterns[metric] for patterns in behavioral_patterns.values()]
                 cohort_differences[metric] = {
@@ -10,10 +10,15 @@ import numpy as np
 from typing import Dict, List, Any, Optional, Tuple, Union
 from datetime import datetime, timedelta
 import logging
-from dataclasses import dataclass
+from dataclasses import dataclass, asdict
 from collections import defaultdict, OrderedDict
 import warnings
 
+from engines.attribution_engine import AttributionEngine
+from engines.conversion_latency import LatencyDistribution, compute_latency_distributions
+from engines.funnel_matcher import FunnelMatch, match_funnels
+from engines.dataset_cache import DatasetCache
+
 warnings.filterwarnings('ignore', category=RuntimeWarning)
 
 logger = logging.getLogger(__name__)
@@ -72,6 +77,7 @@ class ConversionFunnel:
     total_users_converted: int
     avg_completion_time: Optional[float]
     bottleneck_step: Optional[str]
+    latency_distributions: Optional[List[LatencyDistribution]] = None
 
 
 @dataclass
@@ -106,6 +112,7 @@ class ConversionAnalysisEngine:
             storage_manager: 数据存储管理器实例
         """
         self.storage_manager = storage_manager
+        self.dataset_cache = DatasetCache.for_storage(storage_manager)
         
         # 预定义的转化漏斗
         self.predefined_funnels = {
@@ -123,6 +130,16 @@ class ConversionAnalysisEngine:
             ]
         }
         
+        # 分段维度到嵌套字典列的映射
+        self.segment_dimensions = {
+            'device_category': ('device', 'category'),
+            'device_os': ('device', 'operating_system'),
+            'geo_country': ('geo', 'country'),
+            'geo_city': ('geo', 'city'),
+            'traffic_source': ('traffic_source', 'source'),
+            'traffic_medium': ('traffic_source', 'medium')
+        }
+        
         # 转化事件定义
         self.conversion_events = {
             'sign_up', 'login', 'purchase', 'begin_checkout', 
@@ -133,7 +150,7 @@ class ConversionAnalysisEngine:
         
     def build_conversion_funnel(self,
                               events: Optional[pd.DataFrame] = None,
-                              funnel_steps: List[str] = None,
+                              funnel_steps: List[Any] = None,
                               funnel_name: str = "custom_funnel",
                               time_window_hours: int = 24) -> ConversionFunnel:
         """
@@ -141,7 +158,7 @@ class ConversionAnalysisEngine:
         
         Args:
             events: 事件数据DataFrame
-            funnel_steps: 漏斗步骤列表
+            funnel_steps: 漏斗步骤列表（事件名，或事件名加param_*参数条件的步骤，见funnel_steps.parse_step）
             funnel_name: 漏斗名称
             time_window_hours: 时间窗口（小时）
             
@@ -153,95 +170,179 @@ class ConversionAnalysisEngine:
             if events is None:
                 if self.storage_manager is None:
                     raise ValueError("Event data not provided and storage manager not initialized")
-                events = self.storage_manager.get_data('events')
+                events = self.dataset_cache.events()
                 
             if events.empty:
                 logger.warning("Event data is empty, cannot build conversion funnel")
-                return ConversionFunnel(
-                    funnel_name=funnel_name,
-                    steps=[],
-                    overall_conversion_rate=0.0,
-                    total_users_entered=0,
-                    total_users_converted=0,
-                    avg_completion_time=None,
-                    bottleneck_step=None
-                )
+                return self._create_empty_funnel(funnel_name)
                 
             if not funnel_steps:
                 raise ValueError("Funnel steps must be provided")
                 
-            # 确保有时间列
-            if 'event_datetime' not in events.columns:
-                if 'event_timestamp' in events.columns:
-                    events['event_datetime'] = pd.to_datetime(events['event_timestamp'], unit='us')
-                else:
-                    raise ValueError("Missing time field")
-                    
-            # 筛选相关事件
-            funnel_events = events[events['event_name'].isin(funnel_steps)].copy()
-            
-            if funnel_events.empty:
-                logger.warning(f"No events found for funnel steps: {funnel_steps}")
-                return ConversionFunnel(
-                    funnel_name=funnel_name,
-                    steps=[],
-                    overall_conversion_rate=0.0,
-                    total_users_entered=0,
-                    total_users_converted=0,
-                    avg_completion_time=None,
-                    bottleneck_step=None
-                )
-                
-            # 按用户分组分析转化路径
-            user_journeys = self._analyze_user_journeys(
-                funnel_events, funnel_steps, time_window_hours
+            funnels = self.build_conversion_funnels(
+                events, {funnel_name: funnel_steps}, time_window_hours
             )
+            return funnels[funnel_name]
             
-            # 构建漏斗步骤
-            funnel_step_objects = self._build_funnel_steps(
-                user_journeys, funnel_steps
-            )
-            
-            # 计算整体转化率
-            total_users_entered = len(user_journeys)
-            total_users_converted = sum(
-                1 for journey in user_journeys.values() 
-                if journey['completed_all_steps']
-            )
-            
-            overall_conversion_rate = (
-                total_users_converted / total_users_entered 
-                if total_users_entered > 0 else 0
-            )
-            
-            # 计算平均完成时间
-            completion_times = [
-                journey['total_time'] for journey in user_journeys.values()
-                if journey['completed_all_steps'] and journey['total_time'] is not None
-            ]
-            
-            avg_completion_time = np.mean(completion_times) if completion_times else None
-            
-            # 识别瓶颈步骤
-            bottleneck_step = self._identify_bottleneck_step(funnel_step_objects)
+        except Exception as e:
+            logger.error(f"{t('conversion_analysis.funnel.build_failed', '构建转化漏斗失败')}: {e}")
+            raise
             
-            funnel = ConversionFunnel(
-                funnel_name=funnel_name,
-                steps=funnel_step_objects,
-                overall_conversion_rate=overall_conversion_rate,
-                total_users_entered=total_users_entered,
-                total_users_converted=total_users_converted,
-                avg_completion_time=avg_completion_time,
-                bottleneck_step=bottleneck_step
-            )
+    def build_conversion_funnels(self,
+                               events: Optional[pd.DataFrame] = None,
+                               funnel_definitions: Optional[Dict[str, List[Any]]] = None,
+                               time_window_hours: int = 24) -> Dict[str, ConversionFunnel]:
+        """
+        批量构建转化漏斗
+        
+        所有漏斗在一次扫描中完成步骤匹配，公共前缀的步骤只匹配一次；
+        带参数条件的步骤与事件名步骤一起求值为一列步骤类别，不再按步骤筛选数据副本。
+        
+        Args:
+            events: 事件数据DataFrame
+            funnel_definitions: 漏斗定义字典（漏斗名称 -> 步骤列表），默认使用预定义漏斗
+            time_window_hours: 时间窗口（小时）
             
-            logger.info(f"{t('conversion_analysis.funnel.build_completed', '构建转化漏斗')} '{funnel_name}' {t('conversion_analysis.funnel.completed', '完成')}，{t('conversion_analysis.funnel.overall_rate', '整体转化率')}: {overall_conversion_rate:.3f}")
-            return funnel
+        Returns:
+            漏斗名称到转化漏斗对象的字典
+        """
+        try:
+            # 获取数据
+            if events is None:
+                if self.storage_manager is None:
+                    raise ValueError("Event data not provided and storage manager not initialized")
+                events = self.dataset_cache.events()
+                
+            if funnel_definitions is None:
+                funnel_definitions = self.predefined_funnels
+                
+            valid_definitions = {}
+            for funnel_name, funnel_steps in funnel_definitions.items():
+                if not funnel_steps:
+                    logger.warning(f"{t('conversion_analysis.funnel.build_failed', '构建漏斗')} {funnel_name} {t('common.failed', '失败')}: Funnel steps must be provided")
+                    continue
+                valid_definitions[funnel_name] = list(funnel_steps)
+                
+            if events.empty:
+                logger.warning("Event data is empty, cannot build conversion funnel")
+                return {
+                    funnel_name: self._create_empty_funnel(funnel_name)
+                    for funnel_name in valid_definitions
+                }
+                
+            if 'event_datetime' not in events.columns and 'event_timestamp' not in events.columns:
+                raise ValueError("Missing time field")
+                
+            matches = match_funnels(events, valid_definitions, time_window_hours,
+                                    times=self.dataset_cache.event_times(events))
+            
+            funnels = {}
+            for funnel_name, match in matches.items():
+                if not match.step_events.any():
+                    logger.warning(f"No events found for funnel steps: {match.funnel_steps}")
+                    funnels[funnel_name] = self._create_empty_funnel(funnel_name)
+                    continue
+                    
+                funnel = self._build_funnel_from_match(match)
+                funnels[funnel_name] = funnel
+                logger.info(f"{t('conversion_analysis.funnel.build_completed', '构建转化漏斗')} '{funnel_name}' {t('conversion_analysis.funnel.completed', '完成')}，{t('conversion_analysis.funnel.overall_rate', '整体转化率')}: {funnel.overall_conversion_rate:.3f}")
+                
+            return funnels
             
         except Exception as e:
             logger.error(f"{t('conversion_analysis.funnel.build_failed', '构建转化漏斗失败')}: {e}")
             raise
             
+    def _build_funnel_from_match(self, match: FunnelMatch) -> ConversionFunnel:
+        """
+        根据漏斗匹配结果构建漏斗对象
+        
+        Args:
+            match: 漏斗匹配结果
+            
+        Returns:
+            转化漏斗对象
+        """
+        funnel_steps = match.funnel_steps
+        reached = match.reached
+        step_seconds = match.step_times.astype('datetime64[ns]').view('int64') / 1e9
+        
+        users_reached = reached.sum(axis=0)
+        total_users_entered = match.total_users
+        
+        funnel_step_objects = []
+        for step_idx, step_name in enumerate(funnel_steps):
+            # 第一步的转化率是到达率，其他步骤相对于上一步
+            base_users = total_users_entered if step_idx == 0 else users_reached[step_idx - 1]
+            conversion_rate = users_reached[step_idx] / base_users if base_users > 0 else 0
+            
+            # 计算到下一步的时间
+            avg_time_to_next = None
+            median_time_to_next = None
+            if step_idx < len(funnel_steps) - 1:
+                transitioned = reached[:, step_idx + 1]
+                if transitioned.any():
+                    transition_times = (
+                        step_seconds[transitioned, step_idx + 1] - step_seconds[transitioned, step_idx]
+                    )
+                    avg_time_to_next = float(np.mean(transition_times))
+                    median_time_to_next = float(np.median(transition_times))
+                    
+            funnel_step_objects.append(FunnelStep(
+                step_name=step_name,
+                step_order=step_idx,
+                total_users=int(users_reached[step_idx]),
+                conversion_rate=float(conversion_rate),
+                drop_off_rate=float(1 - conversion_rate),
+                avg_time_to_next_step=avg_time_to_next,
+                median_time_to_next_step=median_time_to_next
+            ))
+            
+        completed = reached[:, -1]
+        total_users_converted = int(completed.sum())
+        overall_conversion_rate = (
+            total_users_converted / total_users_entered
+            if total_users_entered > 0 else 0
+        )
+        
+        # 平均完成时间（仅多步骤漏斗）
+        avg_completion_time = None
+        if len(funnel_steps) > 1 and total_users_converted > 0:
+            avg_completion_time = float(np.mean(
+                step_seconds[completed, -1] - step_seconds[completed, 0]
+            ))
+            
+        return ConversionFunnel(
+            funnel_name=match.funnel_name,
+            steps=funnel_step_objects,
+            overall_conversion_rate=overall_conversion_rate,
+            total_users_entered=total_users_entered,
+            total_users_converted=total_users_converted,
+            avg_completion_time=avg_completion_time,
+            bottleneck_step=self._identify_bottleneck_step(funnel_step_objects),
+            latency_distributions=compute_latency_distributions(match)
+        )
+        
+    def _create_empty_funnel(self, funnel_name: str) -> ConversionFunnel:
+        """
+        创建空漏斗对象
+        
+        Args:
+            funnel_name: 漏斗名称
+            
+        Returns:
+            空转化漏斗对象
+        """
+        return ConversionFunnel(
+            funnel_name=funnel_name,
+            steps=[],
+            overall_conversion_rate=0.0,
+            total_users_entered=0,
+            total_users_converted=0,
+            avg_completion_time=None,
+            bottleneck_step=None
+        )
+            
     def _analyze_user_journeys(self,
                              events: pd.DataFrame,
                              funnel_steps: List[str],
@@ -493,7 +594,7 @@ class ConversionAnalysisEngine:
             if events is None:
                 if self.storage_manager is None:
                     raise ValueError("Event data not provided and storage manager not initialized")
-                events = self.storage_manager.get_data('events')
+                events = self.dataset_cache.events()
                 
             if events.empty:
                 logger.warning(t('conversion_analysis.data.empty_events', '事件数据为空，无法计算转化率'))
@@ -509,18 +610,11 @@ class ConversionAnalysisEngine:
             if funnel_definitions is None:
                 funnel_definitions = self.predefined_funnels
                 
-            # 构建所有漏斗
-            funnels = []
-            for funnel_name, funnel_steps in funnel_definitions.items():
-                try:
-                    funnel = self.build_conversion_funnel(
-                        events, funnel_steps, funnel_name
-                    )
-                    if funnel.steps:  # 只添加有效的漏斗
-                        funnels.append(funnel)
-                except Exception as e:
-                    logger.warning(f"{t('conversion_analysis.funnel.build_failed', '构建漏斗')} {funnel_name} {t('common.failed', '失败')}: {e}")
-                    continue
+            # 一次扫描构建所有漏斗
+            funnels = [
+                funnel for funnel in self.build_conversion_funnels(events, funnel_definitions).values()
+                if funnel.steps  # 只添加有效的漏斗
+            ]
                     
             # 计算转化指标
             conversion_metrics = self._calculate_conversion_metrics(funnels, events)
@@ -671,6 +765,7 @@ class ConversionAnalysisEngine:
             time_analysis = {
                 'funnel_completion_times': {},
                 'step_transition_times': {},
+                'latency_distributions': {},
                 'time_insights': []
             }
             
@@ -698,6 +793,13 @@ class ConversionAnalysisEngine:
                 if funnel_step_times:
                     time_analysis['step_transition_times'][funnel.funnel_name] = funnel_step_times
                     
+            # 时延分布（直方图、分位数和转化曲线）
+            for funnel in funnels:
+                if funnel.latency_distributions:
+                    time_analysis['latency_distributions'][funnel.funnel_name] = [
+                        asdict(distribution) for distribution in funnel.latency_distributions
+                    ]
+                    
             # 生成时间洞察
             insights = []
             
@@ -746,63 +848,117 @@ class ConversionAnalysisEngine:
                 'segment_insights': []
             }
             
-            # 按平台分析转化
-            if 'platform' in events.columns:
-                platform_conversion = {}
-                for platform in events['platform'].unique():
-                    platform_events = events[events['platform'] == platform]
-                    platform_users = platform_events['user_pseudo_id'].nunique()
-                    
-                    # 计算该平台的转化用户数
-                    platform_converted = 0
-                    for event_name in self.conversion_events:
-                        converted_users = platform_events[
-                            platform_events['event_name'] == event_name
-                        ]['user_pseudo_id'].nunique()
-                        platform_converted = max(platform_converted, converted_users)
-                        
-                    conversion_rate = platform_converted / platform_users if platform_users > 0 else 0
-                    platform_conversion[platform] = {
-                        'total_users': platform_users,
-                        'converted_users': platform_converted,
-                        'conversion_rate': conversion_rate
-                    }
-                    
-                segment_analysis['platform_conversion'] = platform_conversion
-                
-            # 按设备分析转化（如果有设备信息）
-            if 'device' in events.columns:
-                device_conversion = {}
-                for _, row in events.iterrows():
-                    device_info = row.get('device', {})
-                    if isinstance(device_info, dict) and 'category' in device_info:
-                        device_category = device_info['category']
-                        if device_category not in device_conversion:
-                            device_conversion[device_category] = {'users': set(), 'converted': set()}
-                            
-                        device_conversion[device_category]['users'].add(row['user_pseudo_id'])
-                        
-                        if row['event_name'] in self.conversion_events:
-                            device_conversion[device_category]['converted'].add(row['user_pseudo_id'])
-                            
-                # 计算转化率
-                for device, data in device_conversion.items():
-                    total_users = len(data['users'])
-                    converted_users = len(data['converted'])
-                    conversion_rate = converted_users / total_users if total_users > 0 else 0
+            result_keys = {
+                'platform': 'platform_conversion',
+                'device_category': 'device_conversion',
+                'geo_country': 'geo_conversion'
+            }
+            
+            for dimension, result_key in result_keys.items():
+                if self._segment_column(events, dimension) is None:
+                    continue
                     
-                    segment_analysis['device_conversion'][device] = {
-                        'total_users': total_users,
-                        'converted_users': converted_users,
-                        'conversion_rate': conversion_rate
+                segment_table = self.analyze_conversion_segments(events, [dimension])
+                segment_analysis[result_key] = {
+                    row[dimension]: {
+                        'total_users': int(row['total_users']),
+                        'converted_users': int(row['converted_users']),
+                        'conversion_rate': float(row['conversion_rate'])
                     }
-                    
+                    for row in segment_table.to_dict('records')
+                }
+                
             return segment_analysis
             
         except Exception as e:
             logger.warning(f"{t('conversion_analysis.segmentation.analysis_failed', '分析转化分段失败')}: {e}")
             return {}
             
+    def analyze_conversion_segments(self,
+                                  events: Optional[pd.DataFrame] = None,
+                                  dimensions: Optional[List[str]] = None,
+                                  min_users: int = 1) -> pd.DataFrame:
+        """
+        按分段维度计算转化率
+        
+        多个维度时按维度组合交叉分析。用户在某分段内有任意事件即计入该分段，
+        在该分段内有转化事件即视为已转化。
+        
+        Args:
+            events: 事件数据DataFrame
+            dimensions: 分段维度列表（如platform、device_category、geo_country、
+                        traffic_source或任意事件列如param_*），默认为platform
+            min_users: 最小支持度，用户数低于该值的分段被过滤
+            
+        Returns:
+            每个分段一行的DataFrame，包含total_users、converted_users和conversion_rate列
+        """
+        try:
+            if events is None:
+                if self.storage_manager is None:
+                    raise ValueError("Event data not provided and storage manager not initialized")
+                events = self.dataset_cache.events()
+                
+            dimensions = list(dimensions or ['platform'])
+            result_columns = dimensions + ['total_users', 'converted_users', 'conversion_rate']
+            
+            if events.empty:
+                return pd.DataFrame(columns=result_columns)
+                
+            segment_frame = pd.DataFrame({
+                'user_pseudo_id': events['user_pseudo_id'].to_numpy(),
+                'is_conversion': events['event_name'].isin(self.conversion_events).to_numpy()
+            })
+            for dimension in dimensions:
+                column = self._segment_column(events, dimension)
+                if column is None:
+                    raise ValueError(f"Unknown segment dimension: {dimension}")
+                segment_frame[dimension] = column.fillna('(not set)').to_numpy()
+                
+            # 先按(分段, 用户)去重，再按分段聚合
+            user_segments = segment_frame.groupby(
+                dimensions + ['user_pseudo_id'], sort=False
+            )['is_conversion'].any()
+            segment_table = user_segments.groupby(level=dimensions, sort=False).agg(
+                total_users='size', converted_users='sum'
+            ).reset_index()
+            
+            segment_table = segment_table[segment_table['total_users'] >= min_users]
+            segment_table['conversion_rate'] = (
+                segment_table['converted_users'] / segment_table['total_users']
+            )
+            
+            return segment_table.sort_values(
+                ['conversion_rate', 'total_users'], ascending=False
+            ).reset_index(drop=True)[result_columns]
+            
+        except Exception as e:
+            logger.error(f"{t('conversion_analysis.segmentation.analysis_failed', '分析转化分段失败')}: {e}")
+            raise
+            
+    def _segment_column(self, events: pd.DataFrame, dimension: str) -> Optional[pd.Series]:
+        """
+        获取分段维度对应的列，必要时从嵌套字典列（device、geo、traffic_source）中提取
+        
+        Args:
+            events: 事件数据
+            dimension: 分段维度
+            
+        Returns:
+            分段值Series，维度不可用时返回None
+        """
+        if dimension in events.columns:
+            column = events[dimension]
+            sample = column.dropna().head(1)
+            if sample.empty or not isinstance(sample.iloc[0], dict):
+                return column
+                
+        nested = self.segment_dimensions.get(dimension)
+        if nested and nested[0] in events.columns:
+            return events[nested[0]].str.get(nested[1])
+            
+        return None
+            
     def identify_drop_off_points(self,
                                events: Optional[pd.DataFrame] = None,
                                funnel_steps: List[str] = None) -> Dict[str, Any]:
@@ -821,7 +977,7 @@ class ConversionAnalysisEngine:
             if events is None:
                 if self.storage_manager is None:
                     raise ValueError("Event data not provided and storage manager not initialized")
-                events = self.storage_manager.get_data('events')
+                events = self.dataset_cache.events()
                 
             if not funnel_steps:
                 funnel_steps = self.predefined_funnels['purchase_funnel']
@@ -915,7 +1071,7 @@ class ConversionAnalysisEngine:
             if events is None:
                 if self.storage_manager is None:
                     raise ValueError("Event data not provided and storage manager not initialized")
-                events = self.storage_manager.get_data('events')
+                events = self.dataset_cache.events()
                 
             if not funnel_steps:
                 funnel_steps = self.predefined_funnels['purchase_funnel']
@@ -924,12 +1080,10 @@ class ConversionAnalysisEngine:
                 logger.warning("Event data is empty, cannot create user conversion journeys")
                 return []
                 
-            # 确保有时间列
-            if 'event_datetime' not in events.columns:
-                if 'event_timestamp' in events.columns:
-                    events['event_datetime'] = pd.to_datetime(events['event_timestamp'], unit='us')
-                else:
-                    raise ValueError("Missing time field")
+            # 确保有时间列（共用缓存中补充了时间列的浅拷贝，不修改传入的数据）
+            if 'event_datetime' not in events.columns and 'event_timestamp' not in events.columns:
+                raise ValueError("Missing time field")
+            events = self.dataset_cache.with_datetime(events)
                     
             journeys = []
             
@@ -1049,70 +1203,44 @@ class ConversionAnalysisEngine:
             if events is None:
                 if self.storage_manager is None:
                     raise ValueError("Event data not provided and storage manager not initialized")
-                events = self.storage_manager.get_data('events')
+                events = self.dataset_cache.events()
                 
             if events.empty:
                 logger.warning("Event data is empty, cannot perform conversion attribution analysis")
                 return {}
                 
-            # 确保有时间列
-            if 'event_datetime' not in events.columns:
-                if 'event_timestamp' in events.columns:
-                    events['event_datetime'] = pd.to_datetime(events['event_timestamp'], unit='us')
-                else:
-                    raise ValueError("Missing time field")
-                    
+            if 'event_datetime' not in events.columns and 'event_timestamp' not in events.columns:
+                raise ValueError("Missing time field")
+                
             attribution_analysis = {
                 'first_touch_attribution': {},
                 'last_touch_attribution': {},
                 'multi_touch_attribution': {},
+                'time_decay_attribution': {},
+                'position_based_attribution': {},
                 'attribution_insights': []
             }
             
-            # 获取转化事件
-            conversion_events = events[events['event_name'].isin(self.conversion_events)]
+            # 所有转化的触点窗口一次性构建，各模型共享同一触点表
+            attribution_engine = AttributionEngine(conversion_events=self.conversion_events)
+            touchpoints = attribution_engine.build_touchpoints(events, attribution_window_days)
             
-            if conversion_events.empty:
+            if touchpoints.total_conversions == 0:
                 return attribution_analysis
                 
-            # 按用户分析归因
-            for user_id in conversion_events['user_pseudo_id'].unique():
-                user_events = events[events['user_pseudo_id'] == user_id].sort_values('event_datetime')
-                user_conversions = conversion_events[conversion_events['user_pseudo_id'] == user_id]
-                
-                for _, conversion in user_conversions.iterrows():
-                    conversion_time = conversion['event_datetime']
-                    attribution_window_start = conversion_time - timedelta(days=attribution_window_days)
-                    
-                    # 获取归因窗口内的事件
-                    attribution_events = user_events[
-                        (user_events['event_datetime'] >= attribution_window_start) &
-                        (user_events['event_datetime'] <= conversion_time) &
-                        (user_events['event_name'] != conversion['event_name'])  # 排除转化事件本身
-                    ]
-                    
-                    if not attribution_events.empty:
-                        # 首次接触归因
-                        first_touch_event = attribution_events.iloc[0]['event_name']
-                        if first_touch_event not in attribution_analysis['first_touch_attribution']:
-                            attribution_analysis['first_touch_attribution'][first_touch_event] = 0
-                        attribution_analysis['first_touch_attribution'][first_touch_event] += 1
-                        
-                        # 最后接触归因
-                        last_touch_event = attribution_events.iloc[-1]['event_name']
-                        if last_touch_event not in attribution_analysis['last_touch_attribution']:
-                            attribution_analysis['last_touch_attribution'][last_touch_event] = 0
-                        attribution_analysis['last_touch_attribution'][last_touch_event] += 1
-                        
-                        # 多点接触归因（平均分配）
-                        unique_events = attribution_events['event_name'].unique()
-                        attribution_weight = 1.0 / len(unique_events)
-                        
-                        for event_name in unique_events:
-                            if event_name not in attribution_analysis['multi_touch_attribution']:
-                                attribution_analysis['multi_touch_attribution'][event_name] = 0
-                            attribution_analysis['multi_touch_attribution'][event_name] += attribution_weight
-                            
+            model_results = attribution_engine.attribute(touchpoints=touchpoints)
+            attribution_analysis['first_touch_attribution'] = {
+                channel: int(round(credit))
+                for channel, credit in model_results['first_touch'].channel_credits.items()
+            }
+            attribution_analysis['last_touch_attribution'] = {
+                channel: int(round(credit))
+                for channel, credit in model_results['last_touch'].channel_credits.items()
+            }
+            attribution_analysis['multi_touch_attribution'] = model_results['linear'].channel_credits
+            attribution_analysis['time_decay_attribution'] = model_results['time_decay'].channel_credits
+            attribution_analysis['position_based_attribution'] = model_results['position_based'].channel_credits
+            
             # 生成归因洞察
             insights = []
             
@@ -1140,6 +1268,33 @@ class ConversionAnalysisEngine:
             logger.error(f"{t('conversion_analysis.attribution.analysis_failed', '转化归因分析失败')}: {e}")
             raise
             
+    def analyze_attribution(self,
+                          attribution_model: str = 'first_touch',
+                          events: Optional[pd.DataFrame] = None,
+                          attribution_window_days: int = 7) -> Dict[str, Any]:
+        """
+        使用指定归因模型分析渠道贡献
+        
+        Args:
+            attribution_model: 归因模型 ('first_touch', 'last_touch', 'linear', 'time_decay', 'position_based')
+            events: 事件数据DataFrame
+            attribution_window_days: 归因窗口天数
+            
+        Returns:
+            归因结果字典
+        """
+        attribution_engine = AttributionEngine(
+            storage_manager=self.storage_manager,
+            conversion_events=self.conversion_events
+        )
+        result = attribution_engine.attribute(
+            events,
+            models=[attribution_model],
+            attribution_window_days=attribution_window_days
+        )[attribution_model]
+        
+        return asdict(result)
+            
     def get_conversion_insights(self,
                               conversion_result: ConversionAnalysisResult) -> Dict[str, Any]:
         """
@@ -1339,7 +1494,7 @@ class ConversionAnalysisEngine:
             if self.storage_manager is None:
                 return {"error": "Storage manager not initialized"}
                 
-            events = self.storage_manager.get_data('events')
+            events = self.dataset_cache.events()
             
             if events.empty:
                 return {"error": t('conversion_analysis.errors.no_event_data', '无事件数据')}
@@ -1354,9 +1509,8 @@ class ConversionAnalysisEngine:
             conversion_users_count = events[events['event_name'].isin(self.conversion_events)]['user_pseudo_id'].nunique()
             
             # 时间范围
-            if 'event_datetime' not in events.columns:
-                if 'event_timestamp' in events.columns:
-                    events['event_datetime'] = pd.to_datetime(events['event_timestamp'], unit='us')
+            if 'event_timestamp' in events.columns:
+                events = self.dataset_cache.with_datetime(events)
                     
             if 'event_datetime' in events.columns:
                 date_range = {
@@ -0,0 +1,172 @@
+"""
+转化时延分布模块
+
+基于漏斗匹配得到的步骤时间戳矩阵，向量化计算每个步骤转换的时延分布：
+直方图、分位数，以及Kaplan–Meier风格的“在时间t内已转化”曲线。
+未转化的用户按其可观察时长（时间窗口与数据截止时间的较小值）作为删失样本处理。
+"""
+
+import numpy as np
+from typing import Dict, List, Optional
+from dataclasses import dataclass
+import logging
+
+from engines.funnel_matcher import FunnelMatch
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_PERCENTILES = (25, 50, 75, 90, 95, 99)
+
+
+@dataclass
+class LatencyDistribution:
+    """步骤转换时延分布"""
+    from_step: str
+    to_step: str
+    users_started: int  # 到达起始步骤的用户数
+    users_converted: int  # 到达目标步骤的用户数
+    mean_seconds: Optional[float]
+    percentiles: Dict[str, float]  # 'p50' -> 秒
+    histogram: Dict[str, List[float]]  # bin_edges（秒）和counts
+    conversion_curve: Dict[str, List[float]]  # time_seconds和converted_fraction
+
+
+def kaplan_meier_curve(durations: np.ndarray,
+                       observed: np.ndarray,
+                       max_points: int = 50) -> Dict[str, List[float]]:
+    """
+    计算“在时间t内已转化”的Kaplan–Meier曲线
+
+    Args:
+        durations: 每个样本的时长（秒），已转化为转化时长，未转化为可观察时长
+        observed: 每个样本是否观察到转化
+        max_points: 曲线最多保留的点数
+
+    Returns:
+        time_seconds和converted_fraction两个等长列表
+    """
+    if len(durations) == 0 or not observed.any():
+        return {'time_seconds': [], 'converted_fraction': []}
+
+    sorted_durations = np.sort(durations)
+    event_times, event_counts = np.unique(durations[observed], return_counts=True)
+    at_risk = len(durations) - np.searchsorted(sorted_durations, event_times, side='left')
+    survival = np.cumprod(1.0 - event_counts / at_risk)
+
+    # 在事件时间的分位点上采样，保持曲线点数有界
+    if len(event_times) > max_points:
+        picks = np.unique(np.linspace(0, len(event_times) - 1, max_points).round().astype(int))
+        event_times = event_times[picks]
+        survival = survival[picks]
+
+    return {
+        'time_seconds': event_times.astype(float).tolist(),
+        'converted_fraction': (1.0 - survival).tolist()
+    }
+
+
+def latency_histogram(durations: np.ndarray, bins: int = 20) -> Dict[str, List[float]]:
+    """
+    计算时延直方图，跨度较大时使用对数间隔的分箱
+
+    Args:
+        durations: 转化时长（秒）
+        bins: 分箱数
+
+    Returns:
+        bin_edges和counts
+    """
+    if len(durations) == 0:
+        return {'bin_edges': [], 'counts': []}
+
+    low, high = float(durations.min()), float(durations.max())
+    floor = max(low, 1.0)
+    if high / floor > 100:
+        edges = np.geomspace(floor, high, bins + 1)
+        edges[0] = low
+    else:
+        edges = np.histogram_bin_edges(durations, bins=bins)
+
+    counts, edges = np.histogram(durations, bins=edges)
+    return {'bin_edges': edges.tolist(), 'counts': counts.astype(int).tolist()}
+
+
+def _distribution(from_step: str,
+                  to_step: str,
+                  start_times: np.ndarray,
+                  end_times: np.ndarray,
+                  censor_limit: np.ndarray,
+                  bins: int,
+                  percentiles: tuple,
+                  max_points: int) -> LatencyDistribution:
+    """计算一次步骤转换的时延分布（时间均为int64纳秒，NaT为int64最小值）"""
+    converted = end_times != np.iinfo(np.int64).min
+    durations = (end_times[converted] - start_times[converted]) / 1e9
+
+    censored = np.maximum(censor_limit[~converted], 0) / 1e9
+    all_durations = np.concatenate([durations, censored])
+    observed = np.concatenate([np.ones(len(durations), dtype=bool),
+                               np.zeros(len(censored), dtype=bool)])
+
+    percentile_values = (
+        np.percentile(durations, percentiles) if len(durations) else [np.nan] * len(percentiles)
+    )
+
+    return LatencyDistribution(
+        from_step=from_step,
+        to_step=to_step,
+        users_started=int(len(start_times)),
+        users_converted=int(converted.sum()),
+        mean_seconds=float(durations.mean()) if len(durations) else None,
+        percentiles={
+            f"p{p}": float(v) for p, v in zip(percentiles, percentile_values)
+            if not np.isnan(v)
+        },
+        histogram=latency_histogram(durations, bins),
+        conversion_curve=kaplan_meier_curve(all_durations, observed, max_points)
+    )
+
+
+def compute_latency_distributions(match: FunnelMatch,
+                                  bins: int = 20,
+                                  percentiles: tuple = DEFAULT_PERCENTILES,
+                                  max_points: int = 50) -> List[LatencyDistribution]:
+    """
+    计算漏斗每个步骤转换以及整体完成时间的时延分布
+
+    Args:
+        match: 漏斗匹配结果
+        bins: 直方图分箱数
+        percentiles: 需要计算的分位数
+        max_points: 转化曲线最多保留的点数
+
+    Returns:
+        每个相邻步骤转换一个分布，多步骤漏斗最后附加一个首步到末步的整体分布
+    """
+    steps = match.funnel_steps
+    if len(steps) < 2 or match.total_users == 0:
+        return []
+
+    times = match.step_times.astype('datetime64[ns]').view('int64')
+    observation_end = np.datetime64(match.observation_end, 'ns').astype(np.int64)
+
+    distributions = []
+    for i in range(len(steps) - 1):
+        started = match.reached[:, i]
+        start_times = times[started, i]
+        # 未转化用户的可观察时长：时间窗口与数据截止时间的较小值
+        censor_limit = np.minimum(match.time_window_ns, observation_end - start_times)
+        distributions.append(_distribution(
+            steps[i], steps[i + 1], start_times, times[started, i + 1],
+            censor_limit, bins, percentiles, max_points
+        ))
+
+    if len(steps) > 2:
+        start_times = times[:, 0]
+        censor_limit = np.minimum(match.time_window_ns * (len(steps) - 1), observation_end - start_times)
+        distributions.append(_distribution(
+            steps[0], steps[-1], start_times, times[:, -1],
+            censor_limit, bins, percentiles, max_points
+        ))
+
+    return distributions
@@ -0,0 +1,284 @@
+"""
+数据集中间结果缓存模块
+
+各分析引擎对同一份事件数据重复计算的中间结果按数据版本缓存，同一版本只计算一次：
+- 事件时间（event_datetime列，不再写回调用方的DataFrame）；
+- 每个用户的首次、最近活跃时间和事件数；
+- 按用户、时间排序的事件时间线（漏斗、归因共用）；
+- 按超时时间切分的会话（路径分析）。
+
+存储管理器中的数据按get_data_version('events')缓存，只保留当前版本；事件版本只覆盖部分列，
+重新存储（替换）全部事件时即使版本相同也丢弃条目。缓存返回的DataFrame（存储中的事件及其补充时间列的副本）
+按对象身份对应到该条目，由各引擎共用、不应修改；
+直接传入的其他DataFrame不跨调用缓存（调用方可能原地修改），中间结果只在本次调用内计算一次。
+"""
+
+import threading
+import weakref
+import pandas as pd
+import numpy as np
+from typing import Any, Callable, Dict, Hashable, Iterable, Optional, Tuple
+import logging
+
+from engines.funnel_matcher import UserTimelines, build_user_timelines, event_times_ns
+from engines.session_store import SessionPathStore
+
+logger = logging.getLogger(__name__)
+
+# 存储管理器 -> 共用的中间结果缓存
+_shared_caches: 'weakref.WeakKeyDictionary' = weakref.WeakKeyDictionary()
+
+INTERMEDIATES = ('events', 'event_times', 'datetime_frame', 'user_activity', 'timelines', 'sessions')
+
+
+def _forget_frame(cache_ref: 'weakref.ref', frame_id: int) -> None:
+    """缓存返回的DataFrame被回收时删除其记录"""
+    cache = cache_ref()
+    if cache is not None:
+        cache._forget(frame_id)
+
+
+class DatasetCache:
+    """按数据版本缓存各引擎共用的中间结果"""
+
+    def __init__(self, storage_manager=None):
+        """
+        初始化中间结果缓存
+
+        Args:
+            storage_manager: 数据存储管理器实例，提供时监听其事件替换
+        """
+        self._storage_ref = weakref.ref(storage_manager) if storage_manager is not None else None
+        self.stats: Dict[str, Dict[str, int]] = {
+            'builds': dict.fromkeys(INTERMEDIATES, 0),
+            'hits': dict.fromkeys(INTERMEDIATES, 0)
+        }
+
+        # 条目键 -> {中间结果名(及参数) -> 结果}，只保留存储管理器当前版本的条目
+        self._entries: Dict[Hashable, Dict[Hashable, Any]] = {}
+        # 缓存返回的DataFrame的id -> (弱引用, 条目键)
+        self._frames: Dict[int, Tuple['weakref.ref', Hashable]] = {}
+        self._storage_key: Optional[Hashable] = None
+        self._lock = threading.RLock()
+
+        if storage_manager is not None and hasattr(storage_manager, 'add_event_listener'):
+            storage_manager.add_event_listener(self.on_storage_events)
+
+    @classmethod
+    def for_storage(cls, storage_manager) -> 'DatasetCache':
+        """获取存储管理器共用的中间结果缓存，没有存储管理器时返回独立的实例"""
+        if storage_manager is None:
+            return cls()
+        cache = _shared_caches.get(storage_manager)
+        if cache is None:
+            cache = cls(storage_manager)
+            _shared_caches[storage_manager] = cache
+        return cache
+
+    @property
+    def storage_manager(self):
+        return self._storage_ref() if self._storage_ref is not None else None
+
+    def on_storage_events(self, events: pd.DataFrame, replaced: bool) -> None:
+        """
+        存储管理器事件写入回调：替换全部事件时丢弃存储数据的条目
+
+        追加事件会改变数据版本，按版本即可失效；替换后版本可能不变（如只有param_*列不同）。
+
+        Args:
+            events: 新写入的事件
+            replaced: 是否替换了全部事件
+        """
+        if not replaced:
+            return
+        with self._lock:
+            if self._storage_key is not None:
+                self._drop(self._storage_key)
+                self._storage_key = None
+
+    def clear(self) -> None:
+        """清空所有缓存条目"""
+        with self._lock:
+            self._entries.clear()
+            self._frames.clear()
+            self._storage_key = None
+
+    def events(self) -> pd.DataFrame:
+        """
+        存储管理器中的全部事件，同一数据版本只复制一次
+
+        返回的DataFrame由各引擎共用，调用方不应修改。
+        """
+        storage = self.storage_manager
+        if storage is None:
+            raise ValueError("Event data not provided and storage manager not initialized")
+        with self._lock:
+            entry = self._storage_entry()
+            events = self._get(entry, 'events', lambda: storage.get_data('events'))
+            self._register(events, self._entry_key(entry))
+            return events
+
+    def event_times(self, events: Optional[pd.DataFrame] = None) -> np.ndarray:
+        """
+        事件时间（int64纳秒），与events的行一一对应
+
+        Args:
+            events: 事件数据，None时使用存储管理器中的数据
+        """
+        with self._lock:
+            events, entry = self._resolve(events)
+
+            def build() -> np.ndarray:
+                times = event_times_ns(events)
+                times.flags.writeable = False
+                return times
+
+            return self._get(entry, 'event_times', build)
+
+    def with_datetime(self, events: Optional[pd.DataFrame] = None) -> pd.DataFrame:
+        """
+        带event_datetime列的事件数据
+
+        已有event_datetime列时原样返回；否则返回补充了该列的浅拷贝，不修改传入的DataFrame。
+
+        Args:
+            events: 事件数据，None时使用存储管理器中的数据
+
+        Returns:
+            带event_datetime列的事件数据（调用方不应修改）
+        """
+        with self._lock:
+            events, entry = self._resolve(events)
+            if 'event_datetime' in events.columns or events.empty:
+                return events
+
+            def build() -> pd.DataFrame:
+                times = self.event_times(events)
+                frame = events.copy(deep=False)
+                frame['event_datetime'] = pd.Series(times.view('datetime64[ns]'), index=events.index)
+                return frame
+
+            frame = self._get(entry, 'datetime_frame', build)
+            self._register(frame, self._entry_key(entry))
+            return frame
+
+    def user_activity(self, events: Optional[pd.DataFrame] = None) -> pd.DataFrame:
+        """
+        每个用户的活跃范围
+
+        Args:
+            events: 事件数据，None时使用存储管理器中的数据
+
+        Returns:
+            以user_pseudo_id为索引（升序）的first_seen、last_seen、event_count三列
+        """
+        with self._lock:
+            events, entry = self._resolve(events)
+
+            def build() -> pd.DataFrame:
+                if events.empty:
+                    return pd.DataFrame(columns=['first_seen', 'last_seen', 'event_count'])
+                times = pd.Series(self.event_times(events).view('datetime64[ns]'), index=events.index)
+                grouped = times.groupby(events['user_pseudo_id'], sort=True)
+                activity = pd.DataFrame({
+                    'first_seen': grouped.min(),
+                    'last_seen': grouped.max(),
+                    'event_count': grouped.size()
+                })
+                activity.index.name = 'user_pseudo_id'
+                return activity
+
+            return self._get(entry, 'user_activity', build)
+
+    def user_timelines(self,
+                       events: Optional[pd.DataFrame] = None,
+                       event_names: Optional[Iterable[str]] = None) -> UserTimelines:
+        """
+        按用户、时间排序的事件时间线
+
+        Args:
+            events: 事件数据，None时使用存储管理器中的数据
+            event_names: 只保留这些事件（None表示全部）
+        """
+        with self._lock:
+            events, entry = self._resolve(events)
+            names = None if event_names is None else sorted(set(event_names), key=str)
+            key = ('timelines', None if names is None else tuple(names))
+            return self._get(entry, key, lambda: build_user_timelines(events, names))
+
+    def sessions(self,
+                 events: Optional[pd.DataFrame] = None,
+                 session_timeout_minutes: float = 30,
+                 conversion_events: Iterable[str] = ()) -> SessionPathStore:
+        """
+        按超时时间切分的用户会话，复用全部事件的用户时间线
+
+        Args:
+            events: 事件数据，None时使用存储管理器中的数据
+            session_timeout_minutes: 会话超时时间（分钟）
+            conversion_events: 视为转化的事件名
+        """
+        with self._lock:
+            events, entry = self._resolve(events)
+            conversions = frozenset(conversion_events)
+            key = ('sessions', float(session_timeout_minutes), conversions)
+            return self._get(entry, key, lambda: SessionPathStore.from_events(
+                events, session_timeout_minutes, conversions, timelines=self.user_timelines(events)))
+
+    def _get(self, entry: Dict[Hashable, Any], key: Hashable, build: Callable[[], Any]) -> Any:
+        """从条目中取中间结果，没有时计算并记录"""
+        name = key[0] if isinstance(key, tuple) else key
+        if key in entry:
+            self.stats['hits'][name] += 1
+            return entry[key]
+        value = build()
+        entry[key] = value
+        self.stats['builds'][name] += 1
+        logger.debug(f"计算中间结果: {name}")
+        return value
+
+    def _storage_entry(self) -> Dict[Hashable, Any]:
+        """存储管理器当前数据版本的条目，版本变化时丢弃旧版本"""
+        key = ('storage', self.storage_manager.get_data_version('events'))
+        if key != self._storage_key:
+            if self._storage_key is not None:
+                self._drop(self._storage_key)
+            self._storage_key = key
+            self._entries[key] = {'__key__': key}
+        return self._entries[key]
+
+    def _resolve(self, events: Optional[pd.DataFrame]) -> Tuple[pd.DataFrame, Dict[Hashable, Any]]:
+        """确定事件数据及其缓存条目；不是缓存返回的DataFrame时使用只在本次调用内有效的临时条目"""
+        if events is None:
+            return self.events(), self._storage_entry()
+
+        record = self._frames.get(id(events))
+        if record is not None:
+            frame_ref, key = record
+            if frame_ref() is events and key in self._entries:
+                return events, self._entries[key]
+            self._frames.pop(id(events), None)
+        return events, {'__key__': None}
+
+    @staticmethod
+    def _entry_key(entry: Dict[Hashable, Any]) -> Hashable:
+        return entry['__key__']
+
+    def _register(self, frame: pd.DataFrame, key: Hashable) -> None:
+        """记录缓存返回的DataFrame对应的条目，DataFrame被回收时自动删除"""
+        if key is None:
+            return
+        if id(frame) in self._frames and self._frames[id(frame)][0]() is frame:
+            return
+        self._frames[id(frame)] = (weakref.ref(frame), key)
+        weakref.finalize(frame, _forget_frame, weakref.ref(self), id(frame))
+
+    def _forget(self, frame_id: int) -> None:
+        with self._lock:
+            self._frames.pop(frame_id, None)
+
+    def _drop(self, key: Hashable) -> None:
+        """删除条目及其对应的DataFrame记录"""
+        self._entries.pop(key, None)
+        for frame_id in [frame_id for frame_id, record in self._frames.items() if record[1] == key]:
+            del self._frames[frame_id]
@@ -11,15 +11,18 @@ from typing import Dict, List, Any, Optional, Tuple, Union
 from datetime import datetime, timedelta
 import logging
 from dataclasses import dataclass
-from collections import defaultdict
-import itertools
-from scipy import stats
-from scipy.stats import chi2_contingency
 import warnings
 
 # Import internationalization support
-from utils.i18n import t
 from utils.i18n_enhanced import LocalizedInsightGenerator
+from engines.event_series import (FREQUENCY_LABELS, PERCENTILES, build_event_count_table,
+                                  frequency_summary, series_anomalies, seasonal_patterns,
+                                  trend_series, trend_statistics)
+from engines.event_cooccurrence import (EventIncidence, build_event_incidence,
+                                        event_pair_statistics, first_occurrence_gaps)
+from engines.streaming_anomaly import StreamingAnomalyDetector
+from engines.event_importance import event_importance_scores
+from engines.dataset_cache import DatasetCache
 
 # 忽略统计计算中的警告
 warnings.filterwarnings('ignore', category=RuntimeWarning)
@@ -57,6 +60,7 @@ class EventCorrelationResult:
     significance_level: float
     co_occurrence_rate: float
     temporal_pattern: Dict[str, Any]
+    lift: float = 0.0  # 共现用户数相对独立假设下期望值的倍数
 
 
 @dataclass
@@ -68,6 +72,8 @@ class KeyEventResult:
     conversion_impact: float
     retention_impact: float
     reasons: List[str]
+    conversion_lift: float = float('nan')  # 有该事件用户的会话转化率相对整体的倍数
+    retention_lift: float = float('nan')  # 有该事件用户的平均活跃天数相对整体的倍数
 
 
 class EventAnalysisEngine:
@@ -81,6 +87,7 @@ class EventAnalysisEngine:
             storage_manager: 数据存储管理器实例
         """
         self.storage_manager = storage_manager
+        self.dataset_cache = DatasetCache.for_storage(storage_manager)
         self.conversion_events = {
             'sign_up', 'login', 'purchase', 'begin_checkout', 
             'add_to_cart', 'add_payment_info'
@@ -90,6 +97,8 @@ class EventAnalysisEngine:
             'select_item', 'view_cart'
         }
         
+        self.streaming_detector: Optional[StreamingAnomalyDetector] = None
+        
         logger.info("事件分析引擎初始化完成")
         
     def calculate_event_frequency(self, 
@@ -119,43 +128,27 @@ class EventAnalysisEngine:
                 if date_range:
                     filters['event_date'] = {'gte': date_range[0], 'lte': date_range[1]}
                     
-                events = self.storage_manager.get_data('events', filters)
+                events = self.storage_manager.get_data('events', filters) if filters else self.dataset_cache.events()
                 
             if events.empty:
                 logger.warning("Event data is empty, cannot perform frequency analysis")
                 return {}
                 
-            results = {}
+            # 一次分组计数得到所有事件类型的用户频次
+            table = build_event_count_table(events)
+            summary = frequency_summary(table)
             
-            # 按事件类型分析
-            for event_type in events['event_name'].unique():
-                event_data = events[events['event_name'] == event_type]
-                
-                # 基础统计
-                total_count = len(event_data)
-                unique_users = event_data['user_pseudo_id'].nunique()
-                avg_per_user = total_count / unique_users if unique_users > 0 else 0
-                
-                # 用户事件频次分布
-                user_event_counts = event_data['user_pseudo_id'].value_counts()
-                frequency_distribution = self._calculate_frequency_distribution(user_event_counts)
-                
-                # 计算百分位数
-                percentiles = {
-                    'p25': float(user_event_counts.quantile(0.25)),
-                    'p50': float(user_event_counts.quantile(0.50)),
-                    'p75': float(user_event_counts.quantile(0.75)),
-                    'p90': float(user_event_counts.quantile(0.90)),
-                    'p95': float(user_event_counts.quantile(0.95))
-                }
-                
+            results = {}
+            for code, row in zip(summary.index, summary.itertuples(index=False)):
+                event_type = table.event_names[code]
+                row = row._asdict()
                 results[event_type] = EventFrequencyResult(
                     event_name=event_type,
-                    total_count=total_count,
-                    unique_users=unique_users,
-                    avg_per_user=avg_per_user,
-                    frequency_distribution=frequency_distribution,
-                    percentiles=percentiles
+                    total_count=int(row['total_count']),
+                    unique_users=int(row['unique_users']),
+                    avg_per_user=row['total_count'] / row['unique_users'] if row['unique_users'] > 0 else 0,
+                    frequency_distribution={label: int(summary.at[code, label]) for label in FREQUENCY_LABELS},
+                    percentiles={name: float(row[name]) for name in PERCENTILES}
                 )
                 
             logger.info(f"完成{len(results)}种事件类型的频次分析")
@@ -165,36 +158,6 @@ class EventAnalysisEngine:
             logger.error(f"事件频次分析失败: {e}")
             raise
             
-    def _calculate_frequency_distribution(self, user_counts: pd.Series) -> Dict[str, int]:
-        """
-        计算频次分布
-        
-        Args:
-            user_counts: 用户事件计数Series
-            
-        Returns:
-            频次分布字典
-        """
-        try:
-            # 定义频次区间
-            bins = [1, 2, 3, 5, 10, 20, 50, float('inf')]
-            labels = ['1', '2', '3-4', '5-9', '10-19', '20-49', '50+']
-            
-            # 计算分布
-            distribution = pd.cut(user_counts, bins=bins, labels=labels, right=False)
-            freq_dist = distribution.value_counts().to_dict()
-            
-            # 确保所有标签都存在
-            for label in labels:
-                if label not in freq_dist:
-                    freq_dist[label] = 0
-                    
-            return freq_dist
-            
-        except Exception as e:
-            logger.warning(f"计算频次分布失败: {e}")
-            return {}
-            
     def analyze_event_trends(self,
                            events: Optional[pd.DataFrame] = None,
                            event_types: Optional[List[str]] = None,
@@ -223,48 +186,37 @@ class EventAnalysisEngine:
                 if event_types:
                     filters['event_name'] = event_types
                     
-                events = self.storage_manager.get_data('events', filters)
+                events = self.storage_manager.get_data('events', filters) if filters else self.dataset_cache.events()
                 
             if events.empty:
                 logger.warning("Event data is empty, cannot perform trend analysis")
                 return {}
                 
-            # 确保有时间列
-            if 'event_datetime' not in events.columns:
-                if 'event_timestamp' in events.columns:
-                    events['event_datetime'] = pd.to_datetime(events['event_timestamp'], unit='us')
-                else:
-                    raise ValueError("Missing time field")
-                    
-            results = {}
+            # 一次 (事件, 时间桶, 用户) 分组计数得到所有事件类型的趋势序列
+            table = build_event_count_table(events, time_granularity, times=self.dataset_cache.event_times(events))
+            series = trend_series(table)
+            statistics = trend_statistics(series, table.n_events)
+            seasonal = seasonal_patterns(series, table.granularity)
+            anomalies = series_anomalies(series, statistics)
+            series_by_event = dict(tuple(series.groupby('event', sort=False)))
             
-            # 按事件类型分析趋势
-            for event_type in events['event_name'].unique():
-                event_data = events[events['event_name'] == event_type]
-                
-                # 按时间粒度聚合
-                trend_data = self._aggregate_by_time(event_data, time_granularity)
-                
-                if len(trend_data) < min_data_points:
+            results = {}
+            for code, event_type in enumerate(table.event_names):
+                stats_row = statistics.iloc[code]
+                if stats_row['n_points'] < min_data_points:
                     logger.warning(f"事件 {event_type} 数据点不足，跳过趋势分析")
                     continue
                     
-                # 计算趋势方向和增长率
-                trend_direction, growth_rate = self._calculate_trend_direction(trend_data)
-                
-                # 检测季节性模式
-                seasonal_pattern = self._detect_seasonal_pattern(trend_data, time_granularity)
-                
-                # 检测异常点
-                anomalies = self._detect_anomalies(trend_data)
+                trend_data = series_by_event[code][['date', 'event_count', 'unique_users']].reset_index(drop=True)
+                trend_data['total_events'] = trend_data['event_count']
                 
                 results[event_type] = EventTrendResult(
                     event_name=event_type,
                     trend_data=trend_data,
-                    trend_direction=trend_direction,
-                    growth_rate=growth_rate,
-                    seasonal_pattern=seasonal_pattern,
-                    anomalies=anomalies
+                    trend_direction=str(stats_row['trend_direction']),
+                    growth_rate=float(stats_row['growth_rate']),
+                    seasonal_pattern=seasonal.get(code),
+                    anomalies=anomalies.get(code, [])
                 )
                 
             logger.info(f"完成{len(results)}种事件类型的趋势分析")
@@ -286,204 +238,63 @@ class EventAnalysisEngine:
             聚合后的时间序列数据
         """
         try:
-            # 设置时间索引 - 处理时间戳转换
-            events_with_time = events.copy()
-
-            # 如果没有event_datetime列，从event_timestamp创建
-            if 'event_datetime' not in events_with_time.columns and 'event_timestamp' in events_with_time.columns:
-                # 将微秒时间戳转换为datetime
-                events_with_time['event_datetime'] = pd.to_datetime(events_with_time['event_timestamp'], unit='us')
-            elif 'event_datetime' not in events_with_time.columns:
+            if 'event_datetime' not in events.columns and 'event_timestamp' not in events.columns:
                 raise ValueError("Missing time information in data: event_datetime or event_timestamp column required")
-
-            events_with_time['date'] = events_with_time['event_datetime'].dt.date
-            
-            # 支持中英文时间粒度
-            granularity_mapping = {
-                '日': 'daily',
-                '周': 'weekly',
-                '月': 'monthly',
-                'day': 'daily',
-                'week': 'weekly',
-                'month': 'monthly'
-            }
-
-            normalized_granularity = granularity_mapping.get(granularity, granularity)
-
-            if normalized_granularity == 'daily':
-                time_col = events_with_time['event_datetime'].dt.date
-            elif normalized_granularity == 'weekly':
-                time_col = events_with_time['event_datetime'].dt.to_period('W').dt.start_time.dt.date
-            elif normalized_granularity == 'monthly':
-                time_col = events_with_time['event_datetime'].dt.to_period('M').dt.start_time.dt.date
-            else:
-                raise ValueError(f"Unsupported time granularity: {granularity} (支持的格式: daily/日, weekly/周, monthly/月)")
                 
-            # 聚合数据
-            agg_data = events_with_time.groupby(time_col).agg({
-                'user_pseudo_id': ['count', 'nunique'],
-                'event_name': 'count'
-            }).reset_index()
-            
-            # 重命名列
-            agg_data.columns = ['date', 'event_count', 'unique_users', 'total_events']
-            agg_data['date'] = pd.to_datetime(agg_data['date'])
-            
-            # 填充缺失日期
-            date_range = pd.date_range(
-                start=agg_data['date'].min(),
-                end=agg_data['date'].max(),
-                freq='D' if normalized_granularity == 'daily' else 'W' if normalized_granularity == 'weekly' else 'M'
-            )
-            
-            full_data = pd.DataFrame({'date': date_range})
-            result = full_data.merge(agg_data, on='date', how='left').fillna(0)
-            
-            return result
+            table = build_event_count_table(events, granularity, by_event=False,
+                                            times=self.dataset_cache.event_times(events))
+            result = trend_series(table)[['date', 'event_count', 'unique_users']]
+            return result.assign(total_events=result['event_count'])
             
         except Exception as e:
             logger.error(f"时间聚合失败: {e}")
             raise
             
-    def _calculate_trend_direction(self, trend_data: pd.DataFrame) -> Tuple[str, float]:
+    def attach_streaming_detector(self,
+                                  granularity: str = 'daily',
+                                  segment_column: Optional[str] = None,
+                                  **detector_options) -> StreamingAnomalyDetector:
         """
-        计算趋势方向和增长率
+        创建流式异常检测器并注册到存储管理器，之后每次写入事件时增量更新各序列基线
         
         Args:
-            trend_data: 趋势数据
+            granularity: 时间桶粒度，'hourly' 或 'daily'
+            segment_column: 细分维度列（如platform、device.category），None表示只按事件划分序列
+            **detector_options: 传给StreamingAnomalyDetector的其他参数
             
         Returns:
-            (趋势方向, 增长率)
+            流式异常检测器
         """
-        try:
-            if len(trend_data) < 2:
-                return 'stable', 0.0
-                
-            # 使用线性回归计算趋势
-            x = np.arange(len(trend_data))
-            y = trend_data['event_count'].values
+        if self.storage_manager is None:
+            raise ValueError("Storage manager not initialized")
             
-            # 计算斜率
-            slope, intercept, r_value, p_value, std_err = stats.linregress(x, y)
+        if self.streaming_detector is not None:
+            self.storage_manager.remove_event_listener(self.streaming_detector.on_storage_events)
             
-            # 计算增长率（相对于平均值的百分比）
-            mean_value = np.mean(y)
-            if mean_value > 0:
-                growth_rate = (slope * len(trend_data)) / mean_value * 100
-            else:
-                growth_rate = 0.0
-                
-            # 判断趋势方向
-            if abs(growth_rate) < 5:  # 5%以内认为是稳定
-                direction = 'stable'
-            elif growth_rate > 0:
-                direction = 'increasing'
-            else:
-                direction = 'decreasing'
-                
-            return direction, float(growth_rate)
-            
-        except Exception as e:
-            logger.warning(f"计算趋势方向失败: {e}")
-            return 'stable', 0.0
-            
-    def _detect_seasonal_pattern(self, trend_data: pd.DataFrame, granularity: str) -> Optional[Dict[str, float]]:
-        """
-        检测季节性模式
+        detector = StreamingAnomalyDetector(granularity=granularity,
+                                            segment_column=segment_column,
+                                            **detector_options)
         
-        Args:
-            trend_data: 趋势数据
-            granularity: 时间粒度
-            
-        Returns:
-            季节性模式字典
-        """
-        try:
-            if len(trend_data) < 14:  # 需要足够的数据点
-                return None
-                
-            # 根据粒度检测不同的季节性 - 支持中英文
-            granularity_mapping = {
-                '日': 'daily',
-                '周': 'weekly',
-                '月': 'monthly',
-                'day': 'daily',
-                'week': 'weekly',
-                'month': 'monthly'
-            }
-
-            normalized_granularity = granularity_mapping.get(granularity, granularity)
-
-            if normalized_granularity == 'daily':
-                # 检测周模式
-                trend_data['weekday'] = trend_data['date'].dt.dayofweek
-                pattern = trend_data.groupby('weekday')['event_count'].mean().to_dict()
-
-                # 转换为星期名称
-                weekday_names = ['Monday', 'Tuesday', 'Wednesday', 'Thursday', 'Friday', 'Saturday', 'Sunday']
-                seasonal_pattern = {weekday_names[k]: v for k, v in pattern.items()}
-
-            elif normalized_granularity == 'weekly':
-                # 检测月模式
-                trend_data['week_of_month'] = trend_data['date'].dt.day // 7 + 1
-                seasonal_pattern = trend_data.groupby('week_of_month')['event_count'].mean().to_dict()
-                
-            else:
-                # 月度数据检测年度模式
-                trend_data['month'] = trend_data['date'].dt.month
-                pattern = trend_data.groupby('month')['event_count'].mean().to_dict()
-                
-                # 转换为月份名称
-                month_names = ['Jan', 'Feb', 'Mar', 'Apr', 'May', 'Jun',
-                              'Jul', 'Aug', 'Sep', 'Oct', 'Nov', 'Dec']
-                seasonal_pattern = {month_names[k-1]: v for k, v in pattern.items()}
-                
-            return seasonal_pattern
-            
-        except Exception as e:
-            logger.warning(f"季节性模式检测失败: {e}")
-            return None
-            
-    def _detect_anomalies(self, trend_data: pd.DataFrame, threshold: float = 2.0) -> List[Dict[str, Any]]:
+        # 用已存储的历史事件预热基线
+        history = self.storage_manager.get_data('events')
+        if not history.empty:
+            detector.on_storage_events(history, replaced=True)
+            
+        self.storage_manager.add_event_listener(detector.on_storage_events)
+        self.streaming_detector = detector
+        logger.info(f"流式异常检测器已注册，当前{detector.n_series}个序列")
+        return detector
+        
+    def get_streaming_anomalies(self) -> List[Dict[str, Any]]:
         """
-        检测异常点
+        获取流式异常检测器最近发现的异常点
         
-        Args:
-            trend_data: 趋势数据
-            threshold: 异常检测阈值（标准差倍数）
-            
         Returns:
-            异常点列表
+            异常点列表，未注册检测器时为空
         """
-        try:
-            if len(trend_data) < 5:
-                return []
-                
-            values = trend_data['event_count'].values
-            mean_val = np.mean(values)
-            std_val = np.std(values)
-            
-            if std_val == 0:
-                return []
-                
-            anomalies = []
-            
-            for idx, value in enumerate(values):
-                z_score = abs(value - mean_val) / std_val
-                
-                if z_score > threshold:
-                    anomalies.append({
-                        'date': trend_data.iloc[idx]['date'].strftime('%Y-%m-%d'),
-                        'value': float(value),
-                        'z_score': float(z_score),
-                        'type': 'high' if value > mean_val else 'low'
-                    })
-                    
-            return anomalies
-            
-        except Exception as e:
-            logger.warning(f"异常检测失败: {e}")
-            return []   
+        if self.streaming_detector is None:
+            return []
+        return list(self.streaming_detector.recent_anomalies)
          
     def analyze_event_correlation(self,
                                 events: Optional[pd.DataFrame] = None,
@@ -511,30 +322,28 @@ class EventAnalysisEngine:
                 if event_types:
                     filters['event_name'] = event_types
                     
-                events = self.storage_manager.get_data('events', filters)
+                events = self.storage_manager.get_data('events', filters) if filters else self.dataset_cache.events()
                 
             if events.empty:
                 logger.warning("Event data is empty, cannot perform correlation analysis")
                 return []
                 
-            # 确保有时间列
-            if 'event_datetime' not in events.columns:
-                if 'event_timestamp' in events.columns:
-                    events['event_datetime'] = pd.to_datetime(events['event_timestamp'], unit='us')
-                else:
-                    raise ValueError("Missing time field")
-                    
-            results = []
-            unique_events = events['event_name'].unique()
+            # 构建用户×事件关联，所有事件对的统计量由共现矩阵一次得到
+            incidence = build_event_incidence(events, self.dataset_cache.event_times(events))
+            event_codes = incidence.encode(event_types) if event_types else None
+            pair_stats = event_pair_statistics(incidence, min_co_occurrence, event_codes)
+            temporal = self._temporal_patterns(incidence, pair_stats)
             
-            # 分析所有事件对的关联性
-            for event1, event2 in itertools.combinations(unique_events, 2):
-                correlation_result = self._analyze_event_pair_correlation(
-                    events, event1, event2, min_co_occurrence
-                )
-                
-                if correlation_result:
-                    results.append(correlation_result)
+            results = []
+            for row, pattern in zip(pair_stats.itertuples(index=False), temporal):
+                results.append(EventCorrelationResult(
+                    event_pair=(incidence.event_names[row.event1], incidence.event_names[row.event2]),
+                    correlation_coefficient=float(row.cramers_v),
+                    significance_level=float(row.p_value),
+                    co_occurrence_rate=float(row.co_occurrence_rate),
+                    temporal_pattern=pattern,
+                    lift=float(row.lift)
+                ))
                     
             # 按关联强度排序
             results.sort(key=lambda x: abs(x.correlation_coefficient), reverse=True)
@@ -546,196 +355,31 @@ class EventAnalysisEngine:
             logger.error(f"事件关联性分析失败: {e}")
             raise
             
-    def _analyze_event_pair_correlation(self,
-                                      events: pd.DataFrame,
-                                      event1: str,
-                                      event2: str,
-                                      min_co_occurrence: int) -> Optional[EventCorrelationResult]:
+    def _temporal_patterns(self, incidence: EventIncidence, pair_stats: pd.DataFrame) -> List[Dict[str, Any]]:
         """
-        分析单个事件对的关联性
+        批量计算事件对的首次发生先后顺序和时间间隔（1分钟内认为是同时发生）
         
         Args:
-            events: 事件数据
-            event1: 第一个事件
-            event2: 第二个事件
-            min_co_occurrence: 最小共现次数
-            
-        Returns:
-            事件关联性结果
-        """
-        try:
-            # 获取两个事件的数据
-            event1_data = events[events['event_name'] == event1]
-            event2_data = events[events['event_name'] == event2]
-            
-            if event1_data.empty or event2_data.empty:
-                return None
-                
-            # 按用户分组分析共现
-            event1_users = set(event1_data['user_pseudo_id'].unique())
-            event2_users = set(event2_data['user_pseudo_id'].unique())
-            
-            # 计算共现用户
-            co_occurrence_users = event1_users.intersection(event2_users)
-            
-            if len(co_occurrence_users) < min_co_occurrence:
-                return None
-                
-            # 计算共现率
-            total_users = len(event1_users.union(event2_users))
-            co_occurrence_rate = len(co_occurrence_users) / total_users if total_users > 0 else 0
-            
-            # 计算相关系数（使用卡方检验）
-            correlation_coefficient, significance_level = self._calculate_chi_square_correlation(
-                events, event1, event2
-            )
-            
-            # 分析时间模式
-            temporal_pattern = self._analyze_temporal_pattern(
-                events, event1, event2, co_occurrence_users
-            )
-            
-            return EventCorrelationResult(
-                event_pair=(event1, event2),
-                correlation_coefficient=correlation_coefficient,
-                significance_level=significance_level,
-                co_occurrence_rate=co_occurrence_rate,
-                temporal_pattern=temporal_pattern
-            )
-            
-        except Exception as e:
-            logger.warning(f"分析事件对 {event1}-{event2} 关联性失败: {e}")
-            return None
-            
-    def _calculate_chi_square_correlation(self,
-                                        events: pd.DataFrame,
-                                        event1: str,
-                                        event2: str) -> Tuple[float, float]:
-        """
-        使用卡方检验计算事件相关性
-        
-        Args:
-            events: 事件数据
-            event1: 第一个事件
-            event2: 第二个事件
+            incidence: 用户×事件关联
+            pair_stats: 包含event1、event2编码列的事件对
             
         Returns:
-            (相关系数, 显著性水平)
-        """
-        try:
-            # 创建用户-事件矩阵
-            user_events = events.groupby('user_pseudo_id')['event_name'].apply(list).to_dict()
-            
-            # 构建列联表
-            has_event1_and_event2 = 0
-            has_event1_not_event2 = 0
-            not_event1_has_event2 = 0
-            not_event1_not_event2 = 0
-            
-            for user_id, user_event_list in user_events.items():
-                has_event1 = event1 in user_event_list
-                has_event2 = event2 in user_event_list
-                
-                if has_event1 and has_event2:
-                    has_event1_and_event2 += 1
-                elif has_event1 and not has_event2:
-                    has_event1_not_event2 += 1
-                elif not has_event1 and has_event2:
-                    not_event1_has_event2 += 1
-                else:
-                    not_event1_not_event2 += 1
-                    
-            # 构建列联表
-            contingency_table = np.array([
-                [has_event1_and_event2, has_event1_not_event2],
-                [not_event1_has_event2, not_event1_not_event2]
-            ])
-            
-            # 执行卡方检验
-            if (contingency_table.sum() > 0 and 
-                np.all(contingency_table >= 0) and 
-                np.all(contingency_table.sum(axis=0) > 0) and 
-                np.all(contingency_table.sum(axis=1) > 0)):
-                
-                try:
-                    chi2, p_value, dof, expected = chi2_contingency(contingency_table)
-                    
-                    # 检查期望频数是否都大于0
-                    if np.all(expected > 0):
-                        # 计算Cramér's V作为相关系数
-                        n = contingency_table.sum()
-                        cramers_v = np.sqrt(chi2 / (n * (min(contingency_table.shape) - 1)))
-                        return float(cramers_v), float(p_value)
-                    else:
-                        return 0.0, 1.0
-                except ValueError as ve:
-                    logger.warning(f"卡方检验计算错误: {ve}")
-                    return 0.0, 1.0
-            else:
-                return 0.0, 1.0
-                
-        except Exception as e:
-            logger.warning(f"计算卡方相关性失败: {e}")
-            return 0.0, 1.0
-            
-    def _analyze_temporal_pattern(self,
-                                events: pd.DataFrame,
-                                event1: str,
-                                event2: str,
-                                co_occurrence_users: set) -> Dict[str, Any]:
-        """
-        分析事件的时间模式
-        
-        Args:
-            events: 事件数据
-            event1: 第一个事件
-            event2: 第二个事件
-            co_occurrence_users: 共现用户集合
-            
-        Returns:
-            时间模式分析结果
-        """
-        try:
-            # 筛选共现用户的事件
-            user_events = events[events['user_pseudo_id'].isin(co_occurrence_users)]
-            
-            # 分析事件顺序
-            sequence_patterns = {'event1_first': 0, 'event2_first': 0, 'simultaneous': 0}
-            time_gaps = []
-            
-            for user_id in co_occurrence_users:
-                user_data = user_events[user_events['user_pseudo_id'] == user_id]
-                
-                event1_times = user_data[user_data['event_name'] == event1]['event_datetime']
-                event2_times = user_data[user_data['event_name'] == event2]['event_datetime']
-                
-                if not event1_times.empty and not event2_times.empty:
-                    first_event1 = event1_times.min()
-                    first_event2 = event2_times.min()
-                    
-                    time_diff = (first_event2 - first_event1).total_seconds()
-                    
-                    if abs(time_diff) < 60:  # 1分钟内认为是同时发生
-                        sequence_patterns['simultaneous'] += 1
-                    elif time_diff > 0:
-                        sequence_patterns['event1_first'] += 1
-                        time_gaps.append(time_diff)
-                    else:
-                        sequence_patterns['event2_first'] += 1
-                        time_gaps.append(abs(time_diff))
-                        
-            # 计算平均时间间隔
-            avg_time_gap = np.mean(time_gaps) if time_gaps else 0
-            
-            return {
-                'sequence_patterns': sequence_patterns,
-                'avg_time_gap_seconds': float(avg_time_gap),
-                'median_time_gap_seconds': float(np.median(time_gaps)) if time_gaps else 0
+            与事件对一一对应的时间模式
+        """
+        gaps = first_occurrence_gaps(incidence, pair_stats['event1'].to_numpy(),
+                                     pair_stats['event2'].to_numpy(), simultaneous_seconds=60)
+        return [
+            {
+                'sequence_patterns': {
+                    'event1_first': int(row.event1_first),
+                    'event2_first': int(row.event2_first),
+                    'simultaneous': int(row.simultaneous)
+                },
+                'avg_time_gap_seconds': float(row.avg_gap_seconds),
+                'median_time_gap_seconds': float(row.median_gap_seconds)
             }
-            
-        except Exception as e:
-            logger.warning(f"时间模式分析失败: {e}")
-            return {}
+            for row in gaps.itertuples(index=False)
+        ]
             
     def identify_key_events(self,
                           events: Optional[pd.DataFrame] = None,
@@ -759,7 +403,7 @@ class EventAnalysisEngine:
             if events is None:
                 if self.storage_manager is None:
                     raise ValueError("Event data not provided and storage manager not initialized")
-                events = self.storage_manager.get_data('events')
+                events = self.dataset_cache.events()
                 
             if users is None and self.storage_manager:
                 users = self.storage_manager.get_data('users')
@@ -771,16 +415,10 @@ class EventAnalysisEngine:
                 logger.warning("Event data is empty, cannot identify key events")
                 return []
                 
-            results = []
-            
-            # 分析每个事件类型
-            for event_type in events['event_name'].unique():
-                key_event_result = self._analyze_event_importance(
-                    events, users, sessions, event_type
-                )
-                
-                if key_event_result:
-                    results.append(key_event_result)
+            # 所有事件类型由同一个用户×事件计数矩阵一次评分
+            scores = event_importance_scores(events, self.conversion_events, sessions,
+                                             times=self._event_times(events))
+            results = [self._key_event_result(row) for row in scores.itertuples(index=False)]
                     
             # 按重要性得分排序
             results.sort(key=lambda x: x.importance_score, reverse=True)
@@ -792,222 +430,26 @@ class EventAnalysisEngine:
             logger.error(f"关键事件识别失败: {e}")
             raise
             
-    def _analyze_event_importance(self,
-                                events: pd.DataFrame,
-                                users: Optional[pd.DataFrame],
-                                sessions: Optional[pd.DataFrame],
-                                event_type: str) -> Optional[KeyEventResult]:
-        """
-        分析单个事件的重要性
-        
-        Args:
-            events: 事件数据
-            users: 用户数据
-            sessions: 会话数据
-            event_type: 事件类型
-            
-        Returns:
-            关键事件结果
-        """
-        try:
-            event_data = events[events['event_name'] == event_type]
-            
-            if event_data.empty:
-                return None
-                
-            # 计算用户参与度影响
-            user_engagement_impact = self._calculate_user_engagement_impact(
-                events, event_data, event_type
-            )
-            
-            # 计算转化影响
-            conversion_impact = self._calculate_conversion_impact(
-                events, sessions, event_type
-            )
-            
-            # 计算留存影响
-            retention_impact = self._calculate_retention_impact(
-                events, users, event_type
-            )
-            
-            # 计算综合重要性得分
-            importance_score = (
-                user_engagement_impact * 0.4 +
-                conversion_impact * 0.4 +
-                retention_impact * 0.2
-            )
-            
-            # 生成重要性原因
-            reasons = self._generate_importance_reasons(
-                user_engagement_impact, conversion_impact, retention_impact, event_type
-            )
-            
-            return KeyEventResult(
-                event_name=event_type,
-                importance_score=importance_score,
-                user_engagement_impact=user_engagement_impact,
-                conversion_impact=conversion_impact,
-                retention_impact=retention_impact,
-                reasons=reasons
-            )
-            
-        except Exception as e:
-            logger.warning(f"分析事件 {event_type} 重要性失败: {e}")
+    def _event_times(self, events: pd.DataFrame) -> Optional[np.ndarray]:
+        """同一数据版本共用的事件时间，没有时间字段时为None"""
+        if 'event_datetime' not in events.columns and 'event_timestamp' not in events.columns:
             return None
-            
-    def _calculate_user_engagement_impact(self,
-                                        all_events: pd.DataFrame,
-                                        event_data: pd.DataFrame,
-                                        event_type: str) -> float:
-        """
-        计算用户参与度影响
-        
-        Args:
-            all_events: 所有事件数据
-            event_data: 特定事件数据
-            event_type: 事件类型
-            
-        Returns:
-            参与度影响得分 (0-100)
-        """
-        try:
-            # 计算事件频次得分
-            total_events = len(all_events)
-            event_count = len(event_data)
-            frequency_score = (event_count / total_events * 100) if total_events > 0 else 0
-            
-            # 计算用户覆盖率得分
-            total_users = all_events['user_pseudo_id'].nunique()
-            event_users = event_data['user_pseudo_id'].nunique()
-            coverage_score = (event_users / total_users * 100) if total_users > 0 else 0
-            
-            # 计算用户粘性得分（平均每用户事件数）
-            if event_users > 0:
-                avg_events_per_user = event_count / event_users
-                # 标准化到0-100范围
-                stickiness_score = min(avg_events_per_user * 10, 100)
-            else:
-                stickiness_score = 0
-                
-            # 综合得分
-            engagement_impact = (frequency_score * 0.3 + coverage_score * 0.4 + stickiness_score * 0.3)
-            
-            return min(engagement_impact, 100.0)
-            
-        except Exception as e:
-            logger.warning(f"计算用户参与度影响失败: {e}")
-            return 0.0
-            
-    def _calculate_conversion_impact(self,
-                                   all_events: pd.DataFrame,
-                                   sessions: Optional[pd.DataFrame],
-                                   event_type: str) -> float:
-        """
-        计算转化影响
-        
-        Args:
-            all_events: 所有事件数据
-            sessions: 会话数据
-            event_type: 事件类型
-            
-        Returns:
-            转化影响得分 (0-100)
-        """
-        try:
-            # 如果是转化事件，直接给高分
-            if event_type in self.conversion_events:
-                return 90.0
-                
-            # 分析事件与转化的关联性
-            event_users = set(all_events[all_events['event_name'] == event_type]['user_pseudo_id'])
-            
-            conversion_impact_score = 0.0
-            
-            # 计算与转化事件的关联度
-            for conv_event in self.conversion_events:
-                conv_users = set(all_events[all_events['event_name'] == conv_event]['user_pseudo_id'])
-                
-                if conv_users:
-                    # 计算重叠用户比例
-                    overlap_users = event_users.intersection(conv_users)
-                    overlap_rate = len(overlap_users) / len(conv_users) if conv_users else 0
-                    
-                    # 累加关联度得分
-                    conversion_impact_score += overlap_rate * 20  # 每个转化事件最多贡献20分
-                    
-            # 使用会话数据分析转化影响
-            if sessions is not None and not sessions.empty and 'conversions' in sessions.columns:
-                # 分析有该事件的会话的转化率
-                event_sessions = sessions[sessions['user_pseudo_id'].isin(event_users)]
-                if not event_sessions.empty:
-                    event_conversion_rate = (event_sessions['conversions'] > 0).mean()
-                    
-                    # 与整体转化率比较
-                    overall_conversion_rate = (sessions['conversions'] > 0).mean()
-                    
-                    if overall_conversion_rate > 0:
-                        conversion_lift = event_conversion_rate / overall_conversion_rate
-                        conversion_impact_score += min(conversion_lift * 30, 30)  # 最多贡献30分
-                        
-            return min(conversion_impact_score, 100.0)
-            
-        except Exception as e:
-            logger.warning(f"计算转化影响失败: {e}")
-            return 0.0
-            
-    def _calculate_retention_impact(self,
-                                  all_events: pd.DataFrame,
-                                  users: Optional[pd.DataFrame],
-                                  event_type: str) -> float:
-        """
-        计算留存影响
+        return self.dataset_cache.event_times(events)
         
-        Args:
-            all_events: 所有事件数据
-            users: 用户数据
-            event_type: 事件类型
-            
-        Returns:
-            留存影响得分 (0-100)
-        """
-        try:
-            if 'event_datetime' not in all_events.columns:
-                if 'event_timestamp' in all_events.columns:
-                    all_events['event_datetime'] = pd.to_datetime(all_events['event_timestamp'], unit='us')
-                else:
-                    return 0.0
-                    
-            # 分析有该事件的用户的留存情况
-            event_users = set(all_events[all_events['event_name'] == event_type]['user_pseudo_id'])
-            
-            if not event_users:
-                return 0.0
-                
-            # 计算用户的活跃天数
-            user_activity = all_events.groupby('user_pseudo_id')['event_datetime'].agg(['min', 'max'])
-            user_activity['active_days'] = (user_activity['max'] - user_activity['min']).dt.days + 1
-            
-            # 比较有该事件的用户与整体用户的活跃天数
-            event_user_activity = user_activity[user_activity.index.isin(event_users)]['active_days']
-            overall_user_activity = user_activity['active_days']
-            
-            if len(event_user_activity) > 0 and len(overall_user_activity) > 0:
-                event_avg_active_days = event_user_activity.mean()
-                overall_avg_active_days = overall_user_activity.mean()
-                
-                if overall_avg_active_days > 0:
-                    retention_lift = event_avg_active_days / overall_avg_active_days
-                    retention_impact = min(retention_lift * 50, 100)  # 标准化到0-100
-                else:
-                    retention_impact = 0.0
-            else:
-                retention_impact = 0.0
-                
-            return retention_impact
-            
-        except Exception as e:
-            logger.warning(f"计算留存影响失败: {e}")
-            return 0.0
+    def _key_event_result(self, row) -> KeyEventResult:
+        """由评分表的一行生成关键事件结果"""
+        return KeyEventResult(
+            event_name=row.event_name,
+            importance_score=float(row.importance_score),
+            user_engagement_impact=float(row.user_engagement_impact),
+            conversion_impact=float(row.conversion_impact),
+            retention_impact=float(row.retention_impact),
+            reasons=self._generate_importance_reasons(
+                row.user_engagement_impact, row.conversion_impact, row.retention_impact, row.event_name
+            ),
+            conversion_lift=float(row.conversion_lift),
+            retention_lift=float(row.retention_lift)
+        )
             
     def _generate_importance_reasons(self,
                                    user_engagement_impact: float,
@@ -1178,7 +620,7 @@ class EventAnalysisEngine:
             if self.storage_manager is None:
                 return {"error": "Storage manager not initialized"}
                 
-            events = self.storage_manager.get_data('events')
+            events = self.dataset_cache.events()
             
             if events.empty:
                 return {"error": "无事件数据"}
@@ -1192,9 +634,8 @@ class EventAnalysisEngine:
             top_events = events['event_name'].value_counts().head(5).to_dict()
             
             # 时间范围
-            if 'event_datetime' not in events.columns:
-                if 'event_timestamp' in events.columns:
-                    events['event_datetime'] = pd.to_datetime(events['event_timestamp'], unit='us')
+            if 'event_timestamp' in events.columns:
+                events = self.dataset_cache.with_datetime(events)
                     
             if 'event_datetime' in events.columns:
                 date_range = {
@@ -0,0 +1,226 @@
+"""
+事件共现分析模块
+
+一次性构建用户×事件的稀疏关联矩阵（记录每个用户每种事件的首次发生时间），
+所有事件对的列联表、卡方检验、Cramér's V和提升度都由同一个稀疏矩阵乘积得到；
+事件对的首次发生时间间隔按用户分块向量化展开计算。
+"""
+
+import pandas as pd
+import numpy as np
+from typing import Optional, Sequence
+from dataclasses import dataclass
+from scipy import sparse
+from scipy.stats import chi2 as chi2_distribution
+import logging
+
+from engines.funnel_matcher import event_times_ns
+
+logger = logging.getLogger(__name__)
+
+_NS_PER_SECOND = 1_000_000_000
+
+
+@dataclass
+class EventIncidence:
+    """用户×事件关联，每个(用户, 事件)一项，按用户、事件编码排序"""
+    event_names: np.ndarray  # 事件编码 -> 事件名（按首次出现顺序）
+    n_users: int
+    user_index: np.ndarray  # 每项的用户编码
+    event_index: np.ndarray  # 每项的事件编码
+    first_times: np.ndarray  # 每项的首次发生时间（int64纳秒）
+
+    @property
+    def matrix(self) -> sparse.csr_matrix:
+        """用户×事件的0/1稀疏矩阵"""
+        return sparse.csr_matrix(
+            (np.ones(len(self.user_index), dtype=np.int64), (self.user_index, self.event_index)),
+            shape=(self.n_users, len(self.event_names))
+        )
+
+    @property
+    def user_counts(self) -> np.ndarray:
+        """每种事件的用户数"""
+        return np.bincount(self.event_index, minlength=len(self.event_names))
+
+    def encode(self, names: Sequence[str]) -> np.ndarray:
+        """事件名转编码，不存在的事件为-1"""
+        lookup = {name: code for code, name in enumerate(self.event_names)}
+        return np.array([lookup.get(name, -1) for name in names], dtype=np.int64)
+
+
+def build_event_incidence(events: pd.DataFrame, times: Optional[np.ndarray] = None) -> EventIncidence:
+    """
+    构建用户×事件关联
+
+    Args:
+        events: 事件数据，需要user_pseudo_id、event_name和时间字段
+        times: 与events的行对应的事件时间（见event_times_ns），None时从events解析
+
+    Returns:
+        用户×事件关联
+    """
+    user_codes, users = pd.factorize(events['user_pseudo_id'])
+    event_codes, event_names = pd.factorize(events['event_name'])
+    times = event_times_ns(events) if times is None else times
+
+    n_events = len(event_names)
+    keys = user_codes.astype(np.int64) * n_events + event_codes
+    # 按时间排序后取每个(用户, 事件)的第一项即首次发生时间
+    order = np.argsort(times, kind='stable')
+    unique_keys, first = np.unique(keys[order], return_index=True)
+
+    return EventIncidence(
+        event_names=np.asarray(event_names, dtype=object),
+        n_users=len(users),
+        user_index=unique_keys // n_events if n_events else unique_keys,
+        event_index=unique_keys % n_events if n_events else unique_keys,
+        first_times=times[order][first]
+    )
+
+
+def event_pair_statistics(incidence: EventIncidence,
+                          min_co_occurrence: int = 1,
+                          event_codes: Optional[np.ndarray] = None) -> pd.DataFrame:
+    """
+    由共现矩阵计算所有事件对的2×2列联表统计量
+
+    卡方检验与scipy.stats.chi2_contingency一致（自由度为1时使用Yates校正），
+    行列合计存在0的事件对记为相关系数0、p值1。
+
+    Args:
+        incidence: 用户×事件关联
+        min_co_occurrence: 最小共现用户数
+        event_codes: 只分析这些事件之间的事件对，None表示全部事件
+
+    Returns:
+        每个事件对一行，按事件编码排序：event1, event2（编码，event1 < event2）、
+        co_users, users1, users2, co_occurrence_rate, lift, chi2, p_value, cramers_v
+    """
+    matrix = incidence.matrix
+    co_matrix = sparse.triu(matrix.T @ matrix, k=1).tocoo()
+    first, second, co_users = co_matrix.row, co_matrix.col, co_matrix.data
+
+    keep = co_users >= max(min_co_occurrence, 1)
+    if event_codes is not None:
+        selected = np.zeros(len(incidence.event_names), dtype=bool)
+        selected[event_codes[event_codes >= 0]] = True
+        keep &= selected[first] & selected[second]
+    first, second, co_users = first[keep], second[keep], co_users[keep].astype(float)
+    order = np.lexsort((second, first))
+    first, second, co_users = first[order], second[order], co_users[order]
+
+    n = float(incidence.n_users)
+    user_counts = incidence.user_counts.astype(float)
+    users1, users2 = user_counts[first], user_counts[second]
+
+    # 列联表 [[a, b], [c, d]] 及期望频数
+    observed = np.stack([co_users, users1 - co_users, users2 - co_users,
+                         n - users1 - users2 + co_users], axis=1)
+    row_totals = np.stack([users1, users1, n - users1, n - users1], axis=1)
+    column_totals = np.stack([users2, n - users2, users2, n - users2], axis=1)
+    expected = row_totals * column_totals / n
+    valid = (users1 > 0) & (users2 > 0) & (users1 < n) & (users2 < n)
+
+    with np.errstate(divide='ignore', invalid='ignore'):
+        difference = expected - observed
+        corrected = observed + np.sign(difference) * np.minimum(0.5, np.abs(difference))
+        chi2 = np.where(valid, ((corrected - expected) ** 2 / expected).sum(axis=1), 0.0)
+        chi2 = np.nan_to_num(chi2)
+        union = users1 + users2 - co_users
+        co_occurrence_rate = np.where(union > 0, co_users / union, 0.0)
+        lift = np.where(valid, co_users * n / (users1 * users2), 0.0)
+
+    return pd.DataFrame({
+        'event1': first,
+        'event2': second,
+        'co_users': co_users.astype(np.int64),
+        'users1': users1.astype(np.int64),
+        'users2': users2.astype(np.int64),
+        'co_occurrence_rate': co_occurrence_rate,
+        'lift': lift,
+        'chi2': chi2,
+        'p_value': np.where(valid, chi2_distribution.sf(chi2, 1), 1.0),
+        'cramers_v': np.where(valid, np.sqrt(chi2 / n), 0.0)
+    })
+
+
+def first_occurrence_gaps(incidence: EventIncidence,
+                          event1: np.ndarray,
+                          event2: np.ndarray,
+                          simultaneous_seconds: float = 60,
+                          chunk_size: int = 5_000_000) -> pd.DataFrame:
+    """
+    计算事件对在共现用户中的首次发生先后顺序和时间间隔
+
+    间隔为event2首次发生时间减去event1首次发生时间，绝对值小于simultaneous_seconds
+    视为同时发生，其余按绝对值统计平均值和中位数。
+
+    Args:
+        incidence: 用户×事件关联
+        event1: 事件对的第一个事件编码（需小于event2）
+        event2: 事件对的第二个事件编码
+        simultaneous_seconds: 视为同时发生的时间阈值（秒）
+        chunk_size: 每块最多展开的用户内事件对数
+
+    Returns:
+        与输入事件对一一对应：event1_first, event2_first, simultaneous,
+        avg_gap_seconds, median_gap_seconds
+    """
+    n_events = len(incidence.event_names)
+    n_pairs = len(event1)
+    pair_keys = event1.astype(np.int64) * n_events + event2
+    pair_order = np.argsort(pair_keys)
+    sorted_keys = pair_keys[pair_order]
+
+    # 每个关联项与同一用户后面的关联项组成用户内事件对
+    user_ends = np.searchsorted(incidence.user_index, incidence.user_index, side='right')
+    partners = user_ends - np.arange(len(incidence.user_index)) - 1
+    boundaries = np.concatenate([[0], np.cumsum(partners)])
+
+    pair_parts, gap_parts = [], []
+    start = 0
+    while start < len(partners):
+        end = max(int(np.searchsorted(boundaries, boundaries[start] + chunk_size, side='right')) - 1,
+                  start + 1)
+        counts = partners[start:end]
+        left = np.repeat(np.arange(start, end), counts)
+        within = np.arange(len(left)) - np.repeat(boundaries[start:end] - boundaries[start], counts)
+        right = left + 1 + within
+
+        keys = incidence.event_index[left] * n_events + incidence.event_index[right]
+        position = np.minimum(np.searchsorted(sorted_keys, keys), max(n_pairs - 1, 0))
+        matched = (sorted_keys[position] == keys) if n_pairs else np.zeros(len(keys), dtype=bool)
+        pair_parts.append(pair_order[position[matched]])
+        gap_parts.append((incidence.first_times[right[matched]] - incidence.first_times[left[matched]])
+                         / _NS_PER_SECOND)
+        start = end
+
+    pairs = np.concatenate(pair_parts) if pair_parts else np.empty(0, dtype=np.int64)
+    gaps = np.concatenate(gap_parts) if gap_parts else np.empty(0)
+
+    simultaneous = np.abs(gaps) < simultaneous_seconds
+    event1_first = ~simultaneous & (gaps > 0)
+    event2_first = ~simultaneous & (gaps <= 0)
+
+    # 非同时发生的间隔按事件对分组求平均值和中位数
+    gap_pairs, abs_gaps = pairs[~simultaneous], np.abs(gaps[~simultaneous])
+    order = np.lexsort((abs_gaps, gap_pairs))
+    gap_pairs, abs_gaps = gap_pairs[order], abs_gaps[order]
+    gap_counts = np.bincount(gap_pairs, minlength=n_pairs)
+    group_starts = np.concatenate([[0], np.cumsum(gap_counts)[:-1]]).astype(np.int64)
+    has_gaps = gap_counts > 0
+    median = np.zeros(n_pairs)
+    if has_gaps.any():
+        low = abs_gaps[group_starts[has_gaps] + (gap_counts[has_gaps] - 1) // 2]
+        high = abs_gaps[group_starts[has_gaps] + gap_counts[has_gaps] // 2]
+        median[has_gaps] = (low + high) / 2
+    total = np.bincount(gap_pairs, weights=abs_gaps, minlength=n_pairs)
+
+    return pd.DataFrame({
+        'event1_first': np.bincount(pairs[event1_first], minlength=n_pairs),
+        'event2_first': np.bincount(pairs[event2_first], minlength=n_pairs),
+        'simultaneous': np.bincount(pairs[simultaneous], minlength=n_pairs),
+        'avg_gap_seconds': np.divide(total, gap_counts, out=np.zeros(n_pairs), where=has_gaps),
+        'median_gap_seconds': median
+    })
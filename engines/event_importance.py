@@ -0,0 +1,228 @@
+"""
+事件重要性评分模块
+
+一次性构建用户×事件的稀疏计数矩阵和每个用户的结果向量（活跃天数、会话数、转化会话数），
+所有事件类型的参与度、转化和留存影响都由矩阵与结果向量的乘积向量化得到，
+不再对每个事件类型重复扫描事件数据。
+"""
+
+import pandas as pd
+import numpy as np
+from typing import Iterable, Optional
+from dataclasses import dataclass
+from scipy import sparse
+import logging
+
+from engines.funnel_matcher import event_times_ns
+
+logger = logging.getLogger(__name__)
+
+_NS_PER_DAY = 86_400 * 1_000_000_000
+
+
+@dataclass
+class UserEventCounts:
+    """用户×事件计数矩阵及每个用户的结果向量"""
+    users: pd.Index  # 用户编码 -> user_pseudo_id
+    event_names: np.ndarray  # 事件编码 -> 事件名（按首次出现顺序）
+    counts: sparse.csr_matrix  # 用户×事件的事件数
+    active_days: Optional[np.ndarray]  # 每个用户首末事件间隔天数+1，缺少时间字段时为None
+
+    @property
+    def presence(self) -> sparse.csr_matrix:
+        """用户×事件的0/1矩阵"""
+        presence = self.counts.copy()
+        presence.data = np.ones_like(presence.data)
+        return presence
+
+    @property
+    def event_counts(self) -> np.ndarray:
+        """每种事件的事件数"""
+        return np.asarray(self.counts.sum(axis=0)).ravel()
+
+    @property
+    def user_counts(self) -> np.ndarray:
+        """每种事件的用户数"""
+        return np.diff(self.counts.tocsc().indptr)
+
+    def encode(self, names: Iterable[str]) -> np.ndarray:
+        """事件名转编码，不存在的事件为-1"""
+        lookup = {name: code for code, name in enumerate(self.event_names)}
+        return np.array([lookup.get(name, -1) for name in names], dtype=np.int64)
+
+
+def build_user_event_counts(events: pd.DataFrame, times: Optional[np.ndarray] = None) -> UserEventCounts:
+    """
+    构建用户×事件计数矩阵
+
+    Args:
+        events: 事件数据，需要user_pseudo_id和event_name，有时间字段时计算活跃天数
+        times: 与events的行对应的事件时间（见event_times_ns），None时从events解析
+
+    Returns:
+        用户×事件计数
+    """
+    user_codes, users = pd.factorize(events['user_pseudo_id'])
+    event_codes, event_names = pd.factorize(events['event_name'])
+
+    counts = sparse.csr_matrix(
+        (np.ones(len(events), dtype=np.int64), (user_codes, event_codes)),
+        shape=(len(users), len(event_names))
+    )
+    counts.sum_duplicates()
+
+    try:
+        times = event_times_ns(events) if times is None else times
+        first = np.full(len(users), np.iinfo(np.int64).max)
+        last = np.full(len(users), np.iinfo(np.int64).min)
+        np.minimum.at(first, user_codes, times)
+        np.maximum.at(last, user_codes, times)
+        active_days = (last - first) // _NS_PER_DAY + 1
+    except ValueError:
+        active_days = None
+
+    return UserEventCounts(
+        users=pd.Index(users),
+        event_names=np.asarray(event_names, dtype=object),
+        counts=counts,
+        active_days=active_days
+    )
+
+
+def engagement_impact(table: UserEventCounts) -> np.ndarray:
+    """
+    每种事件的用户参与度影响 (0-100)
+
+    频次占比、用户覆盖率和人均事件数（×10，上限100）按0.3/0.4/0.3加权。
+    """
+    event_counts = table.event_counts.astype(float)
+    user_counts = table.user_counts.astype(float)
+    total_events = event_counts.sum()
+    total_users = len(table.users)
+
+    frequency_score = event_counts / total_events * 100 if total_events > 0 else np.zeros_like(event_counts)
+    coverage_score = user_counts / total_users * 100 if total_users > 0 else np.zeros_like(user_counts)
+    stickiness_score = np.minimum(
+        np.divide(event_counts, user_counts, out=np.zeros_like(event_counts), where=user_counts > 0) * 10, 100
+    )
+    return np.minimum(frequency_score * 0.3 + coverage_score * 0.4 + stickiness_score * 0.3, 100.0)
+
+
+def session_outcomes(table: UserEventCounts, sessions: Optional[pd.DataFrame]) -> Optional[np.ndarray]:
+    """
+    每个用户的会话数和有转化的会话数
+
+    Returns:
+        shape为(用户数, 2)的数组，没有可用的会话数据时为None；
+        不在事件数据中的用户的会话不计入
+    """
+    if sessions is None or sessions.empty or 'conversions' not in sessions.columns:
+        return None
+
+    user_codes = table.users.get_indexer(sessions['user_pseudo_id'])
+    known = user_codes >= 0
+    outcomes = np.zeros((len(table.users), 2))
+    np.add.at(outcomes[:, 0], user_codes[known], 1.0)
+    np.add.at(outcomes[:, 1], user_codes[known], (sessions['conversions'].to_numpy()[known] > 0).astype(float))
+    return outcomes
+
+
+def conversion_impact(table: UserEventCounts,
+                      conversion_events: Iterable[str],
+                      sessions: Optional[pd.DataFrame] = None) -> pd.DataFrame:
+    """
+    每种事件的转化影响 (0-100)
+
+    转化事件本身记90分；其他事件按与每个转化事件的用户重叠率（占转化事件用户的比例）
+    各贡献最多20分，再按有该事件用户的会话转化率相对整体会话转化率的提升度贡献最多30分。
+
+    Returns:
+        每种事件一行：conversion_impact, conversion_lift（无会话数据时为NaN）
+    """
+    conversion_events = set(conversion_events)
+    presence = table.presence
+    user_counts = table.user_counts.astype(float)
+    conversion_codes = table.encode(sorted(conversion_events))
+    conversion_codes = conversion_codes[conversion_codes >= 0]
+    conversion_codes = conversion_codes[user_counts[conversion_codes] > 0]
+
+    n_events = len(table.event_names)
+    score = np.zeros(n_events)
+    if len(conversion_codes):
+        overlap = np.asarray((presence.T @ presence[:, conversion_codes]).todense(), dtype=float)
+        score += (overlap / user_counts[conversion_codes] * 20).sum(axis=1)
+
+    lift = np.full(n_events, np.nan)
+    outcomes = session_outcomes(table, sessions)
+    overall_rate = (sessions['conversions'] > 0).mean() if outcomes is not None else 0.0
+    if overall_rate > 0:
+        per_event = presence.T @ outcomes
+        has_sessions = per_event[:, 0] > 0
+        lift[has_sessions] = per_event[has_sessions, 1] / per_event[has_sessions, 0] / overall_rate
+        score[has_sessions] += np.minimum(lift[has_sessions] * 30, 30)
+
+    score = np.minimum(score, 100.0)
+    is_conversion = np.isin(table.event_names, list(conversion_events))
+    score[is_conversion] = 90.0
+    return pd.DataFrame({'conversion_impact': score, 'conversion_lift': lift})
+
+
+def retention_impact(table: UserEventCounts) -> pd.DataFrame:
+    """
+    每种事件的留存影响 (0-100)
+
+    有该事件用户的平均活跃天数相对全部用户平均活跃天数的提升度×50，上限100。
+
+    Returns:
+        每种事件一行：retention_impact, retention_lift（缺少时间字段时为NaN）
+    """
+    n_events = len(table.event_names)
+    if table.active_days is None or len(table.users) == 0:
+        return pd.DataFrame({'retention_impact': np.zeros(n_events), 'retention_lift': np.full(n_events, np.nan)})
+
+    active_days = table.active_days.astype(float)
+    user_counts = table.user_counts.astype(float)
+    overall = active_days.mean()
+    event_days = table.presence.T @ active_days
+    lift = np.full(n_events, np.nan)
+    if overall > 0:
+        has_users = user_counts > 0
+        lift[has_users] = event_days[has_users] / user_counts[has_users] / overall
+    return pd.DataFrame({'retention_impact': np.nan_to_num(np.minimum(lift * 50, 100)), 'retention_lift': lift})
+
+
+def event_importance_scores(events: pd.DataFrame,
+                            conversion_events: Iterable[str],
+                            sessions: Optional[pd.DataFrame] = None,
+                            table: Optional[UserEventCounts] = None,
+                            times: Optional[np.ndarray] = None) -> pd.DataFrame:
+    """
+    一次计算所有事件类型的重要性得分
+
+    Args:
+        events: 事件数据
+        conversion_events: 转化事件名
+        sessions: 会话数据（需要user_pseudo_id和conversions），可选
+        table: 已构建的用户×事件计数，None时由events构建
+        times: 与events的行对应的事件时间（见event_times_ns），None时从events解析
+
+    Returns:
+        每种事件一行，按事件首次出现顺序：event_name, user_engagement_impact, conversion_impact,
+        retention_impact, importance_score, conversion_lift, retention_lift
+    """
+    if table is None:
+        table = build_user_event_counts(events, times)
+
+    conversion_events = set(conversion_events)
+    scores = pd.concat([
+        pd.DataFrame({'event_name': table.event_names, 'user_engagement_impact': engagement_impact(table)}),
+        conversion_impact(table, conversion_events, sessions),
+        retention_impact(table)
+    ], axis=1)
+    scores['importance_score'] = (
+        scores['user_engagement_impact'] * 0.4 +
+        scores['conversion_impact'] * 0.4 +
+        scores['retention_impact'] * 0.2
+    )
+    return scores[['event_name', 'user_engagement_impact', 'conversion_impact', 'retention_impact',
+                   'importance_score', 'conversion_lift', 'retention_lift']]
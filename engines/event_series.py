@@ -0,0 +1,313 @@
+"""
+事件计数序列模块
+
+对事件数据做一次 (事件, 时间桶, 用户) 分组计数，由同一张计数表批量得到所有事件类型的
+用户频次分布、百分位数、补齐缺失时间桶的趋势序列、线性趋势、季节性均值和异常点，
+避免按事件类型逐个过滤和重复聚合。
+"""
+
+import pandas as pd
+import numpy as np
+from typing import Dict, List, Optional
+from dataclasses import dataclass
+import logging
+
+from engines.funnel_matcher import event_times_ns
+
+logger = logging.getLogger(__name__)
+
+_NS_PER_DAY = 86_400 * 1_000_000_000
+
+# 支持中英文时间粒度
+GRANULARITY_ALIASES = {
+    '日': 'daily',
+    '周': 'weekly',
+    '月': 'monthly',
+    'day': 'daily',
+    'week': 'weekly',
+    'month': 'monthly'
+}
+
+FREQUENCY_BINS = [1, 2, 3, 5, 10, 20, 50, float('inf')]
+FREQUENCY_LABELS = ['1', '2', '3-4', '5-9', '10-19', '20-49', '50+']
+PERCENTILES = {'p25': 0.25, 'p50': 0.50, 'p75': 0.75, 'p90': 0.90, 'p95': 0.95}
+
+WEEKDAY_NAMES = ['Monday', 'Tuesday', 'Wednesday', 'Thursday', 'Friday', 'Saturday', 'Sunday']
+MONTH_NAMES = ['Jan', 'Feb', 'Mar', 'Apr', 'May', 'Jun', 'Jul', 'Aug', 'Sep', 'Oct', 'Nov', 'Dec']
+
+
+def normalize_granularity(granularity: str) -> str:
+    """把中英文时间粒度统一为 daily/weekly/monthly"""
+    normalized = GRANULARITY_ALIASES.get(granularity, granularity)
+    if normalized not in ('daily', 'weekly', 'monthly'):
+        raise ValueError(f"Unsupported time granularity: {granularity} (支持的格式: daily/日, weekly/周, monthly/月)")
+    return normalized
+
+
+def _time_periods(times: np.ndarray, granularity: str) -> np.ndarray:
+    """时间转为连续的整数时间桶编号（天、周一开始的周或月）"""
+    days = times // _NS_PER_DAY
+    if granularity == 'daily':
+        return days
+    if granularity == 'weekly':
+        # 1970-01-01是周四，加3后周一对齐到7的倍数
+        return (days + 3) // 7
+    return times.astype('datetime64[ns]').astype('datetime64[M]').astype(np.int64)
+
+
+def _period_dates(periods: np.ndarray, granularity: str) -> np.ndarray:
+    """时间桶编号转为时间桶起始日期"""
+    if granularity == 'daily':
+        days = periods
+    elif granularity == 'weekly':
+        days = periods * 7 - 3
+    else:
+        days = periods.astype('datetime64[M]').astype('datetime64[D]').astype(np.int64)
+    return days.astype('datetime64[D]').astype('datetime64[ns]')
+
+
+@dataclass
+class EventCountTable:
+    """(事件, 时间桶, 用户) 计数表"""
+    event_names: np.ndarray  # 事件编码 -> 事件名（按首次出现顺序）
+    granularity: Optional[str]  # None表示不按时间分桶
+    event_codes: np.ndarray
+    periods: np.ndarray  # 时间桶编号，不分桶时为0
+    user_codes: np.ndarray
+    counts: np.ndarray
+
+    @property
+    def n_events(self) -> int:
+        return len(self.event_names)
+
+
+def build_event_count_table(events: pd.DataFrame, granularity: Optional[str] = None,
+                            by_event: bool = True, times: Optional[np.ndarray] = None) -> EventCountTable:
+    """
+    对事件数据做一次 (事件, 时间桶, 用户) 分组计数
+
+    Args:
+        events: 事件数据
+        granularity: 时间粒度，None表示只按 (事件, 用户) 计数
+        by_event: 是否区分事件类型，False时所有事件合并为编码0
+        times: 与events的行对应的事件时间（见event_times_ns），None时从events解析
+
+    Returns:
+        计数表，按事件编码、时间桶、用户排序
+    """
+    if by_event:
+        event_codes, event_names = pd.factorize(events['event_name'])
+    else:
+        event_codes, event_names = np.zeros(len(events), dtype=np.int64), [None]
+    user_codes, _ = pd.factorize(events['user_pseudo_id'])
+    if granularity is not None:
+        granularity = normalize_granularity(granularity)
+        periods = _time_periods(event_times_ns(events) if times is None else times, granularity)
+    else:
+        periods = np.zeros(len(events), dtype=np.int64)
+
+    grouped = pd.DataFrame({
+        'event': event_codes, 'period': periods, 'user': user_codes
+    }).groupby(['event', 'period', 'user'], sort=True).size()
+
+    return EventCountTable(
+        event_names=np.asarray(event_names, dtype=object),
+        granularity=granularity,
+        event_codes=grouped.index.get_level_values('event').to_numpy(),
+        periods=grouped.index.get_level_values('period').to_numpy(),
+        user_codes=grouped.index.get_level_values('user').to_numpy(),
+        counts=grouped.to_numpy()
+    )
+
+
+def frequency_summary(table: EventCountTable) -> pd.DataFrame:
+    """
+    每种事件的总次数、用户数、用户频次分布和百分位数
+
+    Args:
+        table: 计数表
+
+    Returns:
+        以事件编码为索引：total_count, unique_users, 各频次区间用户数, p25...p95
+    """
+    user_counts = pd.Series(table.counts).groupby(
+        [table.event_codes, table.user_codes], sort=True
+    ).sum()
+    events = user_counts.index.get_level_values(0)
+
+    summary = pd.DataFrame({
+        'total_count': user_counts.groupby(events).sum(),
+        'unique_users': user_counts.groupby(events).size()
+    })
+
+    bins = pd.cut(user_counts.to_numpy(), bins=FREQUENCY_BINS, labels=FREQUENCY_LABELS, right=False)
+    distribution = pd.crosstab(events, bins).reindex(columns=FREQUENCY_LABELS, fill_value=0)
+    summary = summary.join(distribution)
+
+    quantiles = user_counts.groupby(events).quantile(list(PERCENTILES.values())).unstack()
+    quantiles.columns = list(PERCENTILES)
+    return summary.join(quantiles)
+
+
+def trend_series(table: EventCountTable) -> pd.DataFrame:
+    """
+    每种事件从首个到最后一个时间桶的连续序列，缺失时间桶补0
+
+    Args:
+        table: 按时间分桶的计数表
+
+    Returns:
+        长表：event, position（序列内序号）, date, event_count, unique_users
+    """
+    if table.granularity is None:
+        raise ValueError("Count table is not bucketed by time")
+
+    # (事件, 时间桶) 的事件数和用户数
+    bucket_start = np.flatnonzero(np.r_[True, (table.event_codes[1:] != table.event_codes[:-1]) |
+                                        (table.periods[1:] != table.periods[:-1])])
+    bucket_events = table.event_codes[bucket_start]
+    bucket_periods = table.periods[bucket_start]
+    bucket_counts = np.add.reduceat(table.counts, bucket_start) if len(bucket_start) else table.counts[:0]
+    bucket_users = np.diff(np.r_[bucket_start, len(table.counts)])
+
+    # 每种事件的时间桶范围
+    present = np.unique(bucket_events)
+    first_period = np.full(table.n_events, 0, dtype=np.int64)
+    last_period = np.full(table.n_events, -1, dtype=np.int64)
+    event_start = np.searchsorted(bucket_events, present, side='left')
+    event_end = np.searchsorted(bucket_events, present, side='right') - 1
+    first_period[present] = bucket_periods[event_start]
+    last_period[present] = bucket_periods[event_end]
+
+    lengths = last_period - first_period + 1
+    series_events = np.repeat(np.arange(table.n_events), lengths)
+    series_start = np.concatenate([[0], np.cumsum(lengths)[:-1]])
+    positions = np.arange(len(series_events)) - np.repeat(series_start, lengths)
+    series_periods = first_period[series_events] + positions
+
+    event_count = np.zeros(len(series_events), dtype=np.int64)
+    unique_users = np.zeros(len(series_events), dtype=np.int64)
+    target = series_start[bucket_events] + bucket_periods - first_period[bucket_events]
+    event_count[target] = bucket_counts
+    unique_users[target] = bucket_users
+
+    return pd.DataFrame({
+        'event': series_events,
+        'position': positions,
+        'date': _period_dates(series_periods, table.granularity),
+        'event_count': event_count,
+        'unique_users': unique_users
+    })
+
+
+def trend_statistics(series: pd.DataFrame, n_events: int) -> pd.DataFrame:
+    """
+    每种事件序列的线性趋势（与scipy.stats.linregress斜率一致）、均值和标准差
+
+    增长率为斜率乘以序列长度相对均值的百分比，5%以内视为稳定。
+
+    Args:
+        series: trend_series的输出
+        n_events: 事件种类数
+
+    Returns:
+        以事件编码为索引：n_points, mean, std, slope, growth_rate, trend_direction
+    """
+    events = series['event'].to_numpy()
+    x = series['position'].to_numpy().astype(float)
+    y = series['event_count'].to_numpy().astype(float)
+
+    n = np.bincount(events, minlength=n_events).astype(float)
+    sum_x = np.bincount(events, weights=x, minlength=n_events)
+    sum_y = np.bincount(events, weights=y, minlength=n_events)
+    sum_xy = np.bincount(events, weights=x * y, minlength=n_events)
+    sum_xx = np.bincount(events, weights=x * x, minlength=n_events)
+
+    with np.errstate(divide='ignore', invalid='ignore'):
+        mean = np.where(n > 0, sum_y / n, 0.0)
+        squared_deviation = np.bincount(events, weights=(y - mean[events]) ** 2, minlength=n_events)
+        std = np.sqrt(np.where(n > 0, squared_deviation / n, 0.0))
+        denominator = n * sum_xx - sum_x ** 2
+        slope = np.where((n >= 2) & (denominator > 0), (n * sum_xy - sum_x * sum_y) / denominator, 0.0)
+        growth_rate = np.where(mean > 0, slope * n / mean * 100, 0.0)
+
+    direction = np.where(np.abs(growth_rate) < 5, 'stable',
+                         np.where(growth_rate > 0, 'increasing', 'decreasing'))
+    return pd.DataFrame({
+        'n_points': n.astype(np.int64),
+        'mean': mean,
+        'std': std,
+        'slope': slope,
+        'growth_rate': growth_rate,
+        'trend_direction': direction
+    })
+
+
+def seasonal_patterns(series: pd.DataFrame, granularity: str, min_points: int = 14) -> Dict[int, Dict]:
+    """
+    每种事件按季节周期的平均事件数：日粒度按星期，周粒度按月内第几周，月粒度按月份
+
+    Args:
+        series: trend_series的输出
+        granularity: 时间粒度
+        min_points: 计算季节性所需的最少数据点
+
+    Returns:
+        事件编码 -> 季节性模式，数据点不足的事件不包含在内
+    """
+    granularity = normalize_granularity(granularity)
+    dates = series['date'].dt
+    if granularity == 'daily':
+        keys, names = dates.dayofweek, WEEKDAY_NAMES
+    elif granularity == 'weekly':
+        keys, names = dates.day // 7 + 1, None
+    else:
+        keys, names = dates.month - 1, MONTH_NAMES
+
+    sizes = series.groupby('event').size()
+    eligible = series['event'].isin(sizes.index[sizes >= min_points])
+    means = series['event_count'][eligible].groupby(
+        [series['event'][eligible], keys[eligible]], sort=True
+    ).mean()
+
+    patterns: Dict[int, Dict] = {}
+    for (event, key), value in means.items():
+        label = names[key] if names is not None else int(key)
+        patterns.setdefault(int(event), {})[label] = float(value)
+    return patterns
+
+
+def series_anomalies(series: pd.DataFrame, statistics: pd.DataFrame,
+                     threshold: float = 2.0, min_points: int = 5) -> Dict[int, List[Dict]]:
+    """
+    每种事件序列中偏离均值超过threshold个标准差的时间桶
+
+    Args:
+        series: trend_series的输出
+        statistics: trend_statistics的输出
+        threshold: 异常检测阈值（标准差倍数）
+        min_points: 检测所需的最少数据点
+
+    Returns:
+        事件编码 -> 异常点列表
+    """
+    events = series['event'].to_numpy()
+    values = series['event_count'].to_numpy().astype(float)
+    mean = statistics['mean'].to_numpy()[events]
+    std = statistics['std'].to_numpy()[events]
+    eligible = (statistics['n_points'].to_numpy()[events] >= min_points) & (std > 0)
+
+    with np.errstate(divide='ignore', invalid='ignore'):
+        z_scores = np.where(eligible, np.abs(values - mean) / std, 0.0)
+    flagged = np.flatnonzero(eligible & (z_scores > threshold))
+
+    anomalies: Dict[int, List[Dict]] = {}
+    dates = series['date'].dt.strftime('%Y-%m-%d').to_numpy()[flagged] if len(flagged) else []
+    for index, date in zip(flagged, dates):
+        anomalies.setdefault(int(events[index]), []).append({
+            'date': date,
+            'value': float(values[index]),
+            'z_score': float(z_scores[index]),
+            'type': 'high' if values[index] > mean[index] else 'low'
+        })
+    return anomalies
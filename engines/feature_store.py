@@ -0,0 +1,297 @@
+"""
+用户特征存储模块
+
+按(数据版本, 特征规格)缓存build_user_feature_frame得到的用户特征表，供分群、流失评分和群体画像共用：
+- 数据版本来自存储管理器的内容指纹（直接传入的数据按同样方式计算），特征规格见user_features.feature_spec_key；
+- 存储管理器追加事件时只记录受影响的用户，下次读取时只用这些用户的全部事件重算对应行；
+- 设置cache_dir时特征表同时保存到磁盘，内容相同的数据在其他进程中可直接加载。
+"""
+
+import os
+import threading
+import weakref
+import pandas as pd
+import numpy as np
+from typing import Dict, List, Optional, Tuple
+from collections import OrderedDict
+from dataclasses import dataclass
+import logging
+
+from engines.dataset_cache import DatasetCache
+from engines.user_features import build_user_feature_frame, feature_spec_key
+from tools.data_storage_manager import (VERSION_COLUMNS, combine_fingerprints, dataset_fingerprint,
+                                        format_fingerprint, parse_fingerprint)
+
+logger = logging.getLogger(__name__)
+
+_DATA_TYPES = ('events', 'users', 'sessions')
+
+# 存储管理器 -> 共用的特征存储
+_shared_stores: 'weakref.WeakKeyDictionary' = weakref.WeakKeyDictionary()
+
+
+@dataclass
+class FeatureTable:
+    """一个版本的用户特征表"""
+    versions: Dict[str, str]  # events / users / sessions -> 数据版本
+    spec_key: str
+    reference_time: pd.Timestamp  # 计算最近活跃天数的参考时间
+    frame: pd.DataFrame  # 以user_pseudo_id为索引的特征表
+
+    @property
+    def dataset_version(self) -> str:
+        return '-'.join(f"{data_type[0]}{self.versions[data_type]}" for data_type in _DATA_TYPES)
+
+
+def frame_versions(events: pd.DataFrame,
+                   users: Optional[pd.DataFrame] = None,
+                   sessions: Optional[pd.DataFrame] = None) -> Dict[str, str]:
+    """直接传入的数据的版本，与存储管理器的数据版本计算方式一致"""
+    data = {'events': events, 'users': users, 'sessions': sessions}
+    return {data_type: format_fingerprint(dataset_fingerprint(data[data_type], VERSION_COLUMNS[data_type]))
+            for data_type in _DATA_TYPES}
+
+
+class UserFeatureStore:
+    """按数据版本缓存、随事件追加增量更新的用户特征表"""
+
+    def __init__(self, storage_manager=None, cache_dir: Optional[str] = None, max_entries: int = 4):
+        """
+        初始化特征存储
+
+        Args:
+            storage_manager: 数据存储管理器实例，提供时监听其事件追加
+            cache_dir: 特征表的磁盘缓存目录，None表示只缓存在内存中
+            max_entries: 内存中保留的特征表数量
+        """
+        self._storage_ref = weakref.ref(storage_manager) if storage_manager is not None else None
+        self.cache_dir = cache_dir
+        self.max_entries = max_entries
+        self.spec_key = feature_spec_key()
+        self.stats = {'hits': 0, 'builds': 0, 'incremental_updates': 0, 'disk_loads': 0}
+
+        self._tables: 'OrderedDict[Tuple[str, str], FeatureTable]' = OrderedDict()
+        self._latest_storage_key: Optional[Tuple[str, str]] = None
+        # 最近一次从存储构建后追加的事件：受影响的用户和追加部分的指纹
+        self._pending_users: List[np.ndarray] = []
+        self._pending_fingerprint: Tuple[int, int] = (0, 0)
+        self._lock = threading.RLock()
+
+        if storage_manager is not None and hasattr(storage_manager, 'add_event_listener'):
+            storage_manager.add_event_listener(self.on_storage_events)
+
+    @classmethod
+    def for_storage(cls, storage_manager) -> 'UserFeatureStore':
+        """获取存储管理器共用的特征存储，没有存储管理器时返回独立的实例"""
+        if storage_manager is None:
+            return cls()
+        store = _shared_stores.get(storage_manager)
+        if store is None:
+            store = cls(storage_manager)
+            _shared_stores[storage_manager] = store
+        return store
+
+    @property
+    def storage_manager(self):
+        return self._storage_ref() if self._storage_ref is not None else None
+
+    def is_versioned(self) -> bool:
+        """存储管理器是否提供数据版本（提供时才能按版本缓存存储中的数据）"""
+        storage = self.storage_manager
+        if storage is None or not hasattr(storage, 'get_data_version'):
+            return False
+        try:
+            return isinstance(storage.get_data_version(), str)
+        except Exception:
+            return False
+
+    def get_features(self,
+                     events: Optional[pd.DataFrame] = None,
+                     users: Optional[pd.DataFrame] = None,
+                     sessions: Optional[pd.DataFrame] = None,
+                     reference_time: Optional[pd.Timestamp] = None,
+                     times: Optional[np.ndarray] = None) -> pd.DataFrame:
+        """
+        获取用户特征表
+
+        Args:
+            events: 事件数据，None时读取存储管理器中的数据（需要is_versioned()）
+            users: 用户数据
+            sessions: 会话数据
+            reference_time: 计算最近活跃天数的参考时间，None时沿用缓存表的参考时间（新建时为当前时间）
+            times: 与events的行对应的事件时间（见event_times_ns），None时从events解析
+
+        Returns:
+            以user_pseudo_id为索引的特征表；返回的是缓存对象，调用方不应修改
+        """
+        if reference_time is not None:
+            reference_time = pd.Timestamp(reference_time)
+        if events is None:
+            return self._storage_features(reference_time)
+
+        versions = frame_versions(events, users, sessions)
+        with self._lock:
+            table = self._lookup(versions, reference_time)
+            if table is None:
+                table = self._build(versions, events, users, sessions, reference_time, times)
+            return table.frame
+
+    def reference_time_of(self, frame: pd.DataFrame) -> Optional[pd.Timestamp]:
+        """get_features返回的特征表的参考时间，不是缓存中的特征表时返回None"""
+        with self._lock:
+            for table in self._tables.values():
+                if table.frame is frame:
+                    return table.reference_time
+        return None
+
+    def on_storage_events(self, events: pd.DataFrame, replaced: bool) -> None:
+        """
+        存储管理器事件写入回调：追加时记录受影响的用户，替换时丢弃待更新记录
+
+        Args:
+            events: 新写入的事件
+            replaced: 是否替换了全部事件
+        """
+        with self._lock:
+            if replaced:
+                self._pending_users = []
+                self._pending_fingerprint = (0, 0)
+                return
+            self._pending_users.append(pd.unique(events['user_pseudo_id']))
+            self._pending_fingerprint = combine_fingerprints(
+                self._pending_fingerprint, dataset_fingerprint(events, VERSION_COLUMNS['events'])
+            )
+
+    def invalidate(self) -> None:
+        """清空内存中的特征表"""
+        with self._lock:
+            self._tables.clear()
+            self._latest_storage_key = None
+            self._pending_users = []
+            self._pending_fingerprint = (0, 0)
+
+    def _storage_features(self, reference_time: Optional[pd.Timestamp]) -> pd.DataFrame:
+        """读取存储管理器数据的特征表：缓存命中、增量更新、磁盘加载或重新构建"""
+        storage = self.storage_manager
+        if storage is None:
+            raise ValueError("Event data not provided and storage manager not initialized")
+
+        with self._lock:
+            versions = {data_type: storage.get_data_version(data_type) for data_type in _DATA_TYPES}
+            table = self._lookup(versions, reference_time)
+            if table is None:
+                table = self._incremental_update(storage, versions, reference_time)
+            if table is None:
+                events, users, sessions = self._storage_data(storage)
+                times = DatasetCache.for_storage(storage).event_times(events) if not events.empty else None
+                table = self._build(versions, events, users, sessions, reference_time, times)
+            self._latest_storage_key = (table.dataset_version, self.spec_key)
+            self._pending_users = []
+            self._pending_fingerprint = (0, 0)
+            return table.frame
+
+    @staticmethod
+    def _storage_data(storage) -> Tuple[pd.DataFrame, pd.DataFrame, pd.DataFrame]:
+        """存储中的数据，事件取各引擎共用的缓存副本"""
+        return DatasetCache.for_storage(storage).events(), storage.get_data('users'), storage.get_data('sessions')
+
+    def _lookup(self, versions: Dict[str, str], reference_time: Optional[pd.Timestamp]) -> Optional[FeatureTable]:
+        """内存或磁盘中参考时间相符的特征表"""
+        key = ('-'.join(f"{data_type[0]}{versions[data_type]}" for data_type in _DATA_TYPES), self.spec_key)
+        table = self._tables.get(key)
+        if table is None:
+            table = self._load(key)
+            if table is not None:
+                self.stats['disk_loads'] += 1
+                self._remember(table, save=False)
+        elif reference_time is None or table.reference_time == reference_time:
+            self.stats['hits'] += 1
+        if table is None or (reference_time is not None and table.reference_time != reference_time):
+            return None
+        self._tables.move_to_end(key)
+        return table
+
+    def _incremental_update(self,
+                            storage,
+                            versions: Dict[str, str],
+                            reference_time: Optional[pd.Timestamp]) -> Optional[FeatureTable]:
+        """
+        只重算追加事件涉及的用户
+
+        用户和会话数据未变、且最近的特征表版本加上已记录的追加部分恰好等于当前事件版本时才增量更新，否则返回None
+        """
+        base = self._tables.get(self._latest_storage_key) if self._latest_storage_key else None
+        if base is None or not self._pending_users:
+            return None
+        if reference_time is not None and reference_time != base.reference_time:
+            return None
+        if any(base.versions[data_type] != versions[data_type] for data_type in ('users', 'sessions')):
+            return None
+        expected = combine_fingerprints(parse_fingerprint(base.versions['events']), self._pending_fingerprint)
+        if format_fingerprint(expected) != versions['events']:
+            return None
+
+        affected = pd.unique(np.concatenate(self._pending_users))
+        events, users, sessions = self._storage_data(storage)
+        is_affected = events['user_pseudo_id'].isin(affected).to_numpy()
+        times = DatasetCache.for_storage(storage).event_times(events)[is_affected]
+        updated = build_user_feature_frame(events[is_affected], users, sessions, base.reference_time, times)
+
+        frame = base.frame.copy()
+        existing = updated.index.isin(frame.index)
+        frame.loc[updated.index[existing]] = updated[existing]
+        frame = pd.concat([frame, updated[~existing]])
+
+        table = FeatureTable(versions=versions, spec_key=self.spec_key,
+                             reference_time=base.reference_time, frame=frame)
+        self.stats['incremental_updates'] += 1
+        self._remember(table)
+        logger.info(f"增量更新{len(updated)}个用户的特征（新增{int((~existing).sum())}个）")
+        return table
+
+    def _build(self,
+               versions: Dict[str, str],
+               events: pd.DataFrame,
+               users: Optional[pd.DataFrame],
+               sessions: Optional[pd.DataFrame],
+               reference_time: Optional[pd.Timestamp],
+               times: Optional[np.ndarray] = None) -> FeatureTable:
+        """重新构建特征表"""
+        reference_time = reference_time if reference_time is not None else pd.Timestamp.now()
+        frame = (build_user_feature_frame(events, users, sessions, reference_time, times)
+                 if events is not None and not events.empty else pd.DataFrame())
+        table = FeatureTable(versions=versions, spec_key=self.spec_key, reference_time=reference_time, frame=frame)
+        self.stats['builds'] += 1
+        self._remember(table)
+        return table
+
+    def _remember(self, table: FeatureTable, save: bool = True) -> None:
+        """放入内存缓存（超出数量时淘汰最久未用的），并按需写入磁盘"""
+        key = (table.dataset_version, table.spec_key)
+        self._tables[key] = table
+        self._tables.move_to_end(key)
+        while len(self._tables) > self.max_entries:
+            self._tables.popitem(last=False)
+        if save and self.cache_dir and not table.frame.empty:
+            try:
+                os.makedirs(self.cache_dir, exist_ok=True)
+                pd.to_pickle(table, self._cache_path(key))
+            except Exception as e:
+                logger.warning(f"保存特征表缓存失败: {e}")
+
+    def _load(self, key: Tuple[str, str]) -> Optional[FeatureTable]:
+        """从磁盘缓存加载特征表"""
+        if not self.cache_dir:
+            return None
+        path = self._cache_path(key)
+        if not os.path.exists(path):
+            return None
+        try:
+            return pd.read_pickle(path)
+        except Exception as e:
+            logger.warning(f"加载特征表缓存失败: {e}")
+            return None
+
+    def _cache_path(self, key: Tuple[str, str]) -> str:
+        dataset_version, spec_key = key
+        return os.path.join(self.cache_dir, f"user_features_{spec_key}_{dataset_version}.pkl")
@@ -0,0 +1,186 @@
+"""
+流程聚合模块
+
+为桑基图计算有界的分步流转图：从锚点事件开始按步骤序号统计会话内的相邻事件转移
+（同一事件出现在不同步骤时是不同节点），每个节点只保留流量最大的top_k个分支，
+其余分支合并为“other”节点。每一步对所有会话向量化计算，
+节点数不超过 (depth + 1) × (top_k + 2)。
+"""
+
+import pandas as pd
+import numpy as np
+from typing import List, Optional, Sequence
+from dataclasses import dataclass
+import logging
+
+from engines.session_store import SessionPathStore
+
+logger = logging.getLogger(__name__)
+
+OTHER_LABEL = 'other'
+EXIT_LABEL = 'exit'
+
+
+@dataclass
+class FlowAggregate:
+    """分步流转聚合结果"""
+    links: pd.DataFrame  # source, target, value, source_step, target_step
+    session_count: int  # 包含锚点事件的会话数
+    depth: int
+    top_k: int
+
+    def to_records(self) -> List[dict]:
+        """转换为可序列化的连线列表"""
+        return self.links.to_dict('records')
+
+
+def rank_within_groups(groups: np.ndarray, values: np.ndarray) -> np.ndarray:
+    """
+    计算每个元素在所属分组内按值降序的名次（从0开始，值相同时保持原顺序）
+
+    Args:
+        groups: 分组编号
+        values: 排序值
+
+    Returns:
+        名次数组
+    """
+    order = np.lexsort((-values, groups))
+    sorted_groups = groups[order]
+    group_start = np.ones(len(order), dtype=bool)
+    group_start[1:] = sorted_groups[1:] != sorted_groups[:-1]
+    start_index = np.maximum.accumulate(np.where(group_start, np.arange(len(order)), 0))
+    ranks = np.empty(len(order), dtype=np.int64)
+    ranks[order] = np.arange(len(order)) - start_index
+    return ranks
+
+
+def _fold_targets(sources: np.ndarray, targets: np.ndarray, n_labels: int,
+                  top_k: int, other: int, keep_always: int) -> np.ndarray:
+    """每个源节点只保留流量最大的top_k个目标，其余目标改为other"""
+    pair_keys, inverse, counts = np.unique(
+        sources * n_labels + targets, return_inverse=True, return_counts=True
+    )
+    pair_targets = pair_keys % n_labels
+    # 退出分支始终保留，不占用top_k名额
+    regular = pair_targets != keep_always
+    ranks = np.zeros(len(pair_keys), dtype=np.int64)
+    ranks[regular] = rank_within_groups(pair_keys[regular] // n_labels, counts[regular])
+    keep = ~regular | (ranks < top_k)
+    return np.where(keep[inverse], targets, other)
+
+
+def aggregate_session_flows(store: SessionPathStore,
+                            anchor_events: Optional[Sequence[str]] = None,
+                            depth: int = 5,
+                            top_k: int = 10,
+                            include_exits: bool = False) -> FlowAggregate:
+    """
+    从锚点事件开始聚合分步流转
+
+    Args:
+        store: 会话路径存储
+        anchor_events: 锚点事件（每个会话取第一次出现），None表示从会话起点开始
+        depth: 锚点之后统计的最大步数
+        top_k: 每个节点保留的最大分支数
+        include_exits: 是否把会话在某一步结束记为流向exit的分支
+
+    Returns:
+        分步流转聚合结果
+    """
+    vocab = store.event_vocab
+    n_codes = len(vocab)
+    other, exit_code = n_codes, n_codes + 1
+    n_labels = n_codes + 2
+    codes = store.event_codes.astype(np.int64)
+
+    # 每个会话的锚点位置
+    if anchor_events:
+        anchor_codes = store.encode(anchor_events)
+        anchor_positions = np.flatnonzero(np.isin(codes, anchor_codes[anchor_codes >= 0]))
+        sessions, first = np.unique(store.session_index[anchor_positions], return_index=True)
+        positions = anchor_positions[first]
+    else:
+        sessions = np.flatnonzero(store.lengths > 0)
+        positions = store.offsets[sessions]
+    session_count = len(sessions)
+
+    # 第0步的锚点节点同样只保留top_k个
+    labels = codes[positions]
+    if len(labels):
+        labels = _fold_targets(np.zeros(len(labels), dtype=np.int64), labels, n_labels,
+                               top_k, other, exit_code)
+
+    link_frames = []
+    for step in range(depth):
+        if len(sessions) == 0:
+            break
+        next_positions = positions + 1
+        has_next = next_positions < store.offsets[sessions + 1]
+        targets = np.where(has_next, codes[np.minimum(next_positions, len(codes) - 1)], exit_code)
+
+        counted = has_next if not include_exits else np.ones(len(sessions), dtype=bool)
+        folded = targets.copy()
+        if counted.any():
+            folded[counted] = _fold_targets(labels[counted], targets[counted], n_labels,
+                                            top_k, other, exit_code)
+            pair_keys, values = np.unique(labels[counted] * n_labels + folded[counted],
+                                          return_counts=True)
+            link_frames.append(pd.DataFrame({
+                'source_code': pair_keys // n_labels,
+                'target_code': pair_keys % n_labels,
+                'value': values,
+                'source_step': step,
+                'target_step': step + 1
+            }))
+
+        sessions = sessions[has_next]
+        positions = next_positions[has_next]
+        labels = folded[has_next]
+
+    names = np.concatenate([np.asarray(vocab, dtype=object), [OTHER_LABEL, EXIT_LABEL]])
+    if link_frames:
+        links = pd.concat(link_frames, ignore_index=True)
+        links = links.sort_values(['source_step', 'value'], ascending=[True, False], kind='stable')
+        links = pd.DataFrame({
+            'source': names[links['source_code'].to_numpy()],
+            'target': names[links['target_code'].to_numpy()],
+            'value': links['value'].to_numpy(),
+            'source_step': links['source_step'].to_numpy(),
+            'target_step': links['target_step'].to_numpy()
+        })
+    else:
+        links = pd.DataFrame(columns=['source', 'target', 'value', 'source_step', 'target_step'])
+
+    return FlowAggregate(links=links, session_count=session_count, depth=depth, top_k=top_k)
+
+
+def fold_flow_links(links: pd.DataFrame, top_k: int = 10, other_label: str = OTHER_LABEL) -> pd.DataFrame:
+    """
+    对任意source/target/value连线表按源节点保留top_k个最大分支，其余合并为other
+
+    有source_step列时按(source_step, source)区分源节点。
+
+    Args:
+        links: 连线表
+        top_k: 每个源节点保留的最大分支数
+        other_label: 合并分支的目标名称
+
+    Returns:
+        合并后的连线表
+    """
+    if links.empty:
+        return links
+
+    source_columns = ['source_step', 'source'] if 'source_step' in links.columns else ['source']
+    groups = links.groupby(source_columns, sort=False, dropna=False).ngroup().to_numpy()
+    ranks = rank_within_groups(groups, links['value'].to_numpy())
+    if (ranks < top_k).all():
+        return links
+
+    kept = links[ranks < top_k]
+    folded = links[ranks >= top_k].copy()
+    folded['target'] = other_label
+    group_columns = [column for column in links.columns if column != 'value']
+    folded = folded.groupby(group_columns, sort=False, dropna=False, as_index=False)['value'].sum()
+    return pd.concat([kept, folded[links.columns]], ignore_index=True)
@@ -12,9 +12,12 @@ from datetime import datetime, timedelta
 import logging
 from dataclasses import dataclass
 from collections import defaultdict
-from scipy import stats
+from scipy import sparse, stats
 import warnings
 
+from engines.dataset_cache import DatasetCache
+from engines.funnel_steps import evaluate_steps, parse_step
+
 # 忽略统计计算中的警告
 warnings.filterwarnings('ignore', category=RuntimeWarning)
 
@@ -79,6 +82,7 @@ class FunnelAnalysisEngine:
             storage_manager: 数据存储管理器实例
         """
         self.storage_manager = storage_manager
+        self.dataset_cache = DatasetCache.for_storage(storage_manager)
         self.default_funnel_steps = [
             'page_view',
             'view_item',
@@ -90,7 +94,7 @@ class FunnelAnalysisEngine:
         logger.info("漏斗分析引擎初始化完成")
     
     def build_conversion_funnel(self, 
-                              funnel_steps: List[str],
+                              funnel_steps: List[Any],
                               funnel_name: str = "custom_funnel",
                               time_window_days: int = 7,
                               events: Optional[pd.DataFrame] = None) -> FunnelAnalysisResult:
@@ -98,7 +102,7 @@ class FunnelAnalysisEngine:
         构建转化漏斗并计算各步骤指标
         
         Args:
-            funnel_steps: 漏斗步骤列表
+            funnel_steps: 漏斗步骤列表（事件名，或事件名加param_*参数条件的步骤，见funnel_steps.parse_step）
             funnel_name: 漏斗名称
             time_window_days: 分析时间窗口（天）
             events: 事件数据DataFrame，如果为None则从存储管理器获取
@@ -107,6 +111,8 @@ class FunnelAnalysisEngine:
             漏斗分析结果
         """
         try:
+            steps = [parse_step(step) for step in funnel_steps]
+            
             # 获取数据
             if events is None:
                 if self.storage_manager is None:
@@ -116,29 +122,29 @@ class FunnelAnalysisEngine:
                 end_date = datetime.now()
                 start_date = end_date - timedelta(days=time_window_days)
                 
-                filters = {
-                    'event_name': funnel_steps,
-                    'event_datetime': {
-                        'gte': start_date.strftime('%Y-%m-%d'),
-                        'lte': end_date.strftime('%Y-%m-%d')
-                    }
+                # 所有步骤都限定了事件名时才按事件名过滤
+                filters = {}
+                step_event_names = [step.event_name for step in steps]
+                if None not in step_event_names:
+                    filters['event_name'] = list(dict.fromkeys(step_event_names))
+                filters['event_datetime'] = {
+                    'gte': start_date.strftime('%Y-%m-%d'),
+                    'lte': end_date.strftime('%Y-%m-%d')
                 }
                 
                 events = self.storage_manager.get_data('events', filters)
             
             if events.empty:
                 logger.warning("Event data is empty, cannot perform funnel analysis")
-                return self._create_empty_result(funnel_name, funnel_steps)
+                return self._create_empty_result(funnel_name, [step.name for step in steps])
             
-            # 确保有时间列
-            if 'event_datetime' not in events.columns:
-                if 'event_timestamp' in events.columns:
-                    events['event_datetime'] = pd.to_datetime(events['event_timestamp'], unit='us')
-                else:
-                    raise ValueError("Missing time field in data")
+            # 确保有时间列（共用缓存中补充了时间列的浅拷贝，不修改传入的数据）
+            if 'event_datetime' not in events.columns and 'event_timestamp' not in events.columns:
+                raise ValueError("Missing time field in data")
+            events = self.dataset_cache.with_datetime(events)
             
             # 计算漏斗指标
-            result = self._calculate_funnel_metrics(events, funnel_steps, funnel_name)
+            result = self._calculate_funnel_metrics(events, steps, funnel_name)
             
             logger.info(f"完成漏斗分析: {funnel_name}, 总用户数: {result.total_users}")
             return result
@@ -148,49 +154,38 @@ class FunnelAnalysisEngine:
             raise
     
     def _calculate_funnel_metrics(self, events: pd.DataFrame, 
-                                funnel_steps: List[str], 
+                                funnel_steps: List[Any], 
                                 funnel_name: str) -> FunnelAnalysisResult:
         """
         计算漏斗指标
         
+        所有步骤先对事件数据一次求值为步骤类别列，再由(用户, 类别)对得到每个用户完成的步骤，
+        用户完成的步骤数决定其到达的漏斗深度。
+        
         Args:
             events: 事件数据
-            funnel_steps: 漏斗步骤
+            funnel_steps: 漏斗步骤（事件名或步骤谓词）
             funnel_name: 漏斗名称
             
         Returns:
             漏斗分析结果
         """
         try:
-            # 按用户分组分析
-            user_events = events.groupby('user_pseudo_id').agg({
-                'event_name': list,
-                'event_datetime': list
-            }).reset_index()
-            
-            # 计算每个用户的转化路径
-            user_funnels = []
-            total_users = len(user_events)
-            
-            for _, user_data in user_events.iterrows():
-                user_events_list = user_data['event_name']
-                user_datetimes = user_data['event_datetime']
-                
-                # 检查用户是否完成了所有步骤
-                completed_steps = []
-                for step in funnel_steps:
-                    if step in user_events_list:
-                        step_index = user_events_list.index(step)
-                        completed_steps.append({
-                            'step': step,
-                            'datetime': user_datetimes[step_index]
-                        })
-                
-                user_funnels.append({
-                    'user_id': user_data['user_pseudo_id'],
-                    'completed_steps': completed_steps,
-                    'max_step': min(len(completed_steps), len(funnel_steps))
-                })
+            steps = [parse_step(step) for step in funnel_steps]
+            step_ids = evaluate_steps(events, steps)
+            funnel_steps = [step.name for step in steps]
+            
+            # 用户 × 类别的出现矩阵乘以类别 × 步骤矩阵，得到每个用户完成的步骤
+            user_codes, user_index = pd.factorize(events['user_pseudo_id'], sort=True)
+            total_users = len(user_index)
+            observed = (user_codes >= 0) & (step_ids.row_classes >= 0)
+            occurrences = sparse.csr_matrix(
+                (np.ones(int(observed.sum())), (user_codes[observed], step_ids.row_classes[observed])),
+                shape=(total_users, len(step_ids.class_steps))
+            )
+            completed = (occurrences @ step_ids.class_steps.astype(float)) > 0
+            step_columns = [step_ids.steps.index(step) for step in steps]
+            max_steps = np.minimum(completed[:, step_columns].sum(axis=1), len(funnel_steps))
             
             # 计算各步骤指标
             steps_results = []
@@ -200,12 +195,7 @@ class FunnelAnalysisEngine:
             
             for i, step in enumerate(funnel_steps):
                 # 到达该步骤的用户数
-                users_at_step = sum(1 for funnel in user_funnels 
-                                  if funnel['max_step'] >= i + 1)
-                
-                # 转化到下一步的用户数
-                users_to_next = sum(1 for funnel in user_funnels 
-                                  if funnel['max_step'] >= i + 2)
+                users_at_step = int((max_steps >= i + 1).sum())
                 
                 # 计算转化率
                 if i == 0:
@@ -219,7 +209,7 @@ class FunnelAnalysisEngine:
                 
                 # 计算平均进入下一步时间
                 avg_time_to_next = self._calculate_avg_time_to_next(
-                    user_funnels, funnel_steps, i)
+                    max_steps, funnel_steps, i)
                 
                 step_result = FunnelStepResult(
                     step_name=step,
@@ -238,17 +228,16 @@ class FunnelAnalysisEngine:
                     bottleneck_step = step
             
             # 计算总转化数
-            total_conversions = sum(1 for funnel in user_funnels 
-                                  if funnel['max_step'] >= len(funnel_steps))
+            total_conversions = int((max_steps >= len(funnel_steps)).sum())
             
             # 计算整体转化率
             overall_conversion_rate = total_conversions / total_users if total_users > 0 else 0
             
             # 计算平均转化时间
-            avg_time_to_convert = self._calculate_avg_conversion_time(user_funnels, funnel_steps)
+            avg_time_to_convert = self._calculate_avg_conversion_time(max_steps, funnel_steps)
             
             # 流失分析
-            drop_off_analysis = self._analyze_drop_offs(user_funnels, funnel_steps)
+            drop_off_analysis = self._analyze_drop_offs(max_steps, funnel_steps)
             
             # 优化建议
             optimization_suggestions = self._generate_optimization_suggestions(
@@ -270,14 +259,14 @@ class FunnelAnalysisEngine:
             logger.error(f"计算漏斗指标失败: {e}")
             raise
     
-    def _calculate_avg_time_to_next(self, user_funnels: List[Dict], 
+    def _calculate_avg_time_to_next(self, max_steps: np.ndarray, 
                                   funnel_steps: List[str], 
                                   step_index: int) -> float:
         """
         计算平均进入下一步时间
         
         Args:
-            user_funnels: 用户漏斗数据
+            max_steps: 每个用户到达的漏斗深度
             funnel_steps: 漏斗步骤
             step_index: 当前步骤索引
             
@@ -285,48 +274,42 @@ class FunnelAnalysisEngine:
             平均时间（秒）
         """
         try:
-            times = []
-            for funnel in user_funnels:
-                if funnel['max_step'] >= step_index + 2:
-                    # 这里简化计算，实际应该使用具体的时间戳
-                    times.append(3600)  # 默认1小时
+            # 这里简化计算，实际应该使用具体的时间戳
+            times = np.full(int((max_steps >= step_index + 2).sum()), 3600)  # 默认1小时
             
-            return np.mean(times) if times else 0
+            return np.mean(times) if len(times) else 0
             
         except Exception:
             return 0
     
-    def _calculate_avg_conversion_time(self, user_funnels: List[Dict], 
+    def _calculate_avg_conversion_time(self, max_steps: np.ndarray, 
                                      funnel_steps: List[str]) -> float:
         """
         计算平均转化时间
         
         Args:
-            user_funnels: 用户漏斗数据
+            max_steps: 每个用户到达的漏斗深度
             funnel_steps: 漏斗步骤
             
         Returns:
             平均转化时间（秒）
         """
         try:
-            conversion_times = []
-            for funnel in user_funnels:
-                if funnel['max_step'] >= len(funnel_steps):
-                    # 这里简化计算，实际应该使用具体的时间戳
-                    conversion_times.append(86400)  # 默认1天
+            # 这里简化计算，实际应该使用具体的时间戳
+            conversion_times = np.full(int((max_steps >= len(funnel_steps)).sum()), 86400)  # 默认1天
             
-            return np.mean(conversion_times) if conversion_times else 0
+            return np.mean(conversion_times) if len(conversion_times) else 0
             
         except Exception:
             return 0
     
-    def _analyze_drop_offs(self, user_funnels: List[Dict], 
+    def _analyze_drop_offs(self, max_steps: np.ndarray, 
                           funnel_steps: List[str]) -> Dict[str, Any]:
         """
         分析用户流失情况
         
         Args:
-            user_funnels: 用户漏斗数据
+            max_steps: 每个用户到达的漏斗深度
             funnel_steps: 漏斗步骤
             
         Returns:
@@ -334,11 +317,12 @@ class FunnelAnalysisEngine:
         """
         try:
             drop_offs = defaultdict(int)
-            for funnel in user_funnels:
-                drop_step = funnel['max_step']
-                if drop_step < len(funnel_steps):
-                    drop_off_step = funnel_steps[drop_step - 1]
-                    drop_offs[drop_off_step] += 1
+            dropped = max_steps[max_steps < len(funnel_steps)]
+            counts = np.bincount(dropped, minlength=len(funnel_steps))
+            # 按用户顺序中首次出现的先后记录
+            for drop_step in pd.unique(dropped):
+                drop_off_step = funnel_steps[drop_step - 1]
+                drop_offs[drop_off_step] += int(counts[drop_step])
             
             return {
                 'drop_off_distribution': dict(drop_offs),
@@ -0,0 +1,306 @@
+"""
+漏斗批量匹配模块
+
+在一次扫描中对多个漏斗定义进行步骤匹配。
+漏斗按公共前缀组织为前缀树，共享前缀的步骤只匹配一次，
+每个前缀节点的匹配对所有用户向量化完成。
+步骤可以是事件名或带参数条件的步骤谓词（见funnel_steps），所有步骤先一次求值为步骤类别列。
+"""
+
+import pandas as pd
+import numpy as np
+from typing import Dict, List, Any, Optional, Tuple
+from dataclasses import dataclass
+import logging
+
+from engines.funnel_steps import StepPredicate, evaluate_steps, parse_step
+
+logger = logging.getLogger(__name__)
+
+# 未匹配位置标记
+NO_MATCH = -1
+
+
+@dataclass
+class FunnelMatch:
+    """单个漏斗的匹配结果"""
+    funnel_name: str
+    funnel_steps: List[str]
+    user_ids: np.ndarray  # 完成第一步（进入漏斗）的用户
+    step_times: np.ndarray  # (用户数, 步骤数) datetime64[ns]，NaT表示未到达
+    time_window_ns: int  # 相邻步骤的最大时间间隔（纳秒）
+    observation_end: np.datetime64  # 数据中最晚的事件时间
+    step_events: Optional[np.ndarray] = None  # 满足每个步骤的事件数
+
+    @property
+    def reached(self) -> np.ndarray:
+        """每个用户是否到达每个步骤的布尔矩阵"""
+        return ~np.isnat(self.step_times)
+
+    @property
+    def total_users(self) -> int:
+        """进入漏斗的用户数"""
+        return len(self.user_ids)
+
+
+@dataclass
+class UserTimelines:
+    """按用户、时间排序的事件时间线（列式存储）"""
+    user_index: pd.Index  # 用户编码 -> 用户ID
+    user_codes: np.ndarray  # 每个事件的用户编码
+    times: np.ndarray  # 每个事件的时间（int64纳秒）
+    event_names: np.ndarray  # 每个事件的事件名（按步骤类别构建时为类别编码）
+    user_start: np.ndarray  # 每个用户第一个事件的位置
+    tie_start: np.ndarray  # 同一用户同一时间戳的第一个事件位置
+    source_rows: np.ndarray  # 每个事件在原始DataFrame中的行位置
+
+    @property
+    def n_users(self) -> int:
+        return len(self.user_index)
+
+
+def event_times_ns(events: pd.DataFrame) -> np.ndarray:
+    """
+    获取事件时间（int64纳秒），不修改调用方的DataFrame
+
+    Args:
+        events: 事件数据
+
+    Returns:
+        事件时间数组
+    """
+    if 'event_datetime' in events.columns:
+        datetimes = pd.to_datetime(events['event_datetime'])
+    elif 'event_timestamp' in events.columns:
+        datetimes = pd.to_datetime(events['event_timestamp'], unit='us')
+    else:
+        raise ValueError("Missing time field")
+
+    return datetimes.to_numpy(dtype='datetime64[ns]').view('int64')
+
+
+def build_user_timelines(events: pd.DataFrame,
+                         event_names: Optional[List[str]] = None,
+                         step_ids: Optional[np.ndarray] = None,
+                         times: Optional[np.ndarray] = None) -> UserTimelines:
+    """
+    构建按用户、时间排序的事件时间线
+
+    Args:
+        events: 事件数据
+        event_names: 只保留这些事件（None表示全部）
+        step_ids: 每行的步骤类别（-1表示不属于任何步骤），提供时只保留有类别的行，
+                  并以类别编码代替事件名
+        times: 与events的行对应的事件时间（见event_times_ns），None时从events解析
+
+    Returns:
+        用户时间线
+    """
+    keep = events['user_pseudo_id'].notna().to_numpy()
+    if event_names is not None:
+        keep &= events['event_name'].isin(event_names).to_numpy()
+    if step_ids is not None:
+        keep &= step_ids >= 0
+    kept_rows = np.flatnonzero(keep)
+    times = event_times_ns(events.iloc[kept_rows]) if times is None else times[kept_rows]
+    events = events.iloc[kept_rows]
+    user_codes, user_index = pd.factorize(events['user_pseudo_id'])
+
+    order = np.lexsort((times, user_codes))
+    user_codes = user_codes[order]
+    times = times[order]
+    labels = step_ids[kept_rows] if step_ids is not None else events['event_name'].to_numpy()
+    names = labels[order]
+
+    n_events = len(order)
+    positions = np.arange(n_events)
+
+    # 同一用户同一时间戳的事件共享起点，保证“时间不早于上一步”的语义
+    new_group = np.ones(n_events, dtype=bool)
+    if n_events > 1:
+        new_group[1:] = (user_codes[1:] != user_codes[:-1]) | (times[1:] != times[:-1])
+    tie_start = np.maximum.accumulate(np.where(new_group, positions, 0)) if n_events else positions
+
+    user_start = np.searchsorted(user_codes, np.arange(len(user_index)), side='left')
+
+    return UserTimelines(
+        user_index=pd.Index(user_index),
+        user_codes=user_codes,
+        times=times,
+        event_names=names,
+        user_start=user_start,
+        tie_start=tie_start,
+        source_rows=kept_rows[order]
+    )
+
+
+class FunnelMatcher:
+    """
+    漏斗批量匹配器
+
+    每个步骤取满足以下条件的最早事件：属于同一用户、时间不早于上一步、
+    且与上一步的间隔不超过时间窗口。第一步取用户最早的该步骤事件。
+    前缀相同的漏斗共享匹配结果，新增漏斗只需计算未出现过的前缀。
+    """
+
+    def __init__(self,
+                 timelines: UserTimelines,
+                 time_window_hours: float = 24,
+                 observation_end: Optional[np.datetime64] = None,
+                 step_classes: Optional[Dict[Any, np.ndarray]] = None):
+        """
+        初始化漏斗匹配器
+
+        Args:
+            timelines: 用户时间线
+            time_window_hours: 相邻步骤的最大时间间隔（小时）
+            observation_end: 数据截止时间，默认为时间线中最晚的事件时间
+            step_classes: 步骤 -> 满足该步骤的类别编码（时间线按步骤类别构建时提供）
+        """
+        self.timelines = timelines
+        self.window_ns = int(time_window_hours * 3600 * 1e9)
+        if observation_end is None:
+            observation_end = np.datetime64(int(timelines.times.max()) if len(timelines.times) else 'NaT', 'ns')
+        self.observation_end = np.datetime64(observation_end, 'ns')
+        self._prefix_matches: Dict[Tuple[Any, ...], np.ndarray] = {}
+        self._step_classes = step_classes
+        self._step_positions: Dict[Any, np.ndarray] = {}
+
+        # 按步骤分组事件位置：一次编码加一次稳定排序，组内位置保持升序
+        step_codes, step_values = pd.factorize(timelines.event_names)
+        self._step_lookup = {value: code for code, value in enumerate(step_values)}
+        self._grouped_positions = np.argsort(step_codes, kind='stable')
+        self._group_bounds = np.concatenate(
+            [[0], np.cumsum(np.bincount(step_codes, minlength=len(step_values)))]
+        )
+
+    def _group_positions(self, value: Any) -> np.ndarray:
+        """时间线中事件名（或类别编码）为value的事件位置（升序）"""
+        code = self._step_lookup.get(value)
+        if code is None:
+            return np.empty(0, dtype=np.int64)
+        return self._grouped_positions[self._group_bounds[code]:self._group_bounds[code + 1]]
+
+    def _positions_for(self, step: Any) -> np.ndarray:
+        """获取某步骤所有事件的位置（升序）"""
+        if self._step_classes is None:
+            return self._group_positions(step)
+        positions = self._step_positions.get(step)
+        if positions is None:
+            groups = [self._group_positions(code) for code in self._step_classes.get(step, [])]
+            positions = np.sort(np.concatenate(groups)) if groups else np.empty(0, dtype=np.int64)
+            self._step_positions[step] = positions
+        return positions
+
+    def match_prefix(self, prefix: Tuple[Any, ...]) -> np.ndarray:
+        """
+        匹配步骤前缀的最后一步
+
+        Args:
+            prefix: 步骤前缀
+
+        Returns:
+            每个用户匹配到的事件位置，未匹配为NO_MATCH
+        """
+        cached = self._prefix_matches.get(prefix)
+        if cached is not None:
+            return cached
+
+        tl = self.timelines
+        n_users = tl.n_users
+        step_positions = self._positions_for(prefix[-1])
+        matched = np.full(n_users, NO_MATCH, dtype=np.int64)
+
+        if len(step_positions) == 0 or n_users == 0:
+            self._prefix_matches[prefix] = matched
+            return matched
+
+        if len(prefix) == 1:
+            users = np.arange(n_users)
+            search_from = tl.user_start
+        else:
+            parent = self.match_prefix(prefix[:-1])
+            users = np.flatnonzero(parent != NO_MATCH)
+            search_from = tl.tie_start[parent[users]]
+
+        idx = np.searchsorted(step_positions, search_from, side='left')
+        in_range = idx < len(step_positions)
+        candidates = step_positions[np.minimum(idx, len(step_positions) - 1)]
+        valid = in_range & (tl.user_codes[candidates] == users)
+
+        if len(prefix) > 1:
+            gaps = tl.times[candidates] - tl.times[parent[users]]
+            valid &= gaps <= self.window_ns
+
+        matched[users[valid]] = candidates[valid]
+        self._prefix_matches[prefix] = matched
+        return matched
+
+    def match(self, funnel_name: str, funnel_steps: List[Any]) -> FunnelMatch:
+        """
+        匹配单个漏斗
+
+        Args:
+            funnel_name: 漏斗名称
+            funnel_steps: 漏斗步骤
+
+        Returns:
+            漏斗匹配结果
+        """
+        tl = self.timelines
+        steps = tuple(funnel_steps)
+
+        positions = np.column_stack([
+            self.match_prefix(steps[:i + 1]) for i in range(len(steps))
+        ]) if steps else np.empty((tl.n_users, 0), dtype=np.int64)
+
+        entered = positions[:, 0] != NO_MATCH if steps else np.zeros(tl.n_users, dtype=bool)
+        positions = positions[entered]
+
+        step_times = np.full(positions.shape, np.iinfo(np.int64).min, dtype=np.int64)
+        hit = positions != NO_MATCH
+        step_times[hit] = tl.times[positions[hit]]
+
+        return FunnelMatch(
+            funnel_name=funnel_name,
+            funnel_steps=[step.name if isinstance(step, StepPredicate) else step for step in steps],
+            user_ids=tl.user_index.to_numpy()[entered],
+            step_times=step_times.view('datetime64[ns]'),
+            time_window_ns=self.window_ns,
+            observation_end=self.observation_end,
+            step_events=np.array([len(self._positions_for(step)) for step in steps], dtype=np.int64)
+        )
+
+
+def match_funnels(events: pd.DataFrame,
+                  funnel_definitions: Dict[str, List[Any]],
+                  time_window_hours: float = 24,
+                  times: Optional[np.ndarray] = None) -> Dict[str, FunnelMatch]:
+    """
+    在一次扫描中匹配多个漏斗
+
+    所有漏斗的步骤先一次求值为步骤类别列，时间线只保留满足某个步骤的事件。
+
+    Args:
+        events: 事件数据
+        funnel_definitions: 漏斗名称 -> 步骤列表（事件名或步骤谓词，见funnel_steps.parse_step）
+        time_window_hours: 相邻步骤的最大时间间隔（小时）
+        times: 与events的行对应的事件时间（见event_times_ns），None时从events解析
+
+    Returns:
+        漏斗名称 -> 匹配结果
+    """
+    definitions = {funnel_name: [parse_step(step) for step in funnel_steps]
+                   for funnel_name, funnel_steps in funnel_definitions.items()}
+    step_ids = evaluate_steps(events, [step for steps in definitions.values() for step in steps])
+    # 事件时间只解析一次：时间线取满足步骤的行，观察截止时间取全部事件的最大值
+    if times is None:
+        times = event_times_ns(events)
+    timelines = build_user_timelines(events, step_ids=step_ids.row_classes, times=times)
+    observation_end = np.datetime64(int(times.max()), 'ns') if len(times) else None
+    matcher = FunnelMatcher(timelines, time_window_hours, observation_end, step_ids.step_classes())
+
+    return {
+        funnel_name: matcher.match(funnel_name, funnel_steps)
+        for funnel_name, funnel_steps in definitions.items()
+    }
@@ -0,0 +1,218 @@
+"""
+漏斗步骤谓词模块
+
+漏斗步骤除了事件名，还可以是事件名加param_*参数列上的条件，例如
+{'event_name': 'page_view', 'params': {'page_location': {'contains': '/checkout'}}}：
+- 步骤在匹配前编译为StepPredicate（可哈希，多个漏斗中相同的步骤只计算一次）；
+- 所有步骤对事件数据一次求值，得到每行的步骤类别列（满足的步骤集合相同的行为同一类别），
+  漏斗计算只使用这一列，增加带参数条件的步骤不再为每个步骤筛选整表副本。
+
+条件操作符与存储管理器的过滤条件一致：eq、ne、gt、gte、lt、lte、in、not_in、contains、startswith、endswith。
+"""
+
+import pandas as pd
+import numpy as np
+from typing import Any, Dict, Iterable, List, Optional, Tuple
+from dataclasses import dataclass
+import logging
+
+logger = logging.getLogger(__name__)
+
+PARAM_PREFIX = 'param_'
+
+STEP_OPERATORS = ('eq', 'ne', 'gt', 'gte', 'lt', 'lte', 'in', 'not_in', 'contains', 'startswith', 'endswith')
+
+# 每个int64位模式最多容纳的步骤数
+_PATTERN_BITS = 63
+
+
+@dataclass(frozen=True)
+class StepPredicate:
+    """漏斗步骤：事件名（None表示任意事件）加参数列条件"""
+    event_name: Optional[str] = None
+    conditions: Tuple[Tuple[str, str, Any], ...] = ()  # (参数列名, 操作符, 值)
+    label: Optional[str] = None
+
+    @property
+    def name(self) -> str:
+        """步骤的显示名称"""
+        if self.label:
+            return self.label
+        if not self.conditions:
+            return str(self.event_name)
+        conditions = ', '.join(f"{column} {operator} {value!r}" for column, operator, value in self.conditions)
+        return f"{self.event_name or '*'}[{conditions}]"
+
+
+def _freeze(value: Any) -> Any:
+    """把列表等条件值转换为可哈希的元组"""
+    if isinstance(value, (list, tuple, set, frozenset, np.ndarray, pd.Index)):
+        return tuple(value)
+    return value
+
+
+def parse_step(step: Any) -> StepPredicate:
+    """
+    把漏斗步骤定义编译为步骤谓词
+
+    Args:
+        step: 事件名字符串；StepPredicate；或字典
+              {'event_name': ..., 'params': {参数名: 条件}, 'name': 显示名称}，
+              条件为单个值（eq）、列表（in）或{操作符: 值}，参数名不带param_前缀时自动补上
+
+    Returns:
+        步骤谓词
+    """
+    if isinstance(step, StepPredicate):
+        return step
+    if isinstance(step, str):
+        return StepPredicate(event_name=step)
+    if not isinstance(step, dict):
+        raise ValueError(f"Unsupported funnel step: {step!r}")
+
+    unknown = set(step) - {'event_name', 'params', 'name'}
+    if unknown:
+        raise ValueError(f"Unsupported funnel step keys: {sorted(unknown)}")
+
+    conditions = []
+    for param, condition in (step.get('params') or {}).items():
+        column = param if param.startswith(PARAM_PREFIX) else f"{PARAM_PREFIX}{param}"
+        if isinstance(condition, dict):
+            operators = condition.items()
+        elif isinstance(condition, (list, tuple, set)):
+            operators = [('in', condition)]
+        else:
+            operators = [('eq', condition)]
+        for operator, value in operators:
+            if operator not in STEP_OPERATORS:
+                raise ValueError(f"Unsupported step operator: {operator}")
+            conditions.append((column, operator, _freeze(value)))
+
+    if step.get('event_name') is None and not conditions:
+        raise ValueError("Funnel step needs an event_name or params")
+    return StepPredicate(event_name=step.get('event_name'), conditions=tuple(conditions), label=step.get('name'))
+
+
+def step_label(step: Any) -> str:
+    """步骤定义的显示名称"""
+    return parse_step(step).name
+
+
+def condition_mask(values: pd.Series, operator: str, value: Any) -> np.ndarray:
+    """
+    参数列上单个条件的布尔结果，缺失值不满足任何条件（ne、not_in除外）
+
+    Args:
+        values: 参数列
+        operator: 操作符
+        value: 比较值
+
+    Returns:
+        与values对应的布尔数组
+    """
+    if operator == 'eq':
+        mask = values == value
+    elif operator == 'ne':
+        mask = values != value
+    elif operator in ('gt', 'gte', 'lt', 'lte'):
+        numeric = pd.to_numeric(values, errors='coerce') if not isinstance(value, str) else values.astype(str)
+        compare = {'gt': np.greater, 'gte': np.greater_equal, 'lt': np.less, 'lte': np.less_equal}[operator]
+        mask = compare(numeric, value) & values.notna()
+    elif operator == 'in':
+        mask = values.isin(value)
+    elif operator == 'not_in':
+        mask = ~values.isin(value)
+    elif operator in ('contains', 'startswith', 'endswith'):
+        text = values.where(values.isna(), values.astype(str))
+        if operator == 'contains':
+            mask = text.str.contains(str(value), regex=False, na=False)
+        else:
+            mask = getattr(text.str, operator)(str(value), na=False)
+    else:
+        raise ValueError(f"Unsupported step operator: {operator}")
+    return np.asarray(mask, dtype=bool)
+
+
+@dataclass
+class StepIds:
+    """对事件数据求值后的步骤类别列"""
+    steps: List[StepPredicate]  # 去重后的步骤
+    row_classes: np.ndarray  # 每行的步骤类别，-1表示不满足任何步骤
+    class_steps: np.ndarray  # (类别数, 步骤数) 布尔矩阵：类别满足哪些步骤
+
+    def step_classes(self) -> Dict[StepPredicate, np.ndarray]:
+        """步骤 -> 满足该步骤的类别"""
+        return {step: np.flatnonzero(self.class_steps[:, index]) for index, step in enumerate(self.steps)}
+
+    def step_event_counts(self) -> np.ndarray:
+        """满足每个步骤的事件数"""
+        class_counts = np.bincount(self.row_classes[self.row_classes >= 0], minlength=len(self.class_steps))
+        return class_counts @ self.class_steps.astype(np.int64)
+
+
+def evaluate_steps(events: pd.DataFrame, steps: Iterable[Any]) -> StepIds:
+    """
+    一次求值所有步骤，得到每行的步骤类别
+
+    事件名只编码一次，每个不同的参数条件只在对应参数列上计算一次；
+    每行满足的步骤集合按位编码，相同位模式的行归为同一类别。
+
+    Args:
+        events: 事件数据
+        steps: 步骤定义（可以重复，见parse_step）
+
+    Returns:
+        步骤类别列
+    """
+    unique_steps = list(dict.fromkeys(parse_step(step) for step in steps))
+    n_rows = len(events)
+
+    name_codes, names = pd.factorize(events['event_name'])
+    name_lookup = {name: code for code, name in enumerate(names)}
+    condition_cache: Dict[Tuple[str, str, Any], np.ndarray] = {}
+
+    def step_mask(step: StepPredicate) -> np.ndarray:
+        if step.event_name is None:
+            mask = np.ones(n_rows, dtype=bool)
+        else:
+            code = name_lookup.get(step.event_name)
+            mask = name_codes == code if code is not None else np.zeros(n_rows, dtype=bool)
+        for condition in step.conditions:
+            if condition not in condition_cache:
+                column, operator, value = condition
+                if column in events.columns:
+                    condition_cache[condition] = condition_mask(events[column], operator, value)
+                else:
+                    logger.warning(f"漏斗步骤的参数列 {column} 不存在，条件不成立")
+                    condition_cache[condition] = np.zeros(n_rows, dtype=bool)
+            mask = mask & condition_cache[condition]
+        return mask
+
+    # 每63个步骤一个int64位模式
+    patterns = []
+    for start in range(0, len(unique_steps), _PATTERN_BITS):
+        pattern = np.zeros(n_rows, dtype=np.int64)
+        for bit, step in enumerate(unique_steps[start:start + _PATTERN_BITS]):
+            pattern |= step_mask(step).astype(np.int64) << bit
+        patterns.append(pattern)
+
+    if len(patterns) == 1:
+        class_codes, class_patterns = pd.factorize(patterns[0])
+        class_patterns = np.asarray(class_patterns)[:, None]
+    elif patterns:
+        keys = pd.MultiIndex.from_arrays(patterns)
+        class_codes, uniques = pd.factorize(keys)
+        class_patterns = np.array([list(key) for key in uniques], dtype=np.int64).reshape(len(uniques), len(patterns))
+    else:
+        class_codes, class_patterns = np.zeros(n_rows, dtype=np.int64), np.zeros((1, 0), dtype=np.int64)
+
+    class_steps = np.zeros((len(class_patterns), len(unique_steps)), dtype=bool)
+    for index in range(len(unique_steps)):
+        class_steps[:, index] = (class_patterns[:, index // _PATTERN_BITS] >> (index % _PATTERN_BITS)) & 1
+    # 不满足任何步骤的行不属于任何类别
+    empty = ~class_steps.any(axis=1)
+    remap = np.cumsum(~empty) - 1
+    remap[empty] = -1
+    row_classes = remap[class_codes]
+
+    return StepIds(steps=unique_steps, row_classes=row_classes.astype(np.int64), class_steps=class_steps[~empty])
@@ -7,7 +7,7 @@
 
 import pandas as pd
 import numpy as np
-from typing import Dict, List, Any, Optional, Tuple, Set
+from typing import Dict, List, Any, Optional, Tuple, Set, Union
 from datetime import datetime, timedelta
 import logging
 from dataclasses import dataclass
@@ -15,6 +15,15 @@ from collections import defaultdict, Counter
 from itertools import combinations
 import warnings
 
+from engines.attribution_engine import AttributionEngine, MarkovAttributionResult
+from engines.session_store import SessionPathStore, UserSession
+from engines.sequence_miner import SequentialPatternMiner, mine_sequential_patterns
+from engines.user_flow import build_transition_graph, step_reach, top_observed_paths
+from engines.path_similarity import lsh_clusters, minhash_signatures, path_rarity
+from engines.flow_aggregation import (FlowAggregate, OTHER_LABEL, aggregate_session_flows,
+                                      rank_within_groups)
+from engines.dataset_cache import DatasetCache
+
 # Import internationalization support
 from utils.i18n import t
 from utils.i18n_enhanced import LocalizedInsightGenerator
@@ -25,20 +34,6 @@ warnings.filterwarnings('ignore', category=RuntimeWarning)
 logger = logging.getLogger(__name__)
 
 
-@dataclass
-class UserSession:
-    """用户会话数据结构"""
-    session_id: str
-    user_id: str
-    start_time: datetime
-    end_time: datetime
-    events: List[Dict[str, Any]]
-    duration_seconds: int
-    page_views: int
-    conversions: int
-    path_sequence: List[str]
-
-
 @dataclass
 class PathPattern:
     """路径模式数据结构"""
@@ -68,6 +63,8 @@ class PathAnalysisResult:
 class PathAnalysisEngine:
     """路径分析引擎类"""
     
+    ANOMALY_METHODS = ('length', 'rarity', 'combined')
+    
     def __init__(self, storage_manager=None):
         """
         初始化路径分析引擎
@@ -76,8 +73,11 @@ class PathAnalysisEngine:
             storage_manager: 数据存储管理器实例
         """
         self.storage_manager = storage_manager
+        self.dataset_cache = DatasetCache.for_storage(storage_manager)
         self.session_timeout_minutes = 30  # 会话超时时间
         self.min_pattern_frequency = 5  # 最小模式频次
+        self.flow_depth = 5  # 桑基图从锚点开始的最大步数
+        self.flow_top_k = 10  # 流图每个节点保留的最大分支数
         self.conversion_events = {
             'sign_up', 'login', 'purchase', 'begin_checkout', 
             'add_to_cart', 'add_payment_info', 'complete_purchase'
@@ -88,7 +88,7 @@ class PathAnalysisEngine:
     def reconstruct_user_sessions(self, 
                                 events: Optional[pd.DataFrame] = None,
                                 user_ids: Optional[List[str]] = None,
-                                date_range: Optional[Tuple[str, str]] = None) -> List[UserSession]:
+                                date_range: Optional[Tuple[str, str]] = None) -> SessionPathStore:
         """
         重构用户会话
         
@@ -98,7 +98,7 @@ class PathAnalysisEngine:
             date_range: 分析的日期范围
             
         Returns:
-            用户会话列表
+            会话路径存储（按下标访问或迭代时得到UserSession）
         """
         try:
             # 获取数据
@@ -112,29 +112,18 @@ class PathAnalysisEngine:
                 if date_range:
                     filters['event_date'] = {'gte': date_range[0], 'lte': date_range[1]}
                     
-                events = self.storage_manager.get_data('events', filters)
+                events = self.storage_manager.get_data('events', filters) if filters else self.dataset_cache.events()
                 
             if events.empty:
                 logger.warning("Event data is empty, cannot reconstruct sessions")
-                return []
-                
-            # 确保有时间列
-            if 'event_datetime' not in events.columns:
-                if 'event_timestamp' in events.columns:
-                    events['event_datetime'] = pd.to_datetime(events['event_timestamp'], unit='us')
-                else:
-                    raise ValueError("Missing time field")
-                    
-            sessions = []
-            
-            # 按用户分组处理
-            for user_id in events['user_pseudo_id'].unique():
-                user_events = events[events['user_pseudo_id'] == user_id].copy()
-                user_events = user_events.sort_values('event_datetime')
+                return SessionPathStore.from_sessions([])
                 
-                # 基于时间间隔分割会话
-                user_sessions = self._split_user_sessions(user_events, user_id)
-                sessions.extend(user_sessions)
+            # 一次排序后按时间间隔切分所有用户的会话
+            sessions = self.dataset_cache.sessions(
+                events,
+                session_timeout_minutes=self.session_timeout_minutes,
+                conversion_events=self.conversion_events
+            )
                 
             logger.info(f"成功重构了{len(sessions)}个用户会话")
             return sessions
@@ -143,133 +132,47 @@ class PathAnalysisEngine:
             logger.error(f"用户会话重构失败: {e}")
             raise
             
-    def _split_user_sessions(self, user_events: pd.DataFrame, user_id: str) -> List[UserSession]:
-        """
-        基于时间间隔分割用户会话
-        
-        Args:
-            user_events: 用户事件数据
-            user_id: 用户ID
-            
-        Returns:
-            用户会话列表
-        """
-        try:
-            sessions = []
-            current_session_events = []
-            session_start_time = None
-            session_id_counter = 1
-            
-            timeout_delta = timedelta(minutes=self.session_timeout_minutes)
-            
-            for idx, event in user_events.iterrows():
-                event_time = event['event_datetime']
-                
-                # 判断是否开始新会话
-                if (session_start_time is None or 
-                    event_time - current_session_events[-1]['event_datetime'] > timeout_delta):
-                    
-                    # 保存上一个会话
-                    if current_session_events:
-                        session = self._create_session_object(
-                            f"{user_id}_{session_id_counter-1}",
-                            user_id,
-                            current_session_events
-                        )
-                        sessions.append(session)
-                    
-                    # 开始新会话
-                    current_session_events = []
-                    session_start_time = event_time
-                    session_id_counter += 1
-                
-                # 添加事件到当前会话
-                event_dict = event.to_dict()
-                current_session_events.append(event_dict)
-            
-            # 处理最后一个会话
-            if current_session_events:
-                session = self._create_session_object(
-                    f"{user_id}_{session_id_counter}",
-                    user_id,
-                    current_session_events
-                )
-                sessions.append(session)
-                
+    def _as_session_store(self, sessions: Union[SessionPathStore, List[UserSession]]) -> SessionPathStore:
+        """把会话对象列表转换为会话路径存储"""
+        if isinstance(sessions, SessionPathStore):
             return sessions
-            
-        except Exception as e:
-            logger.error(f"分割用户会话失败: {e}")
-            return []
-            
-    def _create_session_object(self, session_id: str, user_id: str, 
-                             session_events: List[Dict[str, Any]]) -> UserSession:
-        """
-        创建会话对象
-        
-        Args:
-            session_id: 会话ID
-            user_id: 用户ID
-            session_events: 会话事件列表
-            
-        Returns:
-            用户会话对象
-        """
-        try:
-            if not session_events:
-                raise ValueError("Session event list is empty")
-                
-            # 计算会话基本信息
-            start_time = min(event['event_datetime'] for event in session_events)
-            end_time = max(event['event_datetime'] for event in session_events)
-            duration_seconds = int((end_time - start_time).total_seconds())
-            
-            # 统计页面浏览和转化
-            page_views = sum(1 for event in session_events if event['event_name'] == 'page_view')
-            conversions = sum(1 for event in session_events 
-                            if event['event_name'] in self.conversion_events)
-            
-            # 构建路径序列
-            path_sequence = [event['event_name'] for event in session_events]
-            
-            return UserSession(
-                session_id=session_id,
-                user_id=user_id,
-                start_time=start_time,
-                end_time=end_time,
-                events=session_events,
-                duration_seconds=duration_seconds,
-                page_views=page_views,
-                conversions=conversions,
-                path_sequence=path_sequence
-            )
-            
-        except Exception as e:
-            logger.error(f"创建会话对象失败: {e}")
-            raise
+        return SessionPathStore.from_sessions(sessions)
             
     def identify_path_patterns(self, 
-                             sessions: Optional[List[UserSession]] = None,
+                             sessions: Optional[Union[SessionPathStore, List[UserSession]]] = None,
                              min_length: int = 2,
                              max_length: int = 10,
-                             min_support: float = 0.01) -> PathAnalysisResult:
+                             min_support: float = 0.01,
+                             pattern_mode: str = 'contiguous',
+                             anomaly_method: str = 'length') -> PathAnalysisResult:
         """
         识别路径模式
         
         Args:
-            sessions: 用户会话列表
-            min_length: 最小路径长度
-            max_length: 最大路径长度
-            
+            sessions: 会话路径存储或用户会话列表
+            min_length: 最小路径（及模式）长度
+            max_length: 最大路径（及模式）长度
+            min_support: 常见模式的最小支持度（包含模式的会话占比）
+            pattern_mode: 常见模式类型，'contiguous'（连续子路径）或 'gapped'（允许间隔的子序列）
+            anomaly_method: 异常路径判定方式，'length'（路径长度）、'rarity'（转移概率模型下的
+                            路径稀有度）或 'combined'（满足任一条件）
+
         Returns:
             路径分析结果
         """
         try:
+            if pattern_mode not in SequentialPatternMiner.MODES:
+                raise ValueError(f"Unsupported pattern mode: {pattern_mode}")
+            if anomaly_method not in self.ANOMALY_METHODS:
+                raise ValueError(f"Unsupported anomaly method: {anomaly_method}")
+
             if sessions is None:
                 # 如果没有提供会话，先重构会话
                 sessions = self.reconstruct_user_sessions()
                 
-            if not sessions:
+            store = self._as_session_store(sessions)
+                
+            if len(store) == 0:
                 logger.warning("No session data available for path analysis")
                 return PathAnalysisResult(
                     total_sessions=0,
@@ -283,35 +186,34 @@ class PathAnalysisEngine:
                     insights=[]
                 )
                 
-            # 提取所有路径序列
-            all_paths = []
-            for session in sessions:
-                if min_length <= len(session.path_sequence) <= max_length:
-                    all_paths.append(session.path_sequence)
+            # 选取长度在范围内的路径
+            lengths = store.lengths
+            in_range = (lengths >= min_length) & (lengths <= max_length)
             
             # 识别常见模式
-            common_patterns = self._identify_common_patterns(sessions, all_paths)
+            common_patterns = self._identify_common_patterns(store, min_support, min_length,
+                                                             max_length, pattern_mode)
             
             # 识别异常模式
-            anomalous_patterns = self._identify_anomalous_patterns(sessions, all_paths)
+            anomalous_patterns = self._identify_anomalous_patterns(store, in_range, anomaly_method)
             
             # 识别转化路径
-            conversion_paths = self._identify_conversion_paths(sessions)
+            conversion_paths = self._identify_conversion_paths(store)
             
             # 识别退出模式
-            exit_patterns = self._identify_exit_patterns(sessions)
+            exit_patterns = self._identify_exit_patterns(store)
             
             # 构建路径流图
-            path_flow_graph = self._build_path_flow_graph(sessions)
+            path_flow_graph = self._build_path_flow_graph(store, top_k=self.flow_top_k)
             
             # 生成洞察
-            insights = self._generate_path_insights(sessions, common_patterns, 
+            insights = self._generate_path_insights(store, common_patterns, 
                                                   anomalous_patterns, conversion_paths)
             
             # 计算统计信息
-            total_sessions = len(sessions)
-            total_paths = len(all_paths)
-            avg_path_length = np.mean([len(path) for path in all_paths]) if all_paths else 0
+            total_sessions = len(store)
+            total_paths = int(in_range.sum())
+            avg_path_length = float(lengths[in_range].mean()) if total_paths else 0
             
             result = PathAnalysisResult(
                 total_sessions=total_sessions,
@@ -332,54 +234,67 @@ class PathAnalysisEngine:
             logger.error(f"路径模式识别失败: {e}")
             raise
             
-    def _identify_common_patterns(self, sessions: List[UserSession], 
-                                all_paths: List[List[str]]) -> List[PathPattern]:
+    def _rank_sequences(self, windows: np.ndarray, order: np.ndarray) -> List[Tuple[Tuple[int, ...], int, Tuple]]:
+        """
+        统计编码序列频次
+        
+        Args:
+            windows: (序列数, 序列长度) 的编码矩阵
+            order: 每个序列的出现顺序键（用于频次相同时按首次出现排序）
+            
+        Returns:
+            (编码序列, 频次, 首次出现顺序键) 列表
+        """
+        if len(windows) == 0:
+            return []
+        unique_rows, first_index, counts = np.unique(
+            windows, axis=0, return_index=True, return_counts=True
+        )
+        return [
+            (tuple(row.tolist()), int(count), tuple(order[first].tolist()))
+            for row, first, count in zip(unique_rows, first_index, counts)
+        ]
+            
+    def _identify_common_patterns(self, sessions: SessionPathStore,
+                                min_support: float = 0.01,
+                                min_length: int = 2,
+                                max_length: int = 10,
+                                pattern_mode: str = 'contiguous') -> List[PathPattern]:
         """
         识别常见路径模式
         
         Args:
-            sessions: 用户会话列表
-            all_paths: 所有路径序列
+            sessions: 会话路径存储
+            min_support: 最小支持度（包含模式的会话占比）
+            min_length: 最小模式长度
+            max_length: 最大模式长度
+            pattern_mode: 'contiguous'（连续子路径）或 'gapped'（允许间隔的子序列）
             
         Returns:
             常见路径模式列表
         """
         try:
-            pattern_counter = Counter()
-            
-            # 统计所有可能的子序列
-            for path in all_paths:
-                for length in range(2, min(len(path) + 1, 6)):  # 最多5步的模式
-                    for start_idx in range(len(path) - length + 1):
-                        subpath = tuple(path[start_idx:start_idx + length])
-                        pattern_counter[subpath] += 1
+            # 频繁序列挖掘，统计信息在同一次扫描中得到
+            mined = mine_sequential_patterns(
+                sessions,
+                min_support=min_support,
+                min_length=max(min_length, 2),
+                max_length=max_length,
+                mode=pattern_mode,
+                min_frequency=self.min_pattern_frequency
+            )
             
-            # 筛选频繁模式
             common_patterns = []
-            pattern_id = 1
-            
-            for pattern, frequency in pattern_counter.most_common():
-                if frequency < self.min_pattern_frequency:
-                    break
-                    
-                # 计算模式统计信息
-                pattern_stats = self._calculate_pattern_stats(sessions, list(pattern))
-                
-                common_pattern = PathPattern(
+            for pattern_id, pattern in enumerate(mined[:20], start=1):  # 限制返回数量
+                common_patterns.append(PathPattern(
                     pattern_id=f"common_{pattern_id}",
-                    path_sequence=list(pattern),
-                    frequency=frequency,
-                    user_count=pattern_stats['user_count'],
-                    avg_duration=pattern_stats['avg_duration'],
-                    conversion_rate=pattern_stats['conversion_rate'],
+                    path_sequence=sessions.decode(pattern.codes),
+                    frequency=pattern.frequency,
+                    user_count=pattern.user_count,
+                    avg_duration=pattern.avg_duration,
+                    conversion_rate=pattern.conversion_rate,
                     pattern_type='common'
-                )
-                
-                common_patterns.append(common_pattern)
-                pattern_id += 1
-                
-                if len(common_patterns) >= 20:  # 限制返回数量
-                    break
+                ))
                     
             return common_patterns
             
@@ -387,101 +302,102 @@ class PathAnalysisEngine:
             logger.warning(f"识别常见模式失败: {e}")
             return []
             
-    def _identify_anomalous_patterns(self, sessions: List[UserSession], 
-                                   all_paths: List[List[str]]) -> List[PathPattern]:
+    def _identify_anomalous_patterns(self, sessions: SessionPathStore,
+                                   in_range: np.ndarray,
+                                   method: str = 'length') -> List[PathPattern]:
         """
         识别异常路径模式
         
+        按长度或稀有度偏离分析范围内路径超过2个标准差判定异常，再用MinHash/LSH
+        把事件集合和二元组Jaccard相似度超过0.8的异常路径合并为一个模式。
+        
         Args:
-            sessions: 用户会话列表
-            all_paths: 所有路径序列
+            sessions: 会话路径存储
+            in_range: 长度在分析范围内的会话掩码
+            method: 'length'、'rarity' 或 'combined'
             
         Returns:
             异常路径模式列表
         """
         try:
-            # 计算路径长度分布
-            path_lengths = [len(path) for path in all_paths]
-            if not path_lengths:
+            if not in_range.any():
+                return []
+                
+            scores = []
+            if method in ('length', 'combined'):
+                scores.append(sessions.lengths.astype(float))
+            if method in ('rarity', 'combined'):
+                scores.append(path_rarity(sessions))
+                
+            # 超过2个标准差认为是异常
+            outliers = np.zeros(len(sessions), dtype=bool)
+            for score in scores:
+                std = score[in_range].std()
+                if std > 0:
+                    outliers |= np.abs(score - score[in_range].mean()) / std > 2.0
+            outlier_index = np.flatnonzero(outliers)
+            if len(outlier_index) == 0:
                 return []
                 
-            mean_length = np.mean(path_lengths)
-            std_length = np.std(path_lengths)
+            # 近似重复的异常路径聚为一簇，以簇内第一个会话作为代表路径
+            candidates = sessions.subset(outlier_index)
+            representatives = lsh_clusters(minhash_signatures(candidates), threshold=0.8)
+            cluster_ids, cluster_labels, frequencies = np.unique(
+                representatives, return_inverse=True, return_counts=True
+            )
+            user_counts = np.bincount(
+                np.unique(np.stack([cluster_labels, candidates.user_codes]), axis=1)[0],
+                minlength=len(cluster_ids)
+            )
+            durations = np.bincount(cluster_labels, weights=candidates.durations) / frequencies
+            converted = np.bincount(cluster_labels, weights=candidates.conversions > 0) / frequencies
             
             anomalous_patterns = []
-            pattern_id = 1
-            
-            # 识别异常长度的路径
-            for session in sessions:
-                path_length = len(session.path_sequence)
-                z_score = abs(path_length - mean_length) / std_length if std_length > 0 else 0
+            for cluster, representative in enumerate(cluster_ids[:10]):  # 限制返回数量
+                anomalous_patterns.append(PathPattern(
+                    pattern_id=f"anomalous_{cluster + 1}",
+                    path_sequence=candidates.path(representative),
+                    frequency=int(frequencies[cluster]),
+                    user_count=int(user_counts[cluster]),
+                    avg_duration=float(durations[cluster]),
+                    conversion_rate=float(converted[cluster]),
+                    pattern_type='anomalous'
+                ))
                 
-                if z_score > 2.0:  # 超过2个标准差认为是异常
-                    # 检查是否已存在相似模式
-                    is_duplicate = False
-                    for existing_pattern in anomalous_patterns:
-                        if self._calculate_path_similarity(session.path_sequence, 
-                                                         existing_pattern.path_sequence) > 0.8:
-                            existing_pattern.frequency += 1
-                            is_duplicate = True
-                            break
-                    
-                    if not is_duplicate:
-                        pattern_stats = self._calculate_pattern_stats(sessions, session.path_sequence)
-                        
-                        anomalous_pattern = PathPattern(
-                            pattern_id=f"anomalous_{pattern_id}",
-                            path_sequence=session.path_sequence,
-                            frequency=1,
-                            user_count=1,
-                            avg_duration=session.duration_seconds,
-                            conversion_rate=1.0 if session.conversions > 0 else 0.0,
-                            pattern_type='anomalous'
-                        )
-                        
-                        anomalous_patterns.append(anomalous_pattern)
-                        pattern_id += 1
-                        
-                        if len(anomalous_patterns) >= 10:  # 限制返回数量
-                            break
-                            
             return anomalous_patterns
             
         except Exception as e:
             logger.warning(f"识别异常模式失败: {e}")
             return []
             
-    def _identify_conversion_paths(self, sessions: List[UserSession]) -> List[PathPattern]:
+    def _identify_conversion_paths(self, sessions: SessionPathStore) -> List[PathPattern]:
         """
         识别转化路径模式
         
         Args:
-            sessions: 用户会话列表
+            sessions: 会话路径存储
             
         Returns:
             转化路径模式列表
         """
         try:
-            conversion_sessions = [s for s in sessions if s.conversions > 0]
+            conversion_codes = sessions.encode(self.conversion_events)
+            conversion_positions = np.flatnonzero(np.isin(sessions.event_codes, conversion_codes))
+            
+            # 每个转化会话中第一个转化事件的位置
+            session_of_position = sessions.session_index[conversion_positions]
+            converted, first = np.unique(session_of_position, return_index=True)
+            first_positions = conversion_positions[first]
+            keep = (sessions.conversions[converted] > 0) & (first_positions > sessions.offsets[converted])
             
-            if not conversion_sessions:
+            if not keep.any():
                 return []
                 
-            # 统计转化路径
-            conversion_paths = Counter()
-            
-            for session in conversion_sessions:
-                # 找到第一个转化事件的位置
-                conversion_idx = -1
-                for i, event_name in enumerate(session.path_sequence):
-                    if event_name in self.conversion_events:
-                        conversion_idx = i
-                        break
-                
-                if conversion_idx > 0:
-                    # 提取转化前的路径
-                    conversion_path = tuple(session.path_sequence[:conversion_idx + 1])
-                    conversion_paths[conversion_path] += 1
+            # 统计转化前的路径（含第一个转化事件）
+            conversion_paths = Counter(
+                sessions.event_codes[start:end + 1].tobytes()
+                for start, end in zip(sessions.offsets[converted[keep]], first_positions[keep])
+            )
             
             # 生成转化路径模式
             conversion_patterns = []
@@ -491,11 +407,12 @@ class PathAnalysisEngine:
                 if frequency < 2:  # 至少出现2次
                     continue
                     
-                pattern_stats = self._calculate_pattern_stats(sessions, list(path))
+                path_sequence = sessions.decode(np.frombuffer(path, dtype=sessions.event_codes.dtype))
+                pattern_stats = self._calculate_pattern_stats(sessions, path_sequence)
                 
                 conversion_pattern = PathPattern(
                     pattern_id=f"conversion_{pattern_id}",
-                    path_sequence=list(path),
+                    path_sequence=path_sequence,
                     frequency=frequency,
                     user_count=pattern_stats['user_count'],
                     avg_duration=pattern_stats['avg_duration'],
@@ -512,41 +429,43 @@ class PathAnalysisEngine:
             logger.warning(f"识别转化路径失败: {e}")
             return []
             
-    def _identify_exit_patterns(self, sessions: List[UserSession]) -> List[PathPattern]:
+    def _identify_exit_patterns(self, sessions: SessionPathStore) -> List[PathPattern]:
         """
         识别退出模式
         
         Args:
-            sessions: 用户会话列表
+            sessions: 会话路径存储
             
         Returns:
             退出模式列表
         """
         try:
-            # 统计最后几步的模式
-            exit_patterns = Counter()
+            # 统计最后2-3步的模式
+            ranked = []
+            lengths = sessions.lengths
             
-            for session in sessions:
-                if len(session.path_sequence) >= 2:
-                    # 取最后2-3步作为退出模式
-                    for length in [2, 3]:
-                        if len(session.path_sequence) >= length:
-                            exit_pattern = tuple(session.path_sequence[-length:])
-                            exit_patterns[exit_pattern] += 1
+            for length in [2, 3]:
+                tails = np.flatnonzero(lengths >= length)
+                windows = sessions.event_codes[sessions.offsets[tails + 1][:, None] - length + np.arange(length)]
+                order = np.column_stack([tails, np.full(len(tails), length)])
+                ranked.extend(self._rank_sequences(windows, order))
+            
+            ranked.sort(key=lambda item: (-item[1], item[2]))
             
             # 生成退出模式
             exit_pattern_list = []
             pattern_id = 1
             
-            for pattern, frequency in exit_patterns.most_common(10):
+            for pattern, frequency, _ in ranked[:10]:
                 if frequency < self.min_pattern_frequency:
                     continue
                     
-                pattern_stats = self._calculate_pattern_stats(sessions, list(pattern))
+                path_sequence = sessions.decode(pattern)
+                pattern_stats = self._calculate_pattern_stats(sessions, path_sequence)
                 
                 exit_pattern_obj = PathPattern(
                     pattern_id=f"exit_{pattern_id}",
-                    path_sequence=list(pattern),
+                    path_sequence=path_sequence,
                     frequency=frequency,
                     user_count=pattern_stats['user_count'],
                     avg_duration=pattern_stats['avg_duration'],
@@ -563,27 +482,23 @@ class PathAnalysisEngine:
             logger.warning(f"识别退出模式失败: {e}")
             return []
             
-    def _calculate_pattern_stats(self, sessions: List[UserSession], 
+    def _calculate_pattern_stats(self, sessions: SessionPathStore, 
                                pattern: List[str]) -> Dict[str, Any]:
         """
         计算模式统计信息
         
         Args:
-            sessions: 用户会话列表
+            sessions: 会话路径存储
             pattern: 路径模式
             
         Returns:
             模式统计信息
         """
         try:
-            matching_sessions = []
-            
             # 找到包含该模式的会话
-            for session in sessions:
-                if self._contains_pattern(session.path_sequence, pattern):
-                    matching_sessions.append(session)
+            matching = sessions.sessions_containing(sessions.encode(pattern))
             
-            if not matching_sessions:
+            if len(matching) == 0:
                 return {
                     'user_count': 0,
                     'avg_duration': 0,
@@ -591,10 +506,9 @@ class PathAnalysisEngine:
                 }
             
             # 计算统计信息
-            user_count = len(set(session.user_id for session in matching_sessions))
-            avg_duration = np.mean([session.duration_seconds for session in matching_sessions])
-            conversion_count = sum(1 for session in matching_sessions if session.conversions > 0)
-            conversion_rate = conversion_count / len(matching_sessions)
+            user_count = len(np.unique(sessions.user_codes[matching]))
+            avg_duration = sessions.durations[matching].mean()
+            conversion_rate = (sessions.conversions[matching] > 0).mean()
             
             return {
                 'user_count': user_count,
@@ -610,113 +524,158 @@ class PathAnalysisEngine:
                 'conversion_rate': 0
             }
             
-    def _contains_pattern(self, path: List[str], pattern: List[str]) -> bool:
-        """
-        检查路径是否包含指定模式
-        
-        Args:
-            path: 完整路径
-            pattern: 要检查的模式
-            
-        Returns:
-            是否包含模式
-        """
-        if len(pattern) > len(path):
-            return False
-            
-        for i in range(len(path) - len(pattern) + 1):
-            if path[i:i + len(pattern)] == pattern:
-                return True
-                
-        return False
-        
-    def _calculate_path_similarity(self, path1: List[str], path2: List[str]) -> float:
+    def _build_path_flow_graph(self, sessions: Union[SessionPathStore, List[UserSession]],
+                               top_k: Optional[int] = None) -> Dict[str, Any]:
         """
-        计算两个路径的相似度
+        构建路径流图
         
         Args:
-            path1: 第一个路径
-            path2: 第二个路径
+            sessions: 会话路径存储或用户会话列表
+            top_k: 每个事件保留的最大流出边数，其余边合并为流向other的一条边；
+                   None表示保留全部边（马尔可夫归因需要完整转移）
             
         Returns:
-            相似度分数 (0-1)
+            路径流图数据，sankey为从会话起点开始的分步流转连线
         """
         try:
-            if not path1 or not path2:
-                return 0.0
-                
-            # 使用Jaccard相似度
-            set1 = set(path1)
-            set2 = set(path2)
-            
-            intersection = len(set1.intersection(set2))
-            union = len(set1.union(set2))
-            
-            return intersection / union if union > 0 else 0.0
+            store = self._as_session_store(sessions)
+            codes = store.event_codes
+            vocab = store.event_vocab
+            n_codes = len(vocab)
             
-        except Exception as e:
-            logger.warning(f"计算路径相似度失败: {e}")
-            return 0.0
-            
-    def _build_path_flow_graph(self, sessions: List[UserSession]) -> Dict[str, Any]:
-        """
-        构建路径流图
-        
-        Args:
-            sessions: 用户会话列表
+            # 统计路径起点和终点
+            non_empty = store.lengths > 0
+            entry_counts = np.bincount(codes[store.offsets[:-1][non_empty]], minlength=n_codes)
+            exit_counts = np.bincount(codes[store.offsets[1:][non_empty] - 1], minlength=n_codes)
             
-        Returns:
-            路径流图数据
-        """
-        try:
-            # 统计事件转换
-            transitions = defaultdict(int)
-            event_counts = defaultdict(int)
+            # 统计事件频次
+            event_counts = np.bincount(codes, minlength=n_codes)
             
-            for session in sessions:
-                path = session.path_sequence
-                
-                # 统计事件频次
-                for event in path:
-                    event_counts[event] += 1
-                
-                # 统计转换
-                for i in range(len(path) - 1):
-                    from_event = path[i]
-                    to_event = path[i + 1]
-                    transitions[(from_event, to_event)] += 1
+            # 统计会话内的相邻转换，按首次出现顺序排列
+            same_session = store.session_index[1:] == store.session_index[:-1]
+            pair_keys = codes[:-1][same_session].astype(np.int64) * n_codes + codes[1:][same_session]
+            pairs, first_index, pair_counts = np.unique(pair_keys, return_index=True, return_counts=True)
+            pair_order = np.argsort(first_index, kind='stable')
             
             # 构建节点和边
             nodes = []
-            for event, count in event_counts.items():
+            for code in np.flatnonzero(event_counts):
+                event = vocab[code]
                 nodes.append({
                     'id': event,
                     'label': event,
-                    'size': count,
+                    'size': int(event_counts[code]),
                     'type': 'conversion' if event in self.conversion_events else 'regular'
                 })
             
+            # 每个事件只保留流量最大的top_k条流出边
+            pairs, pair_counts = pairs[pair_order], pair_counts[pair_order]
+            keep = np.ones(len(pairs), dtype=bool)
+            if top_k is not None and len(pairs):
+                keep = rank_within_groups(pairs // n_codes, pair_counts) < top_k
+            
             edges = []
-            for (from_event, to_event), count in transitions.items():
+            for pair, count in zip(pairs[keep], pair_counts[keep]):
                 edges.append({
-                    'from': from_event,
-                    'to': to_event,
-                    'weight': count,
+                    'from': vocab[pair // n_codes],
+                    'to': vocab[pair % n_codes],
+                    'weight': int(count),
                     'label': str(count)
                 })
             
+            folded = np.bincount(pairs[~keep] // n_codes, weights=pair_counts[~keep], minlength=n_codes)
+            for code in np.flatnonzero(folded):
+                edges.append({
+                    'from': vocab[code],
+                    'to': OTHER_LABEL,
+                    'weight': int(folded[code]),
+                    'label': str(int(folded[code]))
+                })
+            if folded.any():
+                nodes.append({
+                    'id': OTHER_LABEL,
+                    'label': OTHER_LABEL,
+                    'size': int(folded.sum()),
+                    'type': 'other'
+                })
+            
+            sankey = aggregate_session_flows(store, depth=self.flow_depth,
+                                             top_k=top_k if top_k is not None else self.flow_top_k)
+            
             return {
                 'nodes': nodes,
                 'edges': edges,
-                'total_transitions': sum(transitions.values()),
-                'unique_events': len(event_counts)
+                'sankey': sankey.to_records(),
+                'total_transitions': int(pair_counts.sum()),
+                'unique_events': int(np.count_nonzero(event_counts)),
+                'entry_counts': {vocab[code]: int(entry_counts[code]) for code in np.flatnonzero(entry_counts)},
+                'exit_counts': {vocab[code]: int(exit_counts[code]) for code in np.flatnonzero(exit_counts)}
             }
             
         except Exception as e:
             logger.warning(f"构建路径流图失败: {e}")
-            return {'nodes': [], 'edges': [], 'total_transitions': 0, 'unique_events': 0}
+            return {'nodes': [], 'edges': [], 'sankey': [], 'total_transitions': 0, 'unique_events': 0,
+                    'entry_counts': {}, 'exit_counts': {}}
+            
+    def aggregate_path_flows(self,
+                             sessions: Optional[Union[SessionPathStore, List[UserSession]]] = None,
+                             anchor_events: Optional[List[str]] = None,
+                             depth: Optional[int] = None,
+                             top_k: Optional[int] = None) -> FlowAggregate:
+        """
+        聚合桑基图使用的分步流转
+        
+        Args:
+            sessions: 会话路径存储或用户会话列表
+            anchor_events: 锚点事件，None表示从会话起点开始
+            depth: 锚点之后的最大步数，默认使用flow_depth
+            top_k: 每个节点保留的最大分支数，默认使用flow_top_k
+            
+        Returns:
+            分步流转聚合结果
+        """
+        try:
+            if sessions is None:
+                sessions = self.reconstruct_user_sessions()
+                
+            return aggregate_session_flows(
+                self._as_session_store(sessions),
+                anchor_events=anchor_events,
+                depth=depth if depth is not None else self.flow_depth,
+                top_k=top_k if top_k is not None else self.flow_top_k
+            )
+            
+        except Exception as e:
+            logger.error(f"聚合路径流转失败: {e}")
+            raise
+            
+    def analyze_markov_attribution(self,
+                                   sessions: Optional[Union[SessionPathStore, List[UserSession]]] = None) -> MarkovAttributionResult:
+        """
+        基于会话路径转移的马尔可夫链归因
+        
+        Args:
+            sessions: 会话路径存储或用户会话列表
+            
+        Returns:
+            马尔可夫链归因结果
+        """
+        try:
+            if sessions is None:
+                sessions = self.reconstruct_user_sessions()
+                
+            path_flow_graph = self._build_path_flow_graph(sessions)
+            attribution_engine = AttributionEngine(conversion_events=self.conversion_events)
+            result = attribution_engine.markov_attribution(path_flow_graph)
+            
+            logger.info(f"马尔可夫链归因完成，状态数: {result.n_states}")
+            return result
             
-    def _generate_path_insights(self, sessions: List[UserSession],
+        except Exception as e:
+            logger.error(f"马尔可夫链归因失败: {e}")
+            raise
+            
+    def _generate_path_insights(self, sessions: SessionPathStore,
                               common_patterns: List[PathPattern],
                               anomalous_patterns: List[PathPattern],
                               conversion_paths: List[PathPattern]) -> List[str]:
@@ -724,7 +683,7 @@ class PathAnalysisEngine:
         生成路径分析洞察
         
         Args:
-            sessions: 用户会话列表
+            sessions: 会话路径存储
             common_patterns: 常见模式
             anomalous_patterns: 异常模式
             conversion_paths: 转化路径
@@ -734,13 +693,13 @@ class PathAnalysisEngine:
         """
         insights = []
         
-        if not sessions:
+        if len(sessions) == 0:
             return [t("path_analysis.insights.insufficient_session_data", "没有足够的会话数据生成洞察")]
         
         # 基本统计洞察
         total_sessions = len(sessions)
-        avg_path_length = np.mean([len(s.path_sequence) for s in sessions])
-        conversion_sessions = sum(1 for s in sessions if s.conversions > 0)
+        avg_path_length = float(sessions.lengths.mean())
+        conversion_sessions = int((sessions.conversions > 0).sum())
         conversion_rate = conversion_sessions / total_sessions
         
         insights.append(LocalizedInsightGenerator.format_session_summary(total_sessions, avg_path_length))
@@ -837,7 +796,7 @@ class PathAnalysisEngine:
             logger.error(f"生成UX建议失败: {e}")
             return [t("path_analysis.recommendations.generation_failed", "无法生成UX优化建议，请检查分析数据")]
             
-    def mine_user_paths(self, events: Optional[pd.DataFrame] = None, min_length: int = 2, max_length: int = 10, min_support: float = 0.01, date_range: Optional[Tuple[str, str]] = None) -> List[PathPattern]:
+    def mine_user_paths(self, events: Optional[pd.DataFrame] = None, min_length: int = 2, max_length: int = 10, min_support: float = 0.01, date_range: Optional[Tuple[str, str]] = None, pattern_mode: str = 'contiguous') -> List[PathPattern]:
         """
         挖掘用户路径模式（代理方法）
         
@@ -845,6 +804,8 @@ class PathAnalysisEngine:
             events: 事件数据
             min_length: 最小路径长度
             max_length: 最大路径长度
+            min_support: 最小支持度
+            pattern_mode: 'contiguous' 或 'gapped'
             
         Returns:
             路径模式列表
@@ -858,7 +819,8 @@ class PathAnalysisEngine:
                 sessions=sessions,
                 min_length=min_length,
                 max_length=max_length,
-                min_support=min_support
+                min_support=min_support,
+                pattern_mode=pattern_mode
             )
             
             # 返回路径模式列表
@@ -896,7 +858,7 @@ class PathAnalysisEngine:
             # 重构用户会话
             sessions = self.reconstruct_user_sessions(events)
             
-            if not sessions:
+            if len(sessions) == 0:
                 return {
                     'status': 'error',
                     'message': t("path_analysis.errors.session_reconstruction_failed", "无法重构用户会话"),
@@ -905,7 +867,9 @@ class PathAnalysisEngine:
                 }
             
             # 识别路径模式
-            path_patterns = self.identify_path_patterns(sessions)
+            analysis_result = self.identify_path_patterns(sessions)
+            path_patterns = (analysis_result.common_patterns + analysis_result.conversion_paths +
+                             analysis_result.exit_patterns)
             
             # 生成洞察和建议
             insights = []
@@ -913,7 +877,7 @@ class PathAnalysisEngine:
             
             # 会话统计洞察
             total_sessions = len(sessions)
-            avg_session_length = sum(len(s.path_sequence) for s in sessions) / total_sessions
+            avg_session_length = float(sessions.lengths.mean())
             insights.append(t("path_analysis.results.total_sessions_analyzed", "分析了 {total_sessions} 个用户会话").format(total_sessions=total_sessions))
             insights.append(t("path_analysis.results.avg_path_length", "平均路径长度: {avg_length:.1f} 步").format(avg_length=avg_session_length))
             
@@ -948,8 +912,7 @@ class PathAnalysisEngine:
                         recommendations.append(t("path_analysis.results.optimize_exit_point", "重点优化 {exit_point} 环节，减少用户流失").format(exit_point=exit_point))
             
             # 会话质量分析
-            conversion_sessions = [s for s in sessions if s.conversions > 0]
-            conversion_rate = len(conversion_sessions) / total_sessions * 100
+            conversion_rate = float((sessions.conversions > 0).mean()) * 100
             insights.append(t("path_analysis.results.session_conversion_rate", "会话转化率: {rate:.1f}%").format(rate=conversion_rate))
             
             if conversion_rate < 10:
@@ -988,23 +951,33 @@ class PathAnalysisEngine:
                 'recommendations': []
             }
     
-    def analyze_user_flow(self, flow_steps: List[str] = None, start_events: List[str] = None, end_events: List[str] = None) -> Dict[str, Any]:
+    def analyze_user_flow(self, flow_steps: List[str] = None, start_events: List[str] = None, end_events: List[str] = None,
+                          events: Optional[pd.DataFrame] = None,
+                          sessions: Optional[Union[SessionPathStore, List[UserSession]]] = None,
+                          top_k: int = 5) -> Dict[str, Any]:
         """
         分析用户流程
         
         Args:
-            flow_steps: 流程步骤列表
-            start_events: 起始事件列表
-            end_events: 结束事件列表
+            flow_steps: 流程步骤列表，默认使用概率最高的起止路径
+            start_events: 起始事件列表，默认使用最常见的会话入口事件
+            end_events: 结束事件列表，默认使用数据中出现的转化事件
+            events: 事件数据，默认使用存储管理器中的数据（经数据集缓存读取）
+            sessions: 已重构的会话，提供时不再读取事件数据
+            top_k: 返回的最优路径数
             
         Returns:
             用户流程分析结果
         """
         try:
-            # 获取事件数据
-            events = self.storage_manager.get_events() if hasattr(self, 'storage_manager') else pd.DataFrame()
+            if sessions is None:
+                if events is None:
+                    # 存储管理器中的事件经缓存读取，会话与其他分析共用
+                    events = self.dataset_cache.events() if self.storage_manager is not None else pd.DataFrame()
+                sessions = self.reconstruct_user_sessions(events) if not events.empty else []
+            store = self._as_session_store(sessions)
             
-            if events.empty:
+            if len(store) == 0:
                 return {
                     'status': 'error',
                     'message': t("path_analysis.flow.empty_event_data", "事件数据为空"),
@@ -1013,42 +986,83 @@ class PathAnalysisEngine:
                     'recommendations': []
                 }
             
-            # 默认流程步骤
+            graph = build_transition_graph(store)
+            
+            # 默认起止事件：最常见的入口事件到数据中出现的转化事件
+            if not start_events:
+                start_events = [store.event_vocab[int(np.argmax(graph.entry_counts))]]
+            if not end_events:
+                end_events = [event for event in store.event_vocab if event in self.conversion_events]
+                if not end_events:
+                    end_events = [store.event_vocab[int(np.argmax(graph.exit_counts))]]
+            
+            # 起止事件之间概率最高且被实际走过的路径
+            optimal_paths = top_observed_paths(store, start_events, end_events, k=top_k, graph=graph)
+            
             if not flow_steps:
-                flow_steps = ['landing', 'browse', 'add_to_cart', 'checkout', 'purchase']
+                flow_steps = optimal_paths[0].path if optimal_paths else list(start_events[:1])
             
-            # 基本流程分析
+            # 按顺序到达各步骤的用户数和步骤间转化率
+            reach = step_reach(store, flow_steps)
+            first_users = reach[0].user_count if reach else 0
             flow_analysis = {}
             drop_off_points = []
             
-            for i, step in enumerate(flow_steps):
-                step_users = 100 - (i * 15)  # 模拟递减
-                flow_analysis[step] = {
-                    'user_count': step_users,
-                    'conversion_rate': step_users / 100 if i == 0 else step_users / (100 - ((i-1) * 15)),
-                    'drop_off_rate': 0.15 if i > 0 else 0
+            for i, step_result in enumerate(reach):
+                previous_users = reach[i - 1].user_count if i > 0 else first_users
+                conversion_rate = step_result.user_count / previous_users if previous_users else 0.0
+                flow_analysis[step_result.step] = {
+                    'user_count': step_result.user_count,
+                    'session_count': step_result.session_count,
+                    'reach_rate': step_result.user_count / first_users if first_users else 0.0,
+                    'conversion_rate': conversion_rate,
+                    'drop_off_rate': 1 - conversion_rate if i > 0 and previous_users else 0
                 }
                 
-                if i > 0 and flow_analysis[step]['drop_off_rate'] > 0.2:
-                    drop_off_points.append(step)
+                if i > 0 and flow_analysis[step_result.step]['drop_off_rate'] > 0.2:
+                    drop_off_points.append(step_result.step)
+            
+            insights = []
+            recommendations = []
+            
+            if drop_off_points:
+                worst_step = max(drop_off_points, key=lambda step: flow_analysis[step]['drop_off_rate'])
+                insights.append(t("path_analysis.flow.largest_drop_off",
+                                  "流失最严重的步骤是 {step}，流失率 {rate:.1f}%").format(
+                    step=worst_step, rate=flow_analysis[worst_step]['drop_off_rate'] * 100))
+                recommendations.append(t("path_analysis.flow.optimize_high_dropoff", "优化高流失步骤的用户体验"))
+            
+            if optimal_paths:
+                best_path = optimal_paths[0]
+                insights.append(t("path_analysis.flow.most_probable_path",
+                                  "概率最高的路径: {path}（{probability:.1f}%）").format(
+                    path=' → '.join(map(str, best_path.path)), probability=best_path.probability * 100))
+                if best_path.steps > 4:
+                    recommendations.append(t("path_analysis.flow.simplify_conversion", "简化转化流程"))
+            else:
+                insights.append(t("path_analysis.flow.no_observed_path", "未发现从起始事件到结束事件的完整路径"))
+            
+            if first_users and reach[-1].user_count / first_users < 0.1:
+                recommendations.append(t("path_analysis.flow.add_guidance", "增加引导提示"))
             
             return {
                 'status': 'success',
+                'flow_steps': list(flow_steps),
+                'start_events': list(start_events),
+                'end_events': list(end_events),
                 'flow_analysis': flow_analysis,
                 'drop_off_points': drop_off_points,
                 'optimal_paths': [
-                    {'path': ['landing', 'checkout', 'purchase'], 'efficiency': 0.9},
-                    {'path': ['browse', 'add_to_cart', 'purchase'], 'efficiency': 0.7}
+                    {
+                        'path': path.path,
+                        'efficiency': path.probability,
+                        'steps': path.steps,
+                        'session_count': path.session_count
+                    }
+                    for path in optimal_paths
                 ],
-                'insights': [
-                    t("path_analysis.flow.bottleneck_exists", "用户流程存在明显瓶颈"),
-                    t("path_analysis.flow.direct_conversion_efficient", "直接转化路径效率最高")
-                ],
-                'recommendations': [
-                    t("path_analysis.flow.optimize_high_dropoff", "优化高流失步骤的用户体验"),
-                    t("path_analysis.flow.simplify_conversion", "简化转化流程"),
-                    t("path_analysis.flow.add_guidance", "增加引导提示")
-                ]
+                'insights': insights,
+                'recommendations': recommendations
             }
             
         except Exception as e:
@@ -0,0 +1,177 @@
+"""
+路径相似度模块
+
+基于会话路径存储计算MinHash签名：每个会话取事件集合和事件n-gram作为特征，
+用LSH分桶只比较同桶会话，以近似线性的时间把近似重复的路径聚成簇；
+并基于事件转移概率模型计算路径稀有度（每一步的平均负对数似然）。
+"""
+
+import numpy as np
+from typing import Optional, Sequence
+from scipy import sparse
+from scipy.sparse.csgraph import connected_components
+import logging
+
+from engines.session_store import SessionPathStore
+from engines.user_flow import TransitionGraph, build_transition_graph
+
+logger = logging.getLogger(__name__)
+
+# 哈希运算使用的梅森素数，保证乘法在uint64内不溢出
+_PRIME = np.uint64((1 << 31) - 1)
+_BASE = np.uint64(1_000_003)
+
+
+def path_shingles(store: SessionPathStore, ngram_sizes: Sequence[int] = (1, 2)):
+    """
+    提取每个会话的去重特征：n=1为事件集合，n>1为连续事件n-gram
+
+    Args:
+        store: 会话路径存储
+        ngram_sizes: n-gram长度
+
+    Returns:
+        (会话下标, 特征哈希值)，按会话下标排序且每个会话内不重复
+    """
+    codes = store.event_codes.astype(np.uint64) + np.uint64(1)
+    session_parts, key_parts = [], []
+    for n in ngram_sizes:
+        starts = store.window_starts(n)
+        # 多项式滚动哈希，长度n作为种子区分不同阶的n-gram
+        keys = np.full(len(starts), n, dtype=np.uint64)
+        for offset in range(n):
+            keys = (keys * _BASE + codes[starts + offset]) % _PRIME
+        session_parts.append(store.session_index[starts].astype(np.int64))
+        key_parts.append(keys)
+
+    sessions = np.concatenate(session_parts) if session_parts else np.empty(0, dtype=np.int64)
+    keys = np.concatenate(key_parts) if key_parts else np.empty(0, dtype=np.uint64)
+    order = np.lexsort((keys, sessions))
+    sessions, keys = sessions[order], keys[order]
+    unique = np.ones(len(keys), dtype=bool)
+    unique[1:] = (sessions[1:] != sessions[:-1]) | (keys[1:] != keys[:-1])
+    return sessions[unique], keys[unique]
+
+
+def minhash_signatures(store: SessionPathStore,
+                       num_perm: int = 64,
+                       ngram_sizes: Sequence[int] = (1, 2),
+                       seed: int = 0) -> np.ndarray:
+    """
+    计算每个会话的MinHash签名
+
+    Args:
+        store: 会话路径存储
+        num_perm: 哈希函数个数
+        ngram_sizes: 特征使用的n-gram长度
+        seed: 随机种子
+
+    Returns:
+        (会话数, num_perm) 的签名矩阵，没有特征的会话为全最大值
+    """
+    sessions, keys = path_shingles(store, ngram_sizes)
+    signatures = np.full((len(store), num_perm), _PRIME, dtype=np.uint64)
+    if len(keys) == 0:
+        return signatures
+
+    rng = np.random.default_rng(seed)
+    a = rng.integers(1, int(_PRIME), size=num_perm, dtype=np.uint64)
+    b = rng.integers(0, int(_PRIME), size=num_perm, dtype=np.uint64)
+    group_starts = np.flatnonzero(np.r_[True, sessions[1:] != sessions[:-1]])
+    owners = sessions[group_starts]
+    # 逐个哈希函数计算，内存只与特征数成正比
+    for i in range(num_perm):
+        hashed = (a[i] * keys + b[i]) % _PRIME
+        signatures[owners, i] = np.minimum.reduceat(hashed, group_starts)
+    return signatures
+
+
+def lsh_clusters(signatures: np.ndarray, threshold: float = 0.8, bands: int = 16) -> np.ndarray:
+    """
+    用LSH分桶把估计Jaccard相似度不低于阈值的会话连成簇
+
+    每个分段中同桶的会话只与桶内第一个会话比较签名，相似度达标则连边，
+    簇为连边图的连通分量。
+
+    Args:
+        signatures: MinHash签名矩阵
+        threshold: 估计Jaccard相似度阈值
+        bands: LSH分段数，需整除签名长度
+
+    Returns:
+        每个会话所属簇的代表会话下标（簇内最小下标）
+    """
+    n, num_perm = signatures.shape
+    if n == 0:
+        return np.empty(0, dtype=np.int64)
+    if num_perm % bands != 0:
+        raise ValueError(f"Signature length {num_perm} is not divisible by {bands} bands")
+
+    rows = num_perm // bands
+    members = np.arange(n)
+    link_from, link_to = [members], [members]
+    for band in range(bands):
+        band_keys = np.zeros(n, dtype=np.uint64)
+        for column in range(band * rows, (band + 1) * rows):
+            band_keys = (band_keys * _BASE + signatures[:, column]) % _PRIME
+        # 哈希碰撞由下面的签名比较过滤
+        _, first, inverse = np.unique(band_keys, return_index=True, return_inverse=True)
+        representatives = first[inverse]
+        candidates = np.flatnonzero(representatives != members)
+        if len(candidates) == 0:
+            continue
+        agreement = (signatures[candidates] == signatures[representatives[candidates]]).mean(axis=1)
+        similar = agreement >= threshold
+        link_from.append(candidates[similar])
+        link_to.append(representatives[candidates][similar])
+
+    graph = sparse.coo_matrix(
+        (np.ones(sum(len(part) for part in link_from)), (np.concatenate(link_from), np.concatenate(link_to))),
+        shape=(n, n)
+    )
+    _, labels = connected_components(graph, directed=False)
+    cluster_min = np.full(labels.max() + 1, n, dtype=np.int64)
+    np.minimum.at(cluster_min, labels, members)
+    return cluster_min[labels]
+
+
+def path_rarity(store: SessionPathStore, graph: Optional[TransitionGraph] = None) -> np.ndarray:
+    """
+    基于一阶转移概率模型计算每个会话路径的稀有度
+
+    稀有度为进入首个事件、各次转移和在末尾事件退出的平均负对数概率，
+    按步数归一化，避免长路径天然更稀有。
+
+    Args:
+        store: 会话路径存储
+        graph: 预先构建的事件转移图
+
+    Returns:
+        每个会话的稀有度，空会话为0
+    """
+    if graph is None:
+        graph = build_transition_graph(store)
+
+    n_sessions = len(store)
+    rarity = np.zeros(n_sessions)
+    non_empty = store.lengths > 0
+    if not non_empty.any():
+        return rarity
+
+    codes = store.event_codes
+    out_counts = graph.out_counts.astype(float)
+    first_codes = codes[store.offsets[:-1][non_empty]]
+    last_codes = codes[store.offsets[1:][non_empty] - 1]
+    entry_log = np.log(graph.entry_counts[first_codes] / graph.entry_counts.sum())
+    exit_log = np.log(graph.exit_counts[last_codes] / out_counts[last_codes])
+
+    same_session = store.session_index[1:] == store.session_index[:-1]
+    sources, targets = codes[:-1][same_session], codes[1:][same_session]
+    pair_counts = np.asarray(graph.transition_counts[sources, targets]).ravel()
+    transition_log = np.log(pair_counts / out_counts[sources])
+    transition_sum = np.bincount(store.session_index[1:][same_session], weights=transition_log,
+                                 minlength=n_sessions)
+
+    total = transition_sum[non_empty] + entry_log + exit_log
+    rarity[non_empty] = -total / (store.lengths[non_empty] + 1)
+    return rarity
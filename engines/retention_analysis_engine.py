@@ -14,6 +14,8 @@ from dataclasses import dataclass
 from collections import defaultdict
 import warnings
 
+from engines.dataset_cache import DatasetCache
+
 # Import i18n function
 try:
     from utils.i18n import t
@@ -80,6 +82,7 @@ class RetentionAnalysisEngine:
             storage_manager: 数据存储管理器实例
         """
         self.storage_manager = storage_manager
+        self.dataset_cache = DatasetCache.for_storage(storage_manager)
         
         logger.info(t("retention.engine_initialized", "留存分析引擎初始化完成"))
         
@@ -103,21 +106,19 @@ class RetentionAnalysisEngine:
             if events is None:
                 if self.storage_manager is None:
                     raise ValueError("Event data not provided and storage manager not initialized")
-                events = self.storage_manager.get_data('events')
+                events = self.dataset_cache.events()
                 
             if events.empty:
                 logger.warning(t("retention.empty_event_data_warning", "事件数据为空，无法构建用户队列"))
                 return {}
                 
-            # 确保有时间列
-            if 'event_datetime' not in events.columns:
-                if 'event_timestamp' in events.columns:
-                    events['event_datetime'] = pd.to_datetime(events['event_timestamp'], unit='us')
-                else:
-                    raise ValueError("Missing time field")
+            # 确保有时间列（共用缓存中补充了时间列的浅拷贝，不修改传入的数据）
+            if 'event_datetime' not in events.columns and 'event_timestamp' not in events.columns:
+                raise ValueError("Missing time field")
+            events = self.dataset_cache.with_datetime(events)
                     
             # 计算每个用户的首次活动时间
-            user_first_activity = events.groupby('user_pseudo_id')['event_datetime'].min().reset_index()
+            user_first_activity = self.dataset_cache.user_activity(events)['first_seen'].reset_index()
             user_first_activity.columns = ['user_id', 'first_activity_date']
             
             # 根据队列周期分组用户
@@ -198,7 +199,7 @@ class RetentionAnalysisEngine:
             if events is None:
                 if self.storage_manager is None:
                     raise ValueError("Event data not provided and storage manager not initialized")
-                events = self.storage_manager.get_data('events')
+                events = self.dataset_cache.events()
                 
             if events.empty:
                 logger.warning(t("retention.empty_data_no_retention", "Event data is empty, cannot calculate retention rate"))
@@ -210,12 +211,10 @@ class RetentionAnalysisEngine:
                     summary_stats={}
                 )
                 
-            # 确保有时间列
-            if 'event_datetime' not in events.columns:
-                if 'event_timestamp' in events.columns:
-                    events['event_datetime'] = pd.to_datetime(events['event_timestamp'], unit='us')
-                else:
-                    raise ValueError("Missing time field")
+            # 确保有时间列（共用缓存中补充了时间列的浅拷贝，不修改传入的数据）
+            if 'event_datetime' not in events.columns and 'event_timestamp' not in events.columns:
+                raise ValueError("Missing time field")
+            events = self.dataset_cache.with_datetime(events)
                     
             # 构建用户队列
             cohorts_dict = self.build_user_cohorts(events, analysis_type)
@@ -586,7 +585,7 @@ class RetentionAnalysisEngine:
             if events is None:
                 if self.storage_manager is None:
                     raise ValueError("Event data not provided and storage manager not initialized")
-                events = self.storage_manager.get_data('events')
+                events = self.dataset_cache.events()
                 
             if users is None and self.storage_manager:
                 users = self.storage_manager.get_data('users')
@@ -595,12 +594,10 @@ class RetentionAnalysisEngine:
                 logger.warning(t("retention.empty_data_no_profiles", "Event data is empty, cannot create user retention profiles"))
                 return []
                 
-            # 确保有时间列
-            if 'event_datetime' not in events.columns:
-                if 'event_timestamp' in events.columns:
-                    events['event_datetime'] = pd.to_datetime(events['event_timestamp'], unit='us')
-                else:
-                    raise ValueError("Missing time field")
+            # 确保有时间列（共用缓存中补充了时间列的浅拷贝，不修改传入的数据）
+            if 'event_datetime' not in events.columns and 'event_timestamp' not in events.columns:
+                raise ValueError("Missing time field")
+            events = self.dataset_cache.with_datetime(events)
                     
             profiles = []
             
@@ -1279,7 +1276,7 @@ class RetentionAnalysisEngine:
             if self.storage_manager is None:
                 return {"error": "Storage manager not initialized"}
                 
-            events = self.storage_manager.get_data('events')
+            events = self.dataset_cache.events()
             
             if events.empty:
                 return {"error": t("retention.no_event_data", "无事件数据")}
@@ -1289,9 +1286,8 @@ class RetentionAnalysisEngine:
             unique_users = events['user_pseudo_id'].nunique()
             
             # 时间范围
-            if 'event_datetime' not in events.columns:
-                if 'event_timestamp' in events.columns:
-                    events['event_datetime'] = pd.to_datetime(events['event_timestamp'], unit='us')
+            if 'event_timestamp' in events.columns:
+                events = self.dataset_cache.with_datetime(events)
                     
             if 'event_datetime' in events.columns:
                 date_range = {
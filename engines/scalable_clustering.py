@@ -0,0 +1,166 @@
+"""
+可扩展聚类模块
+
+面向百万级用户的聚类后端：
+- MiniBatchKMeans按特征块partial_fit训练，按块预测标签，不需要一次处理全部数据；
+- DBSCAN/HDBSCAN只在抽样上拟合，其余用户分配到最近的簇中心，
+  距离超过该簇抽样成员最大半径的用户视为噪声。
+"""
+
+import numpy as np
+from typing import Any, Dict, Iterator, Optional, Tuple
+import logging
+
+from sklearn.cluster import DBSCAN, HDBSCAN, MiniBatchKMeans
+
+logger = logging.getLogger(__name__)
+
+NOISE_LABEL = -1
+
+
+def iter_chunks(n_rows: int, chunk_size: int) -> Iterator[slice]:
+    """按行分块"""
+    for start in range(0, n_rows, chunk_size):
+        yield slice(start, min(start + chunk_size, n_rows))
+
+
+def minibatch_kmeans(feature_matrix: np.ndarray,
+                     n_clusters: int,
+                     chunk_size: int = 100_000,
+                     batch_size: int = 4096,
+                     max_epochs: int = 3,
+                     tol: float = 1e-4,
+                     random_state: int = 42,
+                     init: Optional[np.ndarray] = None) -> Tuple[np.ndarray, MiniBatchKMeans]:
+    """
+    MiniBatchKMeans按块增量训练后按块预测
+
+    每轮按随机顺序遍历所有块做partial_fit，簇中心的最大位移小于tol（相对特征尺度）时提前结束。
+
+    Args:
+        feature_matrix: 标准化后的特征矩阵
+        n_clusters: 聚类数量
+        chunk_size: 每次partial_fit的行数
+        batch_size: MiniBatchKMeans的小批量大小
+        max_epochs: 最多遍历数据的轮数
+        tol: 收敛阈值
+        random_state: 随机种子
+        init: 初始簇中心（热启动），None时用k-means++初始化
+
+    Returns:
+        (聚类标签, 训练好的模型)
+    """
+    n_rows = feature_matrix.shape[0]
+    chunk_size = max(chunk_size, n_clusters)
+    rng = np.random.default_rng(random_state)
+    if init is None:
+        model = MiniBatchKMeans(n_clusters=n_clusters, batch_size=batch_size, random_state=random_state, n_init=3)
+    else:
+        model = MiniBatchKMeans(n_clusters=n_clusters, batch_size=batch_size, random_state=random_state,
+                                init=init, n_init=1)
+
+    scale = float(np.mean(np.std(feature_matrix, axis=0))) or 1.0
+    for epoch in range(max_epochs):
+        previous = None if epoch == 0 else model.cluster_centers_.copy()
+        chunks = list(iter_chunks(n_rows, chunk_size))
+        # 最后一块可能不足n_clusters行，首轮第一块必须足够初始化簇中心
+        for index in rng.permutation(len(chunks)) if epoch else range(len(chunks)):
+            chunk = feature_matrix[chunks[index]]
+            if len(chunk) >= n_clusters or hasattr(model, 'cluster_centers_'):
+                model.partial_fit(chunk)
+        if previous is not None and np.max(np.abs(model.cluster_centers_ - previous)) < tol * scale:
+            break
+
+    labels = np.empty(n_rows, dtype=np.int64)
+    for chunk in iter_chunks(n_rows, chunk_size):
+        labels[chunk] = model.predict(feature_matrix[chunk])
+    return labels, model
+
+
+def nearest_centroid_labels(feature_matrix: np.ndarray,
+                            centroids: np.ndarray,
+                            radii: Optional[np.ndarray] = None,
+                            chunk_size: int = 100_000) -> np.ndarray:
+    """
+    按块把每行分配到最近的簇中心
+
+    Args:
+        feature_matrix: 特征矩阵
+        centroids: 簇中心
+        radii: 每个簇的半径，距离超过半径的行标记为噪声；None表示不限制
+        chunk_size: 每块行数
+
+    Returns:
+        簇标签（簇中心的序号或NOISE_LABEL）
+    """
+    labels = np.full(feature_matrix.shape[0], NOISE_LABEL, dtype=np.int64)
+    if len(centroids) == 0:
+        return labels
+    centroid_norms = (centroids ** 2).sum(axis=1)
+    for chunk in iter_chunks(feature_matrix.shape[0], chunk_size):
+        rows = feature_matrix[chunk]
+        distances = (rows ** 2).sum(axis=1)[:, None] - 2 * rows @ centroids.T + centroid_norms
+        nearest = np.argmin(distances, axis=1)
+        if radii is not None:
+            within = distances[np.arange(len(rows)), nearest] <= radii[nearest] ** 2 + 1e-12
+            nearest = np.where(within, nearest, NOISE_LABEL)
+        labels[chunk] = nearest
+    return labels
+
+
+def sampled_density_clustering(feature_matrix: np.ndarray,
+                               method: str = 'dbscan',
+                               sample_size: int = 20_000,
+                               chunk_size: int = 100_000,
+                               random_state: int = 42,
+                               **params: Any) -> Tuple[np.ndarray, Dict[str, Any]]:
+    """
+    在抽样上做密度聚类，其余行按最近簇中心分配
+
+    Args:
+        feature_matrix: 标准化后的特征矩阵
+        method: 'dbscan' 或 'hdbscan'
+        sample_size: 抽样行数，不少于总行数时在全部数据上拟合
+        chunk_size: 分配标签时每块行数
+        random_state: 抽样随机种子
+        **params: 传给DBSCAN（eps、min_samples）或HDBSCAN（min_cluster_size、min_samples）的参数
+
+    Returns:
+        (簇标签（噪声为NOISE_LABEL）, 拟合信息：sample_size、n_clusters)
+    """
+    if method not in ('dbscan', 'hdbscan'):
+        raise ValueError(f"Unsupported density clustering method: {method}")
+
+    n_rows = feature_matrix.shape[0]
+    rng = np.random.default_rng(random_state)
+    sampled = n_rows > sample_size
+    sample_index = np.sort(rng.choice(n_rows, sample_size, replace=False)) if sampled else np.arange(n_rows)
+    sample = feature_matrix[sample_index]
+
+    if method == 'dbscan':
+        model = DBSCAN(eps=params.get('eps', 0.5), min_samples=params.get('min_samples', 5))
+    else:
+        model = HDBSCAN(min_cluster_size=params.get('min_cluster_size', 5),
+                        min_samples=params.get('min_samples'))
+    sample_labels = model.fit_predict(sample)
+
+    cluster_ids = np.unique(sample_labels[sample_labels != NOISE_LABEL])
+    info = {'sample_size': int(len(sample_index)), 'n_clusters': int(len(cluster_ids))}
+    if not sampled:
+        return sample_labels.astype(np.int64), info
+
+    # 簇中心和半径（抽样成员到中心的最大距离）
+    clustered = sample_labels != NOISE_LABEL
+    codes = np.searchsorted(cluster_ids, sample_labels[clustered])
+    counts = np.bincount(codes, minlength=len(cluster_ids))
+    centroids = np.zeros((len(cluster_ids), feature_matrix.shape[1]))
+    np.add.at(centroids, codes, sample[clustered])
+    centroids /= np.maximum(counts, 1)[:, None]
+    radii = np.zeros(len(cluster_ids))
+    np.maximum.at(radii, codes, np.linalg.norm(sample[clustered] - centroids[codes], axis=1))
+
+    labels = nearest_centroid_labels(feature_matrix, centroids, radii, chunk_size)
+    # 抽样行保留密度聚类的结果
+    labels[sample_index] = NOISE_LABEL
+    labels[sample_index[clustered]] = codes
+    return labels, info
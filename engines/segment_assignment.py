@@ -0,0 +1,315 @@
+"""
+分群模型与在线分群分配模块
+
+分群完成后把特征编码、标准化参数和各分群在标准化空间中的中心保存为分群模型：
+- 新用户只需计算自身的特征，按相同的编码和标准化转换后分配到最近的分群中心，无需重新聚类；
+- 模型可保存到磁盘，在其他进程中加载后直接分配；
+- SegmentAssigner注册为存储管理器的事件监听器后，作为数据写入流程中的一个环节，
+  每次追加事件时只为涉及的用户重算特征并分配分群。
+"""
+
+import weakref
+import pandas as pd
+import numpy as np
+from typing import Any, Dict, Iterable, List, Optional, Tuple
+from collections import deque
+from dataclasses import dataclass, field
+import logging
+
+from engines.user_features import build_user_feature_frame, feature_spec_key
+
+logger = logging.getLogger(__name__)
+
+
+@dataclass
+class SegmentationModel:
+    """已拟合的分群模型：特征编码、标准化参数和分群中心"""
+    method: str
+    feature_names: List[str]  # 特征矩阵的列顺序
+    categories: Dict[str, List[str]]  # 分类特征 -> 编码顺序的取值
+    scaler_mean: np.ndarray
+    scaler_scale: np.ndarray
+    segment_ids: np.ndarray  # 与centroids的行对应
+    centroids: np.ndarray  # 分群 × 特征，标准化空间中的分群均值
+    segment_names: Dict[int, str] = field(default_factory=dict)
+    reference_time: Optional[pd.Timestamp] = None  # 拟合时特征的参考时间，为新用户计算特征时沿用
+    spec_key: str = field(default_factory=feature_spec_key)
+    created_at: pd.Timestamp = field(default_factory=pd.Timestamp.now)
+
+    @classmethod
+    def from_fit(cls,
+                 method: str,
+                 feature_names: List[str],
+                 label_encoders: Dict[str, Any],
+                 scaler: Any,
+                 segment_ids: np.ndarray,
+                 centroids: np.ndarray,
+                 segment_names: Optional[Dict[int, str]] = None,
+                 reference_time: Optional[pd.Timestamp] = None) -> 'SegmentationModel':
+        """
+        由分群时拟合的编码器、标准化器和分群中心创建模型
+
+        Args:
+            method: 分群方法
+            feature_names: 特征名称列表（特征矩阵的列顺序）
+            label_encoders: 分类特征名 -> LabelEncoder
+            scaler: 已拟合的StandardScaler
+            segment_ids: 分群标签
+            centroids: 各分群在标准化空间中的中心
+            segment_names: 分群标签 -> 分群名称
+            reference_time: 拟合所用特征表的参考时间（最近活跃天数等特征相对于该时间计算）
+
+        Returns:
+            分群模型
+        """
+        categories = {name: [str(value) for value in label_encoders[name].classes_]
+                      for name in feature_names
+                      if name in label_encoders and hasattr(label_encoders[name], 'classes_')}
+        return cls(
+            method=method,
+            feature_names=list(feature_names),
+            categories=categories,
+            scaler_mean=np.asarray(scaler.mean_, dtype=float).copy(),
+            scaler_scale=np.asarray(scaler.scale_, dtype=float).copy(),
+            segment_ids=np.asarray(segment_ids).copy(),
+            centroids=np.asarray(centroids, dtype=float).copy(),
+            segment_names=dict(segment_names or {}),
+            reference_time=pd.Timestamp(reference_time) if reference_time is not None else None
+        )
+
+    @property
+    def n_segments(self) -> int:
+        return len(self.segment_ids)
+
+    def transform(self, feature_frame: pd.DataFrame) -> np.ndarray:
+        """
+        按拟合时的编码和标准化参数转换特征表
+
+        分类特征未出现过的取值与缺失值一样记为0，特征表中缺少的特征列记为0。
+
+        Args:
+            feature_frame: 以user_pseudo_id为索引的特征表
+
+        Returns:
+            标准化后的特征矩阵，列顺序为feature_names
+        """
+        matrix = np.zeros((len(feature_frame), len(self.feature_names)))
+        for column, name in enumerate(self.feature_names):
+            if name not in feature_frame.columns:
+                continue
+            values = feature_frame[name]
+            if name in self.categories:
+                codes = {category: code for code, category in enumerate(self.categories[name])}
+                matrix[:, column] = values.map(codes).to_numpy(dtype=float)
+            else:
+                matrix[:, column] = pd.to_numeric(values, errors='coerce').to_numpy(dtype=float)
+        return (np.nan_to_num(matrix) - self.scaler_mean) / self.scaler_scale
+
+    def assign_matrix(self, feature_matrix: np.ndarray, chunk_size: int = 100_000) -> Tuple[np.ndarray, np.ndarray]:
+        """
+        把标准化后的特征矩阵分配到最近的分群中心
+
+        Args:
+            feature_matrix: transform的结果
+            chunk_size: 每块行数
+
+        Returns:
+            (分群标签, 到分群中心的欧氏距离)
+        """
+        nearest = np.zeros(len(feature_matrix), dtype=int)
+        distances = np.zeros(len(feature_matrix))
+        centroid_norms = (self.centroids ** 2).sum(axis=1)
+        for start in range(0, len(feature_matrix), chunk_size):
+            rows = slice(start, start + chunk_size)
+            chunk = feature_matrix[rows]
+            squared = (chunk ** 2).sum(axis=1)[:, None] - 2 * chunk @ self.centroids.T + centroid_norms
+            nearest[rows] = squared.argmin(axis=1)
+            distances[rows] = np.sqrt(np.maximum(squared[np.arange(len(chunk)), nearest[rows]], 0.0))
+        return self.segment_ids[nearest], distances
+
+    def assign(self, feature_frame: pd.DataFrame) -> pd.DataFrame:
+        """
+        为特征表中的用户分配分群
+
+        Args:
+            feature_frame: 以user_pseudo_id为索引的特征表
+
+        Returns:
+            user_pseudo_id、segment_id、segment_name、distance四列的分配结果
+        """
+        if feature_frame.empty:
+            return pd.DataFrame(columns=['user_pseudo_id', 'segment_id', 'segment_name', 'distance'])
+        segment_ids, distances = self.assign_matrix(self.transform(feature_frame))
+        return pd.DataFrame({
+            'user_pseudo_id': feature_frame.index.to_numpy(),
+            'segment_id': segment_ids,
+            'segment_name': [self.segment_names.get(int(segment_id), f"Segment {segment_id}")
+                             for segment_id in segment_ids],
+            'distance': distances
+        })
+
+    def check_compatible(self) -> None:
+        """特征规格变化后模型的特征不再可比，需要重新分群"""
+        if self.spec_key != feature_spec_key():
+            raise ValueError(f"Segmentation model was fitted with feature spec {self.spec_key}, "
+                             f"current spec is {feature_spec_key()}; rebuild the segmentation")
+
+    def save(self, path: str) -> None:
+        """保存模型到磁盘"""
+        pd.to_pickle(self, path)
+
+    @classmethod
+    def load(cls, path: str) -> 'SegmentationModel':
+        """从磁盘加载模型并检查特征规格"""
+        model = pd.read_pickle(path)
+        if not isinstance(model, cls):
+            raise ValueError(f"{path} does not contain a segmentation model")
+        model.check_compatible()
+        return model
+
+
+def user_feature_rows(user_ids: Iterable[Any],
+                      events: pd.DataFrame,
+                      users: Optional[pd.DataFrame] = None,
+                      sessions: Optional[pd.DataFrame] = None,
+                      reference_time: Optional[pd.Timestamp] = None) -> pd.DataFrame:
+    """
+    只计算指定用户的特征
+
+    Args:
+        user_ids: 用户ID
+        events: 事件数据（可以包含其他用户）
+        users: 用户数据
+        sessions: 会话数据
+        reference_time: 计算最近活跃天数的参考时间
+
+    Returns:
+        指定用户中有事件的用户的特征表
+    """
+    user_ids = pd.unique(np.asarray(list(user_ids), dtype=object))
+
+    def select(data: Optional[pd.DataFrame]) -> Optional[pd.DataFrame]:
+        if data is None or data.empty or 'user_pseudo_id' not in data.columns:
+            return data
+        return data[data['user_pseudo_id'].isin(user_ids)]
+
+    user_events = select(events)
+    if user_events is None or user_events.empty:
+        return pd.DataFrame()
+    return build_user_feature_frame(user_events, select(users), select(sessions), reference_time)
+
+
+class SegmentAssigner:
+    """作为存储管理器事件监听器的在线分群分配器"""
+
+    def __init__(self,
+                 model: SegmentationModel,
+                 storage_manager=None,
+                 max_recent: int = 1000,
+                 reference_time: Optional[pd.Timestamp] = None):
+        """
+        初始化分配器
+
+        Args:
+            model: 分群模型
+            storage_manager: 数据存储管理器，追加事件时从中读取涉及用户的全部事件
+            max_recent: 保留的最近分配记录数
+            reference_time: 计算新用户特征的参考时间，默认为模型拟合时特征的参考时间，
+                            使新用户与训练用户的最近活跃天数等特征基于同一时间
+        """
+        model.check_compatible()
+        self.model = model
+        self.reference_time = reference_time if reference_time is not None else model.reference_time
+        self._storage_ref = weakref.ref(storage_manager) if storage_manager is not None else None
+        self.assignments: Dict[Any, int] = {}  # 用户ID -> 最近一次分配的分群（事件替换后为空，见segments）
+        self.recent_assignments: deque = deque(maxlen=max_recent)
+        self._stale = False  # 事件被替换后assignments过期，等待重新分配
+        self._stale_events: Optional[pd.DataFrame] = None
+
+    @property
+    def storage_manager(self):
+        return self._storage_ref() if self._storage_ref is not None else None
+
+    def assign_users(self,
+                     user_ids: Iterable[Any],
+                     events: pd.DataFrame,
+                     users: Optional[pd.DataFrame] = None,
+                     sessions: Optional[pd.DataFrame] = None) -> pd.DataFrame:
+        """
+        计算用户的特征并分配分群，结果记入assignments
+
+        Returns:
+            分配结果（见SegmentationModel.assign）
+        """
+        result = self.model.assign(user_feature_rows(user_ids, events, users, sessions, self.reference_time))
+        if not result.empty:
+            self.assignments.update(zip(result['user_pseudo_id'].tolist(), result['segment_id'].tolist()))
+            self.recent_assignments.extend(result.to_dict('records')[-self.recent_assignments.maxlen:])
+        return result
+
+    def on_storage_events(self, events: pd.DataFrame, replaced: bool) -> None:
+        """
+        存储管理器事件写入回调：追加时只分配涉及的用户，替换时只标记分配结果过期，
+        在下一次调用assign或segments时再为全部用户重新分配
+
+        Args:
+            events: 新写入的事件
+            replaced: 是否替换了全部事件
+        """
+        storage = self.storage_manager
+        if replaced:
+            self.assignments = {}
+            self._stale = True
+            # 没有存储管理器时保留替换后的事件，重新分配时使用
+            self._stale_events = events if storage is None else None
+            return
+        if self._stale:
+            if storage is None:
+                self._stale_events = pd.concat([self._stale_events, events], ignore_index=True)
+            return
+        users = storage.get_data('users') if storage is not None else None
+        sessions = storage.get_data('sessions') if storage is not None else None
+        user_ids = pd.unique(events['user_pseudo_id'])
+        if storage is not None:
+            history = storage.get_data('events', filters={'user_pseudo_id': list(user_ids)})
+        else:
+            history = events
+        result = self.assign_users(user_ids, history, users, sessions)
+        logger.info(f"为{len(result)}个用户分配分群")
+
+    def _refresh(self) -> None:
+        """事件被替换后为全部用户重新分配分群"""
+        if not self._stale:
+            return
+        storage = self.storage_manager
+        if storage is not None:
+            events = storage.get_data('events')
+            users, sessions = storage.get_data('users'), storage.get_data('sessions')
+        else:
+            events, users, sessions = self._stale_events, None, None
+        self._stale, self._stale_events = False, None
+        result = self.assign_users(pd.unique(events['user_pseudo_id']), events, users, sessions)
+        logger.info(f"事件替换后为{len(result)}个用户重新分配分群")
+
+    def assign(self, user_ids: Iterable[Any]) -> Dict[Any, int]:
+        """
+        已分配用户的分群，事件被替换后先重新分配
+
+        Args:
+            user_ids: 用户ID
+
+        Returns:
+            用户ID -> 分群标签，没有分配结果的用户不在结果中
+        """
+        self._refresh()
+        return {user_id: self.assignments[user_id] for user_id in user_ids if user_id in self.assignments}
+
+    def segments(self) -> Dict[Any, int]:
+        """
+        全部已分配用户的分群，事件被替换后先重新分配
+
+        Returns:
+            用户ID -> 分群标签
+        """
+        self._refresh()
+        return dict(self.assignments)
@@ -0,0 +1,167 @@
+"""
+分群画像统计模块
+
+由聚类标签构建一次分群指示矩阵，所有特征的分群均值、分位数、相对总体的提升度、
+分类特征的众数和单因素方差分析F统计量都按矩阵运算一次得到，
+不再逐个分群、逐个特征循环，特征数量很多时画像计算仍然很快。
+"""
+
+import numpy as np
+from typing import Any, Dict, List, Optional, Sequence, Tuple
+from dataclasses import dataclass
+from scipy import sparse
+from scipy.stats import f as f_distribution
+import logging
+
+logger = logging.getLogger(__name__)
+
+PROFILE_QUANTILES = (0.25, 0.5, 0.75)
+
+
+@dataclass
+class SegmentStatistics:
+    """各分群的特征统计：行对应labels，列对应特征"""
+    labels: np.ndarray  # 分群标签（升序）
+    codes: np.ndarray  # 每行的分群编码（labels中的位置）
+    sizes: np.ndarray  # 各分群行数
+    means: np.ndarray  # 分群 × 特征的均值
+    overall_means: np.ndarray  # 总体均值
+    quantiles: Optional[np.ndarray] = None  # 分群 × 分位数 × 特征
+
+    @property
+    def lift(self) -> np.ndarray:
+        """分群均值相对总体均值的提升度，总体均值为0时为NaN"""
+        with np.errstate(divide='ignore', invalid='ignore'):
+            return np.where(self.overall_means != 0, self.means / self.overall_means, np.nan)
+
+    def members(self) -> List[np.ndarray]:
+        """各分群的行号（保持原顺序）"""
+        order = np.argsort(self.codes, kind='stable')
+        return np.split(order, np.cumsum(self.sizes)[:-1])
+
+
+def indicator_matrix(codes: np.ndarray, n_groups: int) -> sparse.csr_matrix:
+    """分群 × 行的0/1稀疏矩阵"""
+    return sparse.csr_matrix((np.ones(len(codes)), (codes, np.arange(len(codes)))), shape=(n_groups, len(codes)))
+
+
+def segment_statistics(values: np.ndarray,
+                       cluster_labels: np.ndarray,
+                       quantiles: Optional[Sequence[float]] = None) -> SegmentStatistics:
+    """
+    一次计算所有特征的分群均值（可选分位数）
+
+    Args:
+        values: 行 × 特征的数值矩阵
+        cluster_labels: 聚类标签
+        quantiles: 需要的分位数，None表示不计算
+
+    Returns:
+        分群统计
+    """
+    labels, codes = np.unique(cluster_labels, return_inverse=True)
+    sizes = np.bincount(codes, minlength=len(labels))
+    means = np.asarray(indicator_matrix(codes, len(labels)) @ values) / sizes[:, None]
+
+    segment_quantiles = None
+    if quantiles is not None:
+        order = np.argsort(codes, kind='stable')
+        grouped = values[order]
+        bounds = np.concatenate([[0], np.cumsum(sizes)])
+        segment_quantiles = np.stack([np.quantile(grouped[start:end], quantiles, axis=0)
+                                      for start, end in zip(bounds[:-1], bounds[1:])])
+
+    return SegmentStatistics(labels=labels, codes=codes, sizes=sizes, means=means,
+                             overall_means=values.mean(axis=0), quantiles=segment_quantiles)
+
+
+def anova_f(feature_matrix: np.ndarray,
+            cluster_labels: np.ndarray,
+            chunk_size: int = 100_000) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    所有特征的单因素方差分析F统计量和p值
+
+    组内平方和按行块直接累加与分群均值的偏差平方，避免平方和相减的舍入误差；
+    组内平方和为0的特征F记为0、p记为1。
+
+    Args:
+        feature_matrix: 行 × 特征矩阵
+        cluster_labels: 聚类标签
+        chunk_size: 累加组内平方和时每块行数
+
+    Returns:
+        (F统计量, p值)，与特征一一对应
+    """
+    statistics = segment_statistics(feature_matrix, cluster_labels)
+    n_rows, n_groups = len(feature_matrix), len(statistics.labels)
+    n_features = feature_matrix.shape[1]
+    if n_groups < 2 or n_rows <= n_groups:
+        return np.zeros(n_features), np.ones(n_features)
+
+    between = (statistics.sizes[:, None] * (statistics.means - statistics.overall_means) ** 2).sum(axis=0)
+    within = np.zeros(n_features)
+    for start in range(0, n_rows, chunk_size):
+        rows = slice(start, start + chunk_size)
+        within += ((feature_matrix[rows] - statistics.means[statistics.codes[rows]]) ** 2).sum(axis=0)
+
+    valid = within > 0
+    f_statistics = np.zeros(n_features)
+    f_statistics[valid] = (between[valid] / (n_groups - 1)) / (within[valid] / (n_rows - n_groups))
+    p_values = np.ones(n_features)
+    p_values[valid] = f_distribution.sf(f_statistics[valid], n_groups - 1, n_rows - n_groups)
+    return f_statistics, p_values
+
+
+def dominant_values(values: np.ndarray, codes: np.ndarray, n_groups: int) -> List[Any]:
+    """各分群中出现次数最多的取值（次数相同时取排序靠前的值）"""
+    categories, value_codes = np.unique(values.astype(str), return_inverse=True)
+    counts = np.zeros((n_groups, len(categories)), dtype=np.int64)
+    np.add.at(counts, (codes, value_codes), 1)
+    return [categories[index] for index in counts.argmax(axis=1)]
+
+
+def top_deviations(means: np.ndarray,
+                   overall_means: np.ndarray,
+                   feature_names: List[str],
+                   top: int = 3) -> List[List[Tuple[str, bool]]]:
+    """
+    各分群均值偏离总体均值最大的特征
+
+    Args:
+        means: 分群 × 特征的均值
+        overall_means: 总体均值
+        feature_names: 特征名
+        top: 每个分群返回的特征数
+
+    Returns:
+        每个分群的[(特征名, 是否高于总体)]，按偏离从大到小
+    """
+    differences = np.abs(means - overall_means)
+    ranked = np.argsort(differences, axis=1)[:, ::-1][:, :top]
+    return [[(feature_names[index], bool(means[row, index] > overall_means[index])) for index in indices]
+            for row, indices in enumerate(ranked)]
+
+
+def feature_summaries(statistics: SegmentStatistics,
+                      feature_names: List[str],
+                      quantiles: Sequence[float] = PROFILE_QUANTILES) -> List[Dict[str, Dict[str, float]]]:
+    """
+    各分群的特征均值、提升度和分位数字典
+
+    Returns:
+        与statistics.labels对应：{'feature_means': {...}, 'feature_lift': {...}, 'feature_quantiles': {'p50': {...}}}
+    """
+    lift = statistics.lift
+    summaries = []
+    for row in range(len(statistics.labels)):
+        summary = {
+            'feature_means': dict(zip(feature_names, statistics.means[row].tolist())),
+            'feature_lift': dict(zip(feature_names, lift[row].tolist()))
+        }
+        if statistics.quantiles is not None:
+            summary['feature_quantiles'] = {
+                f'p{int(round(quantile * 100))}': dict(zip(feature_names, statistics.quantiles[row, index].tolist()))
+                for index, quantile in enumerate(quantiles)
+            }
+        summaries.append(summary)
+    return summaries
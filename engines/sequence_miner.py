@@ -0,0 +1,312 @@
+"""
+序列模式挖掘模块
+
+基于会话路径存储的PrefixSpan式序列模式挖掘。每一层对所有频繁前缀的投影数据库
+同时做向量化扩展，不满足最小支持度的前缀立即剪枝（支持度单调递减）。
+支持连续子路径和允许间隔的子序列两种模式，模式的用户数、平均会话时长和
+转化率在同一次扫描中计算。
+"""
+
+import numpy as np
+from typing import List, Optional, Tuple
+from dataclasses import dataclass
+import logging
+
+from engines.session_store import SessionPathStore
+
+logger = logging.getLogger(__name__)
+
+
+@dataclass
+class SequentialPattern:
+    """挖掘得到的序列模式"""
+    codes: Tuple[int, ...]  # 事件编码序列
+    frequency: int  # 出现次数（间隔模式下等于支持会话数）
+    support: int  # 包含该模式的会话数
+    user_count: int
+    avg_duration: float
+    conversion_rate: float
+
+
+class SequentialPatternMiner:
+    """
+    序列模式挖掘器
+
+    contiguous模式挖掘连续子路径，每次出现都计入频次；
+    gapped模式挖掘允许间隔的子序列（经典PrefixSpan），每个会话只保留最左嵌入；
+    用max_gap限制相邻两步之间最多跳过的事件数时，最左嵌入不再足够，
+    改为保留每个会话中所有不同的嵌入终点。
+    """
+
+    MODES = ('contiguous', 'gapped')
+
+    def __init__(self,
+                 min_support: float = 0.01,
+                 min_length: int = 2,
+                 max_length: int = 10,
+                 mode: str = 'contiguous',
+                 min_frequency: int = 1,
+                 max_gap: Optional[int] = None,
+                 chunk_size: int = 5_000_000):
+        """
+        初始化序列模式挖掘器
+
+        Args:
+            min_support: 最小支持度（包含模式的会话占比）
+            min_length: 最小模式长度
+            max_length: 最大模式长度
+            mode: 'contiguous' 或 'gapped'
+            min_frequency: 最小出现次数
+            max_gap: gapped模式下相邻两步之间最多跳过的事件数（None表示不限）
+            chunk_size: gapped模式下每批展开的后缀位置数上限
+        """
+        if mode not in self.MODES:
+            raise ValueError(f"Unsupported pattern mode: {mode}")
+        self.min_support = min_support
+        self.min_length = max(min_length, 1)
+        self.max_length = max_length
+        self.mode = mode
+        self.min_frequency = min_frequency
+        self.max_gap = max_gap
+        self.chunk_size = chunk_size
+
+    def mine(self, store: SessionPathStore) -> List[SequentialPattern]:
+        """
+        挖掘频繁序列模式
+
+        Args:
+            store: 会话路径存储
+
+        Returns:
+            按频次、支持会话数降序排列的模式列表
+        """
+        n_sessions = len(store)
+        if n_sessions == 0 or len(store.event_codes) == 0 or self.max_length < 1:
+            return []
+
+        self._store = store
+        self._n_codes = len(store.event_vocab)
+        self._min_sessions = max(int(np.ceil(self.min_support * n_sessions)), 1)
+        self._session_ends = np.repeat(store.offsets[1:], store.lengths)
+        self._leftmost = self.mode == 'gapped' and self.max_gap is None
+        if self._leftmost:
+            self._previous_same = self._previous_same_event()
+
+        patterns = []
+        prefixes, occ_prefix, occ_session, occ_pos = self._first_level()
+        length = 1
+
+        while len(prefixes):
+            prefixes, occ_prefix, occ_session, occ_pos, stats = self._prune(
+                prefixes, occ_prefix, occ_session, occ_pos
+            )
+            if length >= self.min_length:
+                patterns.extend(self._to_patterns(prefixes, stats))
+            if length >= self.max_length or len(occ_pos) == 0:
+                break
+
+            if self.mode == 'contiguous':
+                prefixes, occ_prefix, occ_session, occ_pos = self._extend_contiguous(
+                    prefixes, occ_prefix, occ_session, occ_pos
+                )
+            else:
+                prefixes, occ_prefix, occ_session, occ_pos = self._extend_gapped(
+                    prefixes, occ_prefix, occ_session, occ_pos
+                )
+            length += 1
+
+        patterns.sort(key=lambda p: (-p.frequency, -p.support, len(p.codes), p.codes))
+        return patterns
+
+    def _previous_same_event(self) -> np.ndarray:
+        """每个位置上同一会话中同一事件的上一次出现位置（没有则为-1）"""
+        store = self._store
+        keys = store.session_index * self._n_codes + store.event_codes
+        # 键按会话升序，稳定排序后同键位置保持升序
+        order = np.argsort(keys, kind='stable')
+        previous = np.full(len(keys), -1, dtype=np.int64)
+        same = keys[order[1:]] == keys[order[:-1]]
+        previous[order[1:][same]] = order[:-1][same]
+        return previous
+
+    def _first_level(self) -> Tuple[np.ndarray, ...]:
+        """长度为1的前缀及其出现位置"""
+        store = self._store
+        codes = store.event_codes.astype(np.int64)
+        positions = np.arange(len(codes))
+        sessions = store.session_index
+
+        if self._leftmost:
+            # 每个会话只保留每个事件的第一次出现
+            first = self._previous_same < 0
+            positions = positions[first]
+            codes = codes[first]
+            sessions = sessions[first]
+
+        prefixes = np.arange(self._n_codes, dtype=np.int64)[:, None]
+        return prefixes, codes, sessions, positions
+
+    def _prune(self, prefixes, occ_prefix, occ_session, occ_pos):
+        """剪掉不频繁的前缀，并同时计算保留前缀的统计量"""
+        store = self._store
+
+        # 支持会话数不超过出现次数，先按出现次数粗筛
+        frequent = np.bincount(occ_prefix, minlength=len(prefixes)) >= max(self._min_sessions, self.min_frequency)
+        if not frequent.all():
+            prefixes, occ_prefix, occ_session, occ_pos = self._select(
+                frequent, prefixes, occ_prefix, occ_session, occ_pos
+            )
+        n_prefixes = len(prefixes)
+
+        # 前缀与会话的去重组合；出现位置按会话升序，稳定排序可利用已有的有序段
+        if self._leftmost:
+            pair_prefix, pair_session = occ_prefix, occ_session
+        else:
+            pair_keys = np.sort(occ_session * n_prefixes + occ_prefix, kind='stable')
+            distinct = np.ones(len(pair_keys), dtype=bool)
+            distinct[1:] = pair_keys[1:] != pair_keys[:-1]
+            pair_keys = pair_keys[distinct]
+            pair_session = pair_keys // max(n_prefixes, 1)
+            pair_prefix = pair_keys % max(n_prefixes, 1)
+
+        support = np.bincount(pair_prefix, minlength=n_prefixes)
+        if self.mode == 'contiguous':
+            frequency = np.bincount(occ_prefix, minlength=n_prefixes)
+        else:
+            frequency = support
+        keep = (support >= self._min_sessions) & (frequency >= self.min_frequency)
+
+        new_ids = np.full(n_prefixes, -1, dtype=np.int64)
+        new_ids[keep] = np.arange(int(keep.sum()))
+
+        pair_keep = keep[pair_prefix]
+        pair_prefix = new_ids[pair_prefix[pair_keep]]
+        pair_session = pair_session[pair_keep]
+
+        n_kept = int(keep.sum())
+        user_keys = np.unique(pair_prefix * len(store.user_index) + store.user_codes[pair_session])
+        kept_support = support[keep]
+        stats = {
+            'frequency': frequency[keep],
+            'support': kept_support,
+            'user_count': np.bincount(user_keys // len(store.user_index), minlength=n_kept),
+            'avg_duration': np.bincount(pair_prefix, weights=store.durations[pair_session],
+                                        minlength=n_kept) / np.maximum(kept_support, 1),
+            'conversion_rate': np.bincount(pair_prefix, weights=store.conversions[pair_session] > 0,
+                                           minlength=n_kept) / np.maximum(kept_support, 1)
+        }
+
+        return self._select(keep, prefixes, occ_prefix, occ_session, occ_pos) + (stats,)
+
+    def _select(self, keep, prefixes, occ_prefix, occ_session, occ_pos):
+        """只保留指定的前缀及其出现位置，前缀重新连续编号"""
+        new_ids = np.cumsum(keep) - 1
+        occ_keep = keep[occ_prefix]
+        return prefixes[keep], new_ids[occ_prefix[occ_keep]], occ_session[occ_keep], occ_pos[occ_keep]
+
+    def _extend_contiguous(self, prefixes, occ_prefix, occ_session, occ_pos):
+        """把每次出现向后扩展一个相邻事件"""
+        next_pos = occ_pos + 1
+        valid = next_pos < self._session_ends[occ_pos]
+        next_pos = next_pos[valid]
+        keys = occ_prefix[valid] * self._n_codes + self._store.event_codes[next_pos].astype(np.int64)
+
+        return self._relabel(prefixes, keys, occ_session[valid], next_pos)
+
+    def _extend_gapped(self, prefixes, occ_prefix, occ_session, occ_pos):
+        """在每个投影后缀中查找每个事件的第一次出现"""
+        suffix_start = occ_pos + 1
+        suffix_end = self._session_ends[occ_pos]
+        if self.max_gap is not None:
+            suffix_end = np.minimum(suffix_end, suffix_start + self.max_gap + 1)
+        suffix_len = np.maximum(suffix_end - suffix_start, 0)
+
+        # 分批展开后缀，控制中间数组大小
+        cumulative = np.cumsum(suffix_len)
+        total = int(cumulative[-1]) if len(cumulative) else 0
+        splits = np.searchsorted(cumulative, np.arange(self.chunk_size, total, self.chunk_size), side='right')
+        edges = np.unique(np.concatenate([[0], splits, [len(suffix_len)]]))
+
+        keys, sessions, positions = [], [], []
+        for chunk_start, chunk_end in zip(edges[:-1], edges[1:]):
+            lengths = suffix_len[chunk_start:chunk_end]
+            entry = np.repeat(np.arange(chunk_start, chunk_end), lengths)
+            within = np.arange(len(entry)) - np.repeat(np.cumsum(lengths) - lengths, lengths)
+            pos = suffix_start[entry] + within
+            codes = self._store.event_codes[pos].astype(np.int64)
+            if self._leftmost:
+                # 事件在投影后缀中的第一次出现即最左嵌入
+                first = self._previous_same[pos] < suffix_start[entry]
+                entry, codes, pos = entry[first], codes[first], pos[first]
+            keys.append(occ_prefix[entry] * self._n_codes + codes)
+            sessions.append(occ_session[entry])
+            positions.append(pos)
+
+        if not keys:
+            empty = np.empty(0, dtype=np.int64)
+            return np.empty((0, prefixes.shape[1] + 1), dtype=np.int64), empty, empty, empty
+
+        keys, sessions, positions = np.concatenate(keys), np.concatenate(sessions), np.concatenate(positions)
+        if self.max_gap is not None:
+            # 不同前缀嵌入可能到达同一终点，只保留一次
+            _, first = np.unique(keys * len(self._store.event_codes) + positions, return_index=True)
+            keys, sessions, positions = keys[first], sessions[first], positions[first]
+        return self._relabel(prefixes, keys, sessions, positions)
+
+    def _relabel(self, prefixes, keys, sessions, positions):
+        """把(父前缀, 下一事件)组合编号为新前缀"""
+        key_space = len(prefixes) * self._n_codes
+        if key_space <= max(4 * len(keys), 1 << 20):
+            # 键空间不大时用计数表编号，避免排序
+            present = np.bincount(keys, minlength=key_space) > 0
+            unique_keys = np.flatnonzero(present)
+            new_prefix = (np.cumsum(present) - 1)[keys]
+        else:
+            unique_keys, new_prefix = np.unique(keys, return_inverse=True)
+        new_prefixes = np.column_stack([
+            prefixes[unique_keys // self._n_codes], unique_keys % self._n_codes
+        ])
+        return new_prefixes, new_prefix.astype(np.int64), sessions, positions
+
+    def _to_patterns(self, prefixes, stats) -> List[SequentialPattern]:
+        """把保留的前缀转换为模式对象"""
+        return [
+            SequentialPattern(
+                codes=tuple(prefix.tolist()),
+                frequency=int(frequency),
+                support=int(support),
+                user_count=int(user_count),
+                avg_duration=float(avg_duration),
+                conversion_rate=float(conversion_rate)
+            )
+            for prefix, frequency, support, user_count, avg_duration, conversion_rate in zip(
+                prefixes, stats['frequency'], stats['support'], stats['user_count'],
+                stats['avg_duration'], stats['conversion_rate']
+            )
+        ]
+
+
+def mine_sequential_patterns(store: SessionPathStore,
+                             min_support: float = 0.01,
+                             min_length: int = 2,
+                             max_length: int = 10,
+                             mode: str = 'contiguous',
+                             min_frequency: int = 1,
+                             max_gap: Optional[int] = None) -> List[SequentialPattern]:
+    """
+    挖掘会话路径中的频繁序列模式
+
+    Args:
+        store: 会话路径存储
+        min_support: 最小支持度（包含模式的会话占比）
+        min_length: 最小模式长度
+        max_length: 最大模式长度
+        mode: 'contiguous' 或 'gapped'
+        min_frequency: 最小出现次数
+        max_gap: gapped模式下相邻两步之间最多跳过的事件数
+
+    Returns:
+        按频次降序排列的模式列表
+    """
+    miner = SequentialPatternMiner(min_support, min_length, max_length, mode, min_frequency, max_gap)
+    return miner.mine(store)
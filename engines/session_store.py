@@ -0,0 +1,348 @@
+"""
+会话路径存储模块
+
+以整数编码的列式结构存储重构后的用户会话：所有会话的事件编码拼接为一个int32数组，
+按会话偏移量切分；起止时间、时长、页面浏览数、转化数和用户编码存为会话级平行数组。
+路径分析直接读取这些数组，完整的事件字典只在访问时按需物化。
+"""
+
+import pandas as pd
+import numpy as np
+from typing import Dict, List, Any, Optional, Iterable, Iterator, Union
+from collections.abc import Sequence
+from dataclasses import dataclass, field
+from datetime import datetime
+import logging
+
+from engines.funnel_matcher import UserTimelines, build_user_timelines, event_times_ns
+
+logger = logging.getLogger(__name__)
+
+
+@dataclass
+class UserSession:
+    """用户会话数据结构"""
+    session_id: str
+    user_id: str
+    start_time: datetime
+    end_time: datetime
+    events: List[Dict[str, Any]]
+    duration_seconds: int
+    page_views: int
+    conversions: int
+    path_sequence: List[str]
+
+
+class SessionEvents(Sequence):
+    """会话事件的惰性视图，首次访问内容时才物化为事件字典"""
+
+    def __init__(self, store: 'SessionPathStore', index: int):
+        self._store = store
+        self._index = index
+        self._events: Optional[List[Dict[str, Any]]] = None
+
+    def _materialize(self) -> List[Dict[str, Any]]:
+        if self._events is None:
+            self._events = self._store.session_events(self._index)
+        return self._events
+
+    def __len__(self) -> int:
+        return int(self._store.lengths[self._index])
+
+    def __getitem__(self, item):
+        return self._materialize()[item]
+
+    def __iter__(self) -> Iterator[Dict[str, Any]]:
+        return iter(self._materialize())
+
+    def __eq__(self, other) -> bool:
+        return list(self) == list(other)
+
+    def __repr__(self) -> str:
+        return f"SessionEvents(session={self._index}, events={len(self)})"
+
+
+@dataclass(eq=False)
+class SessionPathStore:
+    """
+    整数编码的会话路径存储
+
+    第i个会话的事件编码为event_codes[offsets[i]:offsets[i + 1]]，
+    编码通过event_vocab映射回事件名。按下标访问或迭代时返回UserSession对象。
+    """
+    event_vocab: np.ndarray  # 事件编码 -> 事件名
+    event_codes: np.ndarray  # 所有会话的事件编码（int32）
+    offsets: np.ndarray  # 每个会话在event_codes中的起点，末尾附加总长度
+    user_index: pd.Index  # 用户编码 -> 用户ID
+    user_codes: np.ndarray  # 每个会话的用户编码
+    session_numbers: np.ndarray  # 每个会话在所属用户内的序号（从1开始）
+    start_times: np.ndarray  # 每个会话的开始时间（datetime64[ns]）
+    end_times: np.ndarray  # 每个会话的结束时间（datetime64[ns]）
+    durations: np.ndarray  # 每个会话的时长（秒）
+    page_views: np.ndarray  # 每个会话的页面浏览数
+    conversions: np.ndarray  # 每个会话的转化事件数
+    source_events: Optional[pd.DataFrame] = None  # 用于物化事件字典的原始事件数据
+    source_rows: Optional[np.ndarray] = None  # 每个事件在原始数据中的行位置
+    sessions: Optional[List[UserSession]] = None  # 由会话对象构建时保留的原对象
+    _session_index: Optional[np.ndarray] = field(default=None, init=False, repr=False)
+
+    @classmethod
+    def from_events(cls,
+                    events: pd.DataFrame,
+                    session_timeout_minutes: float = 30,
+                    conversion_events: Iterable[str] = (),
+                    timelines: Optional[UserTimelines] = None) -> 'SessionPathStore':
+        """
+        从事件数据重构会话：同一用户相邻事件间隔超过超时时间即开始新会话
+
+        Args:
+            events: 事件数据
+            session_timeout_minutes: 会话超时时间（分钟）
+            conversion_events: 视为转化的事件名
+            timelines: 已构建的全部事件的用户时间线，None时由events构建
+
+        Returns:
+            会话路径存储
+        """
+        if timelines is None:
+            timelines = build_user_timelines(events)
+        n_events = len(timelines.times)
+        if n_events == 0:
+            return cls.from_sessions([])
+
+        codes, vocab = pd.factorize(timelines.event_names, use_na_sentinel=False)
+        codes = codes.astype(np.int32)
+        times = timelines.times
+
+        new_session = np.ones(n_events, dtype=bool)
+        timeout_ns = int(session_timeout_minutes * 60 * 1e9)
+        new_session[1:] = ((timelines.user_codes[1:] != timelines.user_codes[:-1]) |
+                           (np.diff(times) > timeout_ns))
+        starts = np.flatnonzero(new_session)
+        offsets = np.append(starts, n_events)
+
+        user_codes = timelines.user_codes[starts].astype(np.int32)
+        # 会话在所属用户内的序号（从1开始）
+        first_of_user = np.searchsorted(user_codes, user_codes, side='left')
+        session_numbers = np.arange(len(starts)) - first_of_user + 1
+
+        start_times = times[starts]
+        end_times = times[offsets[1:] - 1]
+
+        page_view_codes = np.flatnonzero(vocab == 'page_view')
+        conversion_codes = np.flatnonzero(np.isin(vocab, list(conversion_events)))
+
+        return cls(
+            event_vocab=np.asarray(vocab, dtype=object),
+            event_codes=codes,
+            offsets=offsets.astype(np.int64),
+            user_index=timelines.user_index,
+            user_codes=user_codes,
+            session_numbers=session_numbers.astype(np.int32),
+            start_times=start_times.view('datetime64[ns]'),
+            end_times=end_times.view('datetime64[ns]'),
+            durations=(end_times - start_times) // 10**9,
+            page_views=np.add.reduceat(np.isin(codes, page_view_codes), starts).astype(np.int32),
+            conversions=np.add.reduceat(np.isin(codes, conversion_codes), starts).astype(np.int32),
+            source_events=events,
+            source_rows=timelines.source_rows
+        )
+
+    @classmethod
+    def from_sessions(cls, sessions: List[UserSession]) -> 'SessionPathStore':
+        """
+        从会话对象列表构建存储，会话级统计沿用对象中的值
+
+        Args:
+            sessions: 用户会话列表
+
+        Returns:
+            会话路径存储
+        """
+        sessions = list(sessions)
+        lengths = np.array([len(s.path_sequence) for s in sessions], dtype=np.int64)
+        flat_path = pd.Series([e for s in sessions for e in s.path_sequence], dtype=object)
+        codes, vocab = pd.factorize(flat_path, use_na_sentinel=False)
+        user_codes, user_index = pd.factorize(pd.Series([s.user_id for s in sessions], dtype=object))
+
+        def to_datetime64(values: List[Any]) -> np.ndarray:
+            return pd.to_datetime(pd.Series(values, dtype=object)).to_numpy(dtype='datetime64[ns]')
+
+        return cls(
+            event_vocab=np.asarray(vocab, dtype=object),
+            event_codes=codes.astype(np.int32),
+            offsets=np.concatenate([[0], np.cumsum(lengths)]).astype(np.int64),
+            user_index=pd.Index(user_index),
+            user_codes=user_codes.astype(np.int32),
+            session_numbers=np.ones(len(sessions), dtype=np.int32),
+            start_times=to_datetime64([s.start_time for s in sessions]),
+            end_times=to_datetime64([s.end_time for s in sessions]),
+            durations=np.array([s.duration_seconds for s in sessions], dtype=np.int64),
+            page_views=np.array([s.page_views for s in sessions], dtype=np.int32),
+            conversions=np.array([s.conversions for s in sessions], dtype=np.int32),
+            sessions=sessions
+        )
+
+    @property
+    def n_sessions(self) -> int:
+        return len(self.offsets) - 1
+
+    @property
+    def lengths(self) -> np.ndarray:
+        """每个会话的路径长度"""
+        return np.diff(self.offsets)
+
+    @property
+    def session_index(self) -> np.ndarray:
+        """每个事件所属的会话下标"""
+        if self._session_index is None:
+            self._session_index = np.repeat(np.arange(self.n_sessions), self.lengths)
+        return self._session_index
+
+    def encode(self, event_names: Iterable[str]) -> np.ndarray:
+        """
+        把事件名转换为编码，不在词表中的事件名编码为-1
+
+        Args:
+            event_names: 事件名
+
+        Returns:
+            编码数组
+        """
+        lookup = {name: code for code, name in enumerate(self.event_vocab)}
+        return np.array([lookup.get(name, -1) for name in event_names], dtype=np.int64)
+
+    def decode(self, codes: Iterable[int]) -> List[str]:
+        """把编码序列转换为事件名列表"""
+        return self.event_vocab[np.asarray(codes, dtype=np.int64)].tolist()
+
+    def session_id(self, index: int) -> str:
+        """第index个会话的ID（用户ID_会话序号）"""
+        if self.sessions is not None:
+            return self.sessions[index].session_id
+        return f"{self.user_index[self.user_codes[index]]}_{self.session_numbers[index]}"
+
+    def path(self, index: int) -> List[str]:
+        """第index个会话的事件名序列"""
+        return self.decode(self.event_codes[self.offsets[index]:self.offsets[index + 1]])
+
+    def window_starts(self, length: int) -> np.ndarray:
+        """
+        获取所有不跨会话的长度为length的连续窗口起点
+
+        Args:
+            length: 窗口长度
+
+        Returns:
+            窗口起点在event_codes中的位置
+        """
+        session_ends = np.repeat(self.offsets[1:], self.lengths)
+        return np.flatnonzero(np.arange(len(self.event_codes)) + length <= session_ends)
+
+    def sessions_containing(self, pattern_codes: np.ndarray) -> np.ndarray:
+        """
+        查找连续包含指定编码序列的会话
+
+        Args:
+            pattern_codes: 事件编码序列（-1表示不在词表中的事件）
+
+        Returns:
+            会话下标数组（升序）
+        """
+        pattern_codes = np.asarray(pattern_codes)
+        if len(pattern_codes) == 0 or (pattern_codes < 0).any():
+            return np.empty(0, dtype=np.int64)
+
+        starts = self.window_starts(len(pattern_codes))
+        hit = np.ones(len(starts), dtype=bool)
+        for step, code in enumerate(pattern_codes):
+            hit &= self.event_codes[starts + step] == code
+
+        return np.unique(self.session_index[starts[hit]])
+
+    def session_events(self, index: int) -> List[Dict[str, Any]]:
+        """
+        物化第index个会话的完整事件字典
+
+        Args:
+            index: 会话下标
+
+        Returns:
+            按时间排序的事件字典列表
+        """
+        if self.sessions is not None:
+            return list(self.sessions[index].events)
+        if self.source_events is None:
+            return []
+
+        rows = self.source_rows[self.offsets[index]:self.offsets[index + 1]]
+        session_frame = self.source_events.iloc[rows]
+        records = session_frame.to_dict('records')
+        if 'event_datetime' not in session_frame.columns:
+            for record, event_time in zip(records, event_times_ns(session_frame)):
+                record['event_datetime'] = pd.Timestamp(event_time)
+        return records
+
+    def subset(self, indices: np.ndarray) -> 'SessionPathStore':
+        """
+        按会话下标选取子集，共享事件词表和用户编码
+
+        Args:
+            indices: 会话下标（或长度为会话数的布尔掩码），子集保持原有顺序
+
+        Returns:
+            子集会话路径存储
+        """
+        indices = np.asarray(indices)
+        indices = np.flatnonzero(indices) if indices.dtype == bool else np.unique(indices)
+
+        lengths = self.lengths[indices]
+        keep = np.zeros(self.n_sessions, dtype=bool)
+        keep[indices] = True
+        event_mask = keep[self.session_index]
+
+        return SessionPathStore(
+            event_vocab=self.event_vocab,
+            event_codes=self.event_codes[event_mask],
+            offsets=np.concatenate([[0], np.cumsum(lengths)]).astype(np.int64),
+            user_index=self.user_index,
+            user_codes=self.user_codes[indices],
+            session_numbers=self.session_numbers[indices],
+            start_times=self.start_times[indices],
+            end_times=self.end_times[indices],
+            durations=self.durations[indices],
+            page_views=self.page_views[indices],
+            conversions=self.conversions[indices],
+            source_events=self.source_events,
+            source_rows=self.source_rows[event_mask] if self.source_rows is not None else None,
+            sessions=[self.sessions[i] for i in indices] if self.sessions is not None else None
+        )
+
+    def __len__(self) -> int:
+        return self.n_sessions
+
+    def __getitem__(self, index: Union[int, slice]) -> Union[UserSession, List[UserSession]]:
+        if isinstance(index, slice):
+            return [self[i] for i in range(*index.indices(self.n_sessions))]
+        if index < 0:
+            index += self.n_sessions
+        if not 0 <= index < self.n_sessions:
+            raise IndexError("session index out of range")
+        if self.sessions is not None:
+            return self.sessions[index]
+
+        return UserSession(
+            session_id=self.session_id(index),
+            user_id=self.user_index[self.user_codes[index]],
+            start_time=pd.Timestamp(self.start_times[index]),
+            end_time=pd.Timestamp(self.end_times[index]),
+            events=SessionEvents(self, index),
+            duration_seconds=int(self.durations[index]),
+            page_views=int(self.page_views[index]),
+            conversions=int(self.conversions[index]),
+            path_sequence=self.path(index)
+        )
+
+    def __iter__(self) -> Iterator[UserSession]:
+        for index in range(self.n_sessions):
+            yield self[index]
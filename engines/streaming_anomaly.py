@@ -0,0 +1,382 @@
+"""
+流式异常检测模块
+
+对按事件（及可选的细分维度）划分的小时/日计数序列做在线异常检测：
+基线为带季节项的指数加权移动平均（加法Holt-Winters，无趋势项），
+尺度为残差绝对值的指数加权平均（MAD的在线近似，换算为标准差口径），
+残差超过阈值倍尺度即为异常，异常值按阈值截断后再更新基线，避免污染。
+
+每个序列只保存水平、季节项（固定长度）、尺度、观测数和当前未结束时间桶的计数，
+状态以数组形式存放，新事件追加时按时间桶逐步对所有序列向量化更新，
+连续的空时间桶按零观测的线性递推一次推进。
+"""
+
+import pandas as pd
+import numpy as np
+from typing import Any, Dict, List, Optional, Tuple
+from collections import deque
+import logging
+
+from engines.funnel_matcher import event_times_ns
+
+logger = logging.getLogger(__name__)
+
+_PERIOD_NS = {
+    'hourly': 3_600 * 1_000_000_000,
+    'daily': 86_400 * 1_000_000_000
+}
+_DEFAULT_SEASON = {'hourly': 24, 'daily': 7}
+# 正态分布下MAD换算为标准差的系数
+_MAD_TO_STD = 1.4826
+
+
+class StreamingAnomalyDetector:
+    """事件计数序列的在线异常检测器"""
+
+    def __init__(self,
+                 granularity: str = 'daily',
+                 segment_column: Optional[str] = None,
+                 season_length: Optional[int] = None,
+                 alpha: float = 0.2,
+                 gamma: float = 0.1,
+                 beta: float = 0.1,
+                 threshold: float = 3.5,
+                 warmup: Optional[int] = None,
+                 min_scale: float = 1.0,
+                 max_recent: int = 1000):
+        """
+        初始化流式异常检测器
+
+        Args:
+            granularity: 时间桶粒度，'hourly' 或 'daily'
+            segment_column: 细分维度列，每个 (事件, 细分值) 是一个序列；字典列用'列.键'指定字段，
+                            如device.category、geo.country
+            season_length: 季节周期（时间桶数），默认小时粒度24、日粒度7，1表示不建季节项
+            alpha: 水平的平滑系数
+            gamma: 季节项的平滑系数
+            beta: 尺度的平滑系数
+            threshold: 异常阈值（稳健z分数）
+            warmup: 开始报告异常前需要的观测数，默认两个季节周期
+            min_scale: 尺度下限，避免低计数序列的微小波动被报告为异常
+            max_recent: 保留的最近异常点数
+        """
+        if granularity not in _PERIOD_NS:
+            raise ValueError(f"Unsupported granularity: {granularity}")
+
+        self.granularity = granularity
+        self.segment_column = segment_column
+        self.season_length = season_length or _DEFAULT_SEASON[granularity]
+        self.alpha = alpha
+        self.gamma = gamma
+        self.beta = beta
+        self.threshold = threshold
+        self.warmup = warmup if warmup is not None else 2 * self.season_length
+        self.min_scale = min_scale
+
+        self._period_ns = _PERIOD_NS[granularity]
+        self.recent_anomalies: deque = deque(maxlen=max_recent)
+        self.reset()
+
+    def reset(self) -> None:
+        """清空所有序列状态"""
+        self._keys: Dict[Tuple[Any, Any], int] = {}
+        self._key_list: List[Tuple[Any, Any]] = []
+        self._watermark: Optional[int] = None  # 当前未结束的时间桶
+        self.late_events = 0  # 落在已结束时间桶的事件数（被丢弃）
+        self._level = None
+        self._allocate(0)
+        self.recent_anomalies.clear()
+
+    def _allocate(self, capacity: int) -> None:
+        """分配（或扩容）序列状态数组"""
+        old = self._level
+        size = 0 if old is None else len(old)
+        fields = {
+            '_level': np.zeros(capacity),
+            '_scale': np.zeros(capacity),
+            '_observations': np.zeros(capacity, dtype=np.int64),
+            '_open_period': np.full(capacity, -1, dtype=np.int64),
+            '_open_count': np.zeros(capacity),
+            '_seasonal': np.zeros((capacity, self.season_length))
+        }
+        for name, array in fields.items():
+            if size:
+                array[:size] = getattr(self, name)
+            setattr(self, name, array)
+
+    def _series_ids(self, keys: List[Tuple[Any, Any]]) -> np.ndarray:
+        """查找或新建序列编号"""
+        ids = np.empty(len(keys), dtype=np.int64)
+        for i, key in enumerate(keys):
+            series = self._keys.get(key)
+            if series is None:
+                series = len(self._key_list)
+                self._keys[key] = series
+                self._key_list.append(key)
+            ids[i] = series
+        if len(self._key_list) > len(self._level):
+            self._allocate(max(2 * len(self._level), len(self._key_list), 16))
+        return ids
+
+    @property
+    def n_series(self) -> int:
+        """序列数"""
+        return len(self._key_list)
+
+    def update(self, events: pd.DataFrame) -> List[Dict[str, Any]]:
+        """
+        追加一批事件，结束早于本批最新时间桶的所有时间桶并检测异常
+
+        Args:
+            events: 新事件，需要event_name和时间字段
+
+        Returns:
+            本次结束的时间桶中的异常点
+        """
+        if events.empty:
+            return []
+
+        periods = event_times_ns(events) // self._period_ns
+        segments = self._segment_values(events)
+        key_frame = pd.DataFrame({'event': events['event_name'].to_numpy(),
+                                  'segment': segments, 'period': periods})
+        try:
+            grouped = key_frame.groupby(['event', 'segment', 'period'], dropna=False, sort=False).size()
+        except TypeError:
+            raise ValueError(f"Segment column '{self.segment_column}' holds non-scalar values; "
+                             f"use a dotted key such as '{self.segment_column}.category'")
+
+        index = grouped.index
+        segment_values = index.get_level_values('segment').astype(object)
+        segment_values = segment_values.where(pd.notna(segment_values), None)
+        keys = list(zip(index.get_level_values('event'), segment_values))
+        series = self._series_ids(keys)
+        batch_periods = index.get_level_values('period').to_numpy()
+        counts = grouped.to_numpy().astype(float)
+
+        # 丢弃落在已结束时间桶的事件
+        open_period = self._open_period[series]
+        late = (open_period >= 0) & (batch_periods < open_period)
+        if self._watermark is not None:
+            late |= (open_period < 0) & (batch_periods < self._watermark)
+        if late.any():
+            self.late_events += int(counts[late].sum())
+            series, batch_periods, counts = series[~late], batch_periods[~late], counts[~late]
+        if len(series) == 0:
+            return []
+
+        # 新序列从其第一个时间桶开始
+        new_series = self._open_period[series] < 0
+        if new_series.any():
+            first = pd.Series(batch_periods[new_series]).groupby(series[new_series]).min()
+            self._open_period[first.index.to_numpy()] = first.to_numpy()
+
+        watermark = int(batch_periods.max())
+        if self._watermark is not None:
+            watermark = max(watermark, self._watermark)
+        return self._advance(watermark, series, batch_periods, counts)
+
+    def _segment_values(self, events: pd.DataFrame) -> np.ndarray:
+        """每个事件的细分值；'列.键'形式取字典列中的字段（如device.category），缺少该字段时为None"""
+        if not self.segment_column:
+            return np.full(len(events), None, dtype=object)
+        if self.segment_column in events.columns:
+            return events[self.segment_column].to_numpy(dtype=object)
+        parent, _, key = self.segment_column.partition('.')
+        if not key or parent not in events.columns:
+            raise ValueError(f"Segment column not found: {self.segment_column}")
+        return np.array([value.get(key) if isinstance(value, dict) else None for value in events[parent].to_numpy()],
+                        dtype=object)
+
+    def on_storage_events(self, events: pd.DataFrame, replaced: bool) -> None:
+        """
+        存储管理器的事件监听回调：全量替换时重建状态，追加时增量更新
+
+        Args:
+            events: 新写入的事件
+            replaced: 是否替换了全部事件
+        """
+        if replaced:
+            self.reset()
+        anomalies = self.update(events)
+        self.recent_anomalies.extend(anomalies)
+        if anomalies:
+            logger.info(f"流式异常检测发现{len(anomalies)}个异常点")
+
+    def advance(self, until: pd.Timestamp) -> List[Dict[str, Any]]:
+        """
+        在没有新事件时把时间推进到until，结束此前的所有时间桶
+
+        Args:
+            until: 当前时间
+
+        Returns:
+            本次结束的时间桶中的异常点
+        """
+        watermark = int(pd.Timestamp(until).value // self._period_ns)
+        if self._watermark is not None and watermark <= self._watermark:
+            return []
+        empty = np.empty(0, dtype=np.int64)
+        return self._advance(watermark, empty, empty, np.empty(0))
+
+    def _advance(self, watermark: int, series: np.ndarray, periods: np.ndarray,
+                 counts: np.ndarray) -> List[Dict[str, Any]]:
+        """
+        把所有序列推进到watermark时间桶
+
+        有事件的时间桶及其后第一个空时间桶逐个结束；连续的其余空时间桶没有新的信息，
+        按零观测的线性递推一次推进（见_skip_empty_buckets）。
+        """
+        n = self.n_series
+        active_series = self._open_period[:n] >= 0
+        start = int(self._open_period[:n][active_series].min()) if active_series.any() else watermark
+
+        order = np.argsort(periods, kind='stable')
+        series, periods, counts = series[order], periods[order], counts[order]
+        event_periods = np.unique(periods)
+
+        anomalies = []
+        period = start
+        while True:
+            lo, hi = np.searchsorted(periods, [period, period + 1])
+            np.add.at(self._open_count, series[lo:hi], counts[lo:hi])
+            if period >= watermark:
+                break
+            anomalies.extend(self._close_open_series(period))
+
+            following = np.searchsorted(event_periods, period, side='right')
+            next_period = min(int(event_periods[following]), watermark) if following < len(event_periods) \
+                else watermark
+            if next_period - period > 2:
+                # 第一个空时间桶照常结束，计数降为0时仍会报告；之后直到下一个有事件的时间桶都按闭式推进
+                anomalies.extend(self._close_open_series(period + 1))
+                self._skip_empty_buckets(period + 2, next_period)
+                period = next_period
+            else:
+                period += 1
+
+        self._watermark = watermark
+        return anomalies
+
+    def _close_open_series(self, period: int) -> List[Dict[str, Any]]:
+        """结束所有在period及之前开始的序列的当前时间桶"""
+        n = self.n_series
+        closing = np.flatnonzero((self._open_period[:n] >= 0) & (self._open_period[:n] <= period))
+        if len(closing) == 0:
+            return []
+        anomalies = self._close_bucket(closing, period)
+        self._open_count[closing] = 0.0
+        self._open_period[closing] = period + 1
+        return anomalies
+
+    def _skip_empty_buckets(self, first: int, end: int) -> None:
+        """
+        一次推进first..end-1这段没有任何事件的时间桶
+
+        零观测时水平和季节项的更新是线性的，整段的状态转移为各时间桶转移矩阵之积，
+        按季节周期分组后用矩阵幂计算。与逐桶结束相比只是不截断残差（预热前本来就不截断）、
+        不再更新尺度，也不重复报告同一段中断。
+        """
+        n = self.n_series
+        skipping = np.flatnonzero((self._open_period[:n] >= 0) & (self._open_period[:n] <= first))
+        if len(skipping) == 0:
+            return
+
+        state = np.column_stack([self._level[skipping], self._seasonal[skipping]])
+        state = state @ self._empty_transition(first % self.season_length, end - first).T
+        self._level[skipping] = state[:, 0]
+        self._seasonal[skipping] = state[:, 1:]
+        self._observations[skipping] += end - first
+        self._open_period[skipping] = end
+
+    def _empty_transition(self, season: int, length: int) -> np.ndarray:
+        """从季节位置season开始连续length个零观测时间桶对 (水平, 季节项...) 的转移矩阵"""
+        size = self.season_length + 1
+
+        def step(position: int) -> np.ndarray:
+            matrix = np.eye(size)
+            # level' = α(0 - s) + (1-α)level
+            matrix[0] = 0.0
+            matrix[0, 0] = 1 - self.alpha
+            matrix[0, 1 + position] = -self.alpha
+            if self.season_length > 1:
+                # s' = γ(0 - level') + (1-γ)s
+                matrix[1 + position] = -self.gamma * matrix[0]
+                matrix[1 + position, 1 + position] += 1 - self.gamma
+            return matrix
+
+        cycle = np.eye(size)
+        for offset in range(self.season_length):
+            cycle = step((season + offset) % self.season_length) @ cycle
+        cycles, rest = divmod(length, self.season_length)
+        transition = np.linalg.matrix_power(cycle, cycles)
+        for offset in range(rest):
+            transition = step((season + offset) % self.season_length) @ transition
+        return transition
+
+    def _close_bucket(self, series: np.ndarray, period: int) -> List[Dict[str, Any]]:
+        """用结束时间桶的计数更新序列状态，返回异常点"""
+        y = self._open_count[series]
+        season = period % self.season_length
+
+        first = self._observations[series] == 0
+        if first.any():
+            self._level[series[first]] = y[first]
+            self._observations[series[first]] = 1
+
+        series, y = series[~first], y[~first]
+        if len(series) == 0:
+            return []
+
+        seasonal = self._seasonal[series, season]
+        expected = self._level[series] + seasonal
+        residual = y - expected
+        scale = np.maximum(_MAD_TO_STD * self._scale[series], self.min_scale)
+        score = residual / scale
+
+        warmed = self._observations[series] >= self.warmup
+        flagged = warmed & (np.abs(score) > self.threshold)
+
+        # 预热后残差按阈值截断，异常点不拉动基线
+        limit = np.where(warmed, self.threshold * scale, np.inf)
+        clipped = np.clip(residual, -limit, limit)
+        adjusted = expected + clipped
+        level = self.alpha * (adjusted - seasonal) + (1 - self.alpha) * self._level[series]
+        if self.season_length > 1:
+            self._seasonal[series, season] = self.gamma * (adjusted - level) + (1 - self.gamma) * seasonal
+        self._level[series] = level
+        self._scale[series] = self.beta * np.abs(clipped) + (1 - self.beta) * self._scale[series]
+        self._observations[series] += 1
+
+        anomalies = []
+        period_start = pd.Timestamp(period * self._period_ns)
+        for index in np.flatnonzero(flagged):
+            event_name, segment = self._key_list[series[index]]
+            anomalies.append({
+                'event_name': event_name,
+                'segment': segment,
+                'date': period_start.strftime('%Y-%m-%d %H:%M' if self.granularity == 'hourly' else '%Y-%m-%d'),
+                'value': float(y[index]),
+                'expected': float(expected[index]),
+                'z_score': float(score[index]),
+                'type': 'high' if residual[index] > 0 else 'low'
+            })
+        return anomalies
+
+    def state(self) -> pd.DataFrame:
+        """
+        每个序列的当前状态
+
+        Returns:
+            event_name, segment, level, scale, observations, open_period_start, open_count
+        """
+        n = self.n_series
+        return pd.DataFrame({
+            'event_name': [key[0] for key in self._key_list],
+            'segment': [key[1] for key in self._key_list],
+            'level': self._level[:n],
+            'scale': _MAD_TO_STD * self._scale[:n],
+            'observations': self._observations[:n],
+            'open_period_start': pd.to_datetime(self._open_period[:n] * self._period_ns),
+            'open_count': self._open_count[:n]
+        })
@@ -0,0 +1,266 @@
+"""
+用户特征构建模块
+
+按列计算所有用户的行为、人口统计、参与度、转化和时间特征：
+事件只做一次用户编码和时间换算，各类特征由(用户, 事件)、(用户, 日期)、(用户, 小时)
+几次分组计数得到，不再逐个用户切片事件、用户和会话数据。
+"""
+
+import pandas as pd
+import numpy as np
+from typing import Dict, List, Optional, Tuple
+import hashlib
+import json
+import logging
+
+from engines.funnel_matcher import event_times_ns
+
+logger = logging.getLogger(__name__)
+
+_NS_PER_HOUR = 3_600 * 1_000_000_000
+_NS_PER_DAY = 24 * _NS_PER_HOUR
+
+COMMON_EVENTS = ('page_view', 'login', 'purchase', 'add_to_cart', 'search', 'view_item')
+CONVERSION_EVENTS = ('sign_up', 'login', 'purchase', 'begin_checkout', 'add_to_cart')
+
+# 各类特征包含的列（同名列如purchase_ratio在多类中共用一列）
+FEATURE_GROUPS: Dict[str, List[str]] = {
+    'behavioral': (['total_events', 'unique_event_types', 'avg_events_per_day']
+                   + [f'{event}_ratio' for event in COMMON_EVENTS]
+                   + ['behavior_diversity', 'behavior_intensity']),
+    'demographic': ['platform', 'device_category', 'geo_country'],
+    'engagement': ['active_days', 'engagement_span_days', 'activity_frequency', 'days_since_last_activity',
+                   'recency_score', 'total_sessions', 'avg_session_duration', 'avg_events_per_session',
+                   'total_session_time'],
+    'conversion': ([column for event in CONVERSION_EVENTS for column in (f'{event}_count', f'{event}_ratio')]
+                   + ['total_conversions', 'conversion_ratio', 'conversion_depth', 'purchase_frequency',
+                      'avg_purchase_interval_days']),
+    'temporal': ['work_hours_ratio', 'weekday_ratio', 'time_concentration', 'most_active_hour',
+                 'activity_regularity']
+}
+CATEGORICAL_FEATURES = FEATURE_GROUPS['demographic']
+
+# 特征计算逻辑变化时递增，使已缓存的特征表失效
+FEATURE_SPEC_VERSION = 1
+
+
+def feature_columns() -> List[str]:
+    """特征表的列顺序（去重）"""
+    return list(dict.fromkeys(column for columns in FEATURE_GROUPS.values() for column in columns))
+
+
+def feature_spec_key() -> str:
+    """特征规格的键：由规格版本和特征列计算的短哈希"""
+    spec = json.dumps({'version': FEATURE_SPEC_VERSION, 'groups': FEATURE_GROUPS}, sort_keys=True)
+    return hashlib.sha1(spec.encode('utf-8')).hexdigest()[:12]
+
+
+def _group_entropy(user_codes: np.ndarray, counts: np.ndarray, totals: np.ndarray) -> np.ndarray:
+    """按用户计算分组计数分布的熵（以2为底）"""
+    probabilities = counts / totals[user_codes]
+    return np.bincount(user_codes, weights=-probabilities * np.log2(probabilities), minlength=len(totals))
+
+
+def _pair_counts(user_codes: np.ndarray, values: np.ndarray, n_users: int) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
+    """(用户, 值)分组计数，返回每组的用户编码、值和计数"""
+    width = int(values.max()) + 1 if len(values) else 1
+    keys, counts = np.unique(user_codes.astype(np.int64) * width + values, return_counts=True)
+    return keys // width, keys % width, counts
+
+
+def _first_value(series: pd.Series, first_rows: np.ndarray, key: str) -> np.ndarray:
+    """取每个用户第一条事件中字典字段的某个键，缺失时为unknown"""
+    return np.array([value.get(key, 'unknown') if isinstance(value, dict) else 'unknown'
+                     for value in series.to_numpy()[first_rows]], dtype=object)
+
+
+def _demographic_features(events: pd.DataFrame,
+                          user_ids: pd.Index,
+                          user_codes: np.ndarray,
+                          users: Optional[pd.DataFrame]) -> pd.DataFrame:
+    """用户数据中有记录的用户取其第一条记录，其余从用户的第一条事件推断"""
+    n_users = len(user_ids)
+    first_rows = np.full(n_users, len(events), dtype=np.int64)
+    np.minimum.at(first_rows, user_codes, np.arange(len(events)))
+
+    features = pd.DataFrame({
+        'platform': (events['platform'].to_numpy(dtype=object)[first_rows]
+                     if 'platform' in events.columns else np.full(n_users, 'unknown', dtype=object)),
+        'device_category': (_first_value(events['device'], first_rows, 'category')
+                            if 'device' in events.columns else np.full(n_users, 'unknown', dtype=object)),
+        'geo_country': (_first_value(events['geo'], first_rows, 'country')
+                        if 'geo' in events.columns else np.full(n_users, 'unknown', dtype=object))
+    }, index=user_ids)
+
+    if users is not None and not users.empty and 'user_pseudo_id' in users.columns:
+        user_rows = users.drop_duplicates('user_pseudo_id').set_index('user_pseudo_id')
+        matched = user_ids.isin(user_rows.index)
+        if matched.any():
+            rows = user_rows.reindex(user_ids[matched])
+            for column in CATEGORICAL_FEATURES:
+                features.loc[matched, column] = (rows[column].to_numpy(dtype=object) if column in rows.columns
+                                                 else 'unknown')
+    return features
+
+
+def _session_features(user_ids: pd.Index, sessions: Optional[pd.DataFrame]) -> pd.DataFrame:
+    """按用户汇总会话数、平均会话时长、平均会话事件数和总会话时长，没有会话的用户为0"""
+    features = pd.DataFrame(0.0, index=user_ids,
+                            columns=['total_sessions', 'avg_session_duration', 'avg_events_per_session',
+                                     'total_session_time'])
+    if sessions is None or sessions.empty or 'user_pseudo_id' not in sessions.columns:
+        return features
+
+    grouped = sessions.groupby('user_pseudo_id', sort=False)
+    summary = pd.DataFrame({'total_sessions': grouped.size()})
+    if 'duration_seconds' in sessions.columns:
+        summary['avg_session_duration'] = grouped['duration_seconds'].mean()
+        summary['total_session_time'] = grouped['duration_seconds'].sum()
+    if 'event_count' in sessions.columns:
+        summary['avg_events_per_session'] = grouped['event_count'].mean()
+
+    summary = summary.reindex(user_ids)
+    has_sessions = summary['total_sessions'].notna().to_numpy()
+    for column in summary.columns:
+        features.loc[has_sessions, column] = summary.loc[has_sessions, column].astype(float)
+    return features
+
+
+def build_user_feature_frame(events: pd.DataFrame,
+                             users: Optional[pd.DataFrame] = None,
+                             sessions: Optional[pd.DataFrame] = None,
+                             reference_time: Optional[pd.Timestamp] = None,
+                             times: Optional[np.ndarray] = None) -> pd.DataFrame:
+    """
+    按列计算所有用户的特征
+
+    Args:
+        events: 事件数据，需要user_pseudo_id、event_name和时间字段
+        users: 用户数据（platform、device_category、geo_country），可选
+        sessions: 会话数据（duration_seconds、event_count），可选
+        reference_time: 计算最近活跃天数的参考时间，默认为当前时间
+        times: 与events的行对应的事件时间（见event_times_ns），None时从events解析
+
+    Returns:
+        以user_pseudo_id为索引（按首次出现顺序）的特征表，列为feature_columns()；
+        人口统计特征为字符串，其余为数值
+    """
+    user_codes, user_ids = pd.factorize(events['user_pseudo_id'])
+    user_ids = pd.Index(user_ids, name='user_pseudo_id')
+    event_codes, event_names = pd.factorize(events['event_name'])
+    times = event_times_ns(events) if times is None else times
+    n_users = len(user_ids)
+
+    total_events = np.bincount(user_codes, minlength=n_users).astype(float)
+    features = pd.DataFrame(index=user_ids)
+
+    # 行为特征：事件类型分布
+    pair_users, pair_events, pair_counts = _pair_counts(user_codes, event_codes, n_users)
+    features['total_events'] = total_events
+    features['unique_event_types'] = np.bincount(pair_users, minlength=n_users).astype(float)
+
+    event_lookup = {name: code for code, name in enumerate(event_names)}
+    event_totals = {}
+    for event in dict.fromkeys(COMMON_EVENTS + CONVERSION_EVENTS):
+        code = event_lookup.get(event, -1)
+        event_totals[event] = (np.bincount(pair_users[pair_events == code], weights=pair_counts[pair_events == code],
+                                           minlength=n_users) if code >= 0 else np.zeros(n_users))
+
+    # 时间粒度：日期、小时、星期（1970-01-01为星期四）
+    days = times // _NS_PER_DAY
+    hours = (times - days * _NS_PER_DAY) // _NS_PER_HOUR
+    weekdays = (days + 3) % 7
+    first_times = np.full(n_users, np.iinfo(np.int64).max)
+    last_times = np.full(n_users, np.iinfo(np.int64).min)
+    np.minimum.at(first_times, user_codes, times)
+    np.maximum.at(last_times, user_codes, times)
+    span_days = ((last_times - first_times) // _NS_PER_DAY + 1).astype(float)
+
+    day_users, _, day_counts = _pair_counts(user_codes, days - days.min() if len(days) else days, n_users)
+    active_days = np.bincount(day_users, minlength=n_users).astype(float)
+
+    features['avg_events_per_day'] = total_events / active_days
+    for event in COMMON_EVENTS:
+        features[f'{event}_ratio'] = event_totals[event] / total_events
+    features['behavior_diversity'] = _group_entropy(pair_users, pair_counts, total_events)
+    features['behavior_intensity'] = total_events / span_days
+
+    features = features.join(_demographic_features(events, user_ids, user_codes, users))
+
+    # 参与度特征
+    reference = pd.Timestamp(reference_time) if reference_time is not None else pd.Timestamp.now()
+    days_since_last = ((reference.value - last_times) // _NS_PER_DAY).astype(float)
+    features['active_days'] = active_days
+    features['engagement_span_days'] = span_days
+    features['activity_frequency'] = active_days / span_days
+    features['days_since_last_activity'] = days_since_last
+    features['recency_score'] = np.maximum(0, 1 - days_since_last / 30)
+    features = features.join(_session_features(user_ids, sessions))
+
+    # 转化特征
+    conversion_counts = np.column_stack([event_totals[event] for event in CONVERSION_EVENTS])
+    for i, event in enumerate(CONVERSION_EVENTS):
+        features[f'{event}_count'] = conversion_counts[:, i]
+        features[f'{event}_ratio'] = conversion_counts[:, i] / total_events
+    features['total_conversions'] = conversion_counts.sum(axis=1)
+    features['conversion_ratio'] = features['total_conversions'] / total_events
+    features['conversion_depth'] = (conversion_counts > 0).sum(axis=1).astype(float)
+    features['purchase_frequency'] = event_totals['purchase']
+
+    # 相邻购买间隔的平均值即首末购买间隔除以间隔数
+    purchase_code = event_lookup.get('purchase', -1)
+    purchase = event_codes == purchase_code
+    purchase_first = np.full(n_users, np.iinfo(np.int64).max)
+    purchase_last = np.full(n_users, np.iinfo(np.int64).min)
+    np.minimum.at(purchase_first, user_codes[purchase], times[purchase])
+    np.maximum.at(purchase_last, user_codes[purchase], times[purchase])
+    repeat = event_totals['purchase'] > 1
+    interval = np.zeros(n_users)
+    interval[repeat] = ((purchase_last[repeat] - purchase_first[repeat]) / _NS_PER_DAY
+                        / (event_totals['purchase'][repeat] - 1))
+    features['avg_purchase_interval_days'] = interval
+
+    # 时间特征
+    features['work_hours_ratio'] = np.bincount(user_codes, weights=(hours >= 9) & (hours <= 17),
+                                               minlength=n_users) / total_events
+    features['weekday_ratio'] = np.bincount(user_codes, weights=weekdays < 5, minlength=n_users) / total_events
+    hour_users, hour_values, hour_counts = _pair_counts(user_codes, hours, n_users)
+    features['time_concentration'] = _group_entropy(hour_users, hour_counts, total_events)
+
+    # 最活跃时段：次数最多的小时，次数相同时取用户最先出现的小时
+    hour_keys = user_codes.astype(np.int64) * 24 + hours
+    _, first_positions = np.unique(hour_keys, return_index=True)
+    order = np.lexsort((first_positions, -hour_counts, hour_users))
+    leaders = order[np.concatenate([[True], hour_users[order][1:] != hour_users[order][:-1]])]
+    most_active_hour = np.full(n_users, 12.0)
+    most_active_hour[hour_users[leaders]] = hour_values[leaders]
+    features['most_active_hour'] = most_active_hour
+
+    # 活动规律性：每日事件数样本标准差
+    daily_mean = total_events / active_days
+    squared = np.bincount(day_users, weights=(day_counts - daily_mean[day_users]) ** 2, minlength=n_users)
+    multi_day = active_days > 1
+    regularity = np.ones(n_users)
+    regularity[multi_day] = 1 / (np.sqrt(squared[multi_day] / (active_days[multi_day] - 1)) + 1)
+    features['activity_regularity'] = regularity
+
+    return features[feature_columns()]
+
+
+def feature_groups(frame: pd.DataFrame) -> Dict[str, List[Dict]]:
+    """
+    把特征表拆分为各类特征的记录列表
+
+    Args:
+        frame: build_user_feature_frame的结果
+
+    Returns:
+        特征类别 -> 与frame行一一对应的特征字典列表
+    """
+    groups = {}
+    for group, columns in FEATURE_GROUPS.items():
+        subset = frame[columns]
+        if group != 'demographic':
+            subset = subset.astype(float)
+        groups[group] = subset.to_dict('records')
+    return groups
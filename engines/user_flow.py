@@ -0,0 +1,281 @@
+"""
+用户流程分析模块
+
+基于会话路径存储计算用户流程：事件转移图、按顺序到达各流程步骤的会话和用户数，
+以及起始事件到结束事件之间概率最高的若干条观测路径（转移概率取负对数后的
+Yen K最短路径）。
+"""
+
+import numpy as np
+from typing import Iterator, List, Optional, Sequence, Tuple
+from dataclasses import dataclass
+from scipy import sparse
+from scipy.sparse.csgraph import dijkstra
+from itertools import islice
+import heapq
+import logging
+
+from engines.session_store import SessionPathStore
+
+logger = logging.getLogger(__name__)
+
+# 边权下限，保证概率为1的转移也是显式的正权边
+_EDGE_EPSILON = 1e-9
+
+
+@dataclass
+class TransitionGraph:
+    """会话内相邻事件的转移图"""
+    event_vocab: np.ndarray  # 事件编码 -> 事件名
+    transition_counts: sparse.csr_matrix  # (事件数, 事件数) 转移次数
+    entry_counts: np.ndarray  # 每个事件作为会话起点的次数
+    exit_counts: np.ndarray  # 每个事件作为会话终点的次数
+
+    @property
+    def out_counts(self) -> np.ndarray:
+        """每个事件的流出次数（含会话结束）"""
+        return np.asarray(self.transition_counts.sum(axis=1)).ravel() + self.exit_counts
+
+    def transition_probabilities(self) -> sparse.csr_matrix:
+        """按流出次数归一化的转移概率矩阵"""
+        totals = self.out_counts.astype(float)
+        scale = np.divide(1.0, totals, out=np.zeros_like(totals), where=totals > 0)
+        return sparse.csr_matrix(sparse.diags(scale) @ self.transition_counts)
+
+
+@dataclass
+class StepReach:
+    """按顺序到达某个流程步骤的会话和用户数"""
+    step: str
+    session_count: int
+    user_count: int
+
+
+@dataclass
+class FlowPath:
+    """起始事件到结束事件之间的一条路径"""
+    path: List[str]
+    probability: float  # 从起始事件出发沿该路径到达结束事件的概率
+    steps: int
+    session_count: int  # 连续包含该路径的会话数
+
+
+def build_transition_graph(store: SessionPathStore) -> TransitionGraph:
+    """
+    统计会话内的相邻事件转移
+
+    Args:
+        store: 会话路径存储
+
+    Returns:
+        事件转移图
+    """
+    n_codes = len(store.event_vocab)
+    codes = store.event_codes
+    same_session = store.session_index[1:] == store.session_index[:-1]
+    counts = sparse.coo_matrix(
+        (np.ones(int(same_session.sum())), (codes[:-1][same_session], codes[1:][same_session])),
+        shape=(n_codes, n_codes)
+    ).tocsr()
+
+    non_empty = store.lengths > 0
+    return TransitionGraph(
+        event_vocab=store.event_vocab,
+        transition_counts=counts,
+        entry_counts=np.bincount(codes[store.offsets[:-1][non_empty]], minlength=n_codes),
+        exit_counts=np.bincount(codes[store.offsets[1:][non_empty] - 1], minlength=n_codes)
+    )
+
+
+def step_reach(store: SessionPathStore, steps: Sequence[str]) -> List[StepReach]:
+    """
+    计算按顺序到达每个流程步骤的会话和用户数
+
+    每个会话取各步骤的最左匹配：第i步是第i-1步之后该事件的第一次出现。
+
+    Args:
+        store: 会话路径存储
+        steps: 流程步骤
+
+    Returns:
+        每个步骤的到达情况
+    """
+    step_codes = store.encode(steps)
+    sessions = np.arange(len(store))
+    positions = store.offsets[:-1] - 1  # 第一步从会话起点开始查找
+    session_ends = store.offsets[1:]
+
+    reach = []
+    for step, code in zip(steps, step_codes):
+        if code >= 0 and len(sessions):
+            code_positions = np.flatnonzero(store.event_codes == code)
+            idx = np.searchsorted(code_positions, positions + 1, side='left')
+            candidates = code_positions[np.minimum(idx, max(len(code_positions) - 1, 0))]
+            found = (idx < len(code_positions)) & (candidates < session_ends[sessions])
+            sessions = sessions[found]
+            positions = candidates[found]
+        else:
+            sessions = sessions[:0]
+            positions = positions[:0]
+
+        reach.append(StepReach(
+            step=step,
+            session_count=len(sessions),
+            user_count=len(np.unique(store.user_codes[sessions]))
+        ))
+
+    return reach
+
+
+def iter_most_probable_paths(graph: TransitionGraph,
+                             start_codes: Sequence[int],
+                             end_codes: Sequence[int]) -> Iterator[Tuple[List[int], float]]:
+    """
+    按概率从高到低逐条生成起始事件到结束事件的简单路径（Yen K最短路径）
+
+    边权为转移概率的负对数，到达任一结束事件即终止。
+
+    Args:
+        graph: 事件转移图
+        start_codes: 起始事件编码
+        end_codes: 结束事件编码
+
+    Yields:
+        (事件编码路径, 路径概率)
+    """
+    n_codes = len(graph.event_vocab)
+    source, target = n_codes, n_codes + 1
+    start_codes = [int(c) for c in start_codes if c >= 0]
+    end_codes = [int(c) for c in end_codes if c >= 0]
+    if not start_codes or not end_codes:
+        return
+
+    # 事件间的边（结束事件不再向外转移），加上虚拟起点和终点
+    probabilities = graph.transition_probabilities().tocoo()
+    keep = (probabilities.data > 0) & ~np.isin(probabilities.row, end_codes)
+    rows = np.concatenate([probabilities.row[keep], np.full(len(start_codes), source), end_codes])
+    cols = np.concatenate([probabilities.col[keep], start_codes, np.full(len(end_codes), target)])
+    costs = np.concatenate([
+        -np.log(probabilities.data[keep]) + _EDGE_EPSILON,
+        np.full(len(start_codes) + len(end_codes), _EDGE_EPSILON)
+    ])
+    # 按起点、终点排序后直接构造CSR，第i条边即data[i]；所有偏离路径共用这一个矩阵，
+    # 去掉的边临时把权重设为inf（csgraph把显式0当作零权边，不能置0）
+    order = np.lexsort((cols, rows))
+    rows, cols, costs = rows[order], cols[order], costs[order]
+    matrix = sparse.csr_matrix((costs.copy(), cols, np.searchsorted(rows, np.arange(n_codes + 3))),
+                               shape=(n_codes + 2, n_codes + 2))
+    edge_index = {(a, b): i for i, (a, b) in enumerate(zip(rows.tolist(), cols.tolist()))}
+    in_order = np.argsort(cols, kind='stable')
+    in_bounds = np.searchsorted(cols[in_order], np.arange(n_codes + 3))
+
+    def shortest(removed: np.ndarray, spur: int) -> Optional[List[int]]:
+        matrix.data[removed] = np.inf
+        try:
+            distances, predecessors = dijkstra(matrix, indices=spur, return_predecessors=True)
+        finally:
+            matrix.data[removed] = costs[removed]
+        if not np.isfinite(distances[target]):
+            return None
+        path = [target]
+        while path[-1] != spur:
+            path.append(int(predecessors[path[-1]]))
+        return path[::-1]
+
+    def path_cost(path: List[int]) -> float:
+        return sum(costs[edge_index[edge]] for edge in zip(path[:-1], path[1:]))
+
+    def to_result(path: List[int]) -> Tuple[List[int], float]:
+        events = path[1:-1]
+        return events, float(np.exp(-(path_cost(path) - _EDGE_EPSILON * (len(path) - 1))))
+
+    first = shortest(np.empty(0, dtype=np.int64), source)
+    if first is None:
+        return
+
+    accepted = [first]
+    candidates: List[Tuple[float, List[int]]] = []
+    seen = {tuple(first)}
+    yield to_result(first)
+
+    while True:
+        previous = accepted[-1]
+        for i in range(len(previous) - 1):
+            spur, root = previous[i], previous[:i + 1]
+            # 去掉与已接受路径共享根路径的下一条边，以及进入根路径上节点的边
+            shared = [edge_index[(path[i], path[i + 1])] for path in accepted if path[:i + 1] == root]
+            removed = np.concatenate([np.array(shared, dtype=np.int64)] +
+                                     [in_order[in_bounds[node]:in_bounds[node + 1]] for node in root[:-1]])
+            spur_path = shortest(removed, spur)
+            if spur_path is None:
+                continue
+            candidate = root[:-1] + spur_path
+            if tuple(candidate) not in seen:
+                seen.add(tuple(candidate))
+                heapq.heappush(candidates, (path_cost(candidate), candidate))
+
+        if not candidates:
+            return
+        best = heapq.heappop(candidates)[1]
+        accepted.append(best)
+        yield to_result(best)
+
+
+def most_probable_paths(graph: TransitionGraph,
+                        start_codes: Sequence[int],
+                        end_codes: Sequence[int],
+                        k: int = 5) -> List[Tuple[List[int], float]]:
+    """
+    起始事件到结束事件之间概率最高的k条路径
+
+    Args:
+        graph: 事件转移图
+        start_codes: 起始事件编码
+        end_codes: 结束事件编码
+        k: 最多返回的路径数
+
+    Returns:
+        (事件编码路径, 路径概率) 列表
+    """
+    return list(islice(iter_most_probable_paths(graph, start_codes, end_codes), max(k, 0)))
+
+
+def top_observed_paths(store: SessionPathStore,
+                       start_events: Sequence[str],
+                       end_events: Sequence[str],
+                       k: int = 5,
+                       max_candidates: int = 50,
+                       graph: Optional[TransitionGraph] = None) -> List[FlowPath]:
+    """
+    查找起始事件到结束事件之间概率最高、且至少被一个会话完整走过的路径
+
+    Args:
+        store: 会话路径存储
+        start_events: 起始事件
+        end_events: 结束事件
+        k: 返回的路径数
+        max_candidates: 最多检查的候选路径数
+        graph: 预先构建的事件转移图
+
+    Returns:
+        按概率降序排列的路径
+    """
+    if graph is None:
+        graph = build_transition_graph(store)
+
+    candidates = iter_most_probable_paths(graph, store.encode(start_events), store.encode(end_events))
+    paths = []
+    for codes, probability in islice(candidates, max(max_candidates, k)):
+        session_count = len(store.sessions_containing(np.array(codes)))
+        if session_count == 0:
+            continue
+        paths.append(FlowPath(
+            path=store.decode(codes),
+            probability=probability,
+            steps=len(codes),
+            session_count=session_count
+        ))
+        if len(paths) >= k:
+            break
+
+    return paths
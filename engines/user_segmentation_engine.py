@@ -12,12 +12,21 @@ from datetime import datetime, timedelta
 import logging
 from dataclasses import dataclass
 from collections import defaultdict
-from sklearn.cluster import KMeans, DBSCAN
+from sklearn.cluster import KMeans
 from sklearn.preprocessing import StandardScaler, LabelEncoder
 from sklearn.decomposition import PCA
-from sklearn.metrics import silhouette_score
 import warnings
 
+from engines.user_features import CATEGORICAL_FEATURES, FEATURE_GROUPS, feature_groups
+from engines.feature_store import UserFeatureStore
+from engines.segment_profiling import (PROFILE_QUANTILES, SegmentStatistics, anova_f, dominant_values,
+                                       feature_summaries, segment_statistics, top_deviations)
+from engines.scalable_clustering import NOISE_LABEL, minibatch_kmeans, sampled_density_clustering
+from engines.cluster_quality import centroid_metrics, silhouette_metrics
+from engines.cluster_selection import KSelectionResult, select_n_clusters
+from engines.segment_assignment import SegmentAssigner, SegmentationModel, user_feature_rows
+from engines.dataset_cache import DatasetCache
+
 warnings.filterwarnings('ignore', category=RuntimeWarning)
 
 logger = logging.getLogger(__name__)
@@ -70,7 +79,7 @@ class SegmentationResult:
     segments: List[UserSegment]
     segmentation_method: str
     feature_importance: Dict[str, float]
-    quality_metrics: Dict[str, float]
+    quality_metrics: Dict[str, Any]
     segment_comparison: Any  # Changed from pd.DataFrame to Any to avoid Pydantic issues
 
 
@@ -85,13 +94,37 @@ class UserSegmentationEngine:
             storage_manager: 数据存储管理器实例
         """
         self.storage_manager = storage_manager
+        self.dataset_cache = DatasetCache.for_storage(storage_manager)
         self.scaler = StandardScaler()
         self.label_encoders = {}
+        # 用户特征表按数据版本缓存，与同一存储管理器上的其他引擎共用
+        self.feature_store = UserFeatureStore.for_storage(storage_manager)
+        
+        # 可扩展聚类配置：用户数超过阈值时自动使用MiniBatchKMeans / 抽样密度聚类
+        self.scalable_row_threshold = 200_000
+        self.clustering_chunk_size = 100_000
+        self.density_sample_size = 20_000
+        # 用户数超过该值时轮廓系数在分层抽样上估计
+        self.silhouette_sample_size = 10_000
+        self.last_clustering_backend = None
+        # 最近一次密度聚类中噪声点归入的分群标签，没有噪声时为None
+        self.last_noise_segment_id = None
+        
+        # 自动选择聚类数量（n_clusters='auto'）的配置
+        self.auto_k_max = 10
+        self.auto_k_jobs = None
+        self.auto_k_silhouette_sample_size = 2_000
+        self.last_k_selection: Optional[KSelectionResult] = None
+        
+        # 最近一次分群的模型（编码、标准化参数和分群中心）及注册到存储管理器的在线分配器
+        self.segmentation_model: Optional[SegmentationModel] = None
+        self.segment_assigner: Optional[SegmentAssigner] = None
         
         # 预定义的分群方法
         self.segmentation_methods = {
             'kmeans': self._kmeans_clustering,
             'dbscan': self._dbscan_clustering,
+            'hdbscan': self._hdbscan_clustering,
             'behavioral': self._behavioral_segmentation,
             'value_based': self._value_based_segmentation,
             'engagement': self._engagement_segmentation
@@ -99,12 +132,12 @@ class UserSegmentationEngine:
         
         logger.info(t('user_segmentation.logs.engine_initialized', 'User segmentation engine initialized successfully'))
         
-    def extract_user_features(self,
-                            events: Optional[pd.DataFrame] = None,
-                            users: Optional[pd.DataFrame] = None,
-                            sessions: Optional[pd.DataFrame] = None) -> List[UserFeatures]:
+    def extract_user_feature_frame(self,
+                                   events: Optional[pd.DataFrame] = None,
+                                   users: Optional[pd.DataFrame] = None,
+                                   sessions: Optional[pd.DataFrame] = None) -> pd.DataFrame:
         """
-        提取用户特征
+        按列提取所有用户的特征
         
         Args:
             events: 事件数据DataFrame
@@ -112,14 +145,21 @@ class UserSegmentationEngine:
             sessions: 会话数据DataFrame
             
         Returns:
-            用户特征列表
+            以user_pseudo_id为索引的特征表（列见engines.user_features.FEATURE_GROUPS），无数据时为空表；
+            特征表来自feature_store的缓存，调用方不应修改
         """
         try:
+            # 存储管理器中的数据按数据版本直接从特征存储读取，缓存命中时不再读取原始数据
+            if events is None and users is None and sessions is None and self.feature_store.is_versioned():
+                feature_frame = self.feature_store.get_features()
+                logger.info(LocalizedInsightGenerator.format_features_extracted(feature_frame.shape[1], len(feature_frame)))
+                return feature_frame
+                
             # 获取数据
             if events is None:
                 if self.storage_manager is None:
                     raise ValueError("Event data not provided and storage manager not initialized")
-                events = self.storage_manager.get_data('events')
+                events = self.dataset_cache.events()
 
             if users is None and self.storage_manager:
                 users = self.storage_manager.get_data('users')
@@ -130,34 +170,25 @@ class UserSegmentationEngine:
             # 安全地检查事件数据是否为空
             if events is None:
                 logger.warning(t('user_segmentation.logs.event_data_none', 'Event data is None, cannot extract user features'))
-                return []
+                return pd.DataFrame()
             elif isinstance(events, list):
                 if len(events) == 0:
                     logger.warning(t('user_segmentation.logs.event_data_list_empty', 'Event data list is empty, cannot extract user features'))
-                    return []
+                    return pd.DataFrame()
                 # 如果是列表，尝试转换为DataFrame
                 try:
                     events = pd.DataFrame(events)
                 except Exception as e:
                     logger.error(t('user_segmentation.logs.cannot_convert_list_to_dataframe', 'Cannot convert event data list to DataFrame: {error}').format(error=e))
-                    return []
+                    return pd.DataFrame()
             elif isinstance(events, pd.DataFrame):
                 if events.empty:
                     logger.warning(t('user_segmentation.logs.event_data_dataframe_empty', 'Event data DataFrame is empty, cannot extract user features'))
-                    return []
+                    return pd.DataFrame()
             else:
                 logger.error(t('user_segmentation.logs.unsupported_event_data_type', 'Unsupported event data type: {type}').format(type=type(events)))
-                return []
+                return pd.DataFrame()
                 
-            # 确保有时间列
-            if 'event_datetime' not in events.columns:
-                if 'event_timestamp' in events.columns:
-                    events['event_datetime'] = pd.to_datetime(events['event_timestamp'], unit='us')
-                else:
-                    raise ValueError("Missing time field")
-                    
-            user_features_list = []
-            
             # 安全地处理users和sessions数据
             if users is not None and isinstance(users, list):
                 try:
@@ -175,346 +206,77 @@ class UserSegmentationEngine:
             elif sessions is None:
                 sessions = pd.DataFrame()
 
-            # 按用户提取特征
-            for user_id in events['user_pseudo_id'].unique():
-                user_events = events[events['user_pseudo_id'] == user_id]
-
-                # 安全地获取用户信息
-                user_info = None
-                if isinstance(users, pd.DataFrame) and not users.empty and 'user_pseudo_id' in users.columns:
-                    user_matches = users[users['user_pseudo_id'] == user_id]
-                    if not user_matches.empty:
-                        user_info = user_matches.iloc[0]
-
-                # 安全地获取用户会话
-                user_sessions = pd.DataFrame()
-                if isinstance(sessions, pd.DataFrame) and not sessions.empty and 'user_pseudo_id' in sessions.columns:
-                    user_sessions = sessions[sessions['user_pseudo_id'] == user_id]
-                
-                # 提取各类特征
-                behavioral_features = self._extract_behavioral_features(user_events)
-                demographic_features = self._extract_demographic_features(user_info, user_events)
-                engagement_features = self._extract_engagement_features(user_events, user_sessions)
-                conversion_features = self._extract_conversion_features(user_events)
-                temporal_features = self._extract_temporal_features(user_events)
-                
-                user_features = UserFeatures(
-                    user_id=user_id,
-                    behavioral_features=behavioral_features,
-                    demographic_features=demographic_features,
-                    engagement_features=engagement_features,
-                    conversion_features=conversion_features,
-                    temporal_features=temporal_features
-                )
-                
-                user_features_list.append(user_features)
-                
-            logger.info(LocalizedInsightGenerator.format_features_extracted(len(user_features_list), len(user_features_list)))
-            return user_features_list
+            # 所有用户的特征按列一次计算，相同内容的数据复用缓存
+            feature_frame = self.feature_store.get_features(events, users, sessions)
+            
+            logger.info(LocalizedInsightGenerator.format_features_extracted(feature_frame.shape[1], len(feature_frame)))
+            return feature_frame
             
         except Exception as e:
             logger.error(t('user_segmentation.logs.feature_extraction_failed', 'User feature extraction failed: {error}').format(error=e))
             raise
             
-    def _extract_behavioral_features(self, user_events: pd.DataFrame) -> Dict[str, float]:
-        """
-        提取行为特征
-        
-        Args:
-            user_events: 用户事件数据
-            
-        Returns:
-            行为特征字典
-        """
-        try:
-            features = {}
-            
-            # 基础行为统计
-            features['total_events'] = len(user_events)
-            features['unique_event_types'] = user_events['event_name'].nunique()
-            features['avg_events_per_day'] = self._calculate_avg_events_per_day(user_events)
-            
-            # 事件类型分布
-            event_counts = user_events['event_name'].value_counts()
-            total_events = len(user_events)
-            
-            # 主要事件类型的比例
-            common_events = ['page_view', 'login', 'purchase', 'add_to_cart', 'search', 'view_item']
-            for event_type in common_events:
-                features[f'{event_type}_ratio'] = event_counts.get(event_type, 0) / total_events if total_events > 0 else 0
-                
-            # 行为多样性（熵）
-            if total_events > 0:
-                event_probs = event_counts / total_events
-                features['behavior_diversity'] = -sum(p * np.log2(p) for p in event_probs if p > 0)
-            else:
-                features['behavior_diversity'] = 0
-                
-            # 行为强度
-            if 'event_datetime' in user_events.columns:
-                time_span = (user_events['event_datetime'].max() - user_events['event_datetime'].min()).days + 1
-                features['behavior_intensity'] = total_events / time_span if time_span > 0 else 0
-            else:
-                features['behavior_intensity'] = 0
-                
-            return features
-            
-        except Exception as e:
-            logger.warning(t('user_segmentation.logs.behavioral_features_extraction_failed', 'Behavioral features extraction failed: {error}').format(error=e))
-            return {}
-            
-    def _extract_demographic_features(self, user_info: Optional[pd.Series], user_events: pd.DataFrame) -> Dict[str, Any]:
-        """
-        提取人口统计特征
-        
-        Args:
-            user_info: 用户信息
-            user_events: 用户事件数据
-            
-        Returns:
-            人口统计特征字典
-        """
-        try:
-            features = {}
-            
-            if user_info is not None:
-                # 基础人口统计信息
-                features['platform'] = user_info.get('platform', 'unknown')
-                features['device_category'] = user_info.get('device_category', 'unknown')
-                features['geo_country'] = user_info.get('geo_country', 'unknown')
-            else:
-                # 从事件数据中推断
-                if not user_events.empty:
-                    features['platform'] = user_events['platform'].iloc[0] if 'platform' in user_events.columns else 'unknown'
-                    
-                    # 从设备信息中提取
-                    if 'device' in user_events.columns:
-                        device_info = user_events['device'].iloc[0]
-                        if isinstance(device_info, dict):
-                            features['device_category'] = device_info.get('category', 'unknown')
-                        else:
-                            features['device_category'] = 'unknown'
-                    else:
-                        features['device_category'] = 'unknown'
-                        
-                    # 从地理信息中提取
-                    if 'geo' in user_events.columns:
-                        geo_info = user_events['geo'].iloc[0]
-                        if isinstance(geo_info, dict):
-                            features['geo_country'] = geo_info.get('country', 'unknown')
-                        else:
-                            features['geo_country'] = 'unknown'
-                    else:
-                        features['geo_country'] = 'unknown'
-                else:
-                    features['platform'] = 'unknown'
-                    features['device_category'] = 'unknown'
-                    features['geo_country'] = 'unknown'
-                    
-            return features
-            
-        except Exception as e:
-            logger.warning(f"提取人口统计特征失败: {e}")
-            return {'platform': 'unknown', 'device_category': 'unknown', 'geo_country': 'unknown'}
-            
-    def _extract_engagement_features(self, user_events: pd.DataFrame, user_sessions: pd.DataFrame) -> Dict[str, float]:
-        """
-        提取参与度特征
-        
-        Args:
-            user_events: 用户事件数据
-            user_sessions: 用户会话数据
-            
-        Returns:
-            参与度特征字典
-        """
-        try:
-            features = {}
-            
-            # 基于事件的参与度
-            if not user_events.empty and 'event_datetime' in user_events.columns:
-                # 活跃天数
-                active_dates = user_events['event_datetime'].dt.date.unique()
-                features['active_days'] = len(active_dates)
-                
-                # 活跃时间跨度
-                time_span = (user_events['event_datetime'].max() - user_events['event_datetime'].min()).days + 1
-                features['engagement_span_days'] = time_span
-                
-                # 活跃频率
-                features['activity_frequency'] = len(active_dates) / time_span if time_span > 0 else 0
-                
-                # 最近活跃度
-                last_activity = user_events['event_datetime'].max()
-                days_since_last_activity = (datetime.now() - last_activity).days
-                features['days_since_last_activity'] = days_since_last_activity
-                features['recency_score'] = max(0, 1 - days_since_last_activity / 30)  # 30天内的活跃度得分
-            else:
-                features['active_days'] = 0
-                features['engagement_span_days'] = 0
-                features['activity_frequency'] = 0
-                features['days_since_last_activity'] = 999
-                features['recency_score'] = 0
-                
-            # 基于会话的参与度
-            if not user_sessions.empty:
-                features['total_sessions'] = len(user_sessions)
-                features['avg_session_duration'] = user_sessions['duration_seconds'].mean() if 'duration_seconds' in user_sessions.columns else 0
-                features['avg_events_per_session'] = user_sessions['event_count'].mean() if 'event_count' in user_sessions.columns else 0
-                features['total_session_time'] = user_sessions['duration_seconds'].sum() if 'duration_seconds' in user_sessions.columns else 0
-            else:
-                features['total_sessions'] = 0
-                features['avg_session_duration'] = 0
-                features['avg_events_per_session'] = 0
-                features['total_session_time'] = 0
-                
-            return features
-            
-        except Exception as e:
-            logger.warning(f"提取参与度特征失败: {e}")
-            return {}
-            
-    def _extract_conversion_features(self, user_events: pd.DataFrame) -> Dict[str, float]:
+    def extract_user_features(self,
+                            events: Optional[pd.DataFrame] = None,
+                            users: Optional[pd.DataFrame] = None,
+                            sessions: Optional[pd.DataFrame] = None) -> List[UserFeatures]:
         """
-        提取转化特征
+        提取用户特征
         
         Args:
-            user_events: 用户事件数据
+            events: 事件数据DataFrame
+            users: 用户数据DataFrame
+            sessions: 会话数据DataFrame
             
         Returns:
-            转化特征字典
-        """
-        try:
-            features = {}
-            
-            # 转化事件定义
-            conversion_events = {'sign_up', 'login', 'purchase', 'begin_checkout', 'add_to_cart'}
-            
-            # 转化事件统计
-            total_events = len(user_events)
-            conversion_event_counts = {}
-            
-            for event_type in conversion_events:
-                count = len(user_events[user_events['event_name'] == event_type])
-                conversion_event_counts[event_type] = count
-                features[f'{event_type}_count'] = count
-                features[f'{event_type}_ratio'] = count / total_events if total_events > 0 else 0
-                
-            # 总转化事件数
-            total_conversions = sum(conversion_event_counts.values())
-            features['total_conversions'] = total_conversions
-            features['conversion_ratio'] = total_conversions / total_events if total_events > 0 else 0
-            
-            # 转化深度（完成了多少种转化事件）
-            features['conversion_depth'] = sum(1 for count in conversion_event_counts.values() if count > 0)
-            
-            # 购买相关特征
-            purchase_events = user_events[user_events['event_name'] == 'purchase']
-            features['purchase_frequency'] = len(purchase_events)
-            
-            # 如果有购买，计算购买间隔
-            if len(purchase_events) > 1:
-                purchase_times = purchase_events['event_datetime'].sort_values()
-                intervals = purchase_times.diff().dt.total_seconds() / (24 * 3600)  # 转换为天
-                features['avg_purchase_interval_days'] = intervals.mean()
-            else:
-                features['avg_purchase_interval_days'] = 0
-                
-            return features
-            
-        except Exception as e:
-            logger.warning(f"提取转化特征失败: {e}")
-            return {}
-            
-    def _extract_temporal_features(self, user_events: pd.DataFrame) -> Dict[str, float]:
+            用户特征列表
         """
-        提取时间特征
+        feature_frame = self.extract_user_feature_frame(events, users, sessions)
+        return self._features_from_frame(feature_frame)
         
-        Args:
-            user_events: 用户事件数据
-            
-        Returns:
-            时间特征字典
+    def _features_from_frame(self, feature_frame: pd.DataFrame) -> List[UserFeatures]:
         """
-        try:
-            features = {}
-            
-            if user_events.empty or 'event_datetime' not in user_events.columns:
-                return {}
-                
-            # 活动时间模式
-            user_events['hour'] = user_events['event_datetime'].dt.hour
-            user_events['day_of_week'] = user_events['event_datetime'].dt.dayofweek
-            
-            # 活跃时段分布
-            hour_counts = user_events['hour'].value_counts()
-            total_events = len(user_events)
-            
-            # 工作时间 vs 非工作时间
-            work_hours = user_events[(user_events['hour'] >= 9) & (user_events['hour'] <= 17)]
-            features['work_hours_ratio'] = len(work_hours) / total_events if total_events > 0 else 0
-            
-            # 工作日 vs 周末
-            weekdays = user_events[user_events['day_of_week'] < 5]
-            features['weekday_ratio'] = len(weekdays) / total_events if total_events > 0 else 0
-            
-            # 活动时间集中度
-            if len(hour_counts) > 0:
-                hour_probs = hour_counts / total_events
-                features['time_concentration'] = -sum(p * np.log2(p) for p in hour_probs if p > 0)
-            else:
-                features['time_concentration'] = 0
-                
-            # 最活跃时段
-            if len(hour_counts) > 0:
-                features['most_active_hour'] = hour_counts.index[0]
-            else:
-                features['most_active_hour'] = 12  # 默认中午
-                
-            # 活动规律性（标准差）
-            daily_counts = user_events.groupby(user_events['event_datetime'].dt.date).size()
-            features['activity_regularity'] = 1 / (daily_counts.std() + 1) if len(daily_counts) > 1 else 1
-            
-            return features
-            
-        except Exception as e:
-            logger.warning(f"提取时间特征失败: {e}")
-            return {}
-            
-    def _calculate_avg_events_per_day(self, user_events: pd.DataFrame) -> float:
-        """
-        计算平均每日事件数
+        把特征表转换为用户特征列表
         
         Args:
-            user_events: 用户事件数据
+            feature_frame: 以user_pseudo_id为索引的特征表
             
         Returns:
-            平均每日事件数
+            用户特征列表，与特征表的行一一对应
         """
-        try:
-            if user_events.empty or 'event_datetime' not in user_events.columns:
-                return 0
-                
-            active_dates = user_events['event_datetime'].dt.date.unique()
-            return len(user_events) / len(active_dates) if len(active_dates) > 0 else 0
+        if feature_frame.empty:
+            return []
             
-        except Exception as e:
-            logger.warning(f"计算平均每日事件数失败: {e}")
-            return 0
+        groups = feature_groups(feature_frame)
+        return [
+            UserFeatures(
+                user_id=user_id,
+                behavioral_features=behavioral,
+                demographic_features=demographic,
+                engagement_features=engagement,
+                conversion_features=conversion,
+                temporal_features=temporal
+            )
+            for user_id, behavioral, demographic, engagement, conversion, temporal in zip(
+                feature_frame.index, groups['behavioral'], groups['demographic'], groups['engagement'],
+                groups['conversion'], groups['temporal']
+            )
+        ]
             
     def create_user_segments(self,
-                           user_features: Optional[List[UserFeatures]] = None,
+                           user_features: Optional[Union[List[UserFeatures], pd.DataFrame]] = None,
                            method: str = 'kmeans',
-                           n_clusters: int = 5,
+                           n_clusters: Union[int, str] = 5,
                            **kwargs) -> SegmentationResult:
         """
         创建用户分群
         
         Args:
-            user_features: 用户特征列表
+            user_features: 用户特征列表或特征表（extract_user_feature_frame的结果）
             method: 分群方法
-            n_clusters: 聚类数量
-            **kwargs: 其他参数
+            n_clusters: 聚类数量；'auto'时（仅限kmeans，密度聚类忽略该参数）并行扫描k_min..k_max并选出最优k，
+                        得分曲线记录在quality_metrics['k_scores']中
+            **kwargs: 其他参数；自动选择时可用k_min、k_max、selection_metric、n_jobs
             
         Returns:
             分群结果
@@ -522,9 +284,12 @@ class UserSegmentationEngine:
         try:
             # 获取用户特征
             if user_features is None:
-                user_features = self.extract_user_features()
+                user_features = self.extract_user_feature_frame()
+            # 特征表来自特征存储时记下其参考时间，为新用户分配分群时沿用
+            reference_time = (self.feature_store.reference_time_of(user_features)
+                              if isinstance(user_features, pd.DataFrame) else None)
                 
-            if not user_features:
+            if len(user_features) == 0:
                 logger.warning(t('user_segmentation.logs.user_features_empty', 'User features are empty, cannot perform segmentation'))
                 return SegmentationResult(
                     segments=[],
@@ -534,7 +299,9 @@ class UserSegmentationEngine:
                     segment_comparison=pd.DataFrame()
                 )
                 
-            # 准备特征矩阵
+            # 准备特征矩阵（特征列表先转为特征表，画像与特征矩阵共用）
+            if not isinstance(user_features, pd.DataFrame):
+                user_features = self._frame_from_features(user_features)
             feature_matrix, feature_names, user_ids = self._prepare_feature_matrix(user_features)
             
             if feature_matrix.shape[0] == 0:
@@ -551,9 +318,20 @@ class UserSegmentationEngine:
             if method not in self.segmentation_methods:
                 raise ValueError(t('user_segmentation.errors.unsupported_method', 'Unsupported segmentation method: {method}').format(method=method))
                 
-            cluster_labels = self.segmentation_methods[method](
-                feature_matrix, n_clusters, **kwargs
-            )
+            selection_options = {key: kwargs.pop(key) for key in ('k_min', 'k_max', 'selection_metric', 'n_jobs')
+                                 if key in kwargs}
+            k_selection = None
+            self.last_noise_segment_id = None
+            if n_clusters == 'auto' and method not in ('dbscan', 'hdbscan'):
+                # 扫描直接在完整特征矩阵上运行K-means，其他按k分群的方法各有自己的特征或算法，扫描结果不代表它们
+                if method != 'kmeans':
+                    raise ValueError(f"n_clusters='auto' is only supported for method='kmeans', got '{method}'")
+                k_selection = self._select_n_clusters(feature_matrix, kwargs.get('scalable'), **selection_options)
+                cluster_labels = k_selection.labels
+            else:
+                cluster_labels = self.segmentation_methods[method](
+                    feature_matrix, n_clusters, **kwargs
+                )
             
             # 构建分群结果
             segments = self._build_segments(
@@ -570,6 +348,22 @@ class UserSegmentationEngine:
                 feature_matrix, cluster_labels
             )
             
+            # 保存编码、标准化参数和分群中心，供新用户直接分配分群；噪声点的群没有代表性的中心，不参与分配
+            model_segments = [segment for segment in segments
+                              if segment.segment_id not in (NOISE_LABEL, self.last_noise_segment_id)]
+            self.segmentation_model = SegmentationModel.from_fit(
+                method, feature_names, self.label_encoders, self.scaler,
+                segment_ids=np.array([segment.segment_id for segment in model_segments]),
+                centroids=np.array([[segment.avg_features[name] for name in feature_names]
+                                    for segment in model_segments]),
+                segment_names={segment.segment_id: segment.segment_name for segment in model_segments},
+                reference_time=reference_time
+            ) if model_segments else None
+            if k_selection is not None:
+                quality_metrics['selected_k'] = k_selection.best_k
+                quality_metrics['k_selection_metric'] = k_selection.metric
+                quality_metrics['k_scores'] = k_selection.score_curve()
+            
             # 创建分群对比表
             segment_comparison = self._create_segment_comparison(segments, feature_names)
             
@@ -588,85 +382,216 @@ class UserSegmentationEngine:
             logger.error(t('user_segmentation.logs.segmentation_creation_failed', 'User segmentation creation failed: {error}').format(error=e))
             raise
             
-    def _prepare_feature_matrix(self, user_features: List[UserFeatures]) -> Tuple[np.ndarray, List[str], List[str]]:
+    def assign_segments(self,
+                        user_ids: List[str],
+                        events: Optional[pd.DataFrame] = None,
+                        users: Optional[pd.DataFrame] = None,
+                        sessions: Optional[pd.DataFrame] = None,
+                        model: Optional[SegmentationModel] = None) -> pd.DataFrame:
+        """
+        用已有的分群模型为用户分配分群，只计算这些用户的特征，不重新聚类
+        
+        Args:
+            user_ids: 需要分配的用户ID
+            events: 事件数据，None时从存储管理器读取这些用户的事件
+            users: 用户数据，None时从存储管理器读取
+            sessions: 会话数据，None时从存储管理器读取
+            model: 分群模型，默认为最近一次分群的模型
+            
+        Returns:
+            user_pseudo_id、segment_id、segment_name、distance四列的分配结果（没有事件的用户不在结果中）
+        """
+        model = model or self.segmentation_model
+        if model is None:
+            raise ValueError("No segmentation model available, run create_user_segments first")
+        model.check_compatible()
+        
+        user_ids = list(user_ids)
+        if events is None:
+            if self.storage_manager is None:
+                raise ValueError("Event data not provided and storage manager not initialized")
+            events = self.storage_manager.get_data('events', filters={'user_pseudo_id': user_ids})
+            if users is None:
+                users = self.storage_manager.get_data('users')
+            if sessions is None:
+                sessions = self.storage_manager.get_data('sessions')
+                
+        return model.assign(user_feature_rows(user_ids, events, users, sessions, model.reference_time))
+        
+    def attach_segment_assigner(self, model: Optional[SegmentationModel] = None) -> SegmentAssigner:
+        """
+        创建在线分群分配器并注册到存储管理器，之后每次追加事件时为涉及的用户分配分群
+        
+        Args:
+            model: 分群模型，默认为最近一次分群的模型
+            
+        Returns:
+            在线分群分配器，分配结果见其assignments
+        """
+        if self.storage_manager is None:
+            raise ValueError("Storage manager not initialized")
+        model = model or self.segmentation_model
+        if model is None:
+            raise ValueError("No segmentation model available, run create_user_segments first")
+            
+        if self.segment_assigner is not None:
+            self.storage_manager.remove_event_listener(self.segment_assigner.on_storage_events)
+            
+        assigner = SegmentAssigner(model, self.storage_manager)
+        self.storage_manager.add_event_listener(assigner.on_storage_events)
+        self.segment_assigner = assigner
+        logger.info(f"在线分群分配器已注册，共{model.n_segments}个分群")
+        return assigner
+        
+    def save_segmentation_model(self, path: str) -> None:
+        """
+        保存最近一次分群的模型
+        
+        Args:
+            path: 文件路径
+        """
+        if self.segmentation_model is None:
+            raise ValueError("No segmentation model available, run create_user_segments first")
+        self.segmentation_model.save(path)
+        
+    def load_segmentation_model(self, path: str) -> SegmentationModel:
+        """
+        加载分群模型，之后assign_segments默认使用该模型
+        
+        Args:
+            path: 文件路径
+            
+        Returns:
+            分群模型
+        """
+        self.segmentation_model = SegmentationModel.load(path)
+        return self.segmentation_model
+        
+    def _select_n_clusters(self,
+                           feature_matrix: np.ndarray,
+                           scalable: Optional[bool] = None,
+                           k_min: int = 2,
+                           k_max: Optional[int] = None,
+                           selection_metric: str = 'silhouette_score',
+                           n_jobs: Optional[int] = None) -> KSelectionResult:
+        """
+        在同一特征矩阵上并行扫描聚类数量，各k由抽样上的簇中心热启动
+        
+        Args:
+            feature_matrix: 标准化后的特征矩阵
+            scalable: 是否使用MiniBatchKMeans，默认按行数阈值选择
+            k_min: 最小聚类数
+            k_max: 最大聚类数，默认auto_k_max
+            selection_metric: silhouette_score / calinski_harabasz / davies_bouldin
+            n_jobs: 工作进程数，默认auto_k_jobs
+            
+        Returns:
+            扫描结果（最优k、标签和得分曲线）
+        """
+        scalable = self._use_scalable_backend(feature_matrix, scalable)
+        k_selection = select_n_clusters(
+            feature_matrix,
+            k_min=k_min,
+            k_max=k_max or self.auto_k_max,
+            metric=selection_metric,
+            n_jobs=n_jobs if n_jobs is not None else self.auto_k_jobs,
+            scalable=scalable,
+            chunk_size=self.clustering_chunk_size,
+            silhouette_sample_size=self.auto_k_silhouette_sample_size
+        )
+        self.last_k_selection = k_selection
+        self.last_clustering_backend = 'minibatch_kmeans' if scalable else 'kmeans'
+        logger.info(f"自动选择聚类数量: k={k_selection.best_k}（{k_selection.metric}）")
+        return k_selection
+        
+    def _prepare_feature_matrix(self,
+                                user_features: Union[List[UserFeatures], pd.DataFrame]) -> Tuple[np.ndarray, List[str], List[str]]:
         """
         准备特征矩阵
         
         Args:
-            user_features: 用户特征列表
+            user_features: 用户特征列表或特征表
             
         Returns:
             (特征矩阵, 特征名称列表, 用户ID列表)
         """
         try:
-            if not user_features:
+            if len(user_features) == 0:
                 return np.array([]), [], []
                 
-            # 收集所有数值特征
-            all_features = []
-            feature_names = set()
-            user_ids = []
-            
-            for user_feature in user_features:
-                user_feature_dict = {}
-                user_ids.append(user_feature.user_id)
-                
-                # 合并所有数值特征
-                for feature_dict in [
-                    user_feature.behavioral_features,
-                    user_feature.engagement_features,
-                    user_feature.conversion_features,
-                    user_feature.temporal_features
-                ]:
-                    for key, value in feature_dict.items():
-                        if isinstance(value, (int, float)) and not np.isnan(value):
-                            user_feature_dict[key] = value
-                            feature_names.add(key)
-                            
-                # 处理分类特征（编码为数值）
-                demographic_features = user_feature.demographic_features
-                for key, value in demographic_features.items():
-                    if isinstance(value, str):
-                        if key not in self.label_encoders:
-                            self.label_encoders[key] = LabelEncoder()
-                            
-                        # 确保编码器已经拟合
-                        try:
-                            encoded_value = self.label_encoders[key].transform([value])[0]
-                        except ValueError:
-                            # 新的类别，需要重新拟合
-                            all_values = [uf.demographic_features.get(key, 'unknown') for uf in user_features]
-                            self.label_encoders[key].fit(all_values)
-                            encoded_value = self.label_encoders[key].transform([value])[0]
-                            
-                        user_feature_dict[key] = encoded_value
-                        feature_names.add(key)
-                        
-                all_features.append(user_feature_dict)
-                
-            # 转换为矩阵
-            feature_names = sorted(list(feature_names))
-            feature_matrix = []
-            
-            for user_feature_dict in all_features:
-                feature_vector = []
-                for feature_name in feature_names:
-                    value = user_feature_dict.get(feature_name, 0)
-                    feature_vector.append(value)
-                feature_matrix.append(feature_vector)
+            if isinstance(user_features, pd.DataFrame):
+                return self._prepare_frame_matrix(user_features)
                 
-            feature_matrix = np.array(feature_matrix)
-            
-            # 标准化特征
-            if feature_matrix.shape[0] > 0:
-                feature_matrix = self.scaler.fit_transform(feature_matrix)
-                
-            return feature_matrix, feature_names, user_ids
+            # 特征列表先转为特征表，分类特征按列一次编码
+            return self._prepare_frame_matrix(self._frame_from_features(user_features))
             
         except Exception as e:
             logger.warning(f"准备特征矩阵失败: {e}")
             return np.array([]), [], []      
       
+    def _frame_from_features(self, user_features: List[UserFeatures]) -> pd.DataFrame:
+        """
+        用户特征列表转为特征表：数值特征取非NaN的数值，人口统计特征取字符串值，其余记为缺失
+        
+        Args:
+            user_features: 用户特征列表
+            
+        Returns:
+            以user_pseudo_id为索引的特征表
+        """
+        records = []
+        for user_feature in user_features:
+            record = {}
+            for feature_dict in [
+                user_feature.behavioral_features,
+                user_feature.engagement_features,
+                user_feature.conversion_features,
+                user_feature.temporal_features
+            ]:
+                record.update({key: value for key, value in feature_dict.items()
+                               if isinstance(value, (int, float)) and not np.isnan(value)})
+            record.update({key: value for key, value in user_feature.demographic_features.items()
+                           if isinstance(value, str)})
+            records.append(record)
+            
+        index = pd.Index([user_feature.user_id for user_feature in user_features], name='user_pseudo_id')
+        return pd.DataFrame.from_records(records, index=index)
+        
+    def _prepare_frame_matrix(self, feature_frame: pd.DataFrame) -> Tuple[np.ndarray, List[str], List[str]]:
+        """
+        由特征表准备标准化的特征矩阵，分类特征用标签编码，缺失值记为0
+        
+        Args:
+            feature_frame: 以user_pseudo_id为索引的特征表
+            
+        Returns:
+            (特征矩阵, 特征名称列表, 用户ID列表)
+        """
+        columns = {}
+        self.label_encoders = {}
+        for name in feature_frame.columns:
+            values = feature_frame[name]
+            if name in CATEGORICAL_FEATURES or values.dtype == object:
+                is_text = values.map(lambda value: isinstance(value, str)).to_numpy()
+                encoded = np.zeros(len(values))
+                if is_text.any():
+                    encoder = self.label_encoders[name] = LabelEncoder()
+                    encoded[is_text] = encoder.fit_transform(values[is_text].to_numpy(dtype=str))
+                columns[name] = encoded
+            else:
+                columns[name] = values.to_numpy(dtype=float)
+                
+        feature_names = sorted(columns)
+        feature_matrix = np.nan_to_num(np.column_stack([columns[name] for name in feature_names]))
+        feature_matrix = self.scaler.fit_transform(feature_matrix)
+        return feature_matrix, feature_names, feature_frame.index.tolist()
+        
+    def _use_scalable_backend(self, feature_matrix: np.ndarray, scalable: Optional[bool]) -> bool:
+        """是否使用可扩展聚类：显式指定时按指定，否则按行数阈值自动选择"""
+        if scalable is not None:
+            return bool(scalable)
+        return feature_matrix.shape[0] > self.scalable_row_threshold
+        
     def _kmeans_clustering(self, feature_matrix: np.ndarray, n_clusters: int, **kwargs) -> np.ndarray:
         """
         K-means聚类
@@ -674,16 +599,30 @@ class UserSegmentationEngine:
         Args:
             feature_matrix: 特征矩阵
             n_clusters: 聚类数量
-            **kwargs: 其他参数
+            **kwargs: 其他参数；scalable为True/False时强制/禁用MiniBatchKMeans，
+                      默认在行数超过scalable_row_threshold时使用
             
         Returns:
             聚类标签
         """
         try:
+            scalable = kwargs.pop('scalable', None)
+            chunk_size = kwargs.pop('chunk_size', self.clustering_chunk_size)
             if feature_matrix.shape[0] < n_clusters:
                 logger.warning(f"样本数({feature_matrix.shape[0]})少于聚类数({n_clusters})，调整聚类数")
                 n_clusters = max(1, feature_matrix.shape[0])
                 
+            if self._use_scalable_backend(feature_matrix, scalable):
+                options = {key: kwargs[key] for key in ('batch_size', 'max_epochs', 'tol', 'random_state')
+                           if key in kwargs}
+                cluster_labels, _ = minibatch_kmeans(
+                    feature_matrix, n_clusters,
+                    chunk_size=chunk_size,
+                    **options
+                )
+                self.last_clustering_backend = 'minibatch_kmeans'
+                return cluster_labels
+                
             kmeans = KMeans(
                 n_clusters=n_clusters,
                 random_state=42,
@@ -692,6 +631,7 @@ class UserSegmentationEngine:
             )
             
             cluster_labels = kmeans.fit_predict(feature_matrix)
+            self.last_clustering_backend = 'kmeans'
             return cluster_labels
             
         except Exception as e:
@@ -706,32 +646,70 @@ class UserSegmentationEngine:
         Args:
             feature_matrix: 特征矩阵
             n_clusters: 聚类数量（DBSCAN中不直接使用）
-            **kwargs: 其他参数
+            **kwargs: 其他参数（eps、min_samples、scalable、sample_size）
             
         Returns:
             聚类标签
         """
         try:
-            eps = kwargs.get('eps', 0.5)
-            min_samples = kwargs.get('min_samples', 5)
-            
-            dbscan = DBSCAN(eps=eps, min_samples=min_samples)
-            cluster_labels = dbscan.fit_predict(feature_matrix)
-            
-            # DBSCAN可能产生噪声点（标签为-1），将其归为单独的群
-            unique_labels = np.unique(cluster_labels)
-            if -1 in unique_labels:
-                # 将噪声点重新标记
-                noise_mask = cluster_labels == -1
-                max_label = cluster_labels[~noise_mask].max() if np.any(~noise_mask) else -1
-                cluster_labels[noise_mask] = max_label + 1
-                
-            return cluster_labels
+            return self._density_clustering(feature_matrix, 'dbscan', **kwargs)
             
         except Exception as e:
             logger.warning(f"DBSCAN聚类失败: {e}")
             return np.zeros(feature_matrix.shape[0])
             
+    def _hdbscan_clustering(self, feature_matrix: np.ndarray, n_clusters: int, **kwargs) -> np.ndarray:
+        """
+        HDBSCAN聚类
+        
+        Args:
+            feature_matrix: 特征矩阵
+            n_clusters: 聚类数量（HDBSCAN中不直接使用）
+            **kwargs: 其他参数（min_cluster_size、min_samples、scalable、sample_size）
+            
+        Returns:
+            聚类标签
+        """
+        try:
+            return self._density_clustering(feature_matrix, 'hdbscan', **kwargs)
+            
+        except Exception as e:
+            logger.warning(f"HDBSCAN聚类失败: {e}")
+            return np.zeros(feature_matrix.shape[0])
+            
+    def _density_clustering(self, feature_matrix: np.ndarray, method: str, **kwargs) -> np.ndarray:
+        """
+        密度聚类：行数超过阈值时在抽样上拟合、其余用户按最近簇中心分配
+        
+        Args:
+            feature_matrix: 特征矩阵
+            method: 'dbscan' 或 'hdbscan'
+            **kwargs: 聚类参数
+            
+        Returns:
+            聚类标签，噪声点归为单独的群
+        """
+        scalable = kwargs.pop('scalable', None)
+        sample_size = kwargs.pop('sample_size', self.density_sample_size)
+        if not self._use_scalable_backend(feature_matrix, scalable):
+            sample_size = feature_matrix.shape[0]
+            
+        cluster_labels, info = sampled_density_clustering(
+            feature_matrix, method=method, sample_size=sample_size,
+            chunk_size=self.clustering_chunk_size, **kwargs
+        )
+        sampled = info['sample_size'] < feature_matrix.shape[0]
+        self.last_clustering_backend = f"sampled_{method}" if sampled else method
+        
+        # 密度聚类可能产生噪声点（标签为-1），将其归为单独的群
+        noise_mask = cluster_labels == NOISE_LABEL
+        if noise_mask.any():
+            max_label = cluster_labels[~noise_mask].max() if np.any(~noise_mask) else -1
+            cluster_labels[noise_mask] = max_label + 1
+            self.last_noise_segment_id = int(max_label + 1)
+            
+        return cluster_labels
+            
     def _behavioral_segmentation(self, feature_matrix: np.ndarray, n_clusters: int, **kwargs) -> np.ndarray:
         """
         基于行为的分群
@@ -794,7 +772,7 @@ class UserSegmentationEngine:
             return np.zeros(feature_matrix.shape[0])
             
     def _build_segments(self,
-                       user_features: List[UserFeatures],
+                       user_features: Union[List[UserFeatures], pd.DataFrame],
                        cluster_labels: np.ndarray,
                        feature_matrix: np.ndarray,
                        feature_names: List[str]) -> List[UserSegment]:
@@ -802,7 +780,7 @@ class UserSegmentationEngine:
         构建分群对象
         
         Args:
-            user_features: 用户特征列表
+            user_features: 用户特征列表或特征表（行与feature_matrix对应）
             cluster_labels: 聚类标签
             feature_matrix: 特征矩阵
             feature_names: 特征名称列表
@@ -811,43 +789,27 @@ class UserSegmentationEngine:
             用户分群列表
         """
         try:
-            segments = []
-            unique_labels = np.unique(cluster_labels)
+            feature_frame = (user_features if isinstance(user_features, pd.DataFrame)
+                             else self._frame_from_features(user_features))
             
-            for segment_id in unique_labels:
-                # 获取该分群的用户
-                segment_mask = cluster_labels == segment_id
-                segment_user_features = [user_features[i] for i in range(len(user_features)) if segment_mask[i]]
-                segment_feature_matrix = feature_matrix[segment_mask]
-                
-                # 计算分群特征均值
-                avg_features = {}
-                if len(segment_feature_matrix) > 0:
-                    avg_feature_values = np.mean(segment_feature_matrix, axis=0)
-                    for i, feature_name in enumerate(feature_names):
-                        avg_features[feature_name] = float(avg_feature_values[i])
-                        
-                # 生成分群画像
-                segment_profile = self._generate_segment_profile(segment_user_features)
-                
-                # 识别关键特征
-                key_characteristics = self._identify_key_characteristics(
-                    segment_feature_matrix, feature_matrix, feature_names
-                )
-                
-                # 生成分群名称
-                segment_name = self._generate_segment_name(segment_id, segment_profile, key_characteristics)
-                
+            # 标准化特征的分群均值，用于平均特征和关键特征
+            statistics = segment_statistics(feature_matrix, cluster_labels)
+            segment_profiles = self._generate_segment_profiles(feature_frame, cluster_labels)
+            key_characteristics = self._identify_key_characteristics(statistics, feature_names)
+            user_ids = feature_frame.index.to_numpy()
+            
+            segments = []
+            for row, (segment_id, members) in enumerate(zip(statistics.labels, statistics.members())):
+                segment_profile = segment_profiles[row]
                 segment = UserSegment(
                     segment_id=int(segment_id),
-                    segment_name=segment_name,
-                    user_count=len(segment_user_features),
-                    user_ids=[uf.user_id for uf in segment_user_features],
+                    segment_name=self._generate_segment_name(segment_id, segment_profile, key_characteristics[row]),
+                    user_count=len(members),
+                    user_ids=user_ids[members].tolist(),
                     segment_profile=segment_profile,
-                    key_characteristics=key_characteristics,
-                    avg_features=avg_features
+                    key_characteristics=key_characteristics[row],
+                    avg_features=dict(zip(feature_names, statistics.means[row].tolist()))
                 )
-                
                 segments.append(segment)
                 
             return segments
@@ -856,109 +818,103 @@ class UserSegmentationEngine:
             logger.warning(f"构建分群对象失败: {e}")
             return []
             
-    def _generate_segment_profile(self, segment_user_features: List[UserFeatures]) -> Dict[str, Any]:
+    def _generate_segment_profiles(self,
+                                   feature_frame: pd.DataFrame,
+                                   cluster_labels: np.ndarray) -> List[Dict[str, Any]]:
         """
-        生成分群画像
+        生成所有分群的画像
+        
+        数值特征（原始尺度，缺失记为0）的分群均值、分位数和相对总体的提升度一次按矩阵计算，
+        人口统计特征取各分群的众数。
         
         Args:
-            segment_user_features: 分群用户特征列表
+            feature_frame: 用户特征表
+            cluster_labels: 聚类标签
             
         Returns:
-            分群画像字典
+            与升序分群标签对应的画像字典列表
         """
         try:
-            if not segment_user_features:
-                return {}
-                
-            profile = {}
-            
-            # 人口统计特征统计
-            platforms = [uf.demographic_features.get('platform', 'unknown') for uf in segment_user_features]
-            devices = [uf.demographic_features.get('device_category', 'unknown') for uf in segment_user_features]
-            countries = [uf.demographic_features.get('geo_country', 'unknown') for uf in segment_user_features]
-            
-            profile['dominant_platform'] = max(set(platforms), key=platforms.count)
-            profile['dominant_device'] = max(set(devices), key=devices.count)
-            profile['dominant_country'] = max(set(countries), key=countries.count)
-            
-            # 行为特征统计
-            total_events = [uf.behavioral_features.get('total_events', 0) for uf in segment_user_features]
-            conversion_ratios = [uf.conversion_features.get('conversion_ratio', 0) for uf in segment_user_features]
-            active_days = [uf.engagement_features.get('active_days', 0) for uf in segment_user_features]
-            
-            profile['avg_total_events'] = np.mean(total_events)
-            profile['avg_conversion_ratio'] = np.mean(conversion_ratios)
-            profile['avg_active_days'] = np.mean(active_days)
-            
-            # 参与度分级
-            avg_engagement = np.mean([uf.engagement_features.get('activity_frequency', 0) for uf in segment_user_features])
-            if avg_engagement > 0.7:
-                profile['engagement_level'] = 'high'
-            elif avg_engagement > 0.3:
-                profile['engagement_level'] = 'medium'
-            else:
-                profile['engagement_level'] = 'low'
-                
-            # 价值分级
-            avg_conversions = np.mean([uf.conversion_features.get('total_conversions', 0) for uf in segment_user_features])
-            if avg_conversions > 5:
-                profile['value_level'] = 'high'
-            elif avg_conversions > 1:
-                profile['value_level'] = 'medium'
-            else:
-                profile['value_level'] = 'low'
+            numeric = feature_frame.drop(columns=[column for column in CATEGORICAL_FEATURES
+                                                  if column in feature_frame.columns])
+            numeric = numeric.apply(pd.to_numeric, errors='coerce').fillna(0.0)
+            feature_names = list(numeric.columns)
+            statistics = segment_statistics(numeric.to_numpy(dtype=float), cluster_labels, PROFILE_QUANTILES)
+            n_segments = len(statistics.labels)
+            
+            def segment_means(feature_name: str) -> np.ndarray:
+                if feature_name not in feature_names:
+                    return np.zeros(n_segments)
+                return statistics.means[:, feature_names.index(feature_name)]
+            
+            # 人口统计特征众数
+            dominant = {}
+            for key, column in (('dominant_platform', 'platform'), ('dominant_device', 'device_category'),
+                                ('dominant_country', 'geo_country')):
+                values = (feature_frame[column].fillna('unknown').to_numpy(dtype=object)
+                          if column in feature_frame.columns else np.full(len(feature_frame), 'unknown', dtype=object))
+                dominant[key] = dominant_values(values, statistics.codes, n_segments)
+                
+            engagement = segment_means('activity_frequency')
+            conversions = segment_means('total_conversions')
+            total_events = segment_means('total_events')
+            conversion_ratios = segment_means('conversion_ratio')
+            active_days = segment_means('active_days')
+            summaries = feature_summaries(statistics, feature_names)
+            
+            profiles = []
+            for row in range(n_segments):
+                profile = {key: values[row] for key, values in dominant.items()}
+                profile['avg_total_events'] = float(total_events[row])
+                profile['avg_conversion_ratio'] = float(conversion_ratios[row])
+                profile['avg_active_days'] = float(active_days[row])
+                
+                # 参与度分级
+                if engagement[row] > 0.7:
+                    profile['engagement_level'] = 'high'
+                elif engagement[row] > 0.3:
+                    profile['engagement_level'] = 'medium'
+                else:
+                    profile['engagement_level'] = 'low'
+                    
+                # 价值分级
+                if conversions[row] > 5:
+                    profile['value_level'] = 'high'
+                elif conversions[row] > 1:
+                    profile['value_level'] = 'medium'
+                else:
+                    profile['value_level'] = 'low'
+                    
+                profile.update(summaries[row])
+                profiles.append(profile)
                 
-            return profile
+            return profiles
             
         except Exception as e:
             logger.warning(f"生成分群画像失败: {e}")
-            return {}
+            return [{} for _ in np.unique(cluster_labels)]
             
     def _identify_key_characteristics(self,
-                                    segment_features: np.ndarray,
-                                    all_features: np.ndarray,
-                                    feature_names: List[str]) -> List[str]:
+                                    statistics: SegmentStatistics,
+                                    feature_names: List[str]) -> List[List[str]]:
         """
-        识别分群关键特征
+        识别各分群的关键特征：分群均值偏离总体均值最大的3个特征
         
         Args:
-            segment_features: 分群特征矩阵
-            all_features: 全体特征矩阵
+            statistics: 标准化特征的分群统计
             feature_names: 特征名称列表
             
         Returns:
-            关键特征列表
+            与升序分群标签对应的关键特征列表
         """
         try:
-            if len(segment_features) == 0 or len(all_features) == 0:
-                return []
-                
-            characteristics = []
-            
-            # 计算分群特征均值与全体均值的差异
-            segment_means = np.mean(segment_features, axis=0)
-            overall_means = np.mean(all_features, axis=0)
-            
-            # 找出差异最大的特征
-            differences = np.abs(segment_means - overall_means)
-            top_indices = np.argsort(differences)[-5:]  # 取前5个最显著的特征
-            
-            for idx in reversed(top_indices):
-                if idx < len(feature_names):
-                    feature_name = feature_names[idx]
-                    segment_value = segment_means[idx]
-                    overall_value = overall_means[idx]
-                    
-                    if segment_value > overall_value:
-                        characteristics.append(f"高{feature_name}")
-                    else:
-                        characteristics.append(f"低{feature_name}")
-                        
-            return characteristics[:3]  # 返回前3个最重要的特征
+            deviations = top_deviations(statistics.means, statistics.overall_means, feature_names)
+            return [[f"高{feature_name}" if higher else f"低{feature_name}" for feature_name, higher in segment]
+                    for segment in deviations]
             
         except Exception as e:
             logger.warning(f"识别关键特征失败: {e}")
-            return []
+            return [[] for _ in statistics.labels]
             
     def _generate_segment_name(self,
                              segment_id: int,
@@ -1016,6 +972,8 @@ class UserSegmentationEngine:
         """
         计算特征重要性
         
+        所有特征的单因素方差分析F统计量一次计算，按最大值归一化到0-1。
+        
         Args:
             feature_matrix: 特征矩阵
             cluster_labels: 聚类标签
@@ -1028,47 +986,11 @@ class UserSegmentationEngine:
             if len(feature_matrix) == 0 or len(feature_names) == 0:
                 return {}
                 
-            importance = {}
-            
-            # 使用方差分析计算特征重要性
-            unique_labels = np.unique(cluster_labels)
-            
-            for i, feature_name in enumerate(feature_names):
-                feature_values = feature_matrix[:, i]
-                
-                # 计算组间方差和组内方差
-                overall_mean = np.mean(feature_values)
-                between_group_var = 0
-                within_group_var = 0
-                
-                for label in unique_labels:
-                    group_mask = cluster_labels == label
-                    group_values = feature_values[group_mask]
-                    
-                    if len(group_values) > 0:
-                        group_mean = np.mean(group_values)
-                        group_size = len(group_values)
-                        
-                        # 组间方差
-                        between_group_var += group_size * (group_mean - overall_mean) ** 2
-                        
-                        # 组内方差
-                        within_group_var += np.sum((group_values - group_mean) ** 2)
-                        
-                # F统计量作为重要性指标
-                if within_group_var > 0:
-                    f_stat = between_group_var / within_group_var
-                    importance[feature_name] = f_stat
-                else:
-                    importance[feature_name] = 0
-                    
-            # 标准化重要性分数
-            if importance:
-                max_importance = max(importance.values())
-                if max_importance > 0:
-                    importance = {k: v / max_importance for k, v in importance.items()}
-                    
-            return importance
+            f_statistics, _ = anova_f(feature_matrix, cluster_labels)
+            max_importance = f_statistics.max()
+            if max_importance > 0:
+                f_statistics = f_statistics / max_importance
+            return dict(zip(feature_names, f_statistics.tolist()))
             
         except Exception as e:
             logger.warning(f"计算特征重要性失败: {e}")
@@ -1076,10 +998,14 @@ class UserSegmentationEngine:
             
     def _calculate_quality_metrics(self,
                                  feature_matrix: np.ndarray,
-                                 cluster_labels: np.ndarray) -> Dict[str, float]:
+                                 cluster_labels: np.ndarray) -> Dict[str, Any]:
         """
         计算分群质量指标
         
+        轮廓系数在用户数不超过silhouette_sample_size时精确计算，否则在分层抽样上估计并给出95%置信区间，
+        silhouette_estimator记录使用的方法（exact / stratified_sample）；
+        inertia、Calinski-Harabasz和Davies-Bouldin指数由簇中心在O(n)时间内计算。
+        
         Args:
             feature_matrix: 特征矩阵
             cluster_labels: 聚类标签
@@ -1093,42 +1019,29 @@ class UserSegmentationEngine:
             if len(feature_matrix) < 2:
                 return metrics
                 
+            cluster_sizes = np.unique(cluster_labels, return_counts=True)[1]
+            n_clusters = len(cluster_sizes)
+            
             # 轮廓系数
             try:
-                if len(np.unique(cluster_labels)) > 1:
-                    silhouette_avg = silhouette_score(feature_matrix, cluster_labels)
-                    metrics['silhouette_score'] = silhouette_avg
-                else:
-                    metrics['silhouette_score'] = 0
+                metrics.update(silhouette_metrics(feature_matrix, cluster_labels,
+                                                  sample_size=self.silhouette_sample_size))
             except Exception:
                 metrics['silhouette_score'] = 0
+                metrics['silhouette_estimator'] = 'exact'
                 
-            # 簇内平方和
+            # 簇内平方和及基于簇中心的指数
             try:
-                inertia = 0
-                unique_labels = np.unique(cluster_labels)
-                
-                for label in unique_labels:
-                    cluster_points = feature_matrix[cluster_labels == label]
-                    if len(cluster_points) > 0:
-                        cluster_center = np.mean(cluster_points, axis=0)
-                        inertia += np.sum((cluster_points - cluster_center) ** 2)
-                        
-                metrics['inertia'] = inertia
+                metrics.update(centroid_metrics(feature_matrix, cluster_labels))
             except Exception:
                 metrics['inertia'] = 0
                 
             # 分群数量
-            metrics['n_clusters'] = len(np.unique(cluster_labels))
+            metrics['n_clusters'] = n_clusters
             
             # 分群大小分布的均匀性
-            cluster_sizes = [np.sum(cluster_labels == label) for label in np.unique(cluster_labels)]
-            if cluster_sizes:
-                size_std = np.std(cluster_sizes)
-                size_mean = np.mean(cluster_sizes)
-                metrics['size_uniformity'] = 1 - (size_std / size_mean) if size_mean > 0 else 0
-            else:
-                metrics['size_uniformity'] = 0
+            size_mean = np.mean(cluster_sizes)
+            metrics['size_uniformity'] = 1 - (np.std(cluster_sizes) / size_mean) if size_mean > 0 else 0
                 
             return metrics
             
@@ -1283,13 +1196,13 @@ class UserSegmentationEngine:
             logger.error(f"分析分群特征失败: {e}")
             return {}
             
-    def perform_clustering(self, n_clusters: int = 5, method: str = 'kmeans', **kwargs) -> SegmentationResult:
+    def perform_clustering(self, n_clusters: Union[int, str] = 5, method: str = 'kmeans', **kwargs) -> SegmentationResult:
         """
         执行用户聚类分析（代理接口方法）
 
         Args:
-            n_clusters: 聚类数量
-            method: 聚类方法 ('kmeans', 'dbscan', 'behavioral', 'value_based', 'engagement')
+            n_clusters: 聚类数量，'auto'时自动选择（见create_user_segments）
+            method: 聚类方法 ('kmeans', 'dbscan', 'hdbscan', 'behavioral', 'value_based', 'engagement')
             **kwargs: 其他聚类参数
 
         Returns:
@@ -1298,10 +1211,10 @@ class UserSegmentationEngine:
         try:
             logger.info(t('user_segmentation.logs.execute_clustering', 'Executing user clustering: method={method}, clusters={n_clusters}').format(method=method, n_clusters=n_clusters))
 
-            # 首先提取用户特征
-            user_features = self.extract_user_features()
+            # 首先提取用户特征（特征表只提取和标准化一次）
+            user_features = self.extract_user_feature_frame()
 
-            if not user_features:
+            if user_features.empty:
                 logger.warning(t('user_segmentation.logs.cannot_extract_features_empty_result', 'Cannot extract user features, returning empty segmentation result'))
                 return SegmentationResult(
                     segments=[],
@@ -1387,10 +1300,10 @@ class UserSegmentationEngine:
                     'recommendations': []
                 }
             
-            # 提取用户特征
-            user_features = self.extract_user_features(events)
+            # 提取用户特征（按数据版本复用特征存储中的特征表）
+            user_features = self.extract_user_feature_frame(events)
             
-            if not user_features:
+            if user_features.empty:
                 return {
                     'status': 'error',
                     'message': t('user_segmentation.errors.cannot_extract_user_features', '无法提取用户特征'),
@@ -1450,9 +1363,8 @@ class UserSegmentationEngine:
                     recommendations.append(LocalizedInsightGenerator.format_segmentation_recommendation('focus_high_value_needs_quality_service'))
             
             # 特征重要性分析
-            if user_features:
-                sample_features = user_features[0].behavioral_features
-                important_features = sorted(sample_features.keys())[:3]
+            if not user_features.empty:
+                important_features = sorted(FEATURE_GROUPS['behavioral'])[:3]
                 insights.append(t('user_segmentation.insights.main_distinguishing_features', 'Main distinguishing features: {features}').format(
                     features=', '.join(important_features)))
                 recommendations.append(t('user_segmentation.recommendations.design_personalized_experience_based_on_features', 
@@ -1493,7 +1405,7 @@ class UserSegmentationEngine:
             if self.storage_manager is None:
                 return {"error": "Storage manager not initialized"}
                 
-            events = self.storage_manager.get_data('events')
+            events = self.dataset_cache.events()
             users = self.storage_manager.get_data('users')
 
             # 安全地检查事件数据
@@ -1519,9 +1431,8 @@ class UserSegmentationEngine:
             unique_event_types = events['event_name'].nunique()
             
             # 时间范围
-            if 'event_datetime' not in events.columns:
-                if 'event_timestamp' in events.columns:
-                    events['event_datetime'] = pd.to_datetime(events['event_timestamp'], unit='us')
+            if 'event_timestamp' in events.columns:
+                events = self.dataset_cache.with_datetime(events)
                     
             if 'event_datetime' in events.columns:
                 date_range = {
@@ -1568,6 +1479,36 @@ class UserSegmentationEngine:
             logger.error(f"获取分析摘要失败: {e}")
             return {"error": str(e)}
     
+    def _stored_feature_frame(self) -> pd.DataFrame:
+        """存储管理器数据的用户特征表，不可用时为空表"""
+        try:
+            if self.feature_store.is_versioned():
+                return self.feature_store.get_features()
+        except Exception as e:
+            logger.warning(f"读取用户特征表失败: {e}")
+        return pd.DataFrame()
+        
+    def _segment_value_metrics(self, feature_frame: pd.DataFrame, user_ids: List[str]) -> Dict[str, float]:
+        """
+        群体的价值指标：平均会话时长、人均页面浏览数和有购买的用户占比
+        
+        Args:
+            feature_frame: 用户特征表
+            user_ids: 群体的用户ID
+            
+        Returns:
+            价值指标，特征表中没有这些用户时为默认估计值
+        """
+        known = feature_frame.index.intersection(user_ids) if not feature_frame.empty else []
+        if len(known) == 0:
+            return {'avg_session_duration': 180, 'avg_page_views': 8, 'conversion_rate': 0.15}
+        rows = feature_frame.loc[known]
+        return {
+            'avg_session_duration': float(rows['avg_session_duration'].mean()),
+            'avg_page_views': float((rows['page_view_ratio'] * rows['total_events']).mean()),
+            'conversion_rate': float((rows['purchase_count'] > 0).mean())
+        }
+        
     def profile_segments(self, segments: Dict[str, Any]) -> Dict[str, Any]:
         """
         分析用户群体画像
@@ -1587,11 +1528,13 @@ class UserSegmentationEngine:
                     'recommendations': []
                 }
             
-            # 基本群体画像分析
+            # 基本群体画像分析，价值指标由特征存储中的用户特征表计算
+            feature_frame = self._stored_feature_frame()
             profiles = {}
             for segment_id, segment_data in segments.items():
+                user_ids = segment_data.get('user_ids', []) if isinstance(segment_data, dict) else []
                 profiles[segment_id] = {
-                    'size': len(segment_data.get('user_ids', [])) if isinstance(segment_data, dict) else 0,
+                    'size': len(user_ids),
                     'characteristics': [
                         t('user_segmentation.characteristics.high_activity_users', '高活跃度用户'),
                         t('user_segmentation.characteristics.strong_purchase_intention', '购买意向强烈'),
@@ -1602,11 +1545,7 @@ class UserSegmentationEngine:
                         t('user_segmentation.characteristics.attention_to_promotions', '关注促销活动'),
                         t('user_segmentation.characteristics.mainly_mobile_usage', '移动端使用为主')
                     ],
-                    'value_metrics': {
-                        'avg_session_duration': 180,
-                        'avg_page_views': 8,
-                        'conversion_rate': 0.15
-                    }
+                    'value_metrics': self._segment_value_metrics(feature_frame, user_ids)
                 }
             
             return {
@@ -169,7 +169,23 @@ class TestAdvancedVisualizer:
             self.visualizer.create_user_behavior_flow(invalid_data)
         
         assert "缺少必要的列" in str(excinfo.value)
-    
+
+    def test_create_user_behavior_flow_step_nodes(self):
+        """测试分步流程数据按步骤区分节点并合并多余分支"""
+        data = pd.DataFrame({
+            'source': ['home', 'home', 'home', 'a'],
+            'target': ['a', 'b', 'c', 'home'],
+            'value': [5, 1, 3, 2],
+            'source_step': [0, 0, 0, 1],
+            'target_step': [1, 1, 1, 2]
+        })
+
+        fig = self.visualizer.create_user_behavior_flow(data, max_branches=2)
+
+        sankey = fig.data[0]
+        assert list(sankey.node.label) == ['home', 'a', 'c', 'home', 'other']
+        assert sorted(sankey.link.value) == [1, 2, 3, 5]
+
     def test_create_user_segmentation_scatter_with_valid_data(self):
         """测试使用有效数据创建用户分群散点图"""
         data = self.create_sample_segment_data()
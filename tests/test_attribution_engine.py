@@ -0,0 +1,123 @@
+"""
+归因分析引擎测试模块
+
+测试向量化触点构建和各归因模型的权重分配。
+"""
+
+import pytest
+import pandas as pd
+import numpy as np
+from datetime import datetime, timedelta
+import sys
+import os
+
+# 添加项目根目录到路径
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from engines.attribution_engine import AttributionEngine, AttributionResult
+
+
+class TestAttributionEngine:
+    """归因分析引擎测试类"""
+
+    @pytest.fixture
+    def events(self):
+        """创建示例事件数据：user_1在一次购买前有四个触点"""
+        base_time = datetime(2024, 1, 10)
+        rows = [
+            ('user_1', 'search', base_time - timedelta(days=10)),  # 超出7天窗口
+            ('user_1', 'search', base_time - timedelta(days=6)),
+            ('user_1', 'page_view', base_time - timedelta(days=3)),
+            ('user_1', 'view_item', base_time - timedelta(days=1)),
+            ('user_1', 'page_view', base_time - timedelta(hours=1)),
+            ('user_1', 'purchase', base_time),
+            ('user_2', 'page_view', base_time),
+            ('user_2', 'purchase', base_time + timedelta(minutes=5)),
+            ('user_3', 'purchase', base_time),  # 无触点的转化
+        ]
+        return pd.DataFrame(rows, columns=['user_pseudo_id', 'event_name', 'event_datetime'])
+
+    @pytest.fixture
+    def engine(self):
+        """创建只把购买视为转化的归因引擎"""
+        return AttributionEngine(conversion_events={'purchase'})
+
+    def test_build_touchpoints(self, engine, events):
+        """测试触点窗口构建"""
+        touchpoints = engine.build_touchpoints(events, attribution_window_days=7)
+
+        assert touchpoints.total_conversions == 3
+        assert touchpoints.attributed_conversions == 2
+        assert len(touchpoints.conversion_ids) == 5
+        assert np.bincount(touchpoints.conversion_ids).tolist() == [4, 1]
+
+    def test_single_touch_models(self, engine, events):
+        """测试首次接触和最后接触归因"""
+        results = engine.attribute(events, models=['first_touch', 'last_touch'])
+
+        assert isinstance(results['first_touch'], AttributionResult)
+        assert results['first_touch'].channel_credits == {'search': 1.0, 'page_view': 1.0}
+        assert results['last_touch'].channel_credits == {'page_view': 2.0}
+
+    def test_multi_touch_models_conserve_credit(self, engine, events):
+        """测试多触点模型的权重之和等于有触点的转化数"""
+        results = engine.attribute(events, models=['linear', 'time_decay', 'position_based'])
+
+        for result in results.values():
+            assert sum(result.channel_credits.values()) == pytest.approx(2.0)
+
+        assert results['linear'].channel_credits['page_view'] == pytest.approx(1.5)
+        # 位置归因：首尾各0.4，中间两个触点平分0.2
+        assert results['position_based'].channel_credits['search'] == pytest.approx(0.4)
+        assert results['position_based'].channel_credits['view_item'] == pytest.approx(0.1)
+        # 时间衰减：越接近转化的触点权重越高
+        assert results['time_decay'].channel_credits['view_item'] > results['time_decay'].channel_credits['search']
+
+    def test_unsupported_model(self, engine, events):
+        """测试不支持的归因模型"""
+        with pytest.raises(ValueError):
+            engine.attribute(events, models=['unknown_model'])
+
+    def test_empty_events(self, engine):
+        """测试空数据"""
+        results = engine.attribute(pd.DataFrame(), models=['linear'])
+
+        assert results['linear'].total_conversions == 0
+        assert results['linear'].channel_credits == {}
+
+    def test_markov_attribution(self, engine):
+        """测试马尔可夫链归因的吸收概率和移除效应"""
+        # 路径：search → page_view → purchase（2次）、page_view → exit（2次）、search → exit（1次）
+        path_flow_graph = {
+            'edges': [
+                {'from': 'search', 'to': 'page_view', 'weight': 2},
+                {'from': 'page_view', 'to': 'purchase', 'weight': 2},
+            ],
+            'entry_counts': {'search': 3, 'page_view': 2},
+            'exit_counts': {'purchase': 2, 'page_view': 2, 'search': 1},
+        }
+
+        result = engine.markov_attribution(path_flow_graph)
+
+        # P(转化) = 0.6 * (2/3) * 0.5 + 0.4 * 0.5 = 0.4
+        assert result.conversion_probability == pytest.approx(0.4)
+        # 移除page_view后无法转化；移除search后只剩直接进入page_view的路径
+        assert result.removal_effects['page_view'] == pytest.approx(1.0)
+        assert result.removal_effects['search'] == pytest.approx(0.5)
+        assert sum(result.channel_credits.values()) == pytest.approx(result.total_conversions)
+
+    def test_markov_attribution_without_conversions(self, engine):
+        """测试没有转化路径的马尔可夫链归因"""
+        path_flow_graph = {
+            'edges': [{'from': 'search', 'to': 'page_view', 'weight': 1}],
+            'entry_counts': {'search': 1},
+            'exit_counts': {'page_view': 1},
+        }
+
+        result = engine.markov_attribution(path_flow_graph)
+
+        assert result.conversion_probability == 0.0
+        assert result.channel_credits == {}
+
+if __name__ == '__main__':
+    pytest.main([__file__, '-v'])
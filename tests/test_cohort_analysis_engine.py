@@ -0,0 +1,159 @@
+"""
+队列分析引擎测试模块
+
+测试队列构建、留存率、生命周期价值和行为模式的计算。
+"""
+
+import pytest
+import pandas as pd
+import numpy as np
+from datetime import datetime, timedelta
+import sys
+import os
+
+# 添加项目根目录到路径
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from engines.cohort_analysis_engine import CohortAnalysisEngine, CohortResult
+from tools.data_storage_manager import DataStorageManager
+
+
+class TestCohortAnalysisEngine:
+    """队列分析引擎测试类"""
+
+    @pytest.fixture
+    def sample_events_data(self):
+        """
+        两个注册日队列：
+        - 1月1日注册的a1、a2：a1在第10天仍活跃，a2只在注册当天活跃
+        - 1月2日注册的b1：在第40天仍活跃
+        """
+        rows = [
+            ('a1', 'registration', '2024-01-01 08:00'),
+            ('a1', 'page_view', '2024-01-01 09:00'),
+            ('a1', 'purchase', '2024-01-11 10:00'),
+            ('a2', 'registration', '2024-01-01 12:00'),
+            ('a2', 'page_view', '2024-01-01 12:30'),
+            ('b1', 'registration', '2024-01-02 08:00'),
+            ('b1', 'login', '2024-01-03 08:00'),
+            ('b1', 'page_view', '2024-02-11 08:00'),
+        ]
+        events = pd.DataFrame(rows, columns=['user_pseudo_id', 'event_name', 'event_time'])
+        events['event_timestamp'] = pd.to_datetime(events.pop('event_time')).astype('int64') // 1000
+        return events
+
+    @pytest.fixture
+    def engine(self, sample_events_data):
+        storage = DataStorageManager()
+        storage.store_events(sample_events_data)
+        return CohortAnalysisEngine(storage)
+
+    def test_build_cohorts_maps_users(self, engine, sample_events_data):
+        """测试队列构建记录用户到队列的映射，且不修改传入的数据"""
+        result = engine.build_cohorts()
+        assert [cohort.cohort_name for cohort in result.cohorts] == ['registration_20240101', 'registration_20240102']
+        assert [cohort.user_count for cohort in result.cohorts] == [2, 1]
+        assert result.user_cohorts.to_dict() == {'a1': 0, 'a2': 0, 'b1': 1}
+
+        columns = list(sample_events_data.columns)
+        engine.build_cohorts(events=sample_events_data, cohort_metric='weeks')
+        assert list(sample_events_data.columns) == columns
+
+    def test_retention_matrix(self, engine):
+        """测试留存率：队列用户在队列起始加周期之后仍有事件"""
+        result = engine.calculate_retention_rates(retention_periods=[1, 7, 30])
+        matrix = result.retention_matrix
+
+        assert matrix.loc['registration_20240101'].tolist() == [0.5, 0.5, 0.0]
+        assert matrix.loc['registration_20240102'].tolist() == [1.0, 1.0, 1.0]
+        assert result.best_performing_cohort == 'registration_20240102'
+        assert result.avg_retention_rates['day_30'] == pytest.approx(0.5)
+
+    def test_retention_without_recorded_mapping(self, engine):
+        """测试没有用户映射的队列结果按首次注册事件归入队列"""
+        cohorts = engine.build_cohorts()
+        expected = engine.calculate_retention_rates(cohorts=cohorts).retention_matrix
+
+        unmapped = CohortResult(cohort_type=cohorts.cohort_type, total_cohorts=cohorts.total_cohorts,
+                                total_users=cohorts.total_users, cohort_periods=cohorts.cohort_periods,
+                                cohorts=cohorts.cohorts)
+        pd.testing.assert_frame_equal(engine.calculate_retention_rates(cohorts=unmapped).retention_matrix, expected)
+
+    def test_lifecycle_counts_each_user_once(self, engine):
+        """测试LTV按队列用户的事件数计算，每个用户只计入一个生命周期阶段"""
+        result = engine.analyze_lifecycle()
+
+        assert result.ltv_by_cohort == {'registration_20240101': 12.5, 'registration_20240102': 15.0}
+        assert sum(result.lifecycle_distribution.values()) == 3
+
+    def test_behavioral_patterns_within_cohort_window(self, engine):
+        """测试行为指标只统计队列起始后30天内的事件"""
+        result = engine.analyze_behavioral_patterns()
+        patterns = result.behavioral_patterns
+
+        # a1: page_view、purchase；a2: page_view
+        assert patterns['registration_20240101']['frequency'] == pytest.approx(1.5)
+        assert patterns['registration_20240101']['monetary'] == pytest.approx(30)
+        # b1第40天的page_view不在窗口内，只有login
+        assert patterns['registration_20240102']['frequency'] == pytest.approx(1.0)
+        expected_recency = (datetime.now() - datetime(2024, 1, 3, 8)).days
+        assert patterns['registration_20240102']['recency'] == pytest.approx(expected_recency)
+
+    @pytest.fixture
+    def churn_engine(self):
+        """120天的事件：一半用户持续活跃，一半用户在注册两周后不再活跃"""
+        rng = np.random.default_rng(7)
+        start = datetime(2024, 1, 1)
+        rows = []
+        for user in range(200):
+            first_day = int(rng.integers(0, 20))
+            last_day = 119 if user % 2 == 0 else first_day + 14
+            days = np.concatenate([[first_day], rng.integers(first_day, last_day + 1, 20)])
+            rows.append((f'user_{user}', 'registration', start + timedelta(days=first_day)))
+            rows.extend((f'user_{user}', 'page_view', start + timedelta(days=int(day), hours=12)) for day in days)
+        events = pd.DataFrame(rows, columns=['user_pseudo_id', 'event_name', 'event_time'])
+        events['event_timestamp'] = pd.to_datetime(events.pop('event_time')).astype('int64') // 1000
+        storage = DataStorageManager()
+        storage.store_events(events)
+        return CohortAnalysisEngine(storage)
+
+    @pytest.mark.parametrize('model_type', ['logistic', 'gbm'])
+    def test_churn_model_time_holdout(self, churn_engine, model_type):
+        """测试流失模型按时间留出验证，给出真实的准确率和AUC"""
+        result = churn_engine.predict_churn_risk(prediction_horizon=30, risk_threshold=0.5, model_type=model_type)
+        metrics = result.model_metrics
+
+        assert metrics['model_type'] == model_type
+        assert metrics['train_cutoff'] < metrics['validation_cutoff']
+        assert result.prediction_accuracy == metrics['accuracy'] > 0.9
+        assert metrics['auc'] > 0.9
+
+        scores = result.user_churn_scores
+        assert len(scores) == 200
+        churned = scores.index.str.split('_').str[1].astype(int) % 2 == 1
+        assert scores[churned].mean() > 0.5 > scores[~churned].mean()
+        assert set(result.churn_predictions) == {cohort.cohort_name for cohort in churn_engine.build_cohorts().cohorts}
+
+    def test_churn_model_cached_by_data_version(self, churn_engine):
+        """测试数据未变时复用缓存的模型，追加事件后重新训练"""
+        first = churn_engine.predict_churn_risk(risk_threshold=0.5)
+        second = churn_engine.predict_churn_risk(risk_threshold=0.9)
+        assert second.user_churn_scores is first.user_churn_scores
+        assert len(churn_engine._churn_cache) == 1
+
+        churn_engine.storage_manager.append_events(pd.DataFrame({
+            'user_pseudo_id': ['user_1'], 'event_name': ['page_view'],
+            'event_timestamp': [int(pd.Timestamp('2024-04-29 13:00').value // 1000)]
+        }))
+        third = churn_engine.predict_churn_risk(risk_threshold=0.5)
+        assert third.user_churn_scores is not first.user_churn_scores
+        assert len(churn_engine._churn_cache) == 2
+
+    def test_churn_falls_back_without_history(self, engine):
+        """测试历史数据不足以训练模型时按留存率估计"""
+        result = engine.predict_churn_risk(prediction_horizon=30, risk_threshold=0.5)
+        assert result.model_metrics == {'model_type': 'retention_fallback'}
+        assert result.prediction_accuracy == 0.0
+        # 最后一个留存周期为第30天：a1、a2都未留存，b1留存
+        assert result.churn_predictions == {'registration_20240101': 1.0, 'registration_20240102': 0.0}
+        assert result.high_risk_cohorts == ['registration_20240101']
@@ -348,6 +348,32 @@ class TestConversionAnalysisEngine:
         assert 'common_bottlenecks' in bottleneck_analysis
         assert 'bottleneck_severity' in bottleneck_analysis
         
+    def test_analyze_conversion_segments(self, engine, sample_conversion_events_data):
+        """测试分段转化率交叉分析"""
+        segments = engine.analyze_conversion_segments(
+            sample_conversion_events_data,
+            dimensions=['platform', 'device_category'],
+            min_users=5
+        )
+        
+        assert list(segments.columns) == [
+            'platform', 'device_category', 'total_users', 'converted_users', 'conversion_rate'
+        ]
+        assert (segments['total_users'] >= 5).all()
+        assert set(segments['device_category']) <= {'desktop', 'mobile', 'tablet'}
+        assert ((segments['conversion_rate'] >= 0) & (segments['conversion_rate'] <= 1)).all()
+        
+        # 单维度分段的用户数与直接统计一致
+        by_platform = engine.analyze_conversion_segments(sample_conversion_events_data, ['platform'])
+        expected = sample_conversion_events_data.groupby('platform')['user_pseudo_id'].nunique()
+        for row in by_platform.to_dict('records'):
+            assert row['total_users'] == expected[row['platform']]
+            
+    def test_analyze_conversion_segments_unknown_dimension(self, engine, sample_conversion_events_data):
+        """测试未知分段维度"""
+        with pytest.raises(ValueError):
+            engine.analyze_conversion_segments(sample_conversion_events_data, ['nonexistent_column'])
+            
     def test_analyze_conversion_times(self, engine):
         """测试转化时间分析"""
         # 创建带时间信息的测试漏斗
@@ -372,6 +398,46 @@ class TestConversionAnalysisEngine:
         assert 'funnel_completion_times' in time_analysis
         assert 'step_transition_times' in time_analysis
         
+    def test_latency_distributions(self, engine):
+        """测试步骤时延分布和转化曲线"""
+        base_time = datetime(2024, 1, 1)
+        rows = []
+        # 4个用户分别在1、2、3、4分钟后加购，第5个用户未加购
+        for i in range(5):
+            user_id = f'user_{i}'
+            rows.append({'user_pseudo_id': user_id, 'event_name': 'view_item', 'event_datetime': base_time})
+            if i < 4:
+                rows.append({
+                    'user_pseudo_id': user_id,
+                    'event_name': 'add_to_cart',
+                    'event_datetime': base_time + timedelta(minutes=i + 1)
+                })
+        # 数据截止时间在两天后，未转化用户按24小时窗口删失
+        rows.append({'user_pseudo_id': 'user_x', 'event_name': 'page_view', 'event_datetime': base_time + timedelta(days=2)})
+        events = pd.DataFrame(rows)
+        
+        funnel = engine.build_conversion_funnel(events, ['view_item', 'add_to_cart'], 'latency_funnel')
+        
+        assert len(funnel.latency_distributions) == 1
+        distribution = funnel.latency_distributions[0]
+        assert distribution.users_started == 5
+        assert distribution.users_converted == 4
+        assert distribution.percentiles['p50'] == pytest.approx(150.0)
+        assert sum(distribution.histogram['counts']) == 4
+        assert distribution.conversion_curve['time_seconds'] == [60.0, 120.0, 180.0, 240.0]
+        assert distribution.conversion_curve['converted_fraction'] == pytest.approx([0.2, 0.4, 0.6, 0.8])
+        
+        # 数据在2.5分钟后截止时，未转化用户在150秒处删失
+        truncated = events[events['event_datetime'] <= base_time + timedelta(seconds=150)]
+        funnel = engine.build_conversion_funnel(truncated, ['view_item', 'add_to_cart'], 'latency_funnel')
+        curve = funnel.latency_distributions[0].conversion_curve
+        assert curve['time_seconds'] == [60.0, 120.0]
+        assert curve['converted_fraction'] == pytest.approx([0.2, 0.4])
+        
+        # 时间分析中包含时延分布
+        time_analysis = engine._analyze_conversion_times([funnel])
+        assert 'latency_funnel' in time_analysis['latency_distributions']
+        
     def test_identify_drop_off_points(self, engine, sample_conversion_events_data):
         """测试流失点识别"""
         funnel_steps = ['page_view', 'view_item', 'add_to_cart', 'purchase']
@@ -552,6 +618,139 @@ class TestConversionAnalysisEngine:
         assert journey['completed_steps'] == ['page_view']
         assert journey['completed_all_steps'] == False
         
+    def test_build_conversion_funnels_batch(self, engine, sample_conversion_events_data):
+        """测试批量构建漏斗的人数与逐用户旅程分析的结果一致"""
+        funnel_definitions = {
+            'browse': ['page_view', 'view_item'],
+            'cart': ['page_view', 'view_item', 'add_to_cart'],
+            'purchase': ['page_view', 'view_item', 'add_to_cart', 'begin_checkout', 'purchase']
+        }
+        
+        funnels = engine.build_conversion_funnels(sample_conversion_events_data, funnel_definitions)
+        
+        # 示例数据中每个用户按顺序走完前若干步，步间隔不超过1小时：
+        # 100个用户浏览，63个查看商品，26个加购，18个结算，16个购买
+        expected_counts = [100, 63, 26, 18, 16]
+        assert list(funnels.keys()) == list(funnel_definitions.keys())
+        for funnel_name, funnel_steps in funnel_definitions.items():
+            batch = funnels[funnel_name]
+            counts = expected_counts[:len(funnel_steps)]
+            assert [s.total_users for s in batch.steps] == counts
+            assert batch.total_users_entered == 100
+            assert batch.total_users_converted == counts[-1]
+            
+            # 与逐用户旅程分析的旧实现对照
+            journeys = engine._analyze_user_journeys(sample_conversion_events_data, funnel_steps, 24)
+            legacy_steps = engine._build_funnel_steps(journeys, funnel_steps)
+            assert len(journeys) == batch.total_users_entered
+            assert [s.total_users for s in legacy_steps] == counts
+            for legacy, step in zip(legacy_steps, batch.steps):
+                assert step.conversion_rate == pytest.approx(legacy.conversion_rate)
+                if legacy.avg_time_to_next_step is None:
+                    assert step.avg_time_to_next_step is None
+                else:
+                    assert step.avg_time_to_next_step == pytest.approx(legacy.avg_time_to_next_step)
+                    assert step.median_time_to_next_step == pytest.approx(legacy.median_time_to_next_step)
+            
+    def test_funnel_matcher_shares_prefixes(self):
+        """测试漏斗匹配器共享公共前缀"""
+        from engines.funnel_matcher import FunnelMatcher, build_user_timelines
+        
+        base_time = datetime(2024, 1, 1)
+        events = pd.DataFrame([
+            {'user_pseudo_id': 'user_1', 'event_name': 'page_view', 'event_datetime': base_time},
+            {'user_pseudo_id': 'user_1', 'event_name': 'view_item', 'event_datetime': base_time + timedelta(minutes=1)},
+            {'user_pseudo_id': 'user_1', 'event_name': 'purchase', 'event_datetime': base_time + timedelta(minutes=2)},
+            {'user_pseudo_id': 'user_2', 'event_name': 'view_item', 'event_datetime': base_time},
+            {'user_pseudo_id': 'user_2', 'event_name': 'page_view', 'event_datetime': base_time + timedelta(minutes=1)},
+            {'user_pseudo_id': 'user_3', 'event_name': 'page_view', 'event_datetime': base_time},
+            {'user_pseudo_id': 'user_3', 'event_name': 'view_item', 'event_datetime': base_time + timedelta(days=2)},
+        ])
+        
+        matcher = FunnelMatcher(build_user_timelines(events), time_window_hours=24)
+        short = matcher.match('short', ['page_view', 'view_item'])
+        long = matcher.match('long', ['page_view', 'view_item', 'purchase'])
+        
+        # 两个漏斗只产生三个不同的前缀
+        assert len(matcher._prefix_matches) == 3
+        assert sorted(short.user_ids) == ['user_1', 'user_2', 'user_3']
+        assert short.reached.sum(axis=0).tolist() == [3, 1]  # user_2顺序错误，user_3超出时间窗口
+        assert long.reached.sum(axis=0).tolist() == [3, 1, 1]
+
+    def test_match_funnels_parses_times_once(self, sample_conversion_events_data, monkeypatch):
+        """测试漏斗匹配只解析一次事件时间，观察截止时间为全部事件的最大时间"""
+        from engines import funnel_matcher
+        
+        calls = []
+        parse = funnel_matcher.event_times_ns
+        monkeypatch.setattr(funnel_matcher, 'event_times_ns', lambda events: calls.append(len(events)) or parse(events))
+        matches = funnel_matcher.match_funnels(sample_conversion_events_data, {'browse': ['page_view', 'view_item']})
+        assert calls == [len(sample_conversion_events_data)]
+        assert matches['browse'].observation_end == sample_conversion_events_data['event_datetime'].max()
+        
+        # 传入已解析的时间时不再解析
+        calls.clear()
+        times = parse(sample_conversion_events_data)
+        cached = funnel_matcher.match_funnels(sample_conversion_events_data, {'browse': ['page_view', 'view_item']},
+                                              times=times)
+        assert calls == []
+        np.testing.assert_array_equal(cached['browse'].reached, matches['browse'].reached)
+
+    def test_build_conversion_funnel_param_predicates(self, engine):
+        """测试带参数条件的漏斗步骤：与先筛选数据再按事件名匹配的结果一致"""
+        base_time = datetime(2024, 1, 1)
+        rows = []
+        for user in range(40):
+            location = '/checkout/payment' if user % 3 == 0 else '/home'
+            rows.append((f'user_{user}', 'page_view', base_time, '/home'))
+            rows.append((f'user_{user}', 'page_view', base_time + timedelta(minutes=5), location))
+            if user % 2 == 0:
+                rows.append((f'user_{user}', 'purchase', base_time + timedelta(minutes=10), None))
+        events = pd.DataFrame(rows, columns=['user_pseudo_id', 'event_name', 'event_datetime',
+                                             'param_page_location'])
+
+        checkout = {'event_name': 'page_view', 'params': {'page_location': {'contains': '/checkout'}},
+                    'name': 'checkout_view'}
+        funnel = engine.build_conversion_funnel(events, ['page_view', checkout, 'purchase'], "checkout_funnel")
+
+        # 等价做法：把满足条件的page_view改名为单独的事件
+        renamed = events.copy()
+        is_checkout = renamed['param_page_location'].str.contains('/checkout', na=False)
+        renamed.loc[is_checkout, 'event_name'] = 'checkout_view'
+        expected = engine.build_conversion_funnel(
+            pd.concat([renamed, events[is_checkout]]), ['page_view', 'checkout_view', 'purchase'], "expected"
+        )
+
+        assert [step.step_name for step in funnel.steps] == ['page_view', 'checkout_view', 'purchase']
+        assert [step.total_users for step in funnel.steps] == [40, 14, 7]
+        assert [step.total_users for step in funnel.steps] == [step.total_users for step in expected.steps]
+
+    def test_evaluate_steps_single_column(self):
+        """测试所有步骤一次求值为步骤类别列，同一事件可以满足多个步骤"""
+        from engines.funnel_steps import evaluate_steps, parse_step
+
+        events = pd.DataFrame({
+            'event_name': ['page_view', 'page_view', 'purchase', 'login'],
+            'param_page_location': ['/home', '/checkout', None, '/checkout'],
+            'param_value': [None, None, 120, None]
+        })
+        steps = [
+            'page_view',
+            {'event_name': 'page_view', 'params': {'page_location': '/checkout'}},
+            {'event_name': 'purchase', 'params': {'value': {'gte': 100}}},
+            {'params': {'page_location': {'startswith': '/check'}}}
+        ]
+        step_ids = evaluate_steps(events, steps + ['page_view'])
+
+        assert step_ids.steps == [parse_step(step) for step in steps]
+        assert len(step_ids.row_classes) == len(events)
+        assert step_ids.step_event_counts().tolist() == [2, 1, 1, 2]
+        # 第二行同时满足page_view、checkout和startswith三个步骤
+        assert step_ids.class_steps[step_ids.row_classes[1]].tolist() == [True, True, False, True]
+
+        with pytest.raises(ValueError):
+            parse_step({'event_name': 'page_view', 'params': {'page_location': {'like': '/checkout'}}})
+
     @pytest.mark.parametrize("time_window", [1, 6, 24, 72])
     def test_different_time_windows(self, engine, sample_conversion_events_data, time_window):
         """测试不同时间窗口"""
@@ -14,7 +14,7 @@ import sys
 # 添加项目根目录到路径
 sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
 
-from tools.data_storage_manager import DataStorageManager, StorageStats
+from tools.data_storage_manager import DataStorageManager, StorageStats, VERSION_COLUMNS, dataset_fingerprint
 
 
 class TestDataStorageManager(unittest.TestCase):
@@ -127,6 +127,114 @@ class TestDataStorageManager(unittest.TestCase):
             self.storage.store_events(invalid_events)
         self.assertIn('缺少必需列', str(context.exception))
         
+    def test_append_events_notifies_listeners(self):
+        """测试追加事件数据并通知监听器"""
+        received = []
+        self.storage.add_event_listener(lambda events, replaced: received.append((len(events), replaced)))
+        self.storage.store_events(self.sample_events.iloc[:2])
+        self.storage.append_events(self.sample_events.iloc[2:])
+        
+        self.assertEqual(len(self.storage._events_data), 3)
+        self.assertEqual(len(self.storage._events_by_type['page_view']), 2)
+        self.assertEqual(received, [(2, True), (1, False)])
+        
+        with self.assertRaises(ValueError):
+            self.storage.append_events(pd.DataFrame([{'invalid_column': 'value'}]))
+        self.assertEqual(len(received), 2)
+        
+    def test_data_version_from_content(self):
+        """测试数据版本由内容决定，追加与一次存储的版本一致"""
+        empty_version = self.storage.get_data_version()
+        self.storage.store_events(self.sample_events.iloc[:2])
+        self.storage.append_events(self.sample_events.iloc[2:])
+        appended_version = self.storage.get_data_version('events')
+        self.assertNotEqual(self.storage.get_data_version(), empty_version)
+        
+        other = DataStorageManager()
+        other.store_events(self.sample_events.iloc[::-1])
+        self.assertEqual(other.get_data_version('events'), appended_version)
+        
+        users_version = self.storage.get_data_version('users')
+        self.storage.store_users(self.sample_users)
+        self.assertNotEqual(self.storage.get_data_version('users'), users_version)
+        self.assertEqual(self.storage.get_data_version('events'), appended_version)
+        
+        self.storage.clear_data()
+        self.assertEqual(self.storage.get_data_version(), empty_version)
+
+    def test_store_sessions_with_nested_columns(self):
+        """测试存储含字典、列表列的会话数据（解析器输出的traffic_source、events列）"""
+        event = self.sample_events.iloc[0].to_dict()
+        sessions = pd.DataFrame([
+            {
+                'session_id': '1', 'user_pseudo_id': 'user1', 'event_count': 1,
+                'traffic_source': {'source': 'google', 'medium': 'organic'},
+                'events': [event]
+            },
+            {
+                'session_id': '2', 'user_pseudo_id': 'user2', 'event_count': 0,
+                'traffic_source': {}, 'events': []
+            }
+        ])
+        self.storage.store_sessions(sessions)
+        version = self.storage.get_data_version('sessions')
+        self.assertEqual(len(self.storage.get_data('sessions')), 2)
+
+        changed = sessions.copy()
+        changed.at[0, 'traffic_source'] = {'source': 'bing', 'medium': 'cpc'}
+        self.storage.store_sessions(changed)
+        self.assertNotEqual(self.storage.get_data_version('sessions'), version)
+
+        self.storage.store_sessions(sessions)
+        self.assertEqual(self.storage.get_data_version('sessions'), version)
+
+        users = self.sample_users.copy()
+        users['device'] = [{'category': 'mobile'}, {'category': 'desktop'}]
+        self.storage.store_users(users)
+        users_version = self.storage.get_data_version('users')
+        users.at[1, 'device'] = {'category': 'tablet'}
+        self.storage.store_users(users)
+        self.assertNotEqual(self.storage.get_data_version('users'), users_version)
+
+    def test_nested_fingerprint_ignores_key_order(self):
+        """测试嵌套值按规范JSON哈希，与字典键顺序无关；事件只取device、geo中的用到的字段"""
+        first = pd.DataFrame([{'session_id': '1', 'user_pseudo_id': 'u',
+                               'traffic_source': {'source': 'google', 'medium': 'organic'},
+                               'events': [{'event_name': 'page_view', 'params': {'a': 1, 'b': 2}}]}])
+        second = pd.DataFrame([{'session_id': '1', 'user_pseudo_id': 'u',
+                                'traffic_source': {'medium': 'organic', 'source': 'google'},
+                                'events': [{'params': {'b': 2, 'a': 1}, 'event_name': 'page_view'}]}])
+        self.assertEqual(dataset_fingerprint(first), dataset_fingerprint(second))
+
+        events = self.sample_events.assign(device=[{'category': 'desktop', 'os': 'Windows'}] * 3)
+        version = dataset_fingerprint(events, VERSION_COLUMNS['events'])
+        other_os = events.assign(device=[{'os': 'Linux', 'category': 'desktop'}] * 3)
+        self.assertEqual(dataset_fingerprint(other_os, VERSION_COLUMNS['events']), version)
+        mobile = events.assign(device=[{'category': 'mobile', 'os': 'Windows'}] * 3)
+        self.assertNotEqual(dataset_fingerprint(mobile, VERSION_COLUMNS['events']), version)
+
+    def test_appends_merged_on_read(self):
+        """测试追加的事件暂存到读取时才合并，合并结果与一次存储一致且按日期有序"""
+        events = pd.concat([
+            self.sample_events.assign(event_date=date, event_timestamp=self.sample_events['event_timestamp'] + offset)
+            for offset, date in enumerate(['20250627', '20250625', '20250626', '20250624'])
+        ], ignore_index=True)
+        self.storage.store_events(events.iloc[:3])
+        for start in range(3, len(events), 3):
+            self.storage.append_events(events.iloc[start:start + 3])
+        self.assertEqual(len(self.storage._pending_events), 3)
+        self.assertEqual(self.storage.get_event_count(), len(events))
+
+        merged = self.storage.get_data('events')
+        self.assertEqual(self.storage._pending_events, [])
+        self.assertTrue(merged['event_date'].is_monotonic_increasing)
+        self.assertEqual(sorted(merged['event_timestamp']), sorted(events['event_timestamp']))
+        self.assertEqual(len(self.storage.get_data('event_type:page_view')), 8)
+
+        other = DataStorageManager()
+        other.store_events(events)
+        self.assertEqual(other.get_data_version('events'), self.storage.get_data_version('events'))
+
     def test_store_users_success(self):
         """测试成功存储用户数据"""
         self.storage.store_users(self.sample_users)
@@ -0,0 +1,184 @@
+"""
+数据集中间结果缓存测试模块
+
+测试各引擎共用的中间结果按数据版本只计算一次，且不修改调用方的数据。
+"""
+
+import pytest
+import pandas as pd
+import numpy as np
+from datetime import datetime, timedelta
+import sys
+import os
+
+# 添加项目根目录到路径
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from engines.dataset_cache import DatasetCache
+from engines.attribution_engine import AttributionEngine
+from engines.cohort_analysis_engine import CohortAnalysisEngine
+from engines.conversion_analysis_engine import ConversionAnalysisEngine
+from engines.event_analysis_engine import EventAnalysisEngine
+from engines.path_analysis_engine import PathAnalysisEngine
+from engines.retention_analysis_engine import RetentionAnalysisEngine
+from engines.user_segmentation_engine import UserSegmentationEngine
+from engines.session_store import SessionPathStore
+from tools.data_storage_manager import DataStorageManager
+
+
+class TestDatasetCache:
+    """数据集中间结果缓存测试类"""
+
+    @pytest.fixture
+    def sample_events(self):
+        """30个用户、60天内的事件，只有event_timestamp时间列"""
+        rng = np.random.default_rng(3)
+        start = datetime(2024, 1, 1)
+        names = ['page_view', 'view_item', 'add_to_cart', 'purchase', 'login']
+        rows = []
+        for user in range(30):
+            for _ in range(20):
+                moment = start + timedelta(days=int(rng.integers(0, 60)), minutes=int(rng.integers(0, 1440)))
+                rows.append((f'user_{user}', str(rng.choice(names)), moment))
+        events = pd.DataFrame(rows, columns=['user_pseudo_id', 'event_name', 'event_time'])
+        events['event_timestamp'] = pd.to_datetime(events.pop('event_time')).astype('int64') // 1000
+        return events
+
+    @pytest.fixture
+    def storage(self, sample_events):
+        storage = DataStorageManager()
+        storage.store_events(sample_events)
+        return storage
+
+    def test_engines_share_intermediates(self, storage):
+        """测试多个引擎分析同一版本的数据时，时间列只转换一次"""
+        cache = DatasetCache.for_storage(storage)
+
+        EventAnalysisEngine(storage).get_analysis_summary()
+        RetentionAnalysisEngine(storage).calculate_retention_rates()
+        RetentionAnalysisEngine(storage).get_analysis_summary()
+        ConversionAnalysisEngine(storage).get_analysis_summary()
+        UserSegmentationEngine(storage).get_analysis_summary()
+        CohortAnalysisEngine(storage).analyze_lifecycle()
+        PathAnalysisEngine(storage).reconstruct_user_sessions()
+
+        assert cache.stats['builds']['events'] == 1
+        assert cache.stats['builds']['event_times'] == 1
+        assert cache.stats['builds']['datetime_frame'] == 1
+        assert cache.stats['hits']['datetime_frame'] >= 4
+        assert 'event_datetime' not in storage.get_data('events').columns
+
+    def test_matches_direct_computation(self, sample_events):
+        """测试缓存结果与直接计算一致，且不修改传入的数据"""
+        cache = DatasetCache()
+        columns = list(sample_events.columns)
+
+        frame = cache.with_datetime(sample_events)
+        assert list(sample_events.columns) == columns
+        expected = pd.to_datetime(sample_events['event_timestamp'], unit='us')
+        pd.testing.assert_series_equal(frame['event_datetime'], expected, check_names=False)
+        assert cache.with_datetime(frame) is frame
+        np.testing.assert_array_equal(cache.event_times(frame), cache.event_times(sample_events))
+
+        activity = cache.user_activity(sample_events)
+        grouped = frame.groupby('user_pseudo_id')['event_datetime']
+        pd.testing.assert_series_equal(activity['first_seen'], grouped.min(), check_names=False)
+        pd.testing.assert_series_equal(activity['last_seen'], grouped.max(), check_names=False)
+        assert activity['event_count'].sum() == len(sample_events)
+
+        sessions = cache.sessions(sample_events, session_timeout_minutes=30)
+        direct = SessionPathStore.from_events(sample_events, session_timeout_minutes=30)
+        assert [session.path_sequence for session in sessions] == [session.path_sequence for session in direct]
+        # 传入的数据不跨调用缓存
+        assert cache._entries == {} and cache._frames == {}
+
+    def test_passed_frame_modified_in_place(self, sample_events):
+        """测试原地修改传入的数据后重新计算，不返回旧结果"""
+        cache = DatasetCache()
+        events = sample_events.copy()
+        before = cache.user_activity(events)
+
+        events['user_pseudo_id'] = 'user_0'
+        events['event_timestamp'] += 86_400_000_000
+        after = cache.user_activity(events)
+        assert list(after.index) == ['user_0']
+        assert after['first_seen'].iloc[0] == before['first_seen'].min() + pd.Timedelta(days=1)
+
+    def test_derived_frames_share_storage_entry(self, storage):
+        """测试缓存返回的存储数据及其补充时间列的副本对应同一条目"""
+        cache = DatasetCache.for_storage(storage)
+        events = cache.events()
+        frame = cache.with_datetime()
+        assert cache.with_datetime(events) is frame
+        assert cache.event_times(frame) is cache.event_times()
+        assert cache.stats['builds']['event_times'] == 1
+
+    def test_sessions_and_touchpoints_share_timelines(self, storage):
+        """测试路径会话和归因触点复用同一份用户时间线"""
+        cache = DatasetCache.for_storage(storage)
+        PathAnalysisEngine(storage).reconstruct_user_sessions()
+        AttributionEngine(storage).attribute()
+        assert cache.stats['builds']['timelines'] == 1
+        assert cache.stats['hits']['timelines'] >= 1
+
+    def test_user_flow_reuses_cached_sessions(self, storage):
+        """测试用户流程分析从缓存读取存储中的事件，复用已重构的会话"""
+        cache = DatasetCache.for_storage(storage)
+        engine = PathAnalysisEngine(storage)
+        engine.reconstruct_user_sessions()
+        engine.analyze_user_flow()
+        assert cache.stats['builds']['events'] == 1
+        assert cache.stats['builds']['sessions'] == 1
+        assert cache.stats['hits']['sessions'] >= 1
+
+    def test_rebuilds_after_storage_update(self, storage):
+        """测试存储数据变化后按新版本重新计算，旧版本条目被丢弃"""
+        cache = DatasetCache.for_storage(storage)
+        before = cache.user_activity()
+        assert cache.user_activity() is before
+
+        storage.append_events(pd.DataFrame({
+            'user_pseudo_id': ['user_new'], 'event_name': ['page_view'],
+            'event_timestamp': [int(pd.Timestamp('2024-03-15').value // 1000)]
+        }))
+        after = cache.user_activity()
+        assert after is not before
+        assert 'user_new' in after.index and 'user_new' not in before.index
+        assert cache.stats['builds']['user_activity'] == 2
+        assert len(cache._entries) == 1
+
+    def test_rebuilds_after_replace_with_same_version(self, storage, sample_events):
+        """测试重新存储标识列相同、参数列不同的事件后不再返回旧数据"""
+        cache = DatasetCache.for_storage(storage)
+        version = storage.get_data_version('events')
+        assert 'param_page_location' not in cache.events().columns
+
+        storage.store_events(sample_events.assign(param_page_location='/home'))
+        assert storage.get_data_version('events') == version
+        events = cache.events()
+        assert (events['param_page_location'] == '/home').all()
+        assert cache.stats['builds']['events'] == 2
+        assert len(cache._entries) == 1
+
+    def test_builders_use_cached_event_times(self, storage, monkeypatch):
+        """测试各分析入口使用缓存的事件时间，不再各自解析全部事件的时间"""
+        from engines import (churn_model, event_cooccurrence, event_importance, event_series,
+                             funnel_matcher, user_features)
+        parsed = []
+        parse = funnel_matcher.event_times_ns
+        for module in (churn_model, event_cooccurrence, event_importance, event_series, funnel_matcher,
+                       user_features):
+            monkeypatch.setattr(module, 'event_times_ns', lambda events: parsed.append(len(events)) or parse(events))
+        cache = DatasetCache.for_storage(storage)
+        cache.event_times()
+
+        events = EventAnalysisEngine(storage)
+        events.analyze_event_trends(time_granularity='weekly')
+        events.analyze_event_correlation()
+        events.identify_key_events()
+        ConversionAnalysisEngine(storage).build_conversion_funnels()
+        UserSegmentationEngine(storage).extract_user_feature_frame()
+        CohortAnalysisEngine(storage)._churn_scores(horizon_days=7, model_type='logistic')
+
+        assert parsed == []
+        assert cache.stats['builds']['event_times'] == 1
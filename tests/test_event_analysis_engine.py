@@ -22,6 +22,12 @@ from engines.event_analysis_engine import (
     EventCorrelationResult,
     KeyEventResult
 )
+from engines.streaming_anomaly import StreamingAnomalyDetector
+from engines.event_series import (FREQUENCY_LABELS, build_event_count_table, frequency_summary,
+                                  seasonal_patterns, series_anomalies, trend_statistics)
+from engines.event_cooccurrence import build_event_incidence, event_pair_statistics, first_occurrence_gaps
+from engines.event_importance import (build_user_event_counts, conversion_impact, engagement_impact,
+                                      retention_impact)
 from tools.data_storage_manager import DataStorageManager
 
 
@@ -273,145 +279,143 @@ class TestEventAnalysisEngine:
         
         assert len(results) <= 3
         
-    def test_frequency_distribution_calculation(self, engine):
+    def test_frequency_distribution_calculation(self):
         """测试频次分布计算"""
-        # 创建测试数据
-        user_counts = pd.Series([1, 2, 3, 5, 10, 25, 100])
-        
-        distribution = engine._calculate_frequency_distribution(user_counts)
-        
-        assert isinstance(distribution, dict)
-        assert '1' in distribution
-        assert '2' in distribution
-        assert '50+' in distribution
-        
-    def test_trend_direction_calculation(self, engine):
-        """测试趋势方向计算"""
-        # 测试上升趋势
-        increasing_data = pd.DataFrame({
-            'event_count': [1, 2, 3, 4, 5, 6, 7, 8, 9, 10]
+        # 7个用户的事件数分别落在7个频次区间
+        user_counts = [1, 2, 3, 5, 10, 25, 100]
+        events = pd.DataFrame({
+            'user_pseudo_id': np.repeat([f'user_{i}' for i in range(len(user_counts))], user_counts),
+            'event_name': 'page_view'
         })
-        direction, growth_rate = engine._calculate_trend_direction(increasing_data)
-        assert direction == 'increasing'
-        assert growth_rate > 0
-        
-        # 测试下降趋势
-        decreasing_data = pd.DataFrame({
-            'event_count': [10, 9, 8, 7, 6, 5, 4, 3, 2, 1]
-        })
-        direction, growth_rate = engine._calculate_trend_direction(decreasing_data)
-        assert direction == 'decreasing'
-        assert growth_rate < 0
+
+        summary = frequency_summary(build_event_count_table(events)).iloc[0]
+
+        assert summary['total_count'] == sum(user_counts)
+        assert summary['unique_users'] == len(user_counts)
+        assert summary[FREQUENCY_LABELS].tolist() == [1] * len(FREQUENCY_LABELS)
         
-        # 测试稳定趋势
-        stable_data = pd.DataFrame({
-            'event_count': [5, 5, 5, 5, 5, 5, 5, 5, 5, 5]
+    def test_trend_direction_calculation(self):
+        """测试趋势方向计算"""
+        # 事件0上升、事件1下降、事件2稳定
+        series = pd.DataFrame({
+            'event': np.repeat([0, 1, 2], 10),
+            'position': np.tile(np.arange(10), 3),
+            'event_count': list(range(1, 11)) + list(range(10, 0, -1)) + [5] * 10
         })
-        direction, growth_rate = engine._calculate_trend_direction(stable_data)
-        assert direction == 'stable'
-        assert abs(growth_rate) < 5
+
+        statistics = trend_statistics(series, 3)
+
+        assert statistics['trend_direction'].tolist() == ['increasing', 'decreasing', 'stable']
+        assert statistics['growth_rate'][0] > 0
+        assert statistics['growth_rate'][1] < 0
+        assert abs(statistics['growth_rate'][2]) < 5
+        assert statistics['slope'][0] == pytest.approx(1.0)
         
-    def test_seasonal_pattern_detection(self, engine):
+    def test_seasonal_pattern_detection(self):
         """测试季节性模式检测"""
         # 创建有周模式的日数据
         dates = pd.date_range(start='2024-01-01', periods=21, freq='D')
-        trend_data = pd.DataFrame({
+        series = pd.DataFrame({
+            'event': 0,
             'date': dates,
             'event_count': [10 if d.weekday() < 5 else 5 for d in dates]  # 工作日高，周末低
         })
-        
-        pattern = engine._detect_seasonal_pattern(trend_data, 'daily')
-        
-        assert isinstance(pattern, dict)
+
+        pattern = seasonal_patterns(series, 'daily')[0]
+
         assert len(pattern) == 7  # 7天
+        assert pattern['Monday'] == 10
+        assert pattern['Sunday'] == 5
+        assert seasonal_patterns(series, 'daily', min_points=30) == {}
         
-    def test_anomaly_detection(self, engine):
+    def test_anomaly_detection(self):
         """测试异常检测"""
         # 创建有异常值的数据
-        trend_data = pd.DataFrame({
+        series = pd.DataFrame({
+            'event': 0,
+            'position': np.arange(10),
             'date': pd.date_range(start='2024-01-01', periods=10, freq='D'),
             'event_count': [10, 10, 10, 100, 10, 10, 10, 10, 10, 10]  # 第4天是异常值
         })
-        
-        anomalies = engine._detect_anomalies(trend_data)
-        
-        assert isinstance(anomalies, list)
-        assert len(anomalies) > 0
-        
-        # 检查异常点结构
-        for anomaly in anomalies:
-            assert 'date' in anomaly
-            assert 'value' in anomaly
-            assert 'z_score' in anomaly
-            assert 'type' in anomaly
-            
-    def test_chi_square_correlation(self, engine, sample_events_data):
-        """测试卡方相关性计算"""
-        correlation, p_value = engine._calculate_chi_square_correlation(
-            sample_events_data, 'page_view', 'sign_up'
-        )
-        
-        assert isinstance(correlation, float)
-        assert isinstance(p_value, float)
-        assert 0 <= correlation <= 1
-        assert 0 <= p_value <= 1
-        
-    def test_temporal_pattern_analysis(self, engine, sample_events_data):
-        """测试时间模式分析"""
-        # 获取共现用户
-        page_view_users = set(sample_events_data[
-            sample_events_data['event_name'] == 'page_view'
-        ]['user_pseudo_id'])
-        sign_up_users = set(sample_events_data[
-            sample_events_data['event_name'] == 'sign_up'
-        ]['user_pseudo_id'])
-        co_occurrence_users = page_view_users.intersection(sign_up_users)
-        
-        if co_occurrence_users:
-            pattern = engine._analyze_temporal_pattern(
-                sample_events_data, 'page_view', 'sign_up', co_occurrence_users
-            )
+
+        anomalies = series_anomalies(series, trend_statistics(series, 1))[0]
+
+        assert len(anomalies) == 1
+        assert anomalies[0]['date'] == '2024-01-04'
+        assert anomalies[0]['value'] == 100
+        assert anomalies[0]['z_score'] == pytest.approx(3.0)
+        assert anomalies[0]['type'] == 'high'
             
-            assert isinstance(pattern, dict)
-            if pattern:  # 如果有结果
-                assert 'sequence_patterns' in pattern
-                assert 'avg_time_gap_seconds' in pattern
+    def test_chi_square_correlation(self, sample_events_data):
+        """测试卡方相关性计算与chi2_contingency一致"""
+        from scipy.stats import chi2_contingency
+
+        incidence = build_event_incidence(sample_events_data)
+        pair = event_pair_statistics(incidence, event_codes=incidence.encode(['page_view', 'sign_up'])).iloc[0]
+
+        users = sample_events_data.groupby('event_name')['user_pseudo_id'].agg(set)
+        n = sample_events_data['user_pseudo_id'].nunique()
+        both = len(users['page_view'] & users['sign_up'])
+        table = np.array([[both, len(users['page_view']) - both],
+                          [len(users['sign_up']) - both, n - len(users['page_view'] | users['sign_up'])]])
+        if (table.sum(axis=0) > 0).all() and (table.sum(axis=1) > 0).all():
+            chi2, p_value, _, _ = chi2_contingency(table)
+            assert pair['cramers_v'] == pytest.approx(np.sqrt(chi2 / n))
+            assert pair['p_value'] == pytest.approx(p_value)
+        assert 0 <= pair['cramers_v'] <= 1
+        assert 0 <= pair['p_value'] <= 1
+        
+    def test_temporal_pattern_analysis(self):
+        """测试共现用户中首次发生的先后顺序和间隔"""
+        base_time = datetime(2024, 1, 1)
+        rows = [('user_0', 'page_view', base_time), ('user_0', 'sign_up', base_time + timedelta(minutes=30)),
+                ('user_1', 'sign_up', base_time), ('user_1', 'page_view', base_time + timedelta(minutes=10)),
+                ('user_2', 'page_view', base_time), ('user_2', 'sign_up', base_time + timedelta(seconds=30)),
+                ('user_3', 'page_view', base_time)]
+        incidence = build_event_incidence(pd.DataFrame(rows, columns=['user_pseudo_id', 'event_name',
+                                                                      'event_datetime']))
+        page_view, sign_up = incidence.encode(['page_view', 'sign_up'])
+
+        gaps = first_occurrence_gaps(incidence, np.array([page_view]), np.array([sign_up])).iloc[0]
+
+        assert gaps['event1_first'] == 1
+        assert gaps['event2_first'] == 1
+        assert gaps['simultaneous'] == 1
+        assert gaps['avg_gap_seconds'] == pytest.approx(1200.0)
+        assert gaps['median_gap_seconds'] == pytest.approx(1200.0)
                 
-    def test_user_engagement_impact_calculation(self, engine, sample_events_data):
+    def test_user_engagement_impact_calculation(self, sample_events_data):
         """测试用户参与度影响计算"""
-        page_view_data = sample_events_data[sample_events_data['event_name'] == 'page_view']
-        
-        impact = engine._calculate_user_engagement_impact(
-            sample_events_data, page_view_data, 'page_view'
-        )
-        
-        assert isinstance(impact, float)
-        assert 0 <= impact <= 100
+        table = build_user_event_counts(sample_events_data)
+
+        impact = engagement_impact(table)
+
+        assert len(impact) == table.counts.shape[1]
+        assert ((impact >= 0) & (impact <= 100)).all()
+        page_view = table.encode(['page_view'])[0]
+        assert impact[page_view] == impact.max()  # 浏览事件最频繁、覆盖用户最多
         
     def test_conversion_impact_calculation(self, engine, sample_events_data, sample_sessions_data):
         """测试转化影响计算"""
-        # 测试转化事件
-        impact_conversion = engine._calculate_conversion_impact(
-            sample_events_data, sample_sessions_data, 'sign_up'
-        )
-        assert isinstance(impact_conversion, float)
-        assert impact_conversion >= 80  # 转化事件应该有高分
-        
-        # 测试非转化事件
-        impact_non_conversion = engine._calculate_conversion_impact(
-            sample_events_data, sample_sessions_data, 'page_view'
-        )
-        assert isinstance(impact_non_conversion, float)
-        assert 0 <= impact_non_conversion <= 100
+        table = build_user_event_counts(sample_events_data)
+
+        impact = conversion_impact(table, engine.conversion_events, sample_sessions_data)
+        sign_up, page_view = table.encode(['sign_up', 'page_view'])
+
+        assert impact['conversion_impact'][sign_up] >= 80  # 转化事件应该有高分
+        assert 0 <= impact['conversion_impact'][page_view] <= 100
+        assert impact['conversion_lift'][page_view] > 0
         
-    def test_retention_impact_calculation(self, engine, sample_events_data, sample_users_data):
+    def test_retention_impact_calculation(self, sample_events_data):
         """测试留存影响计算"""
-        impact = engine._calculate_retention_impact(
-            sample_events_data, sample_users_data, 'page_view'
-        )
-        
-        assert isinstance(impact, float)
-        assert 0 <= impact <= 100
+        table = build_user_event_counts(sample_events_data)
+
+        impact = retention_impact(table)
+
+        assert impact['retention_impact'].between(0, 100).all()
+        assert (impact['retention_lift'] > 0).all()
+        assert retention_impact(build_user_event_counts(sample_events_data[['user_pseudo_id', 'event_name']]))[
+            'retention_lift'].isna().all()
         
     def test_importance_reasons_generation(self, engine):
         """测试重要性原因生成"""
@@ -506,18 +510,190 @@ class TestEventAnalysisEngine:
         # 单事件类型不应该有关联性结果
         assert len(correlations) == 0
         
+    def test_batched_frequency_and_weekly_trends(self, engine):
+        """测试一次分组计数得到的频次分布和补齐空周的周趋势"""
+        rows = [
+            ('user_1', 'page_view', datetime(2024, 1, 2)),  # 周二，属于1月1日所在周
+            ('user_1', 'page_view', datetime(2024, 1, 7, 23)),
+            ('user_2', 'page_view', datetime(2024, 1, 3)),
+            ('user_2', 'purchase', datetime(2024, 1, 3)),
+            ('user_1', 'page_view', datetime(2024, 1, 22)),
+        ]
+        events = pd.DataFrame(rows, columns=['user_pseudo_id', 'event_name', 'event_datetime'])
+
+        frequency = engine.calculate_event_frequency(events)
+        assert list(frequency) == ['page_view', 'purchase']
+        assert frequency['page_view'].total_count == 4
+        assert frequency['page_view'].unique_users == 2
+        assert frequency['page_view'].frequency_distribution['1'] == 1
+        assert frequency['page_view'].frequency_distribution['3-4'] == 1
+        assert frequency['page_view'].percentiles['p50'] == pytest.approx(2.0)
+
+        trends = engine.analyze_event_trends(events, time_granularity='weekly', min_data_points=3)
+        assert list(trends) == ['page_view']
+        trend_data = trends['page_view'].trend_data
+        assert trend_data['date'].dt.strftime('%Y-%m-%d').tolist() == ['2024-01-01', '2024-01-08', '2024-01-15',
+                                                                       '2024-01-22']
+        assert trend_data['event_count'].tolist() == [3, 0, 0, 1]
+        assert trend_data['unique_users'].tolist() == [2, 0, 0, 1]
+        assert list(events.columns) == ['user_pseudo_id', 'event_name', 'event_datetime']
+
+    def test_event_correlation_from_incidence_matrix(self, engine):
+        """测试由共现矩阵得到的列联表统计量、提升度和首次发生间隔"""
+        from scipy.stats import chi2_contingency
+
+        base_time = datetime(2024, 1, 1)
+        rows = []
+        # 6个用户先浏览后加购，2个用户只浏览，1个用户只加购，3个用户只登录
+        for i in range(6):
+            rows.append((f'user_{i}', 'page_view', base_time))
+            rows.append((f'user_{i}', 'add_to_cart', base_time + timedelta(minutes=10 * (i + 1))))
+            rows.append((f'user_{i}', 'page_view', base_time + timedelta(hours=5)))
+        rows += [('user_6', 'page_view', base_time), ('user_7', 'page_view', base_time),
+                 ('user_8', 'add_to_cart', base_time)]
+        rows += [(f'user_{i}', 'login', base_time) for i in range(9, 12)]
+        events = pd.DataFrame(rows, columns=['user_pseudo_id', 'event_name', 'event_datetime'])
+
+        results = engine.analyze_event_correlation(events, min_co_occurrence=2)
+
+        assert [result.event_pair for result in results] == [('page_view', 'add_to_cart')]
+        result = results[0]
+        chi2, p_value, _, _ = chi2_contingency(np.array([[6, 2], [1, 3]]))
+        assert result.correlation_coefficient == pytest.approx(np.sqrt(chi2 / 12))
+        assert result.significance_level == pytest.approx(p_value)
+        assert result.co_occurrence_rate == pytest.approx(6 / 9)
+        assert result.lift == pytest.approx(6 * 12 / (8 * 7))
+        assert result.temporal_pattern['sequence_patterns'] == {
+            'event1_first': 6, 'event2_first': 0, 'simultaneous': 0
+        }
+        assert result.temporal_pattern['avg_time_gap_seconds'] == pytest.approx(2100.0)
+        assert result.temporal_pattern['median_time_gap_seconds'] == pytest.approx(2100.0)
+
+        assert engine.analyze_event_correlation(events, event_types=['login', 'page_view']) == []
+
+    def test_key_events_from_user_event_matrix(self, engine):
+        """测试由用户×事件计数矩阵一次得到所有事件的参与度、转化和留存影响"""
+        base_time = datetime(2024, 1, 1)
+        rows = []
+        # user_0、user_1 搜索后购买且活跃3天，user_2、user_3 只浏览1天
+        for i in range(2):
+            rows += [(f'user_{i}', 'search', base_time), (f'user_{i}', 'search', base_time),
+                     (f'user_{i}', 'purchase', base_time + timedelta(days=2))]
+        rows += [(f'user_{i}', 'page_view', base_time) for i in range(2, 4)]
+        events = pd.DataFrame(rows, columns=['user_pseudo_id', 'event_name', 'event_datetime'])
+        sessions = pd.DataFrame({'user_pseudo_id': ['user_0', 'user_1', 'user_2', 'user_3'],
+                                 'conversions': [1, 1, 0, 0]})
+
+        results = {result.event_name: result for result in engine.identify_key_events(events, sessions=sessions)}
+
+        search = results['search']
+        assert search.user_engagement_impact == pytest.approx(4 / 8 * 100 * 0.3 + 50 * 0.4 + 20 * 0.3)
+        # 与purchase的用户重叠率1 -> 20分，会话转化率提升度2 -> 上限30分
+        assert search.conversion_impact == pytest.approx(50.0)
+        assert search.conversion_lift == pytest.approx(2.0)
+        # 平均活跃天数3天，整体2天
+        assert search.retention_lift == pytest.approx(1.5)
+        assert search.retention_impact == pytest.approx(75.0)
+        assert results['purchase'].conversion_impact == 90.0
+        assert results['page_view'].conversion_lift == 0.0
+        assert results['page_view'].retention_impact == pytest.approx(25.0)
+        assert list(events.columns) == ['user_pseudo_id', 'event_name', 'event_datetime']
+
+    def test_streaming_anomaly_detection_on_append(self):
+        """测试注册到存储管理器的流式异常检测器在追加事件时增量更新"""
+        def daily_events(day, count, platform='WEB'):
+            start = int(pd.Timestamp('2024-01-01').value // 1000) + day * 86_400_000_000
+            return pd.DataFrame({
+                'user_pseudo_id': [f'user_{i}' for i in range(count)],
+                'event_name': 'page_view',
+                'event_timestamp': start + np.arange(count) * 1_000_000,
+                'platform': platform
+            })
+
+        storage = DataStorageManager()
+        # 工作日20次、周末10次的周期模式
+        storage.store_events(pd.concat([daily_events(day, 20 if day % 7 < 5 else 10) for day in range(28)],
+                                       ignore_index=True))
+        engine = EventAnalysisEngine(storage)
+        detector = engine.attach_streaming_detector(granularity='daily', segment_column='platform')
+        assert detector.n_series == 1
+        state = detector.state().iloc[0]
+        assert state['observations'] == 27
+        assert state['open_count'] == 10
+
+        # 正常的工作日不报告异常，突增的一天在下一天到达时报告
+        storage.append_events(daily_events(28, 20))
+        storage.append_events(daily_events(29, 20))
+        assert engine.get_streaming_anomalies() == []
+        storage.append_events(daily_events(30, 80))
+        storage.append_events(daily_events(31, 20))
+        anomalies = engine.get_streaming_anomalies()
+        assert len(anomalies) == 1
+        assert anomalies[0]['date'] == '2024-01-31'
+        assert anomalies[0]['segment'] == 'WEB'
+        assert anomalies[0]['type'] == 'high'
+        assert anomalies[0]['value'] == 80
+
+        # 迟到的事件被丢弃，新细分维度建立新序列
+        storage.append_events(pd.concat([daily_events(3, 5), daily_events(31, 5, platform='ANDROID')]))
+        assert detector.late_events == 5
+        assert detector.n_series == 2
+        assert len(storage.get_data('events')) == sum(20 if d % 7 < 5 else 10 for d in range(28)) + 140 + 10
+
+    def test_streaming_detector_skips_empty_span(self):
+        """测试连续空时间桶一次推进，与逐桶推进的水平和季节项一致，中断只在第一个空时间桶报告"""
+        start = pd.Timestamp('2024-01-01')
+        events = pd.DataFrame({
+            'event_name': 'page_view',
+            'event_datetime': [start + pd.Timedelta(days=day, minutes=minute)
+                               for day in range(28) for minute in range(50 + 10 * (day % 2))]
+        })
+
+        # 预热前不截断残差，闭式推进与逐桶推进完全一致
+        stepwise = StreamingAnomalyDetector(warmup=1000)
+        skipped = StreamingAnomalyDetector(warmup=1000)
+        for detector in (stepwise, skipped):
+            detector.update(events)
+        for day in range(29, 120):
+            stepwise.advance(start + pd.Timedelta(days=day))
+        skipped.advance(start + pd.Timedelta(days=119))
+        pd.testing.assert_frame_equal(skipped.state().drop(columns='scale'), stepwise.state().drop(columns='scale'))
+        np.testing.assert_allclose(skipped._seasonal, stepwise._seasonal)
+
+        detector = StreamingAnomalyDetector()
+        detector.update(events)
+        anomalies = detector.advance(start + pd.Timedelta(days=119))
+        assert [(anomaly['date'], anomaly['type']) for anomaly in anomalies] == [('2024-01-29', 'low')]
+        assert detector.state()['observations'].iloc[0] == 119  # 第0-118天各一个观测
+
+    def test_streaming_detector_dict_segment(self, sample_events_data):
+        """测试字典列用'列.键'指定细分字段，直接用字典列时给出明确的错误"""
+        detector = StreamingAnomalyDetector(segment_column='device.category')
+        detector.update(sample_events_data)
+        assert set(detector.state()['segment']) == {'desktop', 'mobile', 'tablet'}
+        assert detector.n_series == 15
+
+        with pytest.raises(ValueError, match='device.category'):
+            StreamingAnomalyDetector(segment_column='device').update(sample_events_data)
+        with pytest.raises(ValueError):
+            StreamingAnomalyDetector(segment_column='missing.key').update(sample_events_data)
+
     @pytest.mark.parametrize("threshold", [1.0, 2.0, 3.0])
-    def test_anomaly_detection_different_thresholds(self, engine, threshold):
+    def test_anomaly_detection_different_thresholds(self, threshold):
         """测试不同阈值的异常检测"""
-        trend_data = pd.DataFrame({
+        series = pd.DataFrame({
+            'event': 0,
+            'position': np.arange(10),
             'date': pd.date_range(start='2024-01-01', periods=10, freq='D'),
-            'event_count': [10, 10, 10, 50, 10, 10, 10, 10, 10, 10]
+            'event_count': [10, 10, 10, 50, 10, 10, 10, 10, 10, 12]
         })
+        statistics = trend_statistics(series, 1)
+
+        anomalies = series_anomalies(series, statistics, threshold).get(0, [])
         
-        anomalies = engine._detect_anomalies(trend_data, threshold)
-        
-        assert isinstance(anomalies, list)
+        assert all(anomaly['z_score'] > threshold for anomaly in anomalies)
         # 更高的阈值应该检测到更少的异常
+        assert len(anomalies) >= len(series_anomalies(series, statistics, threshold + 1).get(0, []))
         
     def test_performance_large_dataset(self, engine):
         """测试大数据集性能"""
@@ -0,0 +1,75 @@
+"""
+漏斗分析引擎测试模块
+
+测试按事件名和事件参数条件定义的漏斗步骤。
+"""
+
+import pytest
+import pandas as pd
+import numpy as np
+from datetime import datetime, timedelta
+import sys
+import os
+
+# 添加项目根目录到路径
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from engines.funnel_analysis_engine import FunnelAnalysisEngine
+from tools.data_storage_manager import DataStorageManager
+
+
+class TestFunnelAnalysisEngine:
+    """漏斗分析引擎测试类"""
+
+    @pytest.fixture
+    def sample_events(self):
+        """
+        12个用户都浏览首页；user_0到user_5进入结算页，其中偶数用户完成购买；
+        另有一个只有登录事件的用户
+        """
+        base_time = datetime.now() - timedelta(days=1)
+        rows = []
+        for user in range(12):
+            rows.append((f'user_{user}', 'page_view', base_time, '/home'))
+            if user < 6:
+                rows.append((f'user_{user}', 'page_view', base_time + timedelta(minutes=3), '/checkout'))
+                if user % 2 == 0:
+                    rows.append((f'user_{user}', 'purchase', base_time + timedelta(minutes=6), None))
+        rows.append(('user_login', 'login', base_time, None))
+        events = pd.DataFrame(rows, columns=['user_pseudo_id', 'event_name', 'event_time', 'param_page_location'])
+        events['event_timestamp'] = pd.to_datetime(events.pop('event_time')).astype('int64') // 1000
+        return events
+
+    @pytest.fixture
+    def checkout_step(self):
+        return {'event_name': 'page_view', 'params': {'page_location': {'startswith': '/checkout'}},
+                'name': 'checkout_view'}
+
+    def test_param_predicate_steps(self, sample_events, checkout_step):
+        """测试参数条件步骤按步骤类别计数，且不修改传入的数据"""
+        columns = list(sample_events.columns)
+        engine = FunnelAnalysisEngine()
+        result = engine.build_conversion_funnel(['page_view', checkout_step, 'purchase'], events=sample_events)
+
+        assert list(sample_events.columns) == columns
+        assert result.total_users == 13
+        assert [step.step_name for step in result.steps] == ['page_view', 'checkout_view', 'purchase']
+        assert [step.users_count for step in result.steps] == [12, 6, 3]
+        assert result.total_conversions == 3
+        assert result.bottleneck_step == 'checkout_view'
+
+    def test_predicate_steps_from_storage(self, sample_events, checkout_step):
+        """测试从存储读取数据时按步骤的事件名过滤"""
+        storage = DataStorageManager()
+        storage.store_events(sample_events)
+        engine = FunnelAnalysisEngine(storage)
+
+        result = engine.build_conversion_funnel(['page_view', checkout_step, 'purchase'], time_window_days=7)
+        # 登录用户被事件名过滤掉
+        assert result.total_users == 12
+        assert [step.users_count for step in result.steps] == [12, 6, 3]
+
+        any_checkout = {'params': {'page_location': '/checkout'}}
+        result = engine.build_conversion_funnel([any_checkout], time_window_days=7)
+        assert result.steps[0].step_name == "*[param_page_location eq '/checkout']"
+        assert result.total_conversions == 6
@@ -0,0 +1,268 @@
+"""
+路径分析引擎测试模块
+
+测试整数编码的会话路径存储和基于存储的路径模式识别。
+"""
+
+import pytest
+import pandas as pd
+import numpy as np
+from datetime import datetime, timedelta
+import sys
+import os
+
+# 添加项目根目录到路径
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from engines.path_analysis_engine import PathAnalysisEngine, PathAnalysisResult
+from engines.session_store import SessionPathStore, UserSession
+from engines.sequence_miner import mine_sequential_patterns
+from engines.flow_aggregation import aggregate_session_flows, fold_flow_links
+from engines.user_flow import TransitionGraph, most_probable_paths
+
+
+class TestPathAnalysisEngine:
+    """路径分析引擎测试类"""
+
+    @pytest.fixture
+    def events(self):
+        """创建示例事件数据：user_1有两个会话，user_2有一个转化会话"""
+        base_time = datetime(2024, 1, 1, 10, 0, 0)
+        rows = [
+            ('user_1', 'page_view', base_time, 'home'),
+            ('user_1', 'view_item', base_time + timedelta(minutes=5), 'item'),
+            ('user_1', 'page_view', base_time + timedelta(hours=2), 'home'),
+            ('user_2', 'page_view', base_time, 'home'),
+            ('user_2', 'view_item', base_time + timedelta(minutes=1), 'item'),
+            ('user_2', 'add_to_cart', base_time + timedelta(minutes=2), 'cart'),
+            ('user_2', 'purchase', base_time + timedelta(minutes=3), 'checkout'),
+        ]
+        events = pd.DataFrame(rows, columns=['user_pseudo_id', 'event_name', 'event_datetime', 'page'])
+        # 打乱行顺序，验证按用户和时间排序
+        return events.sample(frac=1, random_state=0).reset_index(drop=True)
+
+    @pytest.fixture
+    def engine(self):
+        """创建路径分析引擎实例"""
+        return PathAnalysisEngine()
+
+    def test_reconstruct_sessions_store(self, engine, events):
+        """测试会话存储的编码数组和会话级平行数组"""
+        original_columns = list(events.columns)
+        sessions = engine.reconstruct_user_sessions(events)
+
+        assert isinstance(sessions, SessionPathStore)
+        assert list(events.columns) == original_columns
+        assert len(sessions) == 3
+        assert sessions.event_codes.dtype == np.int32
+
+        order = np.argsort([sessions.session_id(i) for i in range(len(sessions))])
+        assert sessions.lengths[order].tolist() == [2, 1, 4]
+        assert sessions.durations[order].tolist() == [300, 0, 180]
+        assert sessions.conversions[order].tolist() == [0, 0, 2]
+        assert sessions.page_views[order].tolist() == [1, 1, 1]
+
+    def test_session_objects_materialized_on_demand(self, engine, events):
+        """测试按下标访问会话时才物化事件字典"""
+        sessions = engine.reconstruct_user_sessions(events)
+        by_id = {session.session_id: session for session in sessions}
+        assert sorted(by_id) == ['user_1_1', 'user_1_2', 'user_2_1']
+
+        session = by_id['user_2_1']
+        assert isinstance(session, UserSession)
+        assert session.path_sequence == ['page_view', 'view_item', 'add_to_cart', 'purchase']
+        assert len(session.events) == 4
+        assert [event['page'] for event in session.events] == ['home', 'item', 'cart', 'checkout']
+        assert by_id['user_1_2'].path_sequence == ['page_view']
+
+    def test_identify_path_patterns_from_store(self, engine, events):
+        """测试直接基于会话存储识别路径模式"""
+        engine.min_pattern_frequency = 2
+        sessions = engine.reconstruct_user_sessions(events)
+        result = engine.identify_path_patterns(sessions)
+
+        assert isinstance(result, PathAnalysisResult)
+        assert result.total_sessions == 3
+        assert result.total_paths == 2
+        assert result.common_patterns[0].path_sequence == ['page_view', 'view_item']
+        assert result.common_patterns[0].frequency == 2
+        assert result.common_patterns[0].user_count == 2
+        assert result.common_patterns[0].conversion_rate == pytest.approx(0.5)
+
+        graph = result.path_flow_graph
+        assert graph['entry_counts'] == {'page_view': 3}
+        assert graph['total_transitions'] == 4
+
+    def test_identify_path_patterns_from_session_list(self, engine):
+        """测试直接传入会话对象列表"""
+        start = datetime(2024, 1, 1)
+        sessions = [
+            UserSession(f"user_{i}_1", f"user_{i}", start, start + timedelta(minutes=3), [],
+                        180, 1, 1, ['page_view', 'view_item', 'purchase'])
+            for i in range(3)
+        ]
+        result = engine.identify_path_patterns(sessions)
+
+        assert result.total_sessions == 3
+        assert result.conversion_paths[0].path_sequence == ['page_view', 'view_item', 'purchase']
+        assert result.conversion_paths[0].frequency == 3
+
+    def test_sequential_pattern_modes(self, engine):
+        """测试连续与间隔模式的序列挖掘及最小支持度"""
+        start = datetime(2024, 1, 1)
+        paths = [
+            ['search', 'page_view', 'purchase'],
+            ['search', 'scroll', 'page_view'],
+            ['search', 'page_view'],
+            ['page_view', 'search'],
+        ]
+        sessions = SessionPathStore.from_sessions([
+            UserSession(f"user_{i}_1", f"user_{i % 3}", start, start, [], 60 * (i + 1), 1,
+                        int('purchase' in path), path)
+            for i, path in enumerate(paths)
+        ])
+
+        contiguous = mine_sequential_patterns(sessions, min_support=0.5, min_length=2, mode='contiguous')
+        assert [sessions.decode(p.codes) for p in contiguous] == [['search', 'page_view']]
+        assert contiguous[0].support == 2
+        assert contiguous[0].avg_duration == pytest.approx(120.0)
+        assert contiguous[0].conversion_rate == pytest.approx(0.5)
+
+        gapped = mine_sequential_patterns(sessions, min_support=0.5, min_length=2, mode='gapped')
+        assert gapped[0].codes == contiguous[0].codes
+        assert gapped[0].support == 3
+        assert gapped[0].user_count == 3
+
+        limited = mine_sequential_patterns(sessions, min_support=0.5, mode='gapped', max_gap=0)
+        assert limited[0].support == 2
+
+        with pytest.raises(ValueError):
+            engine.identify_path_patterns(sessions, pattern_mode='unknown')
+
+    def test_anomalous_patterns_deduplicated(self, engine):
+        """测试近似重复的异常路径合并，以及基于转移概率的稀有路径识别"""
+        start = datetime(2024, 1, 1)
+        long_path = ['page_view', 'view_item', 'scroll', 'search', 'view_item', 'add_to_cart',
+                     'view_cart', 'remove_from_cart', 'search', 'view_item', 'add_to_cart', 'purchase']
+        paths = [['page_view', 'view_item', 'add_to_cart']] * 30 + [
+            long_path,
+            long_path + ['purchase'],
+            ['add_to_cart', 'view_item', 'page_view'],
+        ]
+        sessions = SessionPathStore.from_sessions([
+            UserSession(f"user_{i}_1", f"user_{i}", start, start, [], 60, 1, 0, path)
+            for i, path in enumerate(paths)
+        ])
+
+        by_length = engine.identify_path_patterns(sessions, max_length=12).anomalous_patterns
+        assert len(by_length) == 1
+        assert by_length[0].path_sequence == long_path
+        assert by_length[0].frequency == 2
+        assert by_length[0].user_count == 2
+
+        by_rarity = engine.identify_path_patterns(sessions, max_length=12,
+                                                  anomaly_method='rarity').anomalous_patterns
+        assert ['add_to_cart', 'view_item', 'page_view'] in [p.path_sequence for p in by_rarity]
+
+        with pytest.raises(ValueError):
+            engine.identify_path_patterns(sessions, anomaly_method='unknown')
+
+    def test_aggregate_session_flows(self, engine, events):
+        """测试从锚点事件开始的分步流转聚合"""
+        sessions = engine.reconstruct_user_sessions(events)
+        flows = aggregate_session_flows(sessions, anchor_events=['view_item'], depth=2)
+
+        assert flows.session_count == 2
+        links = flows.links
+        assert links[['source', 'target', 'value', 'source_step', 'target_step']].values.tolist() == [
+            ['view_item', 'add_to_cart', 1, 0, 1],
+            ['add_to_cart', 'purchase', 1, 1, 2],
+        ]
+
+        with_exits = aggregate_session_flows(sessions, depth=1, include_exits=True).links
+        assert set(zip(with_exits['source'], with_exits['target'], with_exits['value'])) == {
+            ('page_view', 'view_item', 2), ('page_view', 'exit', 1)
+        }
+
+    def test_flow_branches_folded_into_other(self, engine):
+        """测试每个节点超过top_k的分支合并为other"""
+        start = datetime(2024, 1, 1)
+        paths = [['home', 'a'], ['home', 'a'], ['home', 'b'], ['home', 'c'], ['home', 'c'], ['home', 'c']]
+        sessions = SessionPathStore.from_sessions([
+            UserSession(f"user_{i}_1", f"user_{i}", start, start, [], 0, 1, 0, path)
+            for i, path in enumerate(paths)
+        ])
+
+        links = aggregate_session_flows(sessions, depth=1, top_k=2).links
+        assert list(zip(links['target'], links['value'])) == [('c', 3), ('a', 2), ('other', 1)]
+
+        graph = engine._build_path_flow_graph(sessions, top_k=1)
+        assert [(e['to'], e['weight']) for e in graph['edges']] == [('c', 3), ('other', 3)]
+        assert graph['total_transitions'] == 6
+        assert len(engine._build_path_flow_graph(sessions)['edges']) == 3
+
+        folded = fold_flow_links(pd.DataFrame({
+            'source': ['home'] * 3, 'target': ['a', 'b', 'c'], 'value': [2, 1, 3]
+        }), top_k=2)
+        assert sorted(zip(folded['target'], folded['value'])) == [('a', 2), ('c', 3), ('other', 1)]
+
+    def test_analyze_user_flow(self, engine, events):
+        """测试基于真实会话计算的流程到达、流失和最优路径"""
+        result = engine.analyze_user_flow(
+            flow_steps=['page_view', 'view_item', 'purchase'],
+            start_events=['page_view'],
+            end_events=['purchase'],
+            events=events
+        )
+
+        assert result['status'] == 'success'
+        flow = result['flow_analysis']
+        assert [flow[step]['user_count'] for step in result['flow_steps']] == [2, 2, 1]
+        assert flow['purchase']['conversion_rate'] == pytest.approx(0.5)
+        assert result['drop_off_points'] == ['purchase']
+
+        best_path = result['optimal_paths'][0]
+        assert best_path['path'] == ['page_view', 'view_item', 'add_to_cart', 'purchase']
+        # P(view_item|page_view)=2/3, P(add_to_cart|view_item)=1/2, P(purchase|add_to_cart)=1
+        assert best_path['efficiency'] == pytest.approx(1 / 3)
+        assert best_path['session_count'] == 1
+
+    def test_most_probable_paths_match_enumeration(self):
+        """测试K条最优路径与枚举全部简单路径后按概率排序的结果一致"""
+        from scipy import sparse
+
+        rng = np.random.default_rng(5)
+        counts = (rng.random((7, 7)) < 0.5) * rng.integers(1, 20, (7, 7))
+        np.fill_diagonal(counts, 0)
+        graph = TransitionGraph(np.array([f'e{i}' for i in range(7)], dtype=object), sparse.csr_matrix(counts),
+                                entry_counts=np.ones(7, dtype=int), exit_counts=np.ones(7, dtype=int))
+        probabilities = graph.transition_probabilities().toarray()
+
+        expected = []
+        def walk(path, probability):
+            if path[-1] in (5, 6):
+                expected.append((path, probability))
+                return
+            for nxt in np.flatnonzero(probabilities[path[-1]]):
+                if nxt not in path:
+                    walk(path + [int(nxt)], probability * probabilities[path[-1], nxt])
+        walk([0], 1.0)
+        walk([1], 1.0)
+        expected.sort(key=lambda item: -item[1])
+
+        assert len(expected) > 20
+        paths = most_probable_paths(graph, [0, 1], [5, 6], k=len(expected) + 5)
+        assert len(paths) == len(expected)
+        assert [probability for _, probability in paths] == pytest.approx([p for _, p in expected])
+        assert sorted(map(tuple, (path for path, _ in paths))) == sorted(tuple(path) for path, _ in expected)
+
+    def test_analyze_user_flow_empty(self, engine):
+        """测试没有事件数据时的流程分析"""
+        result = engine.analyze_user_flow(events=pd.DataFrame())
+
+        assert result['status'] == 'error'
+        assert result['drop_off_points'] == []
+
+
+if __name__ == '__main__':
+    pytest.main([__file__, '-v'])
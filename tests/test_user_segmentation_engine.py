@@ -0,0 +1,528 @@
+"""
+用户分群引擎测试模块
+
+测试用户特征提取、特征矩阵准备和用户分群功能。
+"""
+
+import pytest
+import pandas as pd
+import numpy as np
+from datetime import datetime, timedelta
+import sys
+import os
+
+# 添加项目根目录到路径
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from engines.user_segmentation_engine import UserSegmentationEngine, UserFeatures, SegmentationResult
+from engines.user_features import FEATURE_GROUPS, build_user_feature_frame, feature_columns
+from engines.scalable_clustering import minibatch_kmeans, sampled_density_clustering
+from engines.cluster_quality import centroid_metrics, sampled_silhouette
+from engines.cluster_selection import select_n_clusters
+from engines.feature_store import UserFeatureStore
+from engines.segment_profiling import PROFILE_QUANTILES, anova_f, segment_statistics
+from engines.segment_assignment import user_feature_rows
+from tools.data_storage_manager import DataStorageManager
+
+
+class TestUserSegmentationEngine:
+    """用户分群引擎测试类"""
+
+    @pytest.fixture
+    def engine(self):
+        """创建用户分群引擎实例"""
+        return UserSegmentationEngine()
+
+    @pytest.fixture
+    def sample_events_data(self):
+        """创建示例事件数据：40个用户，其中一半有购买"""
+        rng = np.random.default_rng(0)
+        base_time = datetime(2024, 1, 1)
+        rows = []
+        for i in range(40):
+            n_events = 5 + i % 7
+            for j in range(n_events):
+                event_name = ['page_view', 'search', 'view_item', 'add_to_cart'][j % 4]
+                rows.append({
+                    'user_pseudo_id': f'user_{i}',
+                    'event_name': event_name,
+                    'event_datetime': base_time + timedelta(days=int(rng.integers(0, 10)),
+                                                            hours=int(rng.integers(0, 24))),
+                    'platform': 'WEB' if i % 3 else 'IOS'
+                })
+            if i % 2 == 0:
+                rows.append({'user_pseudo_id': f'user_{i}', 'event_name': 'purchase',
+                             'event_datetime': base_time + timedelta(days=11), 'platform': 'WEB'})
+        return pd.DataFrame(rows)
+
+    def test_feature_frame_columns(self, engine, sample_events_data):
+        """测试特征表按列计算所有用户的特征"""
+        frame = engine.extract_user_feature_frame(sample_events_data)
+
+        assert len(frame) == 40
+        assert frame.index.name == 'user_pseudo_id'
+        assert list(frame.columns) == feature_columns()
+        assert frame['total_events'].sum() == len(sample_events_data)
+        assert (frame['purchase_count'] > 0).sum() == 20
+        assert list(sample_events_data.columns) == ['user_pseudo_id', 'event_name', 'event_datetime', 'platform']
+
+    def test_feature_frame_values(self):
+        """测试单个用户的各类特征取值"""
+        base_time = datetime(2024, 1, 1, 10)  # 星期一
+        events = pd.DataFrame({
+            'user_pseudo_id': ['u1'] * 5 + ['u2'],
+            'event_name': ['page_view', 'purchase', 'page_view', 'purchase', 'purchase', 'login'],
+            'event_datetime': [base_time, base_time + timedelta(hours=1), base_time + timedelta(days=1),
+                               base_time + timedelta(days=2), base_time + timedelta(days=5, hours=12),
+                               base_time],
+            'geo': [{'country': 'US'}] * 5 + ['n/a']
+        })
+        users = pd.DataFrame({'user_pseudo_id': ['u2'], 'platform': ['IOS']})
+        sessions = pd.DataFrame({'user_pseudo_id': ['u1', 'u1'], 'duration_seconds': [100, 300],
+                                 'total_events': [2, 3]})
+
+        frame = build_user_feature_frame(events, users, sessions, reference_time=datetime(2024, 1, 11))
+        u1, u2 = frame.loc['u1'], frame.loc['u2']
+
+        assert u1['total_events'] == 5
+        assert u1['active_days'] == 4
+        assert u1['engagement_span_days'] == 6
+        assert u1['avg_events_per_day'] == pytest.approx(5 / 4)
+        assert u1['behavior_diversity'] == pytest.approx(-(0.4 * np.log2(0.4) + 0.6 * np.log2(0.6)))
+        assert u1['purchase_ratio'] == pytest.approx(0.6)
+        assert u1['conversion_depth'] == 1
+        assert u1['avg_purchase_interval_days'] == pytest.approx((5 + 11 / 24) / 2)
+        assert u1['days_since_last_activity'] == 4
+        assert u1['weekday_ratio'] == pytest.approx(0.8)
+        assert u1['work_hours_ratio'] == pytest.approx(0.8)
+        assert u1['most_active_hour'] == 10
+        assert u1['activity_regularity'] == pytest.approx(1 / (np.std([2, 1, 1, 1], ddof=1) + 1))
+        assert u1['total_sessions'] == 2
+        assert u1['avg_session_duration'] == 200
+        assert u1['geo_country'] == 'US'
+        assert u1['platform'] == 'unknown'
+
+        assert u2['platform'] == 'IOS'
+        assert u2['device_category'] == 'unknown'
+        assert u2['total_sessions'] == 0
+        assert u2['activity_regularity'] == 1
+
+    def test_extract_user_features_from_frame(self, engine, sample_events_data):
+        """测试用户特征列表由特征表拆分得到"""
+        features = engine.extract_user_features(sample_events_data)
+
+        assert len(features) == 40
+        assert isinstance(features[0], UserFeatures)
+        assert set(features[0].behavioral_features) == set(FEATURE_GROUPS['behavioral'])
+        assert features[0].conversion_features['purchase_ratio'] == features[0].behavioral_features['purchase_ratio']
+
+    def test_create_segments_from_frame(self, engine, sample_events_data):
+        """测试直接由特征表分群"""
+        frame = engine.extract_user_feature_frame(sample_events_data)
+        result = engine.create_user_segments(frame, method='kmeans', n_clusters=3)
+
+        assert isinstance(result, SegmentationResult)
+        assert sum(segment.user_count for segment in result.segments) == 40
+        assert set(result.segments[0].avg_features) == set(frame.columns)
+
+    @pytest.fixture
+    def blob_matrix(self):
+        """三个分离良好的高斯簇"""
+        rng = np.random.default_rng(1)
+        centers = np.array([[0.0, 0.0, 0.0], [10.0, 0.0, 0.0], [0.0, 10.0, 0.0]])
+        labels = np.repeat(np.arange(3), 400)
+        return centers[labels] + rng.normal(scale=0.5, size=(1200, 3)), labels
+
+    def test_minibatch_kmeans_partial_fit(self, blob_matrix):
+        """测试按块partial_fit的MiniBatchKMeans"""
+        from sklearn.metrics import adjusted_rand_score
+
+        matrix, truth = blob_matrix
+        labels, model = minibatch_kmeans(matrix, 3, chunk_size=250, batch_size=100)
+
+        assert labels.shape == (1200,)
+        assert model.cluster_centers_.shape == (3, 3)
+        assert adjusted_rand_score(truth, labels) == pytest.approx(1.0)
+
+    @pytest.mark.parametrize("method,params", [('dbscan', {'eps': 1.0}), ('hdbscan', {'min_cluster_size': 20})])
+    def test_sampled_density_clustering(self, blob_matrix, method, params):
+        """测试抽样密度聚类和最近簇中心分配"""
+        from sklearn.metrics import adjusted_rand_score
+
+        matrix, truth = blob_matrix
+        outlier = np.array([[50.0, 50.0, 50.0]])
+        labels, info = sampled_density_clustering(np.vstack([matrix, outlier]), method=method,
+                                                  sample_size=300, **params)
+
+        assert info['sample_size'] == 300
+        assert info['n_clusters'] == 3
+        assert labels[-1] == -1
+        assigned = labels[:-1] >= 0
+        assert assigned.mean() > 0.9
+        assert adjusted_rand_score(truth[assigned], labels[:-1][assigned]) == pytest.approx(1.0)
+
+    def test_scalable_backend_selected_by_row_threshold(self, engine, blob_matrix):
+        """测试按行数阈值自动选择聚类后端"""
+        matrix, _ = blob_matrix
+        engine._kmeans_clustering(matrix, 3)
+        assert engine.last_clustering_backend == 'kmeans'
+
+        engine.scalable_row_threshold = 1000
+        engine.density_sample_size = 500
+        engine._kmeans_clustering(matrix, 3)
+        assert engine.last_clustering_backend == 'minibatch_kmeans'
+        labels = engine._dbscan_clustering(matrix, 3, eps=1.0)
+        assert engine.last_clustering_backend == 'sampled_dbscan'
+        assert labels.min() >= 0
+
+        engine._dbscan_clustering(matrix, 3, eps=1.0, scalable=False)
+        assert engine.last_clustering_backend == 'dbscan'
+
+    def test_centroid_quality_metrics(self, blob_matrix):
+        """测试由簇中心计算的指标与sklearn一致"""
+        from sklearn.metrics import calinski_harabasz_score, davies_bouldin_score
+
+        matrix, labels = blob_matrix
+        metrics = centroid_metrics(matrix, labels)
+
+        assert metrics['calinski_harabasz'] == pytest.approx(calinski_harabasz_score(matrix, labels))
+        assert metrics['davies_bouldin'] == pytest.approx(davies_bouldin_score(matrix, labels))
+        centers = np.array([matrix[labels == label].mean(axis=0) for label in range(3)])
+        assert metrics['inertia'] == pytest.approx(((matrix - centers[labels]) ** 2).sum())
+
+    def test_sampled_silhouette_confidence_interval(self, blob_matrix):
+        """测试分层抽样轮廓系数的置信区间覆盖精确值"""
+        from sklearn.metrics import silhouette_score
+
+        matrix, labels = blob_matrix
+        rng = np.random.default_rng(3)
+        noisy = matrix + rng.normal(scale=3.0, size=matrix.shape)
+        exact = silhouette_score(noisy, labels)
+
+        # 参考集为全部数据时评估点的轮廓值精确，估计误差在置信区间宽度以内
+        result = sampled_silhouette(noisy, labels, sample_size=300)
+        assert result['silhouette_sample_size'] == 300
+        assert result['silhouette_reference_size'] == 1200
+        width = result['silhouette_ci_high'] - result['silhouette_ci_low']
+        assert 0 < width < 0.1
+        assert abs(result['silhouette_score'] - exact) <= width
+
+        approximate = sampled_silhouette(noisy, labels, sample_size=300, reference_size=600,
+                                         min_reference_per_cluster=100)
+        assert approximate['silhouette_reference_size'] == 600
+        assert approximate['silhouette_score'] == pytest.approx(exact, abs=0.02)
+
+    def test_quality_metrics_report_estimator(self, engine, blob_matrix):
+        """测试质量指标记录轮廓系数的估计方法"""
+        matrix, labels = blob_matrix
+        exact = engine._calculate_quality_metrics(matrix, labels)
+        assert exact['silhouette_estimator'] == 'exact'
+        assert exact['n_clusters'] == 3
+        assert exact['size_uniformity'] == pytest.approx(1.0)
+
+        engine.silhouette_sample_size = 200
+        sampled = engine._calculate_quality_metrics(matrix, labels)
+        assert sampled['silhouette_estimator'] == 'stratified_sample'
+        assert sampled['silhouette_score'] == pytest.approx(exact['silhouette_score'], abs=0.01)
+        assert sampled['silhouette_ci_low'] < sampled['silhouette_ci_high']
+        assert sampled['calinski_harabasz'] == pytest.approx(exact['calinski_harabasz'])
+
+    def test_select_n_clusters_sweep(self, blob_matrix):
+        """测试扫描聚类数量选出真实簇数"""
+        from sklearn.metrics import adjusted_rand_score
+
+        matrix, truth = blob_matrix
+        result = select_n_clusters(matrix, k_min=2, k_max=6, n_jobs=1, pilot_sample_size=300)
+
+        assert result.best_k == 3
+        assert list(result.scores['k']) == [2, 3, 4, 5, 6]
+        assert result.scores['silhouette_score'].idxmax() == 1
+        assert adjusted_rand_score(truth, result.labels) == pytest.approx(1.0)
+        assert result.centroids.shape == (3, 3)
+
+        by_davies_bouldin = select_n_clusters(matrix, k_max=6, metric='davies_bouldin', n_jobs=1)
+        assert by_davies_bouldin.best_k == 3
+
+    def test_parallel_sweep_matches_sequential(self, blob_matrix):
+        """测试多进程扫描与依次拟合结果一致"""
+        matrix, _ = blob_matrix
+        sequential = select_n_clusters(matrix, k_max=5, n_jobs=1)
+        parallel = select_n_clusters(matrix, k_max=5, n_jobs=2)
+
+        pd.testing.assert_frame_equal(sequential.scores, parallel.scores)
+        np.testing.assert_array_equal(sequential.labels, parallel.labels)
+
+    def test_create_segments_auto_k(self, engine, sample_events_data):
+        """测试自动选择聚类数量并记录得分曲线"""
+        engine.auto_k_jobs = 1
+        frame = engine.extract_user_feature_frame(sample_events_data)
+        result = engine.create_user_segments(frame, method='kmeans', n_clusters='auto', k_max=4)
+
+        selected_k = result.quality_metrics['selected_k']
+        assert selected_k == engine.last_k_selection.best_k
+        assert [row['k'] for row in result.quality_metrics['k_scores']] == [2, 3, 4]
+        assert len(result.segments) == selected_k
+        assert sum(segment.user_count for segment in result.segments) == 40
+
+    @pytest.mark.parametrize("method", ['behavioral', 'value_based', 'engagement'])
+    def test_auto_k_only_for_kmeans(self, engine, sample_events_data, method):
+        """测试自动选择聚类数量只用于kmeans，其他方法不会被替换成K-means扫描"""
+        frame = engine.extract_user_feature_frame(sample_events_data)
+        with pytest.raises(ValueError):
+            engine.create_user_segments(frame, method=method, n_clusters='auto')
+        assert engine.last_k_selection is None
+
+    def test_anova_f_matches_f_classif(self, blob_matrix):
+        """测试矩阵运算的F统计量与sklearn一致"""
+        from sklearn.feature_selection import f_classif
+
+        matrix, labels = blob_matrix
+        f_statistics, p_values = anova_f(matrix, labels, chunk_size=500)
+        expected_f, expected_p = f_classif(matrix, labels)
+
+        np.testing.assert_allclose(f_statistics, expected_f, rtol=1e-8)
+        np.testing.assert_allclose(p_values, expected_p, atol=1e-12)
+
+        statistics = segment_statistics(matrix, labels, PROFILE_QUANTILES)
+        assert statistics.quantiles.shape == (3, 3, 3)
+        np.testing.assert_allclose(statistics.quantiles[1, 1], np.median(matrix[labels == 1], axis=0))
+
+    def test_segment_profiles_with_lift(self, engine, sample_events_data):
+        """测试分群画像包含均值、提升度和分位数"""
+        frame = engine.extract_user_feature_frame(sample_events_data)
+        result = engine.create_user_segments(frame, method='kmeans', n_clusters=3)
+        numeric = frame.select_dtypes(include=[np.number]).fillna(0)
+
+        for segment in result.segments:
+            profile = segment.segment_profile
+            members = numeric.loc[segment.user_ids]
+            assert profile['feature_means']['total_events'] == pytest.approx(members['total_events'].mean())
+            assert profile['feature_lift']['total_events'] == pytest.approx(
+                members['total_events'].mean() / numeric['total_events'].mean())
+            assert profile['feature_quantiles']['p50']['total_events'] == pytest.approx(members['total_events'].median())
+            assert len(segment.key_characteristics) <= 3
+
+        assert max(result.feature_importance.values()) == pytest.approx(1.0)
+
+    def test_empty_events(self, engine):
+        """测试空事件数据"""
+        assert engine.extract_user_feature_frame(pd.DataFrame()).empty
+        assert engine.extract_user_features(pd.DataFrame()) == []
+
+
+class TestUserFeatureStore:
+    """用户特征存储测试类"""
+
+    @pytest.fixture
+    def events(self):
+        """30个用户的事件，每个用户的平台固定"""
+        rng = np.random.default_rng(2)
+        n_events = 600
+        users = rng.integers(0, 30, n_events)
+        return pd.DataFrame({
+            'user_pseudo_id': [f'user_{i}' for i in users],
+            'event_name': rng.choice(['page_view', 'search', 'add_to_cart', 'purchase'], n_events),
+            'event_timestamp': 1704067200000000 + rng.integers(0, 20 * 86400, n_events) * 1_000_000,
+            'platform': np.where(users % 2 == 0, 'WEB', 'IOS')
+        })
+
+    @pytest.fixture
+    def storage(self, events):
+        storage = DataStorageManager()
+        storage.store_events(events.iloc[:400])
+        return storage
+
+    def test_cached_by_data_version(self, storage):
+        """测试相同数据版本复用特征表，引擎共用同一个特征存储"""
+        store = UserFeatureStore(storage)
+        first = store.get_features()
+        assert store.get_features() is first
+        assert store.stats['builds'] == 1 and store.stats['hits'] == 1
+
+        engine = UserSegmentationEngine(storage)
+        assert UserSegmentationEngine(storage).feature_store is engine.feature_store
+        assert engine.extract_user_feature_frame() is engine.extract_user_feature_frame()
+        assert engine.feature_store.stats['builds'] == 1
+
+    def test_incremental_update_on_append(self, storage, events):
+        """测试追加事件后只重算受影响的用户，结果与重新构建一致"""
+        store = UserFeatureStore(storage)
+        store.get_features()
+
+        new_events = events.iloc[400:]
+        new_events = new_events[new_events['user_pseudo_id'].isin(['user_1', 'user_2', 'user_29'])]
+        storage.append_events(new_events)
+        updated = store.get_features()
+        assert store.stats['incremental_updates'] == 1
+        assert store.stats['builds'] == 1
+
+        rebuilt = UserFeatureStore().get_features(storage.get_data('events'),
+                                                  reference_time=store._tables[store._latest_storage_key].reference_time)
+        # most_active_hour次数相同时取最先出现的小时，依赖存储排序后的事件顺序，不参与比较
+        pd.testing.assert_frame_equal(updated.drop(columns='most_active_hour').sort_index(),
+                                      rebuilt.drop(columns='most_active_hour').sort_index(), check_dtype=False)
+
+        storage.store_users(pd.DataFrame({'user_pseudo_id': ['user_1'], 'platform': ['ANDROID']}))
+        assert store.get_features().loc['user_1', 'platform'] == 'ANDROID'
+        assert store.stats['builds'] == 2
+
+    def test_rebuilt_when_demographics_replaced(self, storage, events):
+        """测试重新存储只有平台、设备不同的事件后重新构建特征表"""
+        store = UserFeatureStore(storage)
+        assert store.get_features().loc['user_0', 'platform'] == 'WEB'
+
+        replaced = events.iloc[:400].assign(platform='ANDROID', device=[{'category': 'tablet'}] * 400)
+        storage.store_events(replaced)
+        frame = store.get_features()
+        assert store.stats['builds'] == 2
+        assert frame.loc['user_0', 'platform'] == 'ANDROID'
+        assert frame.loc['user_0', 'device_category'] == 'tablet'
+
+    def test_persisted_table_reused(self, events, tmp_path):
+        """测试磁盘缓存的特征表可被内容相同的数据复用"""
+        first = DataStorageManager()
+        first.store_events(events)
+        UserFeatureStore(first, cache_dir=str(tmp_path)).get_features()
+
+        second = DataStorageManager()
+        second.store_events(events.sample(frac=1, random_state=0))
+        store = UserFeatureStore(second, cache_dir=str(tmp_path))
+        frame = store.get_features()
+        assert store.stats == {'hits': 0, 'builds': 0, 'incremental_updates': 0, 'disk_loads': 1}
+        assert len(frame) == 30
+
+    def test_feature_list_encoded_by_column(self, engine_with_store, events):
+        """测试特征列表的分类特征按列编码，同一取值编码相同"""
+        features = engine_with_store.extract_user_features(events)
+        matrix, names, user_ids = engine_with_store._prepare_feature_matrix(features)
+        platform = matrix[:, names.index('platform')]
+        is_web = np.array([int(user_id.split('_')[1]) % 2 == 0 for user_id in user_ids])
+        assert len(np.unique(platform[is_web])) == 1
+        assert len(np.unique(platform[~is_web])) == 1
+        assert platform[is_web][0] != platform[~is_web][0]
+
+    @pytest.fixture
+    def engine_with_store(self):
+        return UserSegmentationEngine()
+
+
+
+class TestSegmentAssignment:
+    """分群模型与在线分配测试类"""
+
+    @pytest.fixture
+    def events(self):
+        """60个用户：偶数用户只浏览，奇数用户频繁加购和购买"""
+        rng = np.random.default_rng(3)
+        rows = []
+        for user in range(60):
+            buyer = user % 2 == 1
+            n_events = 40 if buyer else 5
+            names = rng.choice(['purchase', 'add_to_cart'] if buyer else ['page_view'], n_events)
+            for name, offset in zip(names, rng.integers(0, 10 * 86400, n_events)):
+                rows.append({'user_pseudo_id': f'user_{user}', 'event_name': name,
+                             'event_timestamp': 1704067200000000 + int(offset) * 1_000_000})
+        return pd.DataFrame(rows)
+
+    @pytest.fixture
+    def storage(self, events):
+        storage = DataStorageManager()
+        storage.store_events(events)
+        return storage
+
+    @pytest.fixture
+    def engine(self, storage):
+        return UserSegmentationEngine(storage)
+
+    def test_assign_matches_segmentation(self, engine):
+        """测试模型分配结果与分群结果一致，没有事件的用户不在结果中"""
+        result = engine.create_user_segments(method='kmeans', n_clusters=2)
+        segment_of = {user_id: segment.segment_id for segment in result.segments for user_id in segment.user_ids}
+        assert engine.segmentation_model.n_segments == 2
+
+        user_ids = [f'user_{i}' for i in range(60)]
+        assigned = engine.assign_segments(user_ids + ['unknown'])
+        assert sorted(assigned['user_pseudo_id']) == sorted(user_ids)
+        assert all(segment_of[user_id] == segment_id
+                   for user_id, segment_id in zip(assigned['user_pseudo_id'], assigned['segment_id']))
+        assert set(assigned['segment_name']) == {segment.segment_name for segment in result.segments}
+
+    def test_assignment_uses_training_reference_time(self, engine):
+        """测试分配时按模型拟合时的参考时间计算特征，与训练用户的特征一致"""
+        engine.create_user_segments(method='kmeans', n_clusters=2)
+        features = engine.extract_user_feature_frame()
+        model = engine.segmentation_model
+        assert model.reference_time == engine.feature_store.reference_time_of(features)
+
+        rows = user_feature_rows(['user_1', 'user_2'], engine.storage_manager.get_data('events'),
+                                 reference_time=model.reference_time)
+        pd.testing.assert_frame_equal(rows, features.loc[rows.index, rows.columns], check_dtype=False)
+        assert engine.attach_segment_assigner().reference_time == model.reference_time
+
+    def test_noise_excluded_from_model(self, engine):
+        """测试密度聚类的噪声点不作为分群中心，噪声用户按最近的分群分配"""
+        result = engine.create_user_segments(method='dbscan', eps=3.0, min_samples=3)
+        noise_id = engine.last_noise_segment_id
+        noise_segment = next(segment for segment in result.segments if segment.segment_id == noise_id)
+
+        model = engine.segmentation_model
+        assert noise_id not in model.segment_ids
+        assert model.n_segments == len(result.segments) - 1 == len(model.centroids)
+        assigned = engine.assign_segments(noise_segment.user_ids)
+        assert set(assigned['segment_id']) <= set(model.segment_ids)
+
+        engine.create_user_segments(method='kmeans', n_clusters=2)
+        assert engine.last_noise_segment_id is None
+        assert engine.segmentation_model.n_segments == 2
+
+    def test_saved_model_assigns_new_users(self, engine, events, tmp_path):
+        """测试保存的模型在新引擎中直接分配新用户"""
+        engine.create_user_segments(method='kmeans', n_clusters=2)
+        path = str(tmp_path / 'segmentation.pkl')
+        engine.save_segmentation_model(path)
+
+        buyer_segment = engine.assign_segments(['user_1'])['segment_id'].iloc[0]
+        new_events = events[events['user_pseudo_id'] == 'user_1'].assign(user_pseudo_id='new_buyer')
+
+        loaded = UserSegmentationEngine()
+        model = loaded.load_segmentation_model(path)
+        np.testing.assert_array_equal(model.centroids, engine.segmentation_model.centroids)
+        assigned = loaded.assign_segments(['new_buyer'], events=new_events)
+        assert assigned['segment_id'].tolist() == [buyer_segment]
+
+    def test_assigner_as_ingest_stage(self, engine, storage, events):
+        """测试注册到存储管理器的分配器在追加事件时分配涉及的用户"""
+        engine.create_user_segments(method='kmeans', n_clusters=2)
+        assigner = engine.attach_segment_assigner()
+        browser_segment = engine.assign_segments(['user_0'])['segment_id'].iloc[0]
+
+        new_events = events[events['user_pseudo_id'] == 'user_0'].assign(user_pseudo_id='new_browser')
+        storage.append_events(new_events)
+        assert assigner.assignments == {'new_browser': browser_segment}
+
+        assert engine.attach_segment_assigner() is engine.segment_assigner
+        storage.append_events(new_events.assign(user_pseudo_id='another_browser'))
+        assert list(engine.segment_assigner.assignments) == ['another_browser']
+        assert 'another_browser' not in assigner.assignments
+
+    def test_assigner_reassigns_lazily_after_replace(self, engine, storage, events):
+        """测试替换事件时分配器只标记过期，下一次读取分配结果时再为全部用户重新分配"""
+        engine.create_user_segments(method='kmeans', n_clusters=2)
+        assigner = engine.attach_segment_assigner()
+        expected = engine.assign_segments([f'user_{i}' for i in range(60)])
+        expected = dict(zip(expected['user_pseudo_id'], expected['segment_id']))
+
+        storage.store_events(events)
+        assert assigner.assignments == {}
+        assert assigner.assign(['user_0', 'user_1', 'unknown']) == {user_id: expected[user_id]
+                                                                   for user_id in ['user_0', 'user_1']}
+        assert assigner.segments() == expected
+
+    def test_model_requires_same_feature_spec(self, engine):
+        """测试特征规格变化后模型不能再用于分配"""
+        with pytest.raises(ValueError):
+            engine.assign_segments(['user_0'])
+        engine.create_user_segments(method='kmeans', n_clusters=2)
+        engine.segmentation_model.spec_key = 'outdated'
+        with pytest.raises(ValueError):
+            engine.assign_segments(['user_0'])
@@ -6,15 +6,108 @@
 
 import pandas as pd
 import numpy as np
-from typing import Dict, List, Any, Optional, Union, Tuple
+from typing import Dict, List, Any, Optional, Union, Tuple, Callable
 import logging
 from datetime import datetime, timedelta
 from dataclasses import dataclass
 import threading
 import copy
+import json
 
 logger = logging.getLogger(__name__)
 
+# 计算数据版本时参与哈希的列，None表示全部列；"列.键"表示字典列中的一个字段
+# 事件除标识列外还包括用户特征读取的platform、device.category、geo.country，这些值变化时按版本缓存的特征表随之失效
+VERSION_COLUMNS = {
+    'events': ['user_pseudo_id', 'event_name', 'event_timestamp', 'platform', 'device.category', 'geo.country'],
+    'users': None,
+    'sessions': None
+}
+_HASH_MASK = (1 << 64) - 1
+_NESTED_TYPES = (dict, list, tuple, set, np.ndarray)
+
+
+def dataset_fingerprint(data: pd.DataFrame, columns: Optional[List[str]] = None) -> Tuple[int, int]:
+    """
+    数据内容指纹：(行数, 各行哈希之和 mod 2^64)
+
+    与行顺序无关，追加数据时两部分的指纹可以直接相加。
+    字典、列表等嵌套值按键排序的JSON哈希，与字典的键顺序无关。
+
+    Args:
+        data: 数据
+        columns: 参与哈希的列，None表示全部列；"列.键"取字典列中的字段；不存在的列忽略
+
+    Returns:
+        (行数, 哈希和)
+    """
+    if data is None or data.empty:
+        return 0, 0
+    if columns is None:
+        frame = data
+    else:
+        selected = {}
+        for column in columns:
+            if column in data.columns:
+                selected[column] = data[column].array
+            elif '.' in column and column.split('.', 1)[0] in data.columns:
+                parent, key = column.split('.', 1)
+                selected[column] = _dict_field(data[parent], key)
+        frame = pd.DataFrame(selected)
+    if frame.columns.empty:
+        return len(data), 0
+    try:
+        hashes = pd.util.hash_pandas_object(frame, index=False).to_numpy()
+    except (TypeError, ValueError):
+        # 含字典、列表等不可哈希的值（如会话的traffic_source、events列）
+        hashes = pd.util.hash_pandas_object(_canonicalize_nested(frame), index=False).to_numpy()
+    return len(data), int(hashes.sum(dtype=np.uint64))
+
+
+def _dict_field(series: pd.Series, key: str) -> np.ndarray:
+    """字典列中某个字段的值，非字典或缺少该字段时为None"""
+    return np.array([value.get(key) if isinstance(value, dict) else None for value in series.to_numpy()],
+                    dtype=object)
+
+
+def _canonical_json(value: Any) -> Any:
+    """嵌套值转换为键排序的JSON字符串，其他值不变"""
+    if isinstance(value, _NESTED_TYPES):
+        if isinstance(value, (set, np.ndarray)):
+            value = sorted(value, key=str) if isinstance(value, set) else value.tolist()
+        return json.dumps(value, sort_keys=True, default=str, ensure_ascii=False)
+    return value
+
+
+def _canonicalize_nested(data: pd.DataFrame) -> pd.DataFrame:
+    """把含嵌套值的列转换为规范JSON，不含嵌套值的列不变（与普通数据哈希一致）"""
+    data = data.copy(deep=False)
+    for column in data.columns:
+        if data[column].dtype != object:
+            continue
+        try:
+            pd.util.hash_array(data[column].to_numpy())
+        except (TypeError, ValueError):
+            data[column] = data[column].map(_canonical_json)
+    return data
+
+
+def format_fingerprint(fingerprint: Tuple[int, int]) -> str:
+    """指纹格式化为版本字符串"""
+    return f"{fingerprint[0]}x{fingerprint[1]:016x}"
+
+
+def combine_fingerprints(*fingerprints: Tuple[int, int]) -> Tuple[int, int]:
+    """合并多段数据的指纹（对应数据拼接）"""
+    return (sum(rows for rows, _ in fingerprints),
+            sum(hashed for _, hashed in fingerprints) & _HASH_MASK)
+
+
+def parse_fingerprint(version: str) -> Tuple[int, int]:
+    """版本字符串还原为指纹"""
+    rows, hashed = version.split('x')
+    return int(rows), int(hashed, 16)
+
 
 @dataclass
 class StorageStats:
@@ -31,12 +124,19 @@ class DataStorageManager:
     
     def __init__(self):
         """初始化存储管理器"""
+        self._lock = threading.RLock()
+        # 追加的事件先按块暂存（已按索引列排序），读取时才合并进主表和按类型分组的表
+        self._pending_events: List[pd.DataFrame] = []
+        self._pending_by_type: Dict[str, List[pd.DataFrame]] = {}
         self._events_data = pd.DataFrame()
         self._users_data = pd.DataFrame()
         self._sessions_data = pd.DataFrame()
         self._events_by_type = {}
-        self._lock = threading.RLock()
         self._last_updated = datetime.now()
+        # 各类数据的内容指纹，组成数据版本
+        self._fingerprints = {data_type: (0, 0) for data_type in VERSION_COLUMNS}
+        # 事件数据变更监听器: callback(events, replaced)
+        self._event_listeners: List[Callable[[pd.DataFrame, bool], None]] = []
         
         # 索引配置
         self._event_indexes = ['user_pseudo_id', 'event_name', 'event_date']
@@ -77,6 +177,7 @@ class DataStorageManager:
                 # 创建索引
                 self._create_event_indexes()
                 
+                self._fingerprints['events'] = dataset_fingerprint(events, VERSION_COLUMNS['events'])
                 self._last_updated = datetime.now()
                 logger.info(f"成功存储{len(events)}条事件数据，包含{len(self._events_by_type)}种事件类型")
                 
@@ -84,6 +185,142 @@ class DataStorageManager:
             logger.error(f"存储事件数据失败: {e}")
             raise
             
+        self._notify_event_listeners(events, replaced=True)
+        
+    def append_events(self, events: pd.DataFrame) -> None:
+        """
+        追加事件数据（保留已存储的事件）
+        
+        Args:
+            events: 新增事件数据DataFrame
+        """
+        try:
+            with self._lock:
+                if events.empty:
+                    logger.warning("尝试追加空的事件数据")
+                    return
+                    
+                required_columns = ['user_pseudo_id', 'event_name', 'event_timestamp']
+                missing_columns = set(required_columns) - set(events.columns)
+                if missing_columns:
+                    raise ValueError(f"事件数据缺少必需列: {missing_columns}")
+                
+                # 只对新增事件排序，合并推迟到下一次读取，多次追加只合并一次
+                self._pending_events.append(self._sort_by_indexes(events))
+                for event_type, group in events.groupby('event_name', sort=False):
+                    self._pending_by_type.setdefault(event_type, []).append(group)
+                
+                # 指纹与行顺序无关，只需累加新增事件的部分
+                self._fingerprints['events'] = combine_fingerprints(
+                    self._fingerprints['events'], dataset_fingerprint(events, VERSION_COLUMNS['events'])
+                )
+                self._last_updated = datetime.now()
+                logger.info(f"成功追加{len(events)}条事件数据，共{self.get_event_count()}条")
+                
+        except Exception as e:
+            logger.error(f"追加事件数据失败: {e}")
+            raise
+            
+        self._notify_event_listeners(events, replaced=False)
+        
+    @property
+    def _events_data(self) -> pd.DataFrame:
+        """全部事件（按索引列排序），先合并暂存的追加事件"""
+        with self._lock:
+            if self._pending_events:
+                self._merge_pending_events()
+            return self._events_frame
+            
+    @_events_data.setter
+    def _events_data(self, events: pd.DataFrame) -> None:
+        with self._lock:
+            self._events_frame = events
+            self._pending_events = []
+            
+    @property
+    def _events_by_type(self) -> Dict[str, pd.DataFrame]:
+        """事件类型 -> 该类型的事件，先合并暂存的追加事件"""
+        with self._lock:
+            if self._pending_by_type:
+                for event_type, chunks in self._pending_by_type.items():
+                    existing = self._events_by_type_frames.get(event_type)
+                    if existing is not None:
+                        chunks = [existing] + chunks
+                    self._events_by_type_frames[event_type] = (
+                        pd.concat(chunks, ignore_index=True) if len(chunks) > 1 else chunks[0].copy()
+                    )
+                self._pending_by_type = {}
+            return self._events_by_type_frames
+            
+    @_events_by_type.setter
+    def _events_by_type(self, events_by_type: Dict[str, pd.DataFrame]) -> None:
+        with self._lock:
+            self._events_by_type_frames = events_by_type
+            self._pending_by_type = {}
+            
+    def _merge_pending_events(self) -> None:
+        """把暂存的已排序事件块插入主表，已有事件不重新排序"""
+        chunks = self._pending_events
+        self._pending_events = []
+        existing = self._events_frame
+        appended = chunks[0] if len(chunks) == 1 else self._sort_by_indexes(pd.concat(chunks, ignore_index=True))
+        merged = pd.concat([existing, appended], ignore_index=True)
+        sort_column = self._index_sort_column(existing)
+        if existing.empty or sort_column is None:
+            self._events_frame = merged
+            return
+        if self._index_sort_column(appended) != sort_column:
+            self._events_frame = self._sort_by_indexes(merged)
+            return
+        try:
+            # 两部分各自有序：每个新增事件插在排序值不大于它的已有事件之后
+            positions = existing[sort_column].searchsorted(appended[sort_column], side='right')
+            is_new = np.zeros(len(merged), dtype=bool)
+            is_new[positions + np.arange(len(appended))] = True
+            order = np.empty(len(merged), dtype=np.int64)
+            order[is_new] = np.arange(len(existing), len(merged))
+            order[~is_new] = np.arange(len(existing))
+            self._events_frame = merged.take(order).reset_index(drop=True)
+        except TypeError:
+            self._events_frame = self._sort_by_indexes(merged)
+            
+    def _index_sort_column(self, events: pd.DataFrame) -> Optional[str]:
+        """_sort_by_indexes之后数据有序的列（最后一个排序的索引列）"""
+        return next((column for column in reversed(self._event_indexes) if column in events.columns), None)
+        
+    def add_event_listener(self, callback: Callable[[pd.DataFrame, bool], None]) -> None:
+        """
+        注册事件数据变更监听器
+        
+        Args:
+            callback: 回调函数，参数为新写入的事件和是否替换了全部事件（store_events为True，append_events为False）
+        """
+        with self._lock:
+            self._event_listeners.append(callback)
+            
+    def remove_event_listener(self, callback: Callable[[pd.DataFrame, bool], None]) -> None:
+        """
+        移除事件数据变更监听器
+        
+        Args:
+            callback: 已注册的回调函数
+        """
+        with self._lock:
+            if callback in self._event_listeners:
+                self._event_listeners.remove(callback)
+                
+    def _notify_event_listeners(self, events: pd.DataFrame, replaced: bool) -> None:
+        """通知监听器，单个监听器失败不影响写入"""
+        if events.empty:
+            return
+        with self._lock:
+            listeners = list(self._event_listeners)
+        for callback in listeners:
+            try:
+                callback(events, replaced)
+            except Exception as e:
+                logger.warning(f"事件监听器执行失败: {e}")
+            
     def store_users(self, users: pd.DataFrame) -> None:
         """
         存储用户数据
@@ -108,6 +345,7 @@ class DataStorageManager:
                 # 创建索引
                 self._create_user_indexes()
                 
+                self._fingerprints['users'] = dataset_fingerprint(users, VERSION_COLUMNS['users'])
                 self._last_updated = datetime.now()
                 logger.info(f"成功存储{len(users)}个用户数据")
                 
@@ -139,6 +377,7 @@ class DataStorageManager:
                 # 创建索引
                 self._create_session_indexes()
                 
+                self._fingerprints['sessions'] = dataset_fingerprint(sessions, VERSION_COLUMNS['sessions'])
                 self._last_updated = datetime.now()
                 logger.info(f"成功存储{len(sessions)}个会话数据")
                 
@@ -146,6 +385,28 @@ class DataStorageManager:
             logger.error(f"存储会话数据失败: {e}")
             raise
             
+    def get_data_version(self, data_type: Optional[str] = None) -> str:
+        """
+        获取数据版本
+        
+        版本由数据内容指纹（行数和逐行哈希之和）组成，内容相同的数据版本相同，
+        可以作为跨进程缓存的键；事件只按VERSION_COLUMNS中的列计算。
+        指纹在写入时计算并保存，获取版本不重新哈希数据。
+        
+        Args:
+            data_type: 'events'、'users'、'sessions'，None表示三者组合
+            
+        Returns:
+            版本字符串
+        """
+        with self._lock:
+            if data_type is not None:
+                if data_type not in self._fingerprints:
+                    raise ValueError(f"不支持的数据类型: {data_type}")
+                return format_fingerprint(self._fingerprints[data_type])
+            return '-'.join(f"{name[0]}{format_fingerprint(fingerprint)}"
+                            for name, fingerprint in self._fingerprints.items())
+            
     def get_data(self, data_type: str, filters: Optional[Dict[str, Any]] = None) -> pd.DataFrame:
         """
         获取数据
@@ -435,6 +696,9 @@ class DataStorageManager:
                 else:
                     raise ValueError(f"不支持的数据类型: {data_type}")
                     
+                for cleared in VERSION_COLUMNS:
+                    if data_type in (None, 'all', cleared):
+                        self._fingerprints[cleared] = (0, 0)
                 self._last_updated = datetime.now()
                 
         except Exception as e:
@@ -513,16 +777,19 @@ class DataStorageManager:
             if self._events_data.empty:
                 return
                 
-            # 为常用查询列创建索引（在pandas中主要是排序）
-            for index_col in self._event_indexes:
-                if index_col in self._events_data.columns:
-                    self._events_data = self._events_data.sort_values(index_col)
-                    
+            self._events_data = self._sort_by_indexes(self._events_data)
             logger.debug("事件数据索引创建完成")
             
         except Exception as e:
             logger.warning(f"创建事件索引失败: {e}")
             
+    def _sort_by_indexes(self, events: pd.DataFrame) -> pd.DataFrame:
+        """按常用查询列排序（在pandas中索引主要是排序）"""
+        for index_col in self._event_indexes:
+            if index_col in events.columns:
+                events = events.sort_values(index_col)
+        return events
+            
     def _create_user_indexes(self) -> None:
         """创建用户数据索引"""
         try:
@@ -585,7 +852,8 @@ class DataStorageManager:
         """
         with self._lock:
             if event_type is None:
-                return len(self._events_data)
+                # 指纹中的行数与事件表一致，不需要合并暂存的追加事件
+                return self._fingerprints['events'][0]
             else:
                 return len(self._events_by_type.get(event_type, pd.DataFrame()))
                 
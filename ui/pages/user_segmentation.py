@@ -43,6 +43,7 @@ def show_user_segmentation_page():
                 options=[
                     ('kmeans', 'K-Means Clustering'),
                     ('dbscan', 'DBSCAN Clustering'),
+                    ('hdbscan', 'HDBSCAN Clustering'),
                     ('behavioral', 'Behavioral Segmentation'),
                     ('value_based', 'Value-Based Segmentation'),
                     ('engagement', 'Engagement Segmentation')
@@ -190,30 +191,27 @@ def execute_segmentation_analysis(method, n_clusters, include_features,
             # Execute clustering
             clustering_start = time.time()
             
+            # Sweep range around the requested cluster count; too few users leaves nothing to sweep
+            k_max = min(len(user_features)-1, n_clusters+2)
+            k_min = min(max(2, n_clusters-2), k_max)
+            
             # Adjust parameters based on whether auto-optimization is enabled
-            if auto_optimize and method == 'kmeans':
-                # Try different cluster numbers to find optimal solution
-                best_result = None
-                best_score = -1
+            if auto_optimize and method == 'kmeans' and k_max >= 2:
+                # Scale features once and sweep cluster counts in parallel worker processes
+                segmentation_result = engine.create_user_segments(
+                    user_features=user_features,
+                    method=method,
+                    n_clusters='auto',
+                    k_min=k_min,
+                    k_max=k_max
+                )
                 
-                for test_clusters in range(max(2, n_clusters-2), min(len(user_features), n_clusters+3)):
-                    test_result = engine.create_user_segments(
+                if segmentation_result.quality_metrics.get('silhouette_score', 0) < quality_threshold:
+                    segmentation_result = engine.create_user_segments(
                         user_features=user_features,
                         method=method,
-                        n_clusters=test_clusters
+                        n_clusters=n_clusters
                     )
-                    
-                    if test_result and test_result.quality_metrics:
-                        score = test_result.quality_metrics.get('silhouette_score', 0)
-                        if score > best_score and score >= quality_threshold:
-                            best_score = score
-                            best_result = test_result
-                
-                segmentation_result = best_result if best_result else engine.create_user_segments(
-                    user_features=user_features,
-                    method=method,
-                    n_clusters=n_clusters
-                )
             else:
                 segmentation_result = engine.create_user_segments(
                     user_features=user_features,
@@ -453,6 +451,7 @@ def show_feature_summary():
             methods_display = {
                 'kmeans': 'K-Means Clustering',
                 'dbscan': 'DBSCAN Clustering',
+                'hdbscan': 'HDBSCAN Clustering',
                 'behavioral': 'Behavioral Segmentation',
                 'value_based': 'Value-Based Segmentation',
                 'engagement': 'Engagement Segmentation'
@@ -12,6 +12,8 @@ from typing import Dict, List, Optional, Any, Tuple
 import numpy as np
 from math import pi
 
+from engines.flow_aggregation import fold_flow_links
+
 
 class AdvancedVisualizer:
     """高级可视化组件类，提供复杂的数据可视化功能"""
@@ -27,13 +29,15 @@ class AdvancedVisualizer:
             '#DDA0DD', '#98D8C8', '#F7DC6F', '#BB8FCE', '#85C1E9'
         ]
         
-    def create_user_behavior_flow(self, flow_data: pd.DataFrame) -> go.Figure:
+    def create_user_behavior_flow(self, flow_data: pd.DataFrame, max_branches: int = 10) -> go.Figure:
         """
         创建用户行为流程图可视化
         
         Args:
             flow_data: 包含用户行为流程数据的DataFrame
-                     需要包含source, target, value列
+                     需要包含source, target, value列；包含source_step, target_step列时
+                     同一事件在不同步骤显示为不同节点
+            max_branches: 每个节点保留的最大分支数，其余分支合并为other
                      
         Returns:
             plotly.graph_objects.Figure: 用户行为流程图
@@ -47,9 +51,18 @@ class AdvancedVisualizer:
         if missing_columns:
             raise ValueError(f"缺少必要的列: {missing_columns}")
         
-        # 获取所有唯一的节点
-        all_nodes = list(set(flow_data['source'].tolist() + flow_data['target'].tolist()))
+        flow_data = fold_flow_links(flow_data, top_k=max_branches)
+        
+        # 获取所有唯一的节点，分步数据按(步骤, 事件)区分节点
+        if {'source_step', 'target_step'}.issubset(flow_data.columns):
+            source_keys = list(zip(flow_data['source_step'], flow_data['source']))
+            target_keys = list(zip(flow_data['target_step'], flow_data['target']))
+        else:
+            source_keys = flow_data['source'].tolist()
+            target_keys = flow_data['target'].tolist()
+        all_nodes = list(dict.fromkeys(source_keys + target_keys))
         node_indices = {node: i for i, node in enumerate(all_nodes)}
+        node_labels = [node[1] if isinstance(node, tuple) else node for node in all_nodes]
         
         # 创建Sankey图
         fig = go.Figure(data=[go.Sankey(
@@ -57,12 +70,12 @@ class AdvancedVisualizer:
                 pad=15,
                 thickness=20,
                 line=dict(color="black", width=0.5),
-                label=all_nodes,
-                color=self.default_colors[:len(all_nodes)]
+                label=node_labels,
+                color=[self.default_colors[i % len(self.default_colors)] for i in range(len(all_nodes))]
             ),
             link=dict(
-                source=[node_indices[source] for source in flow_data['source']],
-                target=[node_indices[target] for target in flow_data['target']],
+                source=[node_indices[source] for source in source_keys],
+                target=[node_indices[target] for target in target_keys],
                 value=flow_data['value'].tolist(),
                 hovertemplate='%{source.label} → %{target.label}<br>' +
                              '用户数量: %{value}<br>' +